@@ -0,0 +1,212 @@
+"""
+Модуль, в котором реализован анализатор текста и словарь номеров термов
+
+Анализатор (Analyzer) превращает текст в термы: делит текст на токены
+по пробельным символам, опционально приводит их к нижнему регистру
+и выбрасывает стоп-слова. Один и тот же анализатор используется при
+построении индекса и при разборе запросов, его настройки сохраняются
+в метаданных индекса (см. to_dict), поэтому запрос всегда
+анализируется так же, как документы
+
+Результат нормализации токена кэшируется, повторяющиеся токены
+заново не нормализуются
+
+Словарь номеров (Vocabulary) при построении индекса сопоставляет
+каждому терму плотный номер 0, 1, 2, ... по мере появления термов,
+списки документов копятся в списке по номеру терма, а строка терма
+хранится один раз
+"""
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Set
+
+WHITESPACE = "whitespace"
+
+# максимальное количество токенов в кэше нормализации
+CACHE_SIZE = 2 ** 16
+
+
+class Analyzer:
+    """
+    Анализатор текста
+
+    * lowercase - приводить токены к нижнему регистру
+    * stop_words - термы, которые не индексируются и не ищутся
+    * cache_size - максимальное количество токенов в кэше нормализации
+
+    По умолчанию текст только делится по пробельным символам,
+    как это было до появления анализатора
+    """
+    tokenizer = WHITESPACE
+
+    def __init__(self, lowercase: bool = False, stop_words: Iterable[str] = (),
+                 cache_size: int = CACHE_SIZE):
+        self.lowercase = lowercase
+        self.stop_words = frozenset(word.lower() if lowercase else word
+                                    for word in stop_words)
+        self.cache_size = cache_size
+        self._cache = {}
+
+    def tokenize(self, text: str) -> List[str]:
+        """Деление текста на токены"""
+        return text.split()
+
+    def normalize(self, token: str) -> Optional[str]:
+        """
+        Нормализация одного токена
+
+        Args:
+            token: токен
+
+        Returns: терм или None, если токен - стоп-слово
+        """
+        try:
+            return self._cache[token]
+        except KeyError:
+            pass
+
+        term = token.lower() if self.lowercase else token
+        if term in self.stop_words:
+            term = None
+
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        self._cache[token] = term
+        return term
+
+    def analyze_words(self, tokens: Iterable[str]) -> List[str]:
+        """
+        Нормализация уже разделенных токенов (например слов запроса)
+
+        Args:
+            tokens: токены
+
+        Returns: термы без стоп-слов
+        """
+        terms = []
+        for token in tokens:
+            term = self.normalize(token)
+            if term is not None:
+                terms.append(term)
+        return terms
+
+    def analyze(self, text: str) -> List[str]:
+        """
+        Термы текста по порядку
+
+        Args:
+            text: текст
+
+        Returns: термы без стоп-слов
+        """
+        return self.analyze_words(self.tokenize(text))
+
+    def to_dict(self) -> dict:
+        """Настройки для сохранения в метаданных индекса"""
+        return {"tokenizer": self.tokenizer,
+                "lowercase": self.lowercase,
+                "stop_words": sorted(self.stop_words)}
+
+    @classmethod
+    def from_dict(cls, settings: dict):
+        """
+        Восстановление из настроек, полученных методом to_dict
+
+        Args:
+            settings: настройки анализатора
+
+        Returns: Analyzer
+        """
+        if settings.get("tokenizer", WHITESPACE) != cls.tokenizer:
+            raise ValueError(f"unsupported tokenizer {settings['tokenizer']!r}")
+        return cls(lowercase=settings.get("lowercase", False),
+                   stop_words=settings.get("stop_words", ()))
+
+    def __eq__(self, other):
+        if not isinstance(other, Analyzer):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    __hash__ = None
+
+    def __getstate__(self):
+        # кэш процессам-исполнителям не передается
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        self.__init__(state["lowercase"], state["stop_words"])
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(lowercase={self.lowercase}, "
+                f"stop_words={sorted(self.stop_words)})")
+
+
+class Vocabulary:
+    """
+    Словарь номеров термов
+
+    Номера плотные (0, 1, 2, ...) и выдаются по мере появления термов,
+    поэтому данные термов удобно хранить в списке по номеру
+
+    * analyzer - анализатор, которым токены превращаются в термы
+    * terms - термы по номерам
+    """
+    def __init__(self, analyzer: Optional[Analyzer] = None):
+        self.analyzer = analyzer if analyzer is not None else Analyzer()
+        self.terms = []
+        self._term_ids = {}
+        # токен -> номер терма (-1 для стоп-слов), без ограничения размера:
+        # различных токенов не больше, чем термов в словаре
+        self._token_ids = {}
+
+    def add(self, term: str) -> int:
+        """
+        Номер терма, новый терм получает следующий номер
+
+        Args:
+            term: терм
+
+        Returns: номер терма
+        """
+        term_id = self._term_ids.get(term)
+        if term_id is None:
+            term_id = len(self.terms)
+            self._term_ids[term] = term_id
+            self.terms.append(term)
+        return term_id
+
+    def get(self, term: str) -> Optional[int]:
+        """Номер терма или None, если терма нет"""
+        return self._term_ids.get(term)
+
+    def distinct_term_ids(self, text: str) -> Set[int]:
+        """
+        Номера различных термов текста, новые термы добавляются в словарь
+
+        Повторы токена в тексте схлопываются до нормализации,
+        а уже встречавшиеся токены берутся из словаря без нормализации
+
+        Args:
+            text: текст
+
+        Returns: множество номеров термов без стоп-слов
+        """
+        token_ids = self._token_ids
+        tokens = self.analyzer.tokenize(text)
+        term_ids = set(map(token_ids.get, tokens))
+        if None in term_ids:
+            term_ids.discard(None)
+            for token in set(tokens).difference(token_ids):
+                term = self.analyzer.normalize(token)
+                term_id = -1 if term is None else self.add(term)
+                token_ids[token] = term_id
+                term_ids.add(term_id)
+        term_ids.discard(-1)
+        return term_ids
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def __getitem__(self, term_id: int) -> str:
+        return self.terms[term_id]
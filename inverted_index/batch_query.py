@@ -0,0 +1,229 @@
+"""
+Модуль, в котором реализовано пакетное выполнение запросов
+
+Вместо того чтобы выполнять запросы по одному, весь пакет сначала
+планируется:
+1. слова каждого запроса упорядочиваются по возрастанию количества
+   документов (document frequency), запросы с неизвестными словами
+   сразу получают пустой ответ
+2. упорядоченные запросы складываются в префиксное дерево, поэтому
+   общие префиксы (а значит и общие пересечения) у разных запросов
+   вычисляются один раз
+3. дерево обходится в глубину, пустое промежуточное пересечение
+   отсекает все поддерево
+
+Пакет можно разбить по поддеревьям и выполнить в пуле процессов,
+ответы при этом возвращаются в порядке запросов
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+from typing import List
+from typing import Optional
+
+from postings import as_postings
+from postings import intersect
+from postings import intersect_sorted
+
+
+class PlanNode:
+    """
+    Узел плана пакета запросов
+
+    * children - слово -> дочерний узел
+    * queries - номера запросов, которые заканчиваются в этом узле
+    """
+    __slots__ = ("children", "queries")
+
+    def __init__(self):
+        self.children = {}
+        self.queries = []
+
+
+def doc_frequency(word_to_docs_mapping, word: str) -> int:
+    """
+    Количество документов со словом
+
+    Для ленивых индексов (MmapTermDictionary) списки документов не читаются
+
+    Args:
+        word_to_docs_mapping: инвертированный индекс
+        word: слово
+
+    Returns: количество документов
+    """
+    if hasattr(word_to_docs_mapping, "doc_count"):
+        return word_to_docs_mapping.doc_count(word)
+    docs = word_to_docs_mapping.get(word)
+    return 0 if docs is None else len(docs)
+
+
+def plan_batch(queries: List[List[str]], frequency: Callable[[str], int]) -> PlanNode:
+    """
+    Построение плана выполнения пакета запросов
+
+    Args:
+        queries: запросы, каждый запрос - список слов
+        frequency: функция слово -> количество документов
+
+    Returns: корень префиксного дерева запросов
+             (запросы с неизвестными словами и пустые в план не попадают)
+    """
+    root = PlanNode()
+    frequencies = {}
+
+    for query_id, words in enumerate(queries):
+        words = set(words)
+        if not words:
+            continue
+
+        for word in words:
+            if word not in frequencies:
+                frequencies[word] = frequency(word)
+        if any(frequencies[word] == 0 for word in words):
+            continue
+
+        node = root
+        for word in sorted(words, key=lambda word: (frequencies[word], word)):
+            child = node.children.get(word)
+            if child is None:
+                child = node.children[word] = PlanNode()
+            node = child
+        node.queries.append(query_id)
+
+    return root
+
+
+def _evaluate(node: PlanNode, doc_ids, word_to_docs_mapping, results: dict) -> None:
+    for word, child in node.children.items():
+        postings = word_to_docs_mapping[word]
+
+        if doc_ids is None:
+            child_doc_ids = postings
+        elif isinstance(doc_ids, list):
+            child_doc_ids = intersect_sorted(doc_ids, [postings])
+        else:
+            # на первом уровне doc_ids - список документов индекса любого типа
+            child_doc_ids = intersect([doc_ids, postings])
+
+        if len(child_doc_ids) == 0:
+            continue
+
+        if child.queries:
+            answer = list(child_doc_ids)
+            for query_id in child.queries:
+                results[query_id] = answer
+
+        _evaluate(child, child_doc_ids, word_to_docs_mapping, results)
+
+
+def execute_plan(root: PlanNode, word_to_docs_mapping) -> dict:
+    """
+    Выполнение плана
+
+    Args:
+        root: корень плана (см. plan_batch)
+        word_to_docs_mapping: инвертированный индекс
+
+    Returns: словарь номер запроса -> отсортированный список документов
+             (запросы с пустым ответом в словарь не попадают)
+    """
+    results = {}
+    _evaluate(root, None, word_to_docs_mapping, results)
+    return results
+
+
+def _split_plan(root: PlanNode, parts: int) -> List[PlanNode]:
+    """
+    Деление плана на части по поддеревьям первого слова
+
+    Поддеревья распределяются жадно по количеству запросов в них
+    """
+    def count(node):
+        return len(node.queries) + sum(count(child) for child in node.children.values())
+
+    subtrees = sorted(root.children.items(), key=lambda item: -count(item[1]))
+    plans = [PlanNode() for _ in range(parts)]
+    loads = [0] * parts
+
+    for word, child in subtrees:
+        i = loads.index(min(loads))
+        plans[i].children[word] = child
+        loads[i] += count(child)
+
+    return [plan for plan in plans if plan.children]
+
+
+_worker_mapping = None
+
+
+def _init_worker(index_path: str, storage_policy) -> None:
+    global _worker_mapping
+    word_to_docs_mapping = storage_policy.load(index_path)
+    if isinstance(word_to_docs_mapping, dict):
+        word_to_docs_mapping = {word: as_postings(docs)
+                                for word, docs in word_to_docs_mapping.items()}
+    _worker_mapping = word_to_docs_mapping
+
+
+def _execute_in_worker(root: PlanNode) -> dict:
+    return execute_plan(root, _worker_mapping)
+
+
+def worker_pool(workers: int, index_path: str, storage_policy) -> ProcessPoolExecutor:
+    """
+    Пул процессов для run_batch
+
+    Каждый процесс загружает индекс один раз при запуске,
+    поэтому один пул стоит переиспользовать для всех пакетов
+
+    Args:
+        workers: количество процессов
+        index_path: путь до индекса, который загрузят процессы
+        storage_policy: политика, которой процессы загрузят индекс
+
+    Returns: ProcessPoolExecutor (закрывается вызывающим кодом)
+    """
+    return ProcessPoolExecutor(max_workers=workers,
+                               initializer=_init_worker,
+                               initargs=(index_path, storage_policy))
+
+
+def run_batch(word_to_docs_mapping,
+              queries: List[List[str]],
+              workers: int = 1,
+              index_path: Optional[str] = None,
+              storage_policy=None,
+              executor: Optional[ProcessPoolExecutor] = None) -> List[List[int]]:
+    """
+    Выполнение пакета запросов
+
+    Args:
+        word_to_docs_mapping: инвертированный индекс
+        queries: запросы, каждый запрос - список слов
+        workers: количество процессов
+        index_path: путь до индекса, который загрузят процессы
+                    (нужен только при workers > 1 без executor)
+        storage_policy: политика, которой процессы загрузят индекс
+        executor: пул процессов из worker_pool, общий для нескольких пакетов
+                  (None - при workers > 1 пул создается на время пакета)
+
+    Returns: ответы на запросы в порядке запросов
+    """
+    root = plan_batch(queries,
+                      lambda word: doc_frequency(word_to_docs_mapping, word))
+
+    if workers > 1 and len(root.children) > 1:
+        results = {}
+        if executor is not None:
+            for part in executor.map(_execute_in_worker, _split_plan(root, workers)):
+                results.update(part)
+        else:
+            if index_path is None or storage_policy is None:
+                raise ValueError("index_path and storage_policy are required for workers > 1")
+            with worker_pool(workers, index_path, storage_policy) as executor:
+                for part in executor.map(_execute_in_worker, _split_plan(root, workers)):
+                    results.update(part)
+    else:
+        results = execute_plan(root, word_to_docs_mapping)
+
+    return [results.get(query_id, []) for query_id in range(len(queries))]
@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+"""
+Замеры построения инвертированного индекса, политик хранения
+и задержки запросов на синтетическом корпусе
+
+Корпус и запросы генерируются с распределением слов по закону Ципфа
+(частота слова обратно пропорциональна степени его ранга),
+как в текстах на естественном языке. Для каждого размера корпуса
+(--docs) и каждой политики хранения замеряются:
+    build_s, dump_s, file_bytes, build_peak_rss_bytes - построение и сохранение
+    load_s, latency_*_s, queries_per_s, query_peak_rss_bytes - загрузка и запросы
+
+Построение и запросы выполняются в отдельных процессах,
+чтоб пиковая память (RSS) одной политики не влияла на другие
+
+Результаты сохраняются в JSON (--output) и сравниваются
+с сохраненными ранее (--baseline): если метрика стала хуже больше,
+чем на --tolerance, скрипт завершается с кодом 1
+
+Пример:
+    python benchmark.py --docs 1000 10000 --policies struct mmap --output new.json
+    python benchmark.py --docs 1000 10000 --policies struct mmap --baseline new.json
+"""
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+from typing import List
+
+import inverted_index as IIS
+from stats import PERCENTILES
+from stats import peak_rss_bytes
+from stats import percentile
+from storage_policy import JsonStoragePolicy
+from storage_policy import PklStoragePolicy
+from storage_policy import ZlibStoragePolicy
+
+STORAGE_POLICIES = dict(IIS.STORAGE_POLICIES,
+                        json=JsonStoragePolicy,
+                        pkl=PklStoragePolicy,
+                        zlib=lambda: ZlibStoragePolicy(encoding="utf8"))
+
+# метрики, которые сравниваются с baseline (чем меньше, тем лучше)
+COMPARED_METRICS = ("build_s", "dump_s", "load_s", "file_bytes",
+                    "build_peak_rss_bytes", "query_peak_rss_bytes") + \
+                   tuple(f"latency_p{p}_s" for p in PERCENTILES)
+
+
+def make_inverted_index(doc_count: int, vocabulary_size: int,
+                        words_per_doc: int, seed: int = 0) -> dict:
+    """
+    Синтетический инвертированный индекс
+
+    Args:
+        doc_count: количество документов
+        vocabulary_size: количество различных слов
+        words_per_doc: количество слов в документе
+        seed: зерно генератора случайных чисел
+
+    Returns: словарь слово -> отсортированный список документов
+    """
+    rnd = random.Random(seed)
+    vocabulary = [f"word{i}" for i in range(vocabulary_size)]
+
+    word_to_docs = {}
+    for doc_id in range(1, doc_count + 1):
+        for word in set(rnd.choices(vocabulary, k=words_per_doc)):
+            word_to_docs.setdefault(word, []).append(doc_id)
+
+    return word_to_docs
+
+
+class ZipfWords:
+    """
+    Генератор слов word0, word1, ... с распределением Ципфа:
+    вероятность слова ранга r пропорциональна 1 / (r + 1) ** exponent
+    """
+    def __init__(self, vocabulary_size: int, exponent: float = 1.0, seed: int = 0):
+        self.vocabulary = [f"word{i}" for i in range(vocabulary_size)]
+        self._cum_weights = list(accumulate(1 / (rank + 1) ** exponent
+                                            for rank in range(vocabulary_size)))
+        self._random = random.Random(seed)
+
+    def sample(self, k: int) -> List[str]:
+        """k случайных слов (с повторами)"""
+        return self._random.choices(self.vocabulary, cum_weights=self._cum_weights, k=k)
+
+    def randint(self, low: int, high: int) -> int:
+        return self._random.randint(low, high)
+
+
+def make_corpus(doc_count: int, vocabulary_size: int, words_per_doc: int,
+                exponent: float = 1.0, seed: int = 0) -> List[IIS.Document]:
+    """
+    Синтетический корпус с распределением слов Ципфа
+
+    Длина документа случайная, от 1 до 2 * words_per_doc слов
+
+    Args:
+        doc_count: количество документов
+        vocabulary_size: количество различных слов
+        words_per_doc: среднее количество слов в документе
+        exponent: показатель степени закона Ципфа
+        seed: зерно генератора случайных чисел
+
+    Returns: список документов с номерами 1, 2, ...
+    """
+    words = ZipfWords(vocabulary_size, exponent, seed)
+    return [IIS.Document(doc_id, f"doc{doc_id}",
+                         " ".join(words.sample(words.randint(1, 2 * words_per_doc))))
+            for doc_id in range(1, doc_count + 1)]
+
+
+def make_queries(query_count: int, vocabulary_size: int, max_words: int = 3,
+                 exponent: float = 1.0, seed: int = 1) -> List[List[str]]:
+    """
+    Синтетические запросы из 1..max_words слов с распределением Ципфа
+
+    Args:
+        query_count: количество запросов
+        vocabulary_size: количество различных слов
+        max_words: максимальное количество слов в запросе
+        exponent: показатель степени закона Ципфа
+        seed: зерно генератора случайных чисел
+
+    Returns: список запросов (списков слов)
+    """
+    words = ZipfWords(vocabulary_size, exponent, seed)
+    return [words.sample(words.randint(1, max_words)) for _ in range(query_count)]
+
+
+def benchmark_storage_policy(storage_policy, word_to_docs_mapping: dict,
+                             filepath: str, repeat: int = 3) -> dict:
+    """
+    Замер одной политики хранения
+
+    Args:
+        storage_policy: политика хранения
+        word_to_docs_mapping: инвертированный индекс
+        filepath: путь до временного файла
+        repeat: количество повторов (берется лучшее время)
+
+    Returns: словарь с временем dump и load в секундах,
+             размером файла и количеством идентификаторов в секунду
+    """
+    postings_count = sum(len(docs) for docs in word_to_docs_mapping.values())
+
+    dump_time = load_time = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        storage_policy.dump(word_to_docs_mapping, filepath)
+        dump_time = min(dump_time, time.perf_counter() - started)
+
+        started = time.perf_counter()
+        storage_policy.load(filepath)
+        load_time = min(load_time, time.perf_counter() - started)
+
+    return {"dump_s": dump_time,
+            "load_s": load_time,
+            "file_bytes": os.path.getsize(filepath),
+            "dump_postings_per_s": postings_count / dump_time,
+            "load_postings_per_s": postings_count / load_time}
+
+
+def _build_phase(policy: str, filepath: str, corpus_params: dict, repeat: int) -> dict:
+    """
+    Построение индекса по корпусу и сохранение его политикой policy
+
+    Выполняется в отдельном процессе
+
+    Returns: build_s, dump_s, file_bytes, build_peak_rss_bytes
+    """
+    storage_policy = STORAGE_POLICIES[policy]()
+    documents = make_corpus(**corpus_params)
+
+    build_time = dump_time = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        inverted_index = IIS.build_inverted_index(documents)
+        build_time = min(build_time, time.perf_counter() - started)
+
+        started = time.perf_counter()
+        inverted_index.dump(filepath, storage_policy=storage_policy)
+        dump_time = min(dump_time, time.perf_counter() - started)
+
+    return {"build_s": build_time,
+            "dump_s": dump_time,
+            "file_bytes": os.path.getsize(filepath),
+            "build_peak_rss_bytes": peak_rss_bytes()}
+
+
+def _query_phase(policy: str, filepath: str, queries: list, repeat: int) -> dict:
+    """
+    Загрузка индекса политикой policy и выполнение запросов
+
+    Выполняется в отдельном процессе, каждый запрос выполняется repeat раз
+
+    Returns: load_s, перцентили задержки, queries_per_s, query_peak_rss_bytes
+    """
+    storage_policy = STORAGE_POLICIES[policy]()
+
+    load_time = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        inverted_index = IIS.InvertedIndex.load(filepath, storage_policy=storage_policy)
+        load_time = min(load_time, time.perf_counter() - started)
+
+    latencies = []
+    for _ in range(repeat):
+        for words in queries:
+            started = time.perf_counter()
+            inverted_index.query(words)
+            latencies.append(time.perf_counter() - started)
+    latencies.sort()
+
+    result = {"load_s": load_time}
+    for p in PERCENTILES:
+        result[f"latency_p{p}_s"] = percentile(latencies, p)
+    result["latency_max_s"] = latencies[-1] if latencies else 0.0
+    total = sum(latencies)
+    result["queries_per_s"] = len(latencies) / total if total > 0 else 0.0
+    result["query_peak_rss_bytes"] = peak_rss_bytes()
+    return result
+
+
+def _run_isolated(function, *args):
+    """Выполнение функции в новом процессе (память не наследуется от текущего)"""
+    with ProcessPoolExecutor(max_workers=1,
+                             mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(function, *args).result()
+
+
+def run_benchmark(doc_counts: List[int], policies: List[str],
+                  vocabulary_size: int = 50000, words_per_doc: int = 50,
+                  exponent: float = 1.0, query_count: int = 1000,
+                  max_query_words: int = 3, repeat: int = 3, seed: int = 0) -> dict:
+    """
+    Замер всех политик на корпусах всех размеров
+
+    Args:
+        doc_counts: размеры корпусов (количество документов)
+        policies: названия политик хранения из STORAGE_POLICIES
+        vocabulary_size: количество различных слов
+        words_per_doc: среднее количество слов в документе
+        exponent: показатель степени закона Ципфа
+        query_count: количество запросов
+        max_query_words: максимальное количество слов в запросе
+        repeat: количество повторов (берется лучшее время)
+        seed: зерно генератора случайных чисел
+
+    Returns: {"params": параметры, "results": [{"docs", "policy", метрики...}]}
+    """
+    params = {"vocabulary_size": vocabulary_size,
+              "words_per_doc": words_per_doc,
+              "exponent": exponent,
+              "query_count": query_count,
+              "max_query_words": max_query_words,
+              "repeat": repeat,
+              "seed": seed}
+    queries = make_queries(query_count, vocabulary_size, max_query_words,
+                           exponent, seed=seed + 1)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as tmp_dir:
+        for doc_count in doc_counts:
+            corpus_params = {"doc_count": doc_count,
+                             "vocabulary_size": vocabulary_size,
+                             "words_per_doc": words_per_doc,
+                             "exponent": exponent,
+                             "seed": seed}
+            for policy in policies:
+                filepath = os.path.join(tmp_dir, f"{policy}-{doc_count}")
+                result = {"docs": doc_count, "policy": policy}
+                result.update(_run_isolated(_build_phase, policy, filepath,
+                                            corpus_params, repeat))
+                result.update(_run_isolated(_query_phase, policy, filepath,
+                                            queries, repeat))
+                results.append(result)
+
+    return {"params": params, "results": results}
+
+
+def compare_with_baseline(report: dict, baseline: dict, tolerance: float = 0.1) -> List[dict]:
+    """
+    Поиск метрик, ставших хуже baseline больше, чем на tolerance
+
+    Сравниваются только замеры с одинаковыми docs и policy,
+    метрики из COMPARED_METRICS
+
+    Args:
+        report: результат run_benchmark
+        baseline: сохраненный ранее результат run_benchmark
+        tolerance: допустимое относительное ухудшение (0.1 - на 10%)
+
+    Returns: список регрессий [{"docs", "policy", "metric", "baseline", "current", "ratio"}]
+    """
+    baseline_results = {(result["docs"], result["policy"]): result
+                        for result in baseline["results"]}
+
+    regressions = []
+    for result in report["results"]:
+        old = baseline_results.get((result["docs"], result["policy"]))
+        if old is None:
+            continue
+        for metric in COMPARED_METRICS:
+            current, previous = result.get(metric), old.get(metric)
+            if current is None or not previous:
+                continue
+            ratio = current / previous
+            if ratio > 1 + tolerance:
+                regressions.append({"docs": result["docs"],
+                                    "policy": result["policy"],
+                                    "metric": metric,
+                                    "baseline": previous,
+                                    "current": current,
+                                    "ratio": ratio})
+    return regressions
+
+
+def print_report(report: dict) -> None:
+    """Вывод результатов таблицей"""
+    print(f"{'docs':>8} {'policy':<10} {'build, s':>9} {'dump, s':>9} {'load, s':>9} "
+          f"{'size, MB':>9} {'p50, us':>9} {'p99, us':>9} {'rss, MB':>9}")
+    for result in report["results"]:
+        rss = max(result["build_peak_rss_bytes"] or 0, result["query_peak_rss_bytes"] or 0)
+        print(f"{result['docs']:>8} {result['policy']:<10} {result['build_s']:>9.3f} "
+              f"{result['dump_s']:>9.3f} {result['load_s']:>9.3f} "
+              f"{result['file_bytes'] / 2 ** 20:>9.2f} "
+              f"{result['latency_p50_s'] * 1e6:>9.1f} {result['latency_p99_s'] * 1e6:>9.1f} "
+              f"{rss / 2 ** 20:>9.1f}")
+
+
+def parse_arguments():
+    args_parser = ArgumentParser(description="benchmark inverted index build, "
+                                             "storage policies and query latency")
+    args_parser.add_argument("--docs", dest="docs", nargs="+", default=[20000], type=int,
+                             help="corpus sizes to benchmark")
+    args_parser.add_argument("--vocabulary", dest="vocabulary", default=50000, type=int)
+    args_parser.add_argument("--words-per-doc", dest="words_per_doc", default=50, type=int)
+    args_parser.add_argument("--zipf", dest="zipf", default=1.0, type=float,
+                             help="exponent of Zipf distribution of words")
+    args_parser.add_argument("--queries", dest="queries", default=1000, type=int)
+    args_parser.add_argument("--query-words", dest="query_words", default=3, type=int,
+                             help="maximum number of words in query")
+    args_parser.add_argument("--policies", dest="policies", nargs="+",
+                             choices=STORAGE_POLICIES,
+                             default=["json", "pkl", "zlib", "struct", "columnar", "mmap"])
+    args_parser.add_argument("--repeat", dest="repeat", default=3, type=int)
+    args_parser.add_argument("--seed", dest="seed", default=0, type=int)
+    args_parser.add_argument("--output", dest="output", default=None, type=str,
+                             help="save results to this JSON file")
+    args_parser.add_argument("--baseline", dest="baseline", default=None, type=str,
+                             help="compare results with this JSON file "
+                                  "and exit with code 1 on regression")
+    args_parser.add_argument("--tolerance", dest="tolerance", default=0.1, type=float,
+                             help="allowed relative regression against baseline")
+    return args_parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+
+    report = run_benchmark(args.docs, args.policies,
+                           vocabulary_size=args.vocabulary,
+                           words_per_doc=args.words_per_doc,
+                           exponent=args.zipf,
+                           query_count=args.queries,
+                           max_query_words=args.query_words,
+                           repeat=args.repeat,
+                           seed=args.seed)
+    print_report(report)
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, encoding="utf8") as f:
+            baseline = json.load(f)
+        if baseline.get("params") != report["params"]:
+            print("warning: baseline was measured with different parameters")
+
+        regressions = compare_with_baseline(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"regression: docs={regression['docs']} policy={regression['policy']} "
+                  f"{regression['metric']} {regression['baseline']:.6g} -> "
+                  f"{regression['current']:.6g} (x{regression['ratio']:.2f})")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
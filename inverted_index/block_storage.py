@@ -0,0 +1,377 @@
+"""
+Модуль, в котором реализовано хранение инвертированного индекса
+со сжатием списков документов независимыми блоками
+
+ZlibStoragePolicy сжимает весь индекс одним потоком, поэтому чтобы
+прочитать одно слово, приходится распаковать и разобрать все.
+Здесь списки документов (CompressedPostings.to_bytes) идут подряд
+в порядке возрастания слов и режутся на блоки примерно по block_size
+байт, каждый блок сжимается отдельно (zlib, lzma или bz2).
+Словарь термов и таблица записей не сжимаются и читаются через mmap,
+как у MmapStoragePolicy, поэтому поиск слова, количество документов
+и шаблоны (data*) блоки не трогают, а запрос распаковывает только
+блоки своих слов. Последние распакованные блоки кэшируются
+
+Полная загрузка (preload, raw_items) распаковывает блоки параллельно
+в потоках: zlib, lzma и bz2 отпускают GIL на время распаковки
+
+Формат файла
+    1 заголовок MmapStoragePolicy (magic, версия, количество слов,
+      смещение словаря термов, смещение таблицы записей)
+    2 заголовок блоков (см. block_header): кодек, размер блока,
+      количество блоков, смещение таблицы блоков
+    3 сжатые блоки
+    4 словарь термов - все слова подряд
+    5 таблица записей по 3 числа uint64 на слово: смещение слова
+      в словаре термов, смещение списка документов в несжатом потоке,
+      количество документов + запись-ограничитель
+    6 таблица блоков по 2 числа uint64 на блок: смещение сжатого блока
+      в файле, смещение начала блока в несжатом потоке + ограничитель
+"""
+import bz2
+import lzma
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from postings import CompressedPostings
+from postings import convert_postings
+from storage_policy import MmapStoragePolicy
+from storage_policy import MmapTermDictionary
+
+# кодек -> (номер в заголовке, сжатие, распаковка)
+CODECS = {
+    "zlib": (1, zlib.compress, zlib.decompress),
+    "lzma": (2, lzma.compress, lzma.decompress),
+    "bz2": (3, bz2.compress, bz2.decompress),
+}
+_CODECS_BY_ID = {codec_id: name for name, (codec_id, _, _) in CODECS.items()}
+
+# размер несжатого блока по умолчанию в байтах
+BLOCK_SIZE = 1 << 16
+# сколько распакованных блоков держать в кэше
+CACHE_BLOCKS = 32
+
+
+def _default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def _ordered_map(function, items: list, workers: int):
+    """
+    Применение function к items в workers потоках с результатами по порядку
+
+    Вперед считается не больше 2 * workers элементов,
+    поэтому в памяти не копятся результаты всех элементов
+    """
+    if workers <= 1 or len(items) <= 1:
+        yield from map(function, items)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class BlockTermDictionary(MmapTermDictionary):
+    """
+    Инвертированный индекс в формате BlockStoragePolicy, открытый через mmap
+
+    Ведет себя как словарь слово -> CompressedPostings, слово ищется
+    по несжатому словарю термов, а распаковывается только блок
+    с его списком документов
+
+    * blocks_decompressed - сколько раз распаковывались блоки
+    """
+    def __init__(self, filepath: str, storage_policy):
+        super().__init__(filepath, storage_policy)
+        self._cache = OrderedDict()
+
+        (codec_id, self.block_size, block_count,
+         block_index_offset) = storage_policy.block_header.unpack_from(
+            self._mmap, storage_policy.header.size)
+        if codec_id not in _CODECS_BY_ID:
+            self.close()
+            raise ValueError(f"{filepath} is compressed with unknown codec {codec_id}")
+        self.codec = _CODECS_BY_ID[codec_id]
+        self._decompress = CODECS[self.codec][2]
+
+        block_index = array("Q")
+        block_index.frombytes(self._buffer[block_index_offset:
+                                           block_index_offset + 16 * (block_count + 1)])
+        if sys.byteorder != "little":
+            block_index.byteswap()
+        self._block_offsets = block_index[0::2].tolist()
+        self._block_starts = block_index[1::2].tolist()
+        self._block_count = block_count
+
+        self.workers = storage_policy.workers or _default_workers()
+        self._cache_blocks = storage_policy.cache_blocks
+        self.blocks_decompressed = 0
+
+    def _read_block(self, block: int) -> bytes:
+        """Распаковка блока (без кэша)"""
+        self.blocks_decompressed += 1
+        return self._decompress(self._buffer[self._block_offsets[block]:
+                                             self._block_offsets[block + 1]])
+
+    def _block(self, block: int) -> bytes:
+        """Распакованный блок из кэша или с диска"""
+        data = self._cache.get(block)
+        if data is not None:
+            self._cache.move_to_end(block)
+            return data
+
+        data = self._read_block(block)
+        self._cache[block] = data
+        if len(self._cache) > self._cache_blocks:
+            self._cache.popitem(last=False)
+        return data
+
+    def __getitem__(self, word: str):
+        i = self._find(word)
+        if i < 0:
+            raise KeyError(word)
+
+        step = self._entry_size
+        start = self._entries[i * step + 1]
+        end = self._entries[(i + 1) * step + 1]
+        # список документов никогда не разрезается между блоками
+        block = bisect_right(self._block_starts, start, 0, self._block_count) - 1
+        base = self._block_starts[block]
+        data = memoryview(self._block(block))
+        return self._postings_class.from_bytes(data[start - base:end - base])
+
+    def raw_items(self):
+        """
+        Все слова в байтах со списками документов в порядке хранения,
+        блоки распаковываются параллельно в workers потоках
+
+        Returns: генератор пар (слово в байтах, список документов)
+        """
+        entries = self._entries
+        step = self._entry_size
+        i = 0
+        blocks = _ordered_map(self._read_block, list(range(self._block_count)), self.workers)
+        for block, data in enumerate(blocks):
+            data = memoryview(data)
+            base = self._block_starts[block]
+            block_end = self._block_starts[block + 1]
+            while i < self._term_count and entries[(i + 1) * step + 1] <= block_end:
+                start = entries[i * step + 1] - base
+                end = entries[(i + 1) * step + 1] - base
+                yield self._term(i), self._postings_class.from_bytes(data[start:end])
+                i += 1
+
+    def to_dict(self) -> dict:
+        """Полная загрузка индекса в словарь с параллельной распаковкой блоков"""
+        return {key.decode(self.encoding): postings for key, postings in self.raw_items()}
+
+    def close(self) -> None:
+        self._cache.clear()
+        super().close()
+
+
+class BlockIndexWriter:
+    """
+    Потоковая запись инвертированного индекса в формате BlockStoragePolicy
+
+    Слова должны добавляться в порядке возрастания их байтового
+    представления, заполненные блоки сжимаются параллельно
+    в workers потоках и сразу пишутся в файл
+    """
+    def __init__(self, filepath: str, storage_policy):
+        self.encoding = storage_policy.encoding
+        self._storage_policy = storage_policy
+        self._compress = CODECS[storage_policy.codec][1]
+        self._file = open(filepath, "wb")
+        self._offset = storage_policy.header.size + storage_policy.block_header.size
+        self._file.write(b"\0" * self._offset)
+
+        self._terms = bytearray()
+        self._entries = array("Q")
+        self._previous = None
+
+        self._block = bytearray()
+        # смещение текущего блока в несжатом потоке
+        self._block_start = 0
+        self._block_index = array("Q")
+
+        workers = storage_policy.workers or _default_workers()
+        self._executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        self._max_pending = 2 * workers
+        self._pending = deque()
+
+    def add(self, word: str, docs) -> None:
+        """
+        Добавление слова со списком документов
+
+        Args:
+            word: слово
+            docs: список документов в любом из форматов postings
+                  или просто набор идентификаторов
+        """
+        key = word.encode(self.encoding)
+        if self._previous is not None and key <= self._previous:
+            raise ValueError("words must be added in sorted order")
+        self._previous = key
+
+        postings = convert_postings(docs, CompressedPostings)
+        raw_postings = postings.to_bytes()
+
+        if self._block and len(self._block) + len(raw_postings) > self._storage_policy.block_size:
+            self._flush_block()
+
+        self._entries.extend((len(self._terms),
+                              self._block_start + len(self._block),
+                              len(postings)))
+        self._terms += key
+        self._block += raw_postings
+
+    def _flush_block(self) -> None:
+        """Отправка текущего блока на сжатие"""
+        data = bytes(self._block)
+        self._pending.append((self._block_start,
+                              self._executor.submit(self._compress, data)
+                              if self._executor is not None else self._compress(data)))
+        self._block_start += len(data)
+        self._block = bytearray()
+
+        while len(self._pending) >= self._max_pending:
+            self._write_pending()
+
+    def _write_pending(self) -> None:
+        """Запись самого старого сжатого блока"""
+        block_start, compressed = self._pending.popleft()
+        if self._executor is not None:
+            compressed = compressed.result()
+        self._block_index.extend((self._offset, block_start))
+        self._file.write(compressed)
+        self._offset += len(compressed)
+
+    def close(self) -> None:
+        """Дописывает блоки, словарь термов, таблицы и заголовки, закрывает файл"""
+        if self._block:
+            self._flush_block()
+        while self._pending:
+            self._write_pending()
+        self._shutdown()
+
+        block_count = len(self._block_index) // 2
+        self._block_index.extend((self._offset, self._block_start))
+
+        term_count = len(self._entries) // self._storage_policy.entry_size
+        self._entries.extend((len(self._terms), self._block_start, 0))
+
+        terms_offset = self._offset
+        self._file.write(self._terms)
+        self._offset += len(self._terms)
+
+        padding = -self._offset % 8
+        self._file.write(b"\0" * padding)
+        entries_offset = self._offset + padding
+        block_index_offset = entries_offset + 8 * len(self._entries)
+
+        if sys.byteorder != "little":
+            self._entries.byteswap()
+            self._block_index.byteswap()
+        self._entries.tofile(self._file)
+        self._block_index.tofile(self._file)
+
+        policy = self._storage_policy
+        self._file.seek(0)
+        self._file.write(policy.header.pack(policy.magic,
+                                            policy.version,
+                                            term_count,
+                                            terms_offset,
+                                            entries_offset))
+        self._file.write(policy.block_header.pack(CODECS[policy.codec][0],
+                                                  policy.block_size,
+                                                  block_count,
+                                                  block_index_offset))
+        self._file.close()
+
+    def _shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._shutdown()
+            self._file.close()
+
+
+class BlockStoragePolicy(MmapStoragePolicy):
+    """
+    Сохранение инвертированного индекса со сжатием
+    списков документов независимыми блоками
+
+    load возвращает BlockTermDictionary, который распаковывает
+    только нужные запросу блоки, а с preload=True - обычный словарь,
+    блоки которого распакованы параллельно
+    """
+    magic = b"IIBK"
+    block_header = struct.Struct("<4Q")
+
+    def __init__(self, encoding, codec: str = "zlib", block_size: int = BLOCK_SIZE,
+                 workers: Optional[int] = None, preload: bool = False,
+                 cache_blocks: int = CACHE_BLOCKS):
+        """
+        Args:
+            encoding: кодировка в которой сохраняются слова
+            codec: алгоритм сжатия блоков: zlib, lzma или bz2
+                   (при чтении берется из файла)
+            block_size: размер несжатого блока в байтах
+            workers: количество потоков сжатия и распаковки
+                     (None - по количеству процессоров)
+            preload: загружать индекс целиком
+            cache_blocks: сколько распакованных блоков держать в кэше
+        """
+        super().__init__(encoding)
+        if codec not in CODECS:
+            raise ValueError(f"unknown codec {codec!r}, expected one of {list(CODECS)}")
+        if block_size <= 0:
+            raise ValueError("block_size must be positive")
+        self.codec = codec
+        self.block_size = block_size
+        self.workers = workers
+        self.preload = preload
+        self.cache_blocks = cache_blocks
+
+    def writer(self, filepath: str) -> BlockIndexWriter:
+        """Потоковая запись индекса, слова подаются отсортированными"""
+        return BlockIndexWriter(filepath, self)
+
+    def load(self, filepath: str):
+        """
+        Открытие инвертированного индекса с жесткого диска
+
+        Args:
+            filepath: путь до сохраненного инвертированного индекса
+
+        Returns: ленивый BlockTermDictionary или, с preload,
+                 словарь слово -> CompressedPostings
+        """
+        term_dictionary = BlockTermDictionary(filepath, self)
+        if not self.preload:
+            return term_dictionary
+        with term_dictionary:
+            return term_dictionary.to_dict()
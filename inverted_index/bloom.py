@@ -0,0 +1,127 @@
+"""
+Модуль, в котором реализован фильтр Блума по словарю индекса
+
+Фильтр отвечает на вопрос "есть ли слово в индексе" без обращения
+к словарю термов: "нет" - слова точно нет, "да" - слово, скорее всего,
+есть (с вероятностью ошибки error_rate). Запрос с неизвестным словом
+(опечаткой) сразу возвращает пустой ответ, не читая ни словарь,
+ни списки документов остальных слов
+
+На слово уходит около 1.44 * log2(1 / error_rate) бит:
+при error_rate = 0.01 это примерно 10 бит (1.2 байта)
+
+Позиции битов получаются двойным хэшированием:
+(h1 + i * h2) mod bit_count, i = 0 .. hash_count - 1,
+где h1 и h2 - половины 64 битного blake2b от слова в utf8
+(hash() для строк зависит от процесса и не годится для файла)
+
+Формат файла (см. BloomFilter.header): magic, версия, количество бит,
+количество хэш функций, затем биты
+"""
+import math
+import struct
+from hashlib import blake2b
+from typing import Iterable
+
+BLOOM_SUFFIX = ".bloom"
+
+# вероятность ложного срабатывания по умолчанию
+ERROR_RATE = 0.01
+
+
+class BloomFilter:
+    """
+    Фильтр Блума для слов
+
+    * bit_count - количество бит
+    * hash_count - количество хэш функций
+
+    Пример:
+        bloom = BloomFilter.from_keys(["hello", "world"])
+        "hello" in bloom  # True
+        "helo" in bloom  # почти наверняка False
+    """
+    magic = b"IIBF"
+    version = 1
+    header = struct.Struct("<4sHxxQQ")
+
+    def __init__(self, bit_count: int, hash_count: int, bits=None):
+        if bit_count <= 0 or hash_count <= 0:
+            raise ValueError("bit_count and hash_count must be positive")
+        self.bit_count = bit_count
+        self.hash_count = hash_count
+        self._bits = bits if bits is not None else bytearray((bit_count + 7) // 8)
+
+    @classmethod
+    def from_keys(cls, keys: Iterable[str], error_rate: float = ERROR_RATE):
+        """
+        Фильтр по набору слов
+
+        Args:
+            keys: слова (итерируются один раз, если это список или словарь,
+                  иначе сначала складываются в список)
+            error_rate: желаемая вероятность ложного срабатывания, от 0 до 1
+
+        Returns: BloomFilter
+        """
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        if not hasattr(keys, "__len__"):
+            keys = list(keys)
+
+        key_count = max(len(keys), 1)
+        bit_count = max(math.ceil(-key_count * math.log(error_rate) / math.log(2) ** 2), 8)
+        hash_count = max(round(bit_count / key_count * math.log(2)), 1)
+
+        bloom = cls(bit_count, hash_count)
+        for key in keys:
+            bloom.add(key)
+        return bloom
+
+    def _positions(self, key: str):
+        digest = blake2b(key.encode("utf8"), digest_size=8).digest()
+        h1 = int.from_bytes(digest[:4], "little")
+        h2 = int.from_bytes(digest[4:], "little") | 1
+        bit_count = self.bit_count
+        return [(h1 + i * h2) % bit_count for i in range(self.hash_count)]
+
+    def add(self, key: str) -> None:
+        """Добавление слова"""
+        bits = self._bits
+        for position in self._positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        bits = self._bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def nbytes(self) -> int:
+        """Размер битов фильтра в байтах"""
+        return len(self._bits)
+
+    def to_bytes(self) -> bytes:
+        return self.header.pack(self.magic, self.version,
+                                self.bit_count, self.hash_count) + bytes(self._bits)
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        magic, version, bit_count, hash_count = cls.header.unpack_from(data)
+        if magic != cls.magic or version != cls.version:
+            raise ValueError("data is not a bloom filter")
+        bits = data[cls.header.size:cls.header.size + (bit_count + 7) // 8]
+        return cls(bit_count, hash_count, bytearray(bits))
+
+    def dump(self, filepath: str) -> None:
+        """Сохранение фильтра в файл"""
+        with open(filepath, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, filepath: str):
+        """Загрузка фильтра из файла"""
+        with open(filepath, "rb") as f:
+            return cls.from_bytes(f.read())
@@ -0,0 +1,570 @@
+"""
+Модуль, в котором реализованы булевы запросы к инвертированному индексу
+
+Язык запросов:
+    hello world          - И (оператор AND между словами можно не писать)
+    hello AND world      - И
+    hello OR world       - ИЛИ
+    hello NOT world      - документы с hello без world
+    (hello OR hi) world  - скобки
+    "hello world"        - фраза (нужен позиционный индекс, см. модуль positional)
+    "hello world"~2      - слова фразы по порядку, между соседними
+                           не больше 2 других слов
+    data* или d?ta       - шаблон, OR всех подходящих слов индекса
+                           (см. модуль term_dictionary)
+Операторы пишутся заглавными буквами, приоритет: NOT, AND, OR
+
+Запрос разбирается в дерево (parse_query), затем по дереву строится
+план (plan_query): вложенные AND и OR сливаются, у каждого узла
+оценивается количество документов, операнды AND упорядочиваются
+по возрастанию этой оценки, а NOT становится вычитанием внутри AND.
+При выполнении (execute_plan):
+* кандидаты AND берутся из самого короткого операнда и фильтруются
+  остальными, пустой промежуточный результат прекращает вычисление
+* NOT - вычитание слиянием двух отсортированных списков
+* с ограничением limit кандидаты AND фильтруются порциями,
+  и вычисление останавливается, как только набрано limit документов
+"""
+import heapq
+import re
+from bisect import bisect_left
+from itertools import islice
+from typing import Callable
+from typing import List
+from typing import Optional
+
+from batch_query import doc_frequency
+from positional import filter_phrase
+from postings import intersect_sorted
+from term_dictionary import expand_terms
+from term_dictionary import is_wildcard
+
+AND = "AND"
+OR = "OR"
+NOT = "NOT"
+
+_TOKEN_RE = re.compile(r'"[^"]*"(?:~\d+)?|\(|\)|[^\s()"]+')
+_PHRASE_RE = re.compile(r'"([^"]*)"(?:~(\d+))?')
+
+# минимальный размер порции кандидатов AND при выполнении с limit
+CHUNK_SIZE = 256
+
+
+class QuerySyntaxError(ValueError):
+    """Ошибка в тексте булева запроса"""
+
+
+class Term:
+    """
+    Слово запроса
+
+    * word - слово
+    * cost - количество документов со словом
+    """
+    __slots__ = ("word", "cost")
+
+    def __init__(self, word: str):
+        self.word = word
+        self.cost = None
+
+    def __repr__(self):
+        return f"Term({self.word!r})"
+
+
+class And:
+    """
+    Пересечение
+
+    * positives - операнды, которые должны быть в документе
+    * negatives - операнды под NOT, которых в документе быть не должно
+    * cost - оценка сверху количества документов в результате
+    """
+    __slots__ = ("positives", "negatives", "cost")
+
+    def __init__(self, positives: list, negatives: list = None):
+        self.positives = positives
+        self.negatives = negatives if negatives is not None else []
+        self.cost = None
+
+    def __repr__(self):
+        return f"And({self.positives!r}, not={self.negatives!r})"
+
+
+class Or:
+    """
+    Объединение
+
+    * children - операнды
+    * cost - оценка сверху количества документов в результате
+    """
+    __slots__ = ("children", "cost")
+
+    def __init__(self, children: list):
+        self.children = children
+        self.cost = None
+
+    def __repr__(self):
+        return f"Or({self.children!r})"
+
+
+class Phrase:
+    """
+    Фраза
+
+    * words - слова фразы по порядку
+    * slop - сколько других слов допускается между соседними словами
+    * cost - оценка сверху количества документов в результате
+    """
+    __slots__ = ("words", "slop", "cost")
+
+    def __init__(self, words: List[str], slop: int = 0):
+        self.words = words
+        self.slop = slop
+        self.cost = None
+
+    def __repr__(self):
+        return f"Phrase({self.words!r}, slop={self.slop})"
+
+
+class Not:
+    """
+    Отрицание, допустимо только как операнд AND
+
+    * child - отрицаемый операнд
+    """
+    __slots__ = ("child",)
+
+    def __init__(self, child):
+        self.child = child
+
+    def __repr__(self):
+        return f"Not({self.child!r})"
+
+
+class _Parser:
+    """Разбор запроса рекурсивным спуском"""
+    def __init__(self, tokens: List[str]):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self) -> Optional[str]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self) -> str:
+        token = self.peek()
+        if token is None:
+            raise QuerySyntaxError("unexpected end of query")
+        self.pos += 1
+        return token
+
+    def parse(self):
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise QuerySyntaxError(f"unexpected {self.peek()!r}")
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek() == OR:
+            self.take()
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else Or(children)
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        while self.peek() not in (None, OR, ")"):
+            if self.peek() == AND:
+                self.take()
+            children.append(self.parse_not())
+        return children[0] if len(children) == 1 else And(children)
+
+    def parse_not(self):
+        if self.peek() == NOT:
+            self.take()
+            child = self.parse_not()
+            # NOT NOT x - это x
+            return child.child if isinstance(child, Not) else Not(child)
+        return self.parse_atom()
+
+    def parse_atom(self):
+        token = self.take()
+        if token == "(":
+            node = self.parse_or()
+            if self.take() != ")":
+                raise QuerySyntaxError("missing ')'")
+            return node
+        if token in (AND, OR, ")"):
+            raise QuerySyntaxError(f"unexpected {token!r}")
+        if token.startswith('"'):
+            words, slop = _PHRASE_RE.fullmatch(token).groups()
+            words = words.split()
+            if not words:
+                raise QuerySyntaxError("empty phrase")
+            if len(words) == 1:
+                return Term(words[0])
+            return Phrase(words, int(slop or 0))
+        return Term(token)
+
+
+def parse_query(text: str):
+    """
+    Разбор текста булева запроса
+
+    Args:
+        text: текст запроса, например "(hello OR hi) world NOT bye"
+
+    Returns: дерево запроса из Term, And, Or, Not
+    """
+    if text.count('"') % 2:
+        raise QuerySyntaxError("missing closing quote")
+    tokens = _TOKEN_RE.findall(text)
+    if not tokens:
+        raise QuerySyntaxError("empty query")
+    return _Parser(tokens).parse()
+
+
+def analyze_query(node, analyzer):
+    """
+    Обработка слов дерева запроса анализатором индекса
+
+    Стоп-слова выбрасываются из фраз и из операндов AND и OR
+
+    Args:
+        node: дерево запроса (см. parse_query)
+        analyzer: анализатор (см. модуль analyzer)
+
+    Returns: новое дерево запроса или None, если в запросе остались
+             только стоп-слова
+    """
+    if isinstance(node, Term):
+        word = analyzer.normalize(node.word)
+        return None if word is None else Term(word)
+
+    if isinstance(node, Phrase):
+        words = analyzer.analyze_words(node.words)
+        if not words:
+            return None
+        return Term(words[0]) if len(words) == 1 else Phrase(words, node.slop)
+
+    if isinstance(node, Not):
+        child = analyze_query(node.child, analyzer)
+        return None if child is None else Not(child)
+
+    if isinstance(node, Or):
+        children = [child for child in (analyze_query(child, analyzer)
+                                        for child in node.children)
+                    if child is not None]
+        if not children:
+            return None
+        return children[0] if len(children) == 1 else Or(children)
+
+    children = [child for child in (analyze_query(child, analyzer)
+                                    for child in node.positives + node.negatives)
+                if child is not None]
+    if all(isinstance(child, Not) for child in children):
+        return None
+    return And(children)
+
+
+def plan_query(node, frequency: Callable[[str], int],
+               expand: Optional[Callable[[str], List[str]]] = None):
+    """
+    Построение плана выполнения запроса
+
+    Args:
+        node: дерево запроса (см. parse_query)
+        frequency: функция слово -> количество документов
+        expand: функция шаблон -> подходящие слова индекса,
+                без нее шаблоны ищутся как обычные слова
+
+    Returns: план - дерево из Term, Phrase, And, Or с посчитанными cost,
+             операнды AND упорядочены по возрастанию cost
+    """
+    if isinstance(node, Term):
+        if expand is not None and is_wildcard(node.word):
+            words = expand(node.word)
+            if not words:
+                planned = Term(node.word)
+                planned.cost = 0
+                return planned
+            return plan_query(Or([Term(word) for word in words]), frequency)
+        planned = Term(node.word)
+        planned.cost = frequency(node.word)
+        return planned
+
+    if isinstance(node, Phrase):
+        planned = Phrase(node.words, node.slop)
+        planned.cost = min(frequency(word) for word in node.words)
+        return planned
+
+    if isinstance(node, Not):
+        raise QuerySyntaxError("NOT can only be used together with a positive operand")
+
+    if isinstance(node, Or):
+        children = []
+        for child in node.children:
+            child = plan_query(child, frequency, expand)
+            # вложенные OR сливаются в один
+            children.extend(child.children if isinstance(child, Or) else [child])
+        children = [child for child in children if child.cost]
+        if len(children) == 1:
+            return children[0]
+        planned = Or(children)
+        planned.cost = sum(child.cost for child in children)
+        return planned
+
+    positives = []
+    negatives = []
+    for child in node.positives + node.negatives:
+        if isinstance(child, Not):
+            negatives.append(plan_query(child.child, frequency, expand))
+            continue
+        child = plan_query(child, frequency, expand)
+        # вложенные AND сливаются в один
+        if isinstance(child, And):
+            positives.extend(child.positives)
+            negatives.extend(child.negatives)
+        else:
+            positives.append(child)
+
+    if not positives:
+        raise QuerySyntaxError("NOT can only be used together with a positive operand")
+
+    planned = And(sorted(positives, key=lambda child: child.cost),
+                  sorted((child for child in negatives if child.cost),
+                         key=lambda child: child.cost))
+    planned.cost = planned.positives[0].cost
+    return planned
+
+
+def _intersect_lists(doc_ids: List[int], other: List[int]) -> List[int]:
+    """Пересечение отсортированных списков бинарным поиском по большему"""
+    result = []
+    pos = 0
+    size = len(other)
+    for doc_id in doc_ids:
+        pos = bisect_left(other, doc_id, pos)
+        if pos == size:
+            break
+        if other[pos] == doc_id:
+            result.append(doc_id)
+    return result
+
+
+def _difference_sorted(doc_ids: List[int], present: List[int]) -> List[int]:
+    """
+    Разность отсортированных списков слиянием
+
+    Args:
+        doc_ids: отсортированный список документов
+        present: отсортированное подмножество doc_ids
+
+    Returns: документы из doc_ids, которых нет в present
+    """
+    if not present:
+        return doc_ids
+    result = []
+    pos = 0
+    size = len(present)
+    for doc_id in doc_ids:
+        if pos < size and present[pos] == doc_id:
+            pos += 1
+        else:
+            result.append(doc_id)
+    return result
+
+
+class _Operand:
+    """
+    Операнд AND, умеющий отфильтровать отсортированный список кандидатов
+
+    Слово фильтрует кандидатов своим списком документов (filter_sorted),
+    фраза - списками своих слов и затем позициями,
+    сложный операнд вычисляется один раз при первом обращении
+    """
+    def __init__(self, node, word_to_docs_mapping, positional_mapping):
+        self.node = node
+        self.word_to_docs_mapping = word_to_docs_mapping
+        self.positional_mapping = positional_mapping
+        self._doc_ids = None
+
+    def present(self, doc_ids: List[int]) -> List[int]:
+        if isinstance(self.node, Term):
+            try:
+                postings = self.word_to_docs_mapping[self.node.word]
+            except KeyError:
+                return []
+            return postings.filter_sorted(doc_ids)
+
+        if isinstance(self.node, Phrase):
+            return _filter_phrase(doc_ids, self.node, self.word_to_docs_mapping,
+                                  self.positional_mapping)
+
+        if self._doc_ids is None:
+            self._doc_ids = execute_plan(self.node, self.word_to_docs_mapping,
+                                         positional_mapping=self.positional_mapping)
+        return _intersect_lists(doc_ids, self._doc_ids)
+
+
+def _filter_phrase(doc_ids: List[int], phrase: Phrase, word_to_docs_mapping,
+                   positional_mapping) -> List[int]:
+    if positional_mapping is None:
+        raise ValueError("phrase queries need a positional index")
+    try:
+        postings_lists = [word_to_docs_mapping[word] for word in set(phrase.words)]
+    except KeyError:
+        return []
+    doc_ids = intersect_sorted(doc_ids, postings_lists)
+    return filter_phrase(doc_ids, phrase.words, positional_mapping, phrase.slop)
+
+
+def _filter_candidates(doc_ids: List[int], positives: list, negatives: list) -> List[int]:
+    for operand in positives:
+        if not doc_ids:
+            return doc_ids
+        doc_ids = operand.present(doc_ids)
+    for operand in negatives:
+        if not doc_ids:
+            return doc_ids
+        doc_ids = _difference_sorted(doc_ids, operand.present(doc_ids))
+    return doc_ids
+
+
+def execute_plan(plan, word_to_docs_mapping, limit: Optional[int] = None,
+                 positional_mapping=None) -> List[int]:
+    """
+    Выполнение плана запроса
+
+    Args:
+        plan: план (см. plan_query)
+        word_to_docs_mapping: инвертированный индекс
+        limit: максимальное количество документов в ответе (None - все)
+        positional_mapping: позиционный индекс, нужен для фраз
+
+    Returns: отсортированный список первых limit документов
+    """
+    if limit is not None and limit <= 0:
+        return []
+
+    if isinstance(plan, Term):
+        try:
+            postings = word_to_docs_mapping[plan.word]
+        except KeyError:
+            return []
+        return list(islice(postings, limit))
+
+    if isinstance(plan, Phrase):
+        if plan.cost == 0:
+            return []
+        shortest = min(plan.words, key=lambda word: len(word_to_docs_mapping[word]))
+        doc_ids = _filter_phrase(list(word_to_docs_mapping[shortest]), plan,
+                                 word_to_docs_mapping, positional_mapping)
+        return doc_ids[:limit]
+
+    if isinstance(plan, Or):
+        results = [execute_plan(child, word_to_docs_mapping, limit, positional_mapping)
+                   for child in plan.children]
+        doc_ids = []
+        for doc_id in heapq.merge(*results):
+            if not doc_ids or doc_ids[-1] != doc_id:
+                doc_ids.append(doc_id)
+                if limit is not None and len(doc_ids) == limit:
+                    break
+        return doc_ids
+
+    if plan.cost == 0:
+        return []
+
+    positives = [_Operand(child, word_to_docs_mapping, positional_mapping)
+                 for child in plan.positives[1:]]
+    negatives = [_Operand(child, word_to_docs_mapping, positional_mapping)
+                 for child in plan.negatives]
+
+    if limit is None:
+        candidates = execute_plan(plan.positives[0], word_to_docs_mapping,
+                                  positional_mapping=positional_mapping)
+        return _filter_candidates(candidates, positives, negatives)
+
+    # ранняя остановка: кандидаты раскодируются и фильтруются порциями
+    first = plan.positives[0]
+    if isinstance(first, Term):
+        candidates = iter(word_to_docs_mapping[first.word])
+    else:
+        candidates = iter(execute_plan(first, word_to_docs_mapping,
+                                       positional_mapping=positional_mapping))
+
+    chunk_size = max(CHUNK_SIZE, 2 * limit)
+    doc_ids = []
+    while len(doc_ids) < limit:
+        chunk = list(islice(candidates, chunk_size))
+        if not chunk:
+            break
+        doc_ids.extend(_filter_candidates(chunk, positives, negatives))
+    return doc_ids[:limit]
+
+
+def boolean_query(word_to_docs_mapping, text: str, limit: Optional[int] = None,
+                  positional_mapping=None, analyzer=None) -> List[int]:
+    """
+    Разбор, планирование и выполнение булева запроса
+
+    Args:
+        word_to_docs_mapping: инвертированный индекс
+        text: текст запроса
+        limit: максимальное количество документов в ответе (None - все)
+        positional_mapping: позиционный индекс, нужен для фраз
+        analyzer: анализатор слов запроса (None - слова ищутся как есть)
+
+    Returns: отсортированный список документов
+    """
+    node = parse_query(text)
+    if analyzer is not None:
+        node = analyze_query(node, analyzer)
+        if node is None:
+            return []
+    plan = plan_query(node,
+                      lambda word: doc_frequency(word_to_docs_mapping, word),
+                      lambda pattern: expand_terms(word_to_docs_mapping, pattern))
+    return execute_plan(plan, word_to_docs_mapping, limit, positional_mapping)
+
+
+def and_query(word_to_docs_mapping, words, limit: Optional[int] = None) -> List[int]:
+    """
+    Пересечение списков документов слов с ранней остановкой по limit
+
+    Args:
+        word_to_docs_mapping: инвертированный индекс
+        words: слова запроса, шаблоны (data*, d?ta) заменяются
+               объединением подходящих слов
+        limit: максимальное количество документов в ответе (None - все)
+
+    Returns: отсортированный список документов
+    """
+    words = set(words)
+    if not words:
+        return []
+    plan = plan_query(And([Term(word) for word in words]),
+                      lambda word: doc_frequency(word_to_docs_mapping, word),
+                      lambda pattern: expand_terms(word_to_docs_mapping, pattern))
+    return execute_plan(plan, word_to_docs_mapping, limit)
+
+
+def union_and_query(word_to_docs_mapping, alternatives: List[List[str]],
+                    limit: Optional[int] = None) -> List[int]:
+    """
+    Пересечение объединений: документы, в которых есть
+    хотя бы одно слово из каждой группы
+
+    Args:
+        word_to_docs_mapping: инвертированный индекс
+        alternatives: группы слов, например близкие по написанию
+                      слова для каждого слова запроса
+        limit: максимальное количество документов в ответе (None - все)
+
+    Returns: отсортированный список документов
+    """
+    if not alternatives or not all(alternatives):
+        return []
+    plan = plan_query(And([Or([Term(word) for word in words]) for words in alternatives]),
+                      lambda word: doc_frequency(word_to_docs_mapping, word))
+    return execute_plan(plan, word_to_docs_mapping, limit)
@@ -0,0 +1,289 @@
+"""
+Модуль, в котором реализовано компактное хранилище документов
+
+Тексты документов в хранилище не копируются: для каждого документа
+хранится только смещение и длина его строки в исходном наборе данных
+и название документа. Набор данных и само хранилище открываются
+через mmap, поэтому по номерам документов из ответа на запрос можно
+получить названия и фрагменты текста (snippets), не держа тексты в памяти
+
+Хранилище лежит рядом с индексом (путь индекса + DOCS_SUFFIX),
+у индекса-директории (шарды) - внутри нее (см. document_store_path)
+
+Формат файла (все числа little endian)
+    1 заголовок (см. DocumentStore.header): magic, версия, количество
+      документов, размер набора данных, смещения разделов 3 и 4
+    2 путь до набора данных в utf8
+    3 названия документов подряд в utf8
+    4 колонки uint64 (раздел выровнен по 8 байт), документы
+      по возрастанию номера:
+        номера документов
+        смещения строк в наборе данных
+        длины строк в байтах (без перевода строки)
+        смещения названий в разделе 3 (+ ограничитель)
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Callable
+from typing import Iterable
+from typing import Optional
+
+DOCS_SUFFIX = ".docs"
+# имя хранилища внутри индекса-директории
+DOCS_FILENAME = "documents" + DOCS_SUFFIX
+
+# ширина фрагмента текста по умолчанию в символах
+SNIPPET_WIDTH = 100
+
+
+def document_store_path(index_path: str) -> str:
+    """Путь до хранилища документов индекса (файла или директории)"""
+    if os.path.isdir(index_path):
+        return os.path.join(index_path, DOCS_FILENAME)
+    return index_path + DOCS_SUFFIX
+
+
+def _columns(buffer: memoryview, offset: int, count: int) -> list:
+    """count + 1 чисел uint64 для каждой из колонок хранилища"""
+    sizes = (count, count, count, count + 1)
+    columns = []
+    for size in sizes:
+        column = buffer[offset:offset + 8 * size]
+        if sys.byteorder == "little":
+            column = column.cast("Q")
+        else:
+            column = array("Q", column.tobytes())
+            column.byteswap()
+        columns.append(column)
+        offset += 8 * size
+    return columns
+
+
+class DocumentStoreWriter:
+    """
+    Запись хранилища документов
+
+    Документы можно добавлять в любом порядке, при закрытии
+    они сортируются по номеру
+    """
+    def __init__(self, filepath: str, dataset: str):
+        self._filepath = filepath
+        self._dataset = dataset
+        self._doc_ids = array("Q")
+        self._offsets = array("Q")
+        self._lengths = array("Q")
+        self._name_offsets = array("Q")
+        self._names = bytearray()
+
+    def add(self, doc_id: int, offset: int, length: int, name: str) -> None:
+        """
+        Добавление документа
+
+        Args:
+            doc_id: номер документа
+            offset: смещение строки документа в наборе данных
+            length: длина строки в байтах
+            name: название документа
+        """
+        self._doc_ids.append(doc_id)
+        self._offsets.append(offset)
+        self._lengths.append(length)
+        self._name_offsets.append(len(self._names))
+        self._names += name.encode("utf8")
+
+    def close(self) -> None:
+        """Сортировка документов и запись файла"""
+        count = len(self._doc_ids)
+        doc_ids = self._doc_ids
+        name_offsets = self._name_offsets
+        names = self._names
+        if any(doc_ids[i] > doc_ids[i + 1] for i in range(count - 1)):
+            order = sorted(range(count), key=doc_ids.__getitem__)
+            doc_ids = array("Q", (doc_ids[i] for i in order))
+            self._offsets = array("Q", (self._offsets[i] for i in order))
+            self._lengths = array("Q", (self._lengths[i] for i in order))
+            ends = self._name_offsets[1:] + array("Q", [len(names)])
+            sorted_names = bytearray()
+            name_offsets = array("Q")
+            for i in order:
+                name_offsets.append(len(sorted_names))
+                sorted_names += names[self._name_offsets[i]:ends[i]]
+            names = sorted_names
+        name_offsets.append(len(names))
+
+        path = os.path.abspath(self._dataset).encode("utf8")
+        path_offset = DocumentStore.header.size
+        names_offset = path_offset + len(path)
+        columns_offset = names_offset + len(names)
+        padding = -columns_offset % 8
+        columns_offset += padding
+
+        columns = (doc_ids, self._offsets, self._lengths, name_offsets)
+        if sys.byteorder != "little":
+            for column in columns:
+                column.byteswap()
+
+        with open(self._filepath, "wb") as f:
+            f.write(DocumentStore.header.pack(DocumentStore.magic, DocumentStore.version,
+                                              count, os.path.getsize(self._dataset),
+                                              names_offset, columns_offset))
+            f.write(path)
+            f.write(names)
+            f.write(b"\0" * padding)
+            for column in columns:
+                column.tofile(f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+
+
+class DocumentStore:
+    """
+    Хранилище документов, открытое через mmap
+
+    * dataset - путь до набора данных
+    * encoding - кодировка набора данных
+
+    Пример:
+        with DocumentStore("index.docs") as store:
+            store.name(42)
+            store.snippet(42, {"hello"})
+    """
+    magic = b"IIDS"
+    version = 1
+    header = struct.Struct("<4sHxxQQQQ")
+
+    def __init__(self, filepath: str, dataset: Optional[str] = None, encoding: str = "utf8"):
+        """
+        Args:
+            filepath: путь до хранилища
+            dataset: путь до набора данных (None - путь, записанный при построении)
+            encoding: кодировка набора данных
+        """
+        self.encoding = encoding
+
+        with open(filepath, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, count, dataset_size,
+         names_offset, columns_offset) = self.header.unpack_from(self._mmap)
+        if magic != self.magic or version != self.version:
+            self._mmap.close()
+            raise ValueError(f"{filepath} is not a document store")
+
+        self._buffer = memoryview(self._mmap)
+        self.dataset = dataset if dataset is not None else \
+            bytes(self._buffer[self.header.size:names_offset]).decode("utf8")
+        self._count = count
+        self._names_offset = names_offset
+        (self._doc_ids, self._offsets,
+         self._lengths, self._name_offsets) = _columns(self._buffer, columns_offset, count)
+
+        if os.path.getsize(self.dataset) != dataset_size:
+            self.close()
+            raise ValueError(f"dataset {self.dataset} changed after "
+                             f"document store {filepath} was built")
+        self._dataset_mmap = None
+        if dataset_size > 0:
+            with open(self.dataset, "rb") as f:
+                self._dataset_mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _find(self, doc_id: int) -> int:
+        """Номер записи документа или -1"""
+        i = bisect_left(self._doc_ids, doc_id)
+        if i < self._count and self._doc_ids[i] == doc_id:
+            return i
+        return -1
+
+    def _index(self, doc_id: int) -> int:
+        i = self._find(doc_id)
+        if i < 0:
+            raise KeyError(doc_id)
+        return i
+
+    def __contains__(self, doc_id) -> bool:
+        return self._find(doc_id) >= 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def name(self, doc_id: int) -> str:
+        """Название документа, KeyError - если документа нет"""
+        i = self._index(doc_id)
+        start = self._names_offset + self._name_offsets[i]
+        end = self._names_offset + self._name_offsets[i + 1]
+        return bytes(self._buffer[start:end]).decode("utf8")
+
+    def text(self, doc_id: int) -> str:
+        """Текст документа (без номера и названия), KeyError - если документа нет"""
+        i = self._index(doc_id)
+        start = self._offsets[i]
+        row = self._dataset_mmap[start:start + self._lengths[i]].decode(self.encoding)
+        text = row.split("\t", maxsplit=1)[-1].strip()
+        parts = text.split(maxsplit=1)
+        return parts[1] if len(parts) > 1 else ""
+
+    def snippet(self, doc_id: int, terms: Iterable[str],
+                normalize: Optional[Callable[[str], Optional[str]]] = None,
+                width: int = SNIPPET_WIDTH) -> str:
+        """
+        Фрагмент текста документа вокруг первого слова запроса
+
+        Args:
+            doc_id: номер документа
+            terms: термы запроса
+            normalize: нормализация слов текста перед сравнением
+                       с термами (например Analyzer.normalize)
+            width: примерная ширина фрагмента в символах
+
+        Returns: фрагмент, обрезанные края отмечены "..."
+        """
+        terms = set(terms)
+        words = self.text(doc_id).split()
+
+        first = 0
+        for i, word in enumerate(words):
+            if (normalize(word) if normalize is not None else word) in terms:
+                first = i
+                break
+
+        # слова добавляются поочередно справа и слева от найденного
+        start, end = first, first
+        length = 0
+        while length < width and (start > 0 or end < len(words)):
+            if end < len(words):
+                length += len(words[end]) + 1
+                end += 1
+            if length < width and start > 0:
+                start -= 1
+                length += len(words[start]) + 1
+
+        snippet = " ".join(words[start:end])
+        if start > 0:
+            snippet = "..." + snippet
+        if end < len(words):
+            snippet += "..."
+        return snippet
+
+    def close(self) -> None:
+        """Закрытие файлов"""
+        for column in (self._doc_ids, self._offsets, self._lengths, self._name_offsets):
+            if isinstance(column, memoryview):
+                column.release()
+        self._buffer.release()
+        self._mmap.close()
+        if getattr(self, "_dataset_mmap", None) is not None:
+            self._dataset_mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,243 @@
+"""
+Модуль, в котором реализован поиск слов словаря с опечатками
+
+По словам индекса строится индекс n-грамм: для каждой n-граммы
+(n подряд идущих символов слова, дополненного с краев n - 1 служебными
+символами) хранится список номеров слов, в которых она встречается.
+Слова на расстоянии Левенштейна не больше k от слова запроса ищутся
+без перебора всего словаря:
+* одна правка (вставка, удаление, замена символа) меняет не больше n
+  n-грамм, значит у близкого слова общих n-грамм со словом запроса
+  не меньше len(слово) + n - 1 - k * n (фильтр по количеству)
+* длины слов отличаются не больше чем на k (фильтр по длине)
+* у оставшихся кандидатов расстояние считается честно,
+  с прекращением, как только оно превысило k
+Для коротких слов, у которых фильтр по количеству ничего не отсекает,
+просматриваются только слова подходящей длины
+
+Индекс лежит рядом с основным (путь индекса + FUZZY_SUFFIX)
+
+Формат файла (все числа little endian)
+    1 заголовок (см. NgramIndex.header): magic, версия, n,
+      количество слов, количество n-грамм
+    2 слова в utf8, каждое после varint(длина в байтах)
+    3 n-граммы по возрастанию: varint(длина n-граммы в байтах), n-грамма
+      в utf8, varint(длина списка в байтах), номера слов,
+      записанные CompressedPostings.to_bytes
+"""
+import struct
+from collections import defaultdict
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+from postings import CompressedPostings
+from postings import decode_varint
+from postings import encode_varint
+
+FUZZY_SUFFIX = ".fuzzy"
+
+# длина n-граммы
+NGRAM_SIZE = 3
+# максимальное расстояние по умолчанию
+MAX_DISTANCE = 1
+
+# служебные символы начала и конца слова
+_START = "\x02"
+_END = "\x03"
+
+
+def ngrams(word: str, n: int = NGRAM_SIZE) -> List[str]:
+    """n-граммы слова, дополненного с краев n - 1 служебными символами"""
+    padded = _START * (n - 1) + word + _END * (n - 1)
+    return [padded[i:i + n] for i in range(len(padded) - n + 1)]
+
+
+def levenshtein(first: str, second: str, limit: Optional[int] = None) -> int:
+    """
+    Расстояние Левенштейна (вставка, удаление и замена символа)
+
+    Args:
+        first: первое слово
+        second: второе слово
+        limit: если расстояние больше limit, вычисление прекращается
+               досрочно и возвращается limit + 1
+
+    Returns: расстояние
+    """
+    if len(first) < len(second):
+        first, second = second, first
+    if limit is not None and len(first) - len(second) > limit:
+        return limit + 1
+
+    previous = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, 1):
+        current = [i]
+        for j, second_char in enumerate(second, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (first_char != second_char)))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class NgramIndex:
+    """
+    Индекс n-грамм по словам инвертированного индекса
+
+    * n - длина n-граммы
+    * terms - слова, номер слова - его индекс в списке
+
+    Пример:
+        fuzzy = NgramIndex.from_terms(["hello", "world"])
+        fuzzy.similar("helo", 1)  # ["hello"]
+    """
+    magic = b"IIFZ"
+    version = 1
+    header = struct.Struct("<4sHHQQ")
+
+    def __init__(self, terms: List[str], gram_to_terms: Dict[str, object],
+                 n: int = NGRAM_SIZE):
+        """
+        Args:
+            terms: слова
+            gram_to_terms: n-грамма -> CompressedPostings номеров слов
+                           (или байты, записанные CompressedPostings.to_bytes)
+            n: длина n-граммы
+        """
+        self.n = n
+        self.terms = terms
+        self._gram_to_terms = gram_to_terms
+        self._by_length = None
+
+    @classmethod
+    def from_terms(cls, terms: Iterable[str], n: int = NGRAM_SIZE):
+        """
+        Построение индекса
+
+        Args:
+            terms: слова (повторы выбрасываются)
+            n: длина n-граммы
+
+        Returns: NgramIndex
+        """
+        terms = sorted(set(terms))
+        gram_to_ids = defaultdict(list)
+        for term_id, term in enumerate(terms):
+            for gram in set(ngrams(term, n)):
+                gram_to_ids[gram].append(term_id)
+        # номера слов добавлялись по возрастанию
+        return cls(terms, {gram: CompressedPostings.from_sorted(ids)
+                           for gram, ids in gram_to_ids.items()}, n)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def _term_ids(self, gram: str) -> Iterable[int]:
+        postings = self._gram_to_terms.get(gram)
+        if postings is None:
+            return ()
+        if not isinstance(postings, CompressedPostings):
+            postings = CompressedPostings.from_bytes(postings)
+            self._gram_to_terms[gram] = postings
+        return postings
+
+    def _terms_by_length(self, low: int, high: int) -> Iterable[int]:
+        if self._by_length is None:
+            self._by_length = defaultdict(list)
+            for term_id, term in enumerate(self.terms):
+                self._by_length[len(term)].append(term_id)
+        for length in range(low, high + 1):
+            yield from self._by_length.get(length, ())
+
+    def candidates(self, word: str, max_distance: int) -> Iterable[int]:
+        """
+        Номера слов, которые могут быть на расстоянии не больше max_distance
+        (проходят фильтры по количеству общих n-грамм и по длине)
+        """
+        n = self.n
+        grams = ngrams(word, n)
+        distinct = set(grams)
+        # повторяющиеся n-граммы запроса считаются один раз
+        threshold = len(word) + n - 1 - max_distance * n - (len(grams) - len(distinct))
+        low, high = len(word) - max_distance, len(word) + max_distance
+        if threshold <= 0:
+            return self._terms_by_length(max(low, 0), high)
+
+        counts = defaultdict(int)
+        for gram in distinct:
+            for term_id in self._term_ids(gram):
+                counts[term_id] += 1
+        terms = self.terms
+        return (term_id for term_id, count in counts.items()
+                if count >= threshold and low <= len(terms[term_id]) <= high)
+
+    def similar(self, word: str, max_distance: int = MAX_DISTANCE) -> List[str]:
+        """
+        Слова на расстоянии Левенштейна не больше max_distance от word
+
+        Args:
+            word: слово (уже обработанное анализатором)
+            max_distance: максимальное расстояние
+
+        Returns: слова по возрастанию расстояния, затем по алфавиту
+        """
+        found = []
+        for term_id in self.candidates(word, max_distance):
+            term = self.terms[term_id]
+            distance = levenshtein(word, term, max_distance)
+            if distance <= max_distance:
+                found.append((distance, term))
+        return [term for _, term in sorted(found)]
+
+    def dump(self, filepath: str) -> None:
+        """Сохранение индекса в файл"""
+        with open(filepath, "wb") as f:
+            f.write(self.header.pack(self.magic, self.version, self.n,
+                                     len(self.terms), len(self._gram_to_terms)))
+            out = bytearray()
+            for term in self.terms:
+                data = term.encode("utf8")
+                encode_varint(len(data), out)
+                out += data
+            for gram in sorted(self._gram_to_terms):
+                data = gram.encode("utf8")
+                postings = self._term_ids(gram).to_bytes()
+                encode_varint(len(data), out)
+                out += data
+                encode_varint(len(postings), out)
+                out += postings
+            f.write(out)
+
+    @classmethod
+    def load(cls, filepath: str):
+        """
+        Загрузка индекса из файла
+
+        Слова декодируются сразу, списки n-грамм - при первом обращении
+        """
+        with open(filepath, "rb") as f:
+            data = f.read()
+        magic, version, n, term_count, gram_count = cls.header.unpack_from(data)
+        if magic != cls.magic or version != cls.version:
+            raise ValueError(f"{filepath} is not a fuzzy term index")
+
+        buffer = memoryview(data)
+        pos = cls.header.size
+        terms = []
+        for _ in range(term_count):
+            size, pos = decode_varint(buffer, pos)
+            terms.append(bytes(buffer[pos:pos + size]).decode("utf8"))
+            pos += size
+        gram_to_terms = {}
+        for _ in range(gram_count):
+            size, pos = decode_varint(buffer, pos)
+            gram = bytes(buffer[pos:pos + size]).decode("utf8")
+            pos += size
+            size, pos = decode_varint(buffer, pos)
+            gram_to_terms[gram] = buffer[pos:pos + size]
+            pos += size
+        return cls(terms, gram_to_terms, n)
@@ -3,18 +3,135 @@
 1. Реализован класс с инвертированны индексом
 2. CLI интерфейс для работы с инвертированным индексом
 """
+import asyncio
+import json
 import logging
+import os
+import shutil
 import sys
+import tempfile
+import time
 from argparse import ArgumentParser
 from argparse import ArgumentTypeError
 from argparse import FileType
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from io import TextIOWrapper
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
 from typing import List
-
+from typing import Optional
+from typing import Tuple
+
+from analyzer import Analyzer
+from analyzer import Vocabulary
+from batch_query import run_batch
+from batch_query import worker_pool
+from block_storage import BlockStoragePolicy
+from bloom import BLOOM_SUFFIX
+from bloom import ERROR_RATE
+from bloom import BloomFilter
+from boolean_query import and_query
+from boolean_query import boolean_query
+from boolean_query import union_and_query
+from document_store import DOCS_FILENAME
+from document_store import DOCS_SUFFIX
+from document_store import DocumentStore
+from document_store import DocumentStoreWriter
+from document_store import document_store_path
+from fuzzy import FUZZY_SUFFIX
+from fuzzy import MAX_DISTANCE
+from fuzzy import NgramIndex
+from pipeline import run_pipeline
+from positional import POSITIONS_SUFFIX
+from positional import PositionalStoragePolicy
+from positional import build_positional_index
+from positional import build_positional_index_on_disk
+from postings import CompressedPostings
+from postings import as_postings
+from postings import intersect
+from postings import intersect_sorted
+from query_cache import QueryCache
+from query_server import serve
+from ranking import CollectionStats
+from ranking import NORMS_SUFFIX
+from ranking import RANK_SUFFIX
+from ranking import RankedIndex
+from ranking import build_ranked_index_on_disk
+from reorder import BISECTION
+from reorder import DOC_MAP_SUFFIX
+from reorder import ITERATIONS
+from reorder import METHODS
+from reorder import DocumentMap
+from reorder import document_order
+from reorder import remap_positions
+from reorder import remap_postings
+from reorder import remap_ranking
+from segments import SegmentedInvertedIndex
+from sharding import MANIFEST
+from sharding import PARTITIONS
+from sharding import Partition
+from sharding import ShardedInvertedIndex
+from sharding import is_sharded_index
+from sharding import read_manifest
+from sharding import shard_name
+from sharding import write_manifest
+from spimi import SpimiIndexBuilder
+from spimi import merge_runs
+from spimi import write_run
+from stats import Stats
+from storage_policy import ColumnarStoragePolicy
+from storage_policy import MmapStoragePolicy
+from storage_policy import RoaringStoragePolicy
 from storage_policy import StructStoragePolicy
+from term_dictionary import TrieStoragePolicy
+from term_dictionary import TrieTermDictionary
+from term_dictionary import is_wildcard
+
+try:
+    from numpy_postings import NumpyStoragePolicy
+except ImportError:  # numpy не установлен
+    NumpyStoragePolicy = None
 
 logger = logging.getLogger(__name__)
 
+# метаданные индекса (настройки анализатора) лежат рядом с индексом
+METADATA_SUFFIX = ".meta"
+
+# буфер чтения файла с запросами в байтах
+QUERY_FILE_BUFFER = 1 << 20
+
+# код типа array для беззнакового 32 битного числа
+_UINT32 = "I" if array("I").itemsize == 4 else "L"
+
+STORAGE_POLICIES = {
+    "struct": lambda: StructStoragePolicy(encoding="utf8"),
+    "columnar": lambda: ColumnarStoragePolicy(encoding="utf8"),
+    "mmap": lambda: MmapStoragePolicy(encoding="utf8"),
+    "roaring": lambda: RoaringStoragePolicy(encoding="utf8"),
+    "trie": lambda: TrieStoragePolicy(encoding="utf8"),
+    "block-zlib": lambda: BlockStoragePolicy(encoding="utf8", codec="zlib"),
+    "block-lzma": lambda: BlockStoragePolicy(encoding="utf8", codec="lzma"),
+    "block-bz2": lambda: BlockStoragePolicy(encoding="utf8", codec="bz2"),
+}
+if NumpyStoragePolicy is not None:
+    STORAGE_POLICIES["numpy"] = lambda: NumpyStoragePolicy(encoding="utf8")
+
+# политика хранения по magic в начале файла индекса,
+# файлы StructStoragePolicy заголовка не имеют,
+# кодек блоков определяется при чтении,
+# файл NumpyStoragePolicy без numpy читается как columnar
+_POLICY_BY_MAGIC = {
+    MmapStoragePolicy.magic: "mmap",
+    RoaringStoragePolicy.magic: "roaring",
+    TrieStoragePolicy.magic: "trie",
+    BlockStoragePolicy.magic: "block-zlib",
+    ColumnarStoragePolicy.magic: "columnar",
+    ColumnarStoragePolicy.numpy_magic: "numpy" if NumpyStoragePolicy is not None else "columnar",
+}
+
 
 class Document:
     """
@@ -45,44 +162,279 @@ class InvertedIndex:
     Класс в котором реализован инвертированный индекс
 
     Инвертированный индекс представляет собой словарь, где ключами являются
-    слова (термы), а значениями - списки идентификаторов документов,
-    в которых указанный терм встречается
-    """
-    def __init__(self):
-        self.word_in_docs_map = {}
+    слова (термы), а значениями - отсортированные списки идентификаторов
+    документов, в которых указанный терм встречается
+
+    Списки документов хранятся в сжатом виде (см. модуль postings),
+    при присваивании word_in_docs_map обычные списки сжимаются автоматически
+
+    word_in_docs_map может быть и не словарем, а ленивым отображением
+    (например индекс, открытый через mmap, или словарь термов на префиксном
+    дереве, см. модуль term_dictionary), тогда оно используется как есть
+
+    Опционально к индексу подключается кэш результатов запросов (QueryCache),
+    он сбрасывается при каждом присваивании word_in_docs_map
+    (построение и загрузка индекса)
 
-    def query(self, words: list) -> list:
+    positions - позиционный индекс для фразовых запросов
+    (см. модуль positional) или None, хранится в отдельном файле
+
+    ranking - ранжированный индекс для поиска top-k по BM25
+    (см. модуль ranking) или None, тоже хранится в отдельных файлах
+
+    analyzer - анализатор (см. модуль analyzer), которым построен индекс,
+    им же анализируются слова запросов, сохраняется в метаданных индекса
+
+    bloom - фильтр Блума по словам индекса (см. модуль bloom) или None,
+    запрос со словом, которого точно нет, сразу возвращает пустой ответ,
+    сбрасывается при присваивании word_in_docs_map
+
+    fuzzy - индекс n-грамм по словам индекса (см. модуль fuzzy) или None,
+    нужен для поиска с опечатками (fuzzy_query), тоже сбрасывается
+    при присваивании word_in_docs_map
+
+    doc_map - исходные номера документов перенумерованного индекса
+    (см. модуль reorder и команду optimize) или None, запросы
+    возвращают исходные номера, сбрасывается при присваивании word_in_docs_map
+    """
+    def __init__(self, cache: Optional[QueryCache] = None,
+                 analyzer: Optional[Analyzer] = None):
+        self.cache = cache
+        self.analyzer = analyzer if analyzer is not None else Analyzer()
+        self.positions = None
+        self.ranking = None
+        self.bloom = None
+        self.fuzzy = None
+        self.doc_map = None
+        self._word_in_docs_map = {}
+
+    @property
+    def word_in_docs_map(self) -> dict:
+        return self._word_in_docs_map
+
+    @word_in_docs_map.setter
+    def word_in_docs_map(self, word_to_docs_mapping):
+        if isinstance(word_to_docs_mapping, dict):
+            word_to_docs_mapping = {word: as_postings(docs)
+                                    for word, docs in word_to_docs_mapping.items()}
+        self._word_in_docs_map = word_to_docs_mapping
+        self.bloom = None
+        self.fuzzy = None
+        self.doc_map = None
+
+        if self.cache is not None:
+            self.cache.clear()
+
+    def query(self, words: list, limit: Optional[int] = None) -> list:
         """
         Возвращает список документов, в которых данные слова встречаются
 
         Если слов на вход 2 и более, то вернет только общие документы
         Те документы в которых есть 1-е слово И 2-е слово
 
+        Пересечение начинается с самого короткого списка документов,
+        остальные списки проходятся с перепрыгиванием через блоки
+
+        Шаблон (data*, d?ta) заменяется объединением документов
+        всех подходящих слов
+
+        Слова предварительно обрабатываются анализатором индекса,
+        стоп-слова из запроса выбрасываются. Если по фильтру Блума
+        какого-то слова точно нет, списки документов не читаются
+
         Args:
             words: список со словами
+            limit: вернуть не больше limit первых документов,
+                   вычисление при этом останавливается досрочно (кэш не используется),
+                   кроме перенумерованного индекса: у него первые документы
+                   в исходных номерах известны только после вычисления всего ответа
 
-        Returns: список с документами
+        Returns: отсортированный список с документами
 
         """
-        queries = []
-
-        for word in words:
+        words = self.analyzer.analyze_words(words)
+        if self.bloom is not None and not self._might_contain_all(words):
+            return []
+        return self._external(self._lookup(words, self._index_limit(limit)), limit)
+
+    def _lookup(self, words: list, limit: Optional[int]) -> list:
+        """Ответ на запрос из обработанных анализатором слов в номерах индекса"""
+        if limit is not None or any(is_wildcard(word) for word in words):
+            return and_query(self.word_in_docs_map, words, limit)
+
+        if self.cache is None:
+            return self._query(words)
+
+        key = frozenset(words)
+        if not key:
+            return []
+
+        doc_ids = self.cache.get(key)
+        if doc_ids is not None:
+            self.cache.hits += 1
+            return doc_ids
+
+        subset = self.cache.get_subset(key)
+        if subset is not None:
+            self.cache.partial_hits += 1
+            cached_words, cached_doc_ids = subset
+            (word,) = key - cached_words
             try:
-                queries.append(self.word_in_docs_map[word])
+                doc_ids = intersect_sorted(cached_doc_ids, [self.word_in_docs_map[word]])
             except KeyError:
-                queries.append([])
+                doc_ids = []
+        else:
+            self.cache.misses += 1
+            doc_ids = self._query(key)
+
+        self.cache.put(key, doc_ids)
+        return doc_ids
+
+    def _index_limit(self, limit: Optional[int]) -> Optional[int]:
+        """
+        Ограничение на ответ в номерах индекса: у перенумерованного индекса
+        первые limit документов в номерах индекса - не первые в исходных
+        """
+        return limit if self.doc_map is None else None
+
+    def _external(self, doc_ids: list, limit: Optional[int] = None) -> list:
+        """Первые limit исходных номеров документов (у перенумерованного индекса)"""
+        if self.doc_map is None:
+            return doc_ids
+        return self.doc_map.external(doc_ids)[:limit]
+
+    def _might_contain_all(self, words: list) -> bool:
+        """Могут ли все слова (кроме шаблонов) быть в индексе по фильтру Блума"""
+        bloom = self.bloom
+        return all(word in bloom for word in words if not is_wildcard(word))
+
+    def query_batch(self, queries: List[list], workers: int = 1,
+                    executor: Optional[ProcessPoolExecutor] = None) -> List[list]:
+        """
+        Выполнение пакета запросов с общими пересечениями (см. модуль batch_query)
+
+        Запросы со словами, которых по фильтру Блума точно нет в индексе,
+        в пакет не попадают, запросы с шаблонами выполняются по одному
+
+        Args:
+            queries: запросы, каждый запрос - список слов
+            workers: количество процессов
+            executor: пул процессов из batch_query.worker_pool с этим индексом
+                      (нужен при workers > 1)
+
+        Returns: отсортированные списки документов в порядке запросов
+        """
+        queries = [self.analyzer.analyze_words(words) for words in queries]
+        results = [[] for _ in queries]
+        planned = []
+        for i, words in enumerate(queries):
+            if self.bloom is not None and not self._might_contain_all(words):
+                continue
+            if any(is_wildcard(word) for word in words):
+                results[i] = and_query(self.word_in_docs_map, words)
+            else:
+                planned.append(i)
+        batch_results = run_batch(self.word_in_docs_map,
+                                  [queries[i] for i in planned],
+                                  workers=workers,
+                                  executor=executor)
+        for i, doc_ids in zip(planned, batch_results):
+            results[i] = doc_ids
+        return [self._external(doc_ids) for doc_ids in results]
+
+    def search(self, text: str, limit: Optional[int] = None) -> list:
+        """
+        Булев запрос с операторами AND, OR, NOT, скобками и фразами
+        (см. модуль boolean_query)
+
+        Args:
+            text: текст запроса, например "(hello OR hi) world NOT bye"
+            limit: вернуть не больше limit первых документов
+
+        Returns: отсортированный список с документами
+        """
+        return self._external(boolean_query(self.word_in_docs_map, text,
+                                            self._index_limit(limit),
+                                            positional_mapping=self.positions,
+                                            analyzer=self.analyzer), limit)
+
+    def collection_stats(self, words: list) -> CollectionStats:
+        """
+        Статистика индекса для BM25: количество и суммарная длина
+        документов, количество документов со словами запроса
+
+        Args:
+            words: список со словами
+
+        Returns: CollectionStats
+        """
+        if self.ranking is None:
+            raise ValueError("ranked queries need a ranked index")
+        return self.ranking.collection_stats(self.analyzer.analyze_words(words))
+
+    def top_k(self, words: list, k: int, stats: Optional[CollectionStats] = None) -> list:
+        """
+        Лучшие k документов по BM25, в которых есть хотя бы одно слово запроса
+
+        Args:
+            words: список со словами
+            k: количество документов
+            stats: статистика всего набора, если индекс - его часть (шард),
+                   None - статистика самого индекса
+
+        Returns: пары (документ, оценка) по убыванию оценки
+        """
+        if self.ranking is None:
+            raise ValueError("ranked queries need a ranked index")
+        return self.ranking.top_k(self.analyzer.analyze_words(words), k, stats, self.doc_map)
+
+    def fuzzy_query(self, words: list, max_distance: int = MAX_DISTANCE,
+                    limit: Optional[int] = None) -> list:
+        """
+        Запрос с опечатками
+
+        Каждое слово заменяется объединением документов всех слов индекса
+        на расстоянии Левенштейна не больше max_distance от него,
+        затем объединения пересекаются
 
-        union = set(queries[0])
+        Args:
+            words: список со словами
+            max_distance: максимальное расстояние
+            limit: вернуть не больше limit первых документов
+
+        Returns: отсортированный список с документами
+        """
+        if self.fuzzy is None:
+            raise ValueError("fuzzy queries need an index built with --fuzzy")
+        words = set(self.analyzer.analyze_words(words))
+        alternatives = [self.fuzzy.similar(word, max_distance) for word in words]
+        return self._external(union_and_query(self.word_in_docs_map, alternatives,
+                                              self._index_limit(limit)), limit)
+
+    def close(self) -> None:
+        """Закрытие файлов индекса, открытых через mmap"""
+        for mapping in (self.word_in_docs_map, self.positions, self.ranking, self.doc_map):
+            if hasattr(mapping, "close"):
+                mapping.close()
+
+    def _query(self, words) -> list:
+        postings_lists = []
 
-        for query in queries:
-            union = union.intersection(query)
+        for word in words:
+            try:
+                postings_lists.append(self.word_in_docs_map[word])
+            except KeyError:
+                return []
 
-        return union
+        return intersect(postings_lists)
 
     def dump(self, filepath: str, storage_policy):
         """
         Сохраняет словарь с инвертированным индексом
 
+        Позиционный и ранжированный индексы, если они есть,
+        сохраняются рядом (см. dump_side_indexes)
+
         Args:
             filepath: путь до файла в который сохранить
             storage_policy: метод обработки сохраняемого объекта
@@ -90,26 +442,121 @@ class InvertedIndex:
         Returns: None
 
         """
-        storage_policy.dump(self.word_in_docs_map, filepath)
+        if storage_policy.compressed_postings:
+            word_to_docs_mapping = self.word_in_docs_map
+        else:
+            word_to_docs_mapping = {word: list(docs)
+                                    for word, docs in self.word_in_docs_map.items()}
+        storage_policy.dump(word_to_docs_mapping, filepath)
+
+        self.dump_side_indexes(filepath, getattr(storage_policy, "encoding", "utf8"))
+
+    def dump_side_indexes(self, filepath: str, encoding: str) -> None:
+        """
+        Сохраняет метаданные (настройки анализатора) в filepath + METADATA_SUFFIX,
+        позиционный индекс в filepath + POSITIONS_SUFFIX,
+        ранжированный в filepath + RANK_SUFFIX (+ NORMS_SUFFIX),
+        фильтр Блума в filepath + BLOOM_SUFFIX,
+        индекс n-грамм в filepath + FUZZY_SUFFIX
+        и исходные номера документов в filepath + DOC_MAP_SUFFIX
+
+        Файлы отсутствующих индексов от предыдущего построения удаляются
+
+        Args:
+            filepath: путь до файла основного индекса
+            encoding: кодировка слов
+        """
+        # отсутствие метаданных означает анализатор по умолчанию
+        metadata_path = filepath + METADATA_SUFFIX
+        if self.analyzer != Analyzer():
+            with open(metadata_path, "w", encoding="utf8") as f:
+                json.dump({"analyzer": self.analyzer.to_dict()}, f)
+        elif os.path.exists(metadata_path):
+            os.remove(metadata_path)
+
+        positions_path = filepath + POSITIONS_SUFFIX
+        if self.positions is not None:
+            PositionalStoragePolicy(encoding).dump(self.positions, positions_path)
+        elif os.path.exists(positions_path):
+            os.remove(positions_path)
+
+        rank_path = filepath + RANK_SUFFIX
+        if self.ranking is not None:
+            self.ranking.dump(rank_path, encoding)
+        else:
+            for path in (rank_path, rank_path + NORMS_SUFFIX):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        bloom_path = filepath + BLOOM_SUFFIX
+        if self.bloom is not None:
+            self.bloom.dump(bloom_path)
+        elif os.path.exists(bloom_path):
+            os.remove(bloom_path)
+
+        fuzzy_path = filepath + FUZZY_SUFFIX
+        if self.fuzzy is not None:
+            self.fuzzy.dump(fuzzy_path)
+        elif os.path.exists(fuzzy_path):
+            os.remove(fuzzy_path)
+
+        doc_map_path = filepath + DOC_MAP_SUFFIX
+        if self.doc_map is not None:
+            self.doc_map.dump(doc_map_path)
+        elif os.path.exists(doc_map_path):
+            os.remove(doc_map_path)
 
     @classmethod
-    def load(cls, filepath: str, storage_policy):
+    def load(cls, filepath: str, storage_policy, cache: Optional[QueryCache] = None):
         """
         Загружает объект инвертированнного индекса с диска
 
         По факту загружает только словарь для объекта,
         а потом уже и сам объект воссоздает
 
+        Позиционный и ранжированный индексы открываются через mmap,
+        если они есть, и читаются только фразовыми и ранжированными запросами.
+        Анализатор берется из метаданных, у индексов без метаданных
+        используется анализатор по умолчанию
+
         Args:
             filepath: путь до файла в который сохранить
             storage_policy: метод обработки сохраняемого объекта
+            cache: кэш результатов запросов (будет сброшен)
 
         Returns: InvertedIndex
         """
-        inverted_index = cls()
+        analyzer = None
+        metadata_path = filepath + METADATA_SUFFIX
+        if os.path.exists(metadata_path):
+            with open(metadata_path, encoding="utf8") as f:
+                analyzer = Analyzer.from_dict(json.load(f)["analyzer"])
+
+        inverted_index = cls(cache=cache, analyzer=analyzer)
 
         inverted_index.word_in_docs_map = storage_policy.load(filepath)
 
+        encoding = getattr(storage_policy, "encoding", "utf8")
+        positions_path = filepath + POSITIONS_SUFFIX
+        if os.path.exists(positions_path):
+            inverted_index.positions = PositionalStoragePolicy(encoding).load(positions_path)
+
+        rank_path = filepath + RANK_SUFFIX
+        if os.path.exists(rank_path):
+            inverted_index.ranking = RankedIndex.load(rank_path, encoding)
+
+        bloom_path = filepath + BLOOM_SUFFIX
+        if os.path.exists(bloom_path):
+            inverted_index.bloom = BloomFilter.load(bloom_path)
+
+        fuzzy_path = filepath + FUZZY_SUFFIX
+        if os.path.exists(fuzzy_path):
+            inverted_index.fuzzy = NgramIndex.load(fuzzy_path)
+
+        doc_map_path = filepath + DOC_MAP_SUFFIX
+        if os.path.exists(doc_map_path):
+            inverted_index.doc_map = DocumentMap.load(doc_map_path)
+
         return inverted_index
 
 
@@ -135,6 +582,103 @@ class EncodedFileType(FileType):
             raise ArgumentTypeError(message)
 
 
+def _parse_document(row: str) -> Document:
+    """
+    Разбор одной строки набора данных
+
+    Args:
+        row: строка в формате doc_id<знак табуляции>doc_text
+
+    Returns: Document
+    """
+    doc_id, text = (row.strip()
+                       .split('\t', maxsplit=1))
+
+    doc_id = int(doc_id)
+    doc_name = text.split()[0]
+    doc_content = text.replace(doc_name, "")
+    doc_content = doc_content.strip()
+
+    return Document(doc_id, doc_name, doc_content)
+
+
+def iter_documents(filepath: str,
+                   start: int = 0,
+                   end: Optional[int] = None,
+                   encoding: str = "utf8") -> Iterator[Document]:
+    """
+    Потоковое чтение документов с диска
+
+    В отличие от load_documents в памяти одновременно
+    находится только один документ
+
+    Можно читать не весь файл, а только диапазон байт [start, end),
+    границы диапазона должны совпадать с началами строк (см. split_dataset)
+
+    Args:
+        filepath: пусть до файла с документами
+        start: смещение в байтах, с которого начинать чтение
+        end: смещение в байтах, на котором закончить чтение (None - до конца)
+        encoding: кодировка файла с документами
+
+    Returns: генератор документов
+    """
+    for _, row in _iter_rows(filepath, start, end):
+        yield _parse_document(row.decode(encoding))
+
+
+def _iter_rows(filepath: str,
+               start: int = 0,
+               end: Optional[int] = None) -> Iterator[Tuple[int, bytes]]:
+    """
+    Строки файла в байтах вместе со смещениями их начала
+
+    Args:
+        filepath: пусть до файла с документами
+        start: смещение в байтах, с которого начинать чтение
+        end: смещение в байтах, на котором закончить чтение (None - до конца)
+
+    Returns: генератор пар (смещение, строка)
+    """
+    with open(filepath, "rb") as fin:
+        fin.seek(start)
+        position = start
+        for row in fin:
+            if end is not None and position >= end:
+                break
+            yield position, row
+            position += len(row)
+
+
+def split_dataset(filepath: str, parts: int) -> List[Tuple[int, int]]:
+    """
+    Деление файла с документами на диапазоны байт по границам строк
+
+    Args:
+        filepath: пусть до файла с документами
+        parts: желаемое количество диапазонов
+
+    Returns: список непустых диапазонов [(start, end), ...]
+    """
+    size = os.path.getsize(filepath)
+
+    boundaries = [0]
+    with open(filepath, "rb") as fin:
+        for i in range(1, parts):
+            position = max(size * i // parts, boundaries[-1])
+            if position >= size:
+                break
+            # дочитываем строку, в середину которой попали
+            if position > 0:
+                fin.seek(position - 1)
+                fin.readline()
+            boundaries.append(fin.tell())
+    boundaries.append(size)
+
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:])
+            if start < end]
+
+
 def load_documents(filepath: str) -> list:
     """
     Загружает документы с диска
@@ -157,26 +701,36 @@ def load_documents(filepath: str) -> list:
               Document(doc_id, doc_name, doc_content)
              ]
     """
-    documents = []
+    return list(iter_documents(filepath))
+
 
-    with open(filepath) as fin:
-        for row in fin.readlines():
-            doc_id, text = (row.strip()
-                               .split('\t', maxsplit=1))
+def build_document_store(dataset: str, filepath: str, encoding: str = "utf8") -> None:
+    """
+    Построение хранилища документов (см. модуль document_store)
+    одним потоковым проходом по набору данных
 
-            doc_id = int(doc_id)
-            doc_name = text.split()[0]
-            doc_content = text.replace(doc_name, "")
-            doc_content = doc_content.strip()
+    Args:
+        dataset: путь до файла с документами
+        filepath: путь до файла хранилища
+        encoding: кодировка файла с документами
 
-            doc = Document(doc_id, doc_name, doc_content)
+    Returns: None
+    """
+    with DocumentStoreWriter(filepath, dataset) as writer:
+        for offset, row in _iter_rows(dataset):
+            doc = _parse_document(row.decode(encoding))
+            writer.add(doc.id, offset, len(row.rstrip(b"\r\n")), doc.name)
 
-            documents.append(doc)
 
-    return documents
+def _document_words(doc: Document, analyzer: Analyzer) -> list:
+    return analyzer.analyze(doc.name + " " + doc.content)
 
 
-def build_inverted_index(documents: list):
+def build_inverted_index(documents: list, positions: bool = False, ranked: bool = False,
+                         analyzer: Optional[Analyzer] = None,
+                         bloom_error_rate: Optional[float] = ERROR_RATE,
+                         fuzzy: bool = False,
+                         trie: bool = False):
     """
     Построение ивертированного индекса
 
@@ -190,32 +744,625 @@ def build_inverted_index(documents: list):
                     ...
                    Document(id,name,context)
                    ]
+        positions: построить также позиционный индекс для фразовых запросов
+        ranked: построить также ранжированный индекс для поиска top-k
+        analyzer: анализатор текста документов (None - анализатор по умолчанию)
+        bloom_error_rate: вероятность ложного срабатывания фильтра Блума
+                          по словам индекса (None - фильтр не строится)
+        fuzzy: построить также индекс n-грамм для поиска с опечатками
+        trie: хранить словарь термов в префиксном дереве
+              (шаблоны слов раскрываются обходом только поддерева префикса,
+              без дерева просматриваются все слова)
 
     Returns: InvertedIndex
 
     """
-    inverted_index = InvertedIndex()
+    vocabulary = Vocabulary(analyzer)
+    # идентификаторы документов по номерам термов
+    term_docs = []
+    typecode = _UINT32
+    # документы шли по возрастанию идентификаторов, значит списки уже отсортированы
+    ordered = True
+    previous_id = None
 
     for doc in documents:
-        content = doc.name + " " + doc.content
-        for word in content.split():
-            if word in inverted_index.word_in_docs_map.keys():
-                inverted_index.word_in_docs_map[word].append(doc.id)
-            else:
-                inverted_index.word_in_docs_map[word] = [doc.id]
-
-    # Удаление дубликатов
-    for key in inverted_index.word_in_docs_map.keys():
-        inverted_index.word_in_docs_map[key] = list(set(inverted_index.word_in_docs_map[key]))
+        doc_id = doc.id
+        if previous_id is not None and doc_id <= previous_id:
+            ordered = False
+        previous_id = doc_id
+
+        term_ids = vocabulary.distinct_term_ids(doc.name + " " + doc.content)
+        # номера новых термов выдаются по порядку
+        term_docs.extend(array(typecode) for _ in range(len(vocabulary) - len(term_docs)))
+        try:
+            for term_id in term_ids:
+                term_docs[term_id].append(doc_id)
+        except OverflowError:
+            # идентификаторы не помещаются в 32 бита,
+            # ошибка возникает на первом же добавлении документа
+            typecode = "Q"
+            term_docs = [array(typecode, docs) for docs in term_docs]
+            for term_id in term_ids:
+                term_docs[term_id].append(doc_id)
+
+    compress = CompressedPostings.from_sorted if ordered else CompressedPostings.from_iterable
+    word_to_docs_mapping = {}
+    for term_id, term in enumerate(vocabulary.terms):
+        word_to_docs_mapping[term] = compress(term_docs[term_id])
+        # несжатый список больше не нужен
+        term_docs[term_id] = None
+    analyzer = vocabulary.analyzer
+    inverted_index = InvertedIndex(analyzer=analyzer)
+    if trie:
+        word_to_docs_mapping = TrieTermDictionary.from_dict(word_to_docs_mapping)
+    inverted_index.word_in_docs_map = word_to_docs_mapping
+    if bloom_error_rate is not None:
+        inverted_index.bloom = BloomFilter.from_keys(vocabulary.terms, bloom_error_rate)
+    if fuzzy:
+        inverted_index.fuzzy = NgramIndex.from_terms(vocabulary.terms)
+
+    if positions:
+        inverted_index.positions = build_positional_index(
+            (doc.id, _document_words(doc, analyzer)) for doc in documents)
+    if ranked:
+        inverted_index.ranking = RankedIndex.build(
+            (doc.id, _document_words(doc, analyzer)) for doc in documents)
 
     return inverted_index
 
 
+def build_inverted_index_on_disk(documents: Iterable[Document],
+                                 filepath: str,
+                                 storage_policy,
+                                 memory_budget: int,
+                                 analyzer: Optional[Analyzer] = None) -> None:
+    """
+    Построение ивертированного индекса с ограниченной памятью (SPIMI)
+
+    Документы читаются потоком, частичные индексы сбрасываются
+    во временные файлы при превышении бюджета памяти,
+    затем сливаются и потоково пишутся в filepath
+
+    Args:
+        documents: итерируемый объект с документами
+                   (например генератор iter_documents)
+        filepath: путь до файла куда сохранять индекс
+        storage_policy: политика, поддерживающая потоковую запись (writer)
+        memory_budget: бюджет памяти под частичный индекс в байтах
+        analyzer: анализатор текста документов (None - анализатор по умолчанию)
+
+    Returns: None
+    """
+    if analyzer is None:
+        analyzer = Analyzer()
+
+    with SpimiIndexBuilder(memory_budget, encoding=storage_policy.encoding) as builder:
+        for doc in documents:
+            builder.add_document(doc.id, _document_words(doc, analyzer))
+
+        with storage_policy.writer(filepath) as writer:
+            builder.write(writer)
+
+
+def _build_run(task: tuple) -> str:
+    """
+    Построение частичного индекса по диапазону байт набора данных
+
+    Выполняется в отдельном процессе
+
+    Args:
+        task: (путь до набора данных, start, end,
+               путь до run файла, бюджет памяти, кодировка слов, анализатор)
+
+    Returns: путь до run файла
+    """
+    filepath, start, end, run_path, memory_budget, encoding, analyzer = task
+
+    with SpimiIndexBuilder(memory_budget, encoding=encoding) as builder:
+        for doc in iter_documents(filepath, start, end):
+            builder.add_document(doc.id, _document_words(doc, analyzer))
+        write_run(run_path, builder.items())
+
+    return run_path
+
+
+def build_inverted_index_parallel(dataset: str,
+                                  filepath: str,
+                                  storage_policy,
+                                  workers: int,
+                                  memory_budget: Optional[int] = None,
+                                  analyzer: Optional[Analyzer] = None) -> None:
+    """
+    Построение ивертированного индекса в несколько процессов
+
+    Набор данных делится на диапазоны байт по границам строк,
+    каждый диапазон индексируется в отдельном процессе в run файл,
+    затем runs сливаются и потоково пишутся в filepath.
+    Результат совпадает с однопроцессным построением
+
+    Args:
+        dataset: путь до файла с документами
+        filepath: путь до файла куда сохранять индекс
+        storage_policy: политика, поддерживающая потоковую запись (writer)
+        workers: количество процессов
+        memory_budget: общий бюджет памяти в байтах,
+                       делится поровну между процессами (None - без ограничения)
+        analyzer: анализатор текста документов (None - анализатор по умолчанию)
+
+    Returns: None
+    """
+    if analyzer is None:
+        analyzer = Analyzer()
+
+    ranges = split_dataset(dataset, workers)
+    worker_budget = None
+    if memory_budget is not None:
+        worker_budget = max(memory_budget // workers, 1)
+
+    with tempfile.TemporaryDirectory(prefix="build-") as tmp_dir:
+        tasks = [(dataset, start, end, os.path.join(tmp_dir, f"shard-{i}"),
+                  worker_budget, storage_policy.encoding, analyzer)
+                 for i, (start, end) in enumerate(ranges)]
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            run_paths = list(executor.map(_build_run, tasks))
+
+        with storage_policy.writer(filepath) as writer:
+            for key, postings in merge_runs(run_paths):
+                writer.add(key.decode(storage_policy.encoding), postings)
+
+
+def _build_side_indexes(documents_factory: Callable[[], Iterable[Document]],
+                        filepath: str,
+                        storage_policy,
+                        positions: bool = False,
+                        ranked: bool = False,
+                        analyzer: Optional[Analyzer] = None,
+                        bloom_error_rate: Optional[float] = ERROR_RATE,
+                        fuzzy: bool = False,
+                        memory_budget: Optional[int] = None) -> None:
+    """
+    Построение и сохранение индексов рядом с основным (позиционного,
+    ранжированного, фильтра Блума, индекса n-грамм и метаданных)
+    для потокового построения
+
+    Позиционный и ранжированный индексы строятся отдельными проходами
+    по документам с тем же бюджетом памяти, что и основной (SPIMI),
+    фильтр Блума и индекс n-грамм - по словам уже записанного основного индекса
+
+    Args:
+        documents_factory: функция, возвращающая новый итератор документов
+        filepath: путь до файла с основным индексом
+        storage_policy: политика хранения основного индекса
+        positions: строить позиционный индекс
+        ranked: строить ранжированный индекс
+        analyzer: анализатор текста документов (None - анализатор по умолчанию)
+        bloom_error_rate: вероятность ложного срабатывания фильтра Блума
+                          (None - фильтр не строится)
+        fuzzy: строить индекс n-грамм
+        memory_budget: бюджет памяти под частичные индексы в байтах
+                       (None - частичные индексы сбрасываются только в конце)
+
+    Returns: None
+    """
+    side_indexes = InvertedIndex(analyzer=analyzer)
+    if bloom_error_rate is not None or fuzzy:
+        word_to_docs = storage_policy.load(filepath)
+        try:
+            terms = list(word_to_docs)
+        finally:
+            if hasattr(word_to_docs, "close"):
+                word_to_docs.close()
+        if bloom_error_rate is not None:
+            side_indexes.bloom = BloomFilter.from_keys(terms, bloom_error_rate)
+        if fuzzy:
+            side_indexes.fuzzy = NgramIndex.from_terms(terms)
+    # удаляет и файлы позиционного и ранжированного индексов прошлого построения
+    side_indexes.dump_side_indexes(filepath, storage_policy.encoding)
+
+    analyzer = side_indexes.analyzer
+    if positions:
+        build_positional_index_on_disk(
+            ((doc.id, _document_words(doc, analyzer)) for doc in documents_factory()),
+            filepath + POSITIONS_SUFFIX,
+            memory_budget=memory_budget,
+            encoding=storage_policy.encoding)
+    if ranked:
+        build_ranked_index_on_disk(
+            ((doc.id, _document_words(doc, analyzer)) for doc in documents_factory()),
+            filepath + RANK_SUFFIX,
+            memory_budget=memory_budget,
+            encoding=storage_policy.encoding)
+
+
+def _build_shard(task: tuple) -> str:
+    """
+    Построение одного шарда по документам набора данных,
+    попадающим в этот шард
+
+    Выполняется в отдельном процессе
+
+    Args:
+        task: (путь до набора данных, путь до шарда, Partition, номер шарда,
+               политика хранения, бюджет памяти, positions, ranked, анализатор,
+               вероятность ошибки фильтра Блума, fuzzy)
+
+    Returns: путь до шарда
+    """
+    (dataset, filepath, partition, shard, storage_policy,
+     memory_budget, positions, ranked, analyzer, bloom_error_rate, fuzzy) = task
+
+    def shard_documents():
+        return (doc for doc in iter_documents(dataset) if partition(doc.id) == shard)
+
+    if memory_budget is None:
+        inverted_index = build_inverted_index(list(shard_documents()),
+                                              positions=positions,
+                                              ranked=ranked,
+                                              analyzer=analyzer,
+                                              bloom_error_rate=bloom_error_rate,
+                                              fuzzy=fuzzy)
+        inverted_index.dump(filepath, storage_policy=storage_policy)
+    else:
+        build_inverted_index_on_disk(shard_documents(), filepath,
+                                     storage_policy=storage_policy,
+                                     memory_budget=memory_budget,
+                                     analyzer=analyzer)
+        _build_side_indexes(shard_documents, filepath,
+                            storage_policy=storage_policy,
+                            positions=positions,
+                            ranked=ranked,
+                            analyzer=analyzer,
+                            bloom_error_rate=bloom_error_rate,
+                            fuzzy=fuzzy,
+                            memory_budget=memory_budget)
+
+    return filepath
+
+
+def build_sharded_index(dataset: str,
+                        directory: str,
+                        storage_policy,
+                        shards: int,
+                        partition: str = "hash",
+                        workers: int = 1,
+                        memory_budget: Optional[int] = None,
+                        positions: bool = False,
+                        ranked: bool = False,
+                        analyzer: Optional[Analyzer] = None,
+                        bloom_error_rate: Optional[float] = ERROR_RATE,
+                        fuzzy: bool = False) -> None:
+    """
+    Построение индекса из шардов (см. модуль sharding)
+
+    Каждый шард - обычный индекс по своей части документов,
+    шарды строятся параллельно в workers процессах
+
+    Args:
+        dataset: путь до файла с документами
+        directory: директория, куда сохранять шарды и манифест
+        storage_policy: политика хранения шардов
+        shards: количество шардов
+        partition: деление документов на шарды, "hash" или "range"
+        workers: количество процессов
+        memory_budget: общий бюджет памяти в байтах, делится поровну
+                       между процессами (None - шарды строятся в памяти)
+        positions: строить позиционные индексы шардов
+        ranked: строить ранжированные индексы шардов
+        analyzer: анализатор текста документов (None - анализатор по умолчанию)
+        bloom_error_rate: вероятность ложного срабатывания фильтров Блума
+                          шардов (None - фильтры не строятся)
+        fuzzy: строить индексы n-грамм шардов
+
+    Returns: None
+    """
+    doc_ids = ()
+    if partition == "range":
+        doc_ids = [doc.id for doc in iter_documents(dataset)]
+    shard_partition = Partition.from_doc_ids(partition, shards, doc_ids)
+
+    workers = max(min(workers, shards), 1)
+    worker_budget = None
+    if memory_budget is not None:
+        worker_budget = max(memory_budget // workers, 1)
+
+    os.makedirs(directory, exist_ok=True)
+    tasks = [(dataset, os.path.join(directory, shard_name(shard)), shard_partition, shard,
+              storage_policy, worker_budget, positions, ranked, analyzer,
+              bloom_error_rate, fuzzy)
+             for shard in range(shards)]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_build_shard, tasks))
+    else:
+        for task in tasks:
+            _build_shard(task)
+
+    # манифест пишется последним: без него директория не считается индексом
+    write_manifest(directory, shard_partition)
+
+
+def optimize_index(filepath: str,
+                   output: str,
+                   storage_policy,
+                   method: str = BISECTION,
+                   iterations: int = ITERATIONS) -> None:
+    """
+    Перенумерация документов сохраненного индекса (см. модуль reorder)
+
+    Основной, позиционный и ранжированный индексы переписываются
+    с новыми номерами документов, исходные номера сохраняются рядом
+    с индексом, фильтр Блума и индекс n-грамм переносятся как есть.
+    Индекс из шардов перенумеровывается по шардам
+
+    Args:
+        filepath: путь до индекса (файла или директории с шардами)
+        output: куда сохранить (может совпадать с filepath)
+        storage_policy: политика хранения индекса
+        method: "bisection" или "minhash"
+        iterations: итераций обмена на каждом уровне разбиения (для bisection)
+
+    Returns: None
+    """
+    if is_sharded_index(filepath):
+        _, paths = read_manifest(filepath)
+        os.makedirs(output, exist_ok=True)
+        for path in paths:
+            optimize_index(path, os.path.join(output, os.path.basename(path)),
+                           storage_policy, method, iterations)
+        if os.path.abspath(output) != os.path.abspath(filepath):
+            for name in (MANIFEST, DOCS_FILENAME):
+                if os.path.exists(os.path.join(filepath, name)):
+                    shutil.copyfile(os.path.join(filepath, name), os.path.join(output, name))
+        return
+    if os.path.isdir(filepath):
+        raise ValueError("optimize is not supported for segmented index")
+
+    inverted_index = InvertedIndex.load(filepath, storage_policy=storage_policy)
+    word_to_docs = inverted_index.word_in_docs_map
+    doc_ids = set()
+    for docs in word_to_docs.values():
+        doc_ids.update(docs)
+    if inverted_index.ranking is not None:
+        # документы без слов есть только в длинах документов
+        doc_ids.update(inverted_index.ranking.norms.doc_ids)
+    order = document_order(word_to_docs, sorted(doc_ids), method, iterations)
+    new_ids = {doc_id: i for i, doc_id in enumerate(order, 1)}
+
+    optimized = InvertedIndex(analyzer=inverted_index.analyzer)
+    optimized.word_in_docs_map = remap_postings(word_to_docs, new_ids)
+    if inverted_index.positions is not None:
+        optimized.positions = remap_positions(inverted_index.positions, new_ids)
+    if inverted_index.ranking is not None:
+        optimized.ranking = remap_ranking(inverted_index.ranking, new_ids)
+    optimized.bloom = inverted_index.bloom
+    optimized.fuzzy = inverted_index.fuzzy
+    # номера уже перенумерованного индекса переводятся в исходные
+    external_ids = order if inverted_index.doc_map is None else \
+        [inverted_index.doc_map[doc_id] for doc_id in order]
+    optimized.doc_map = DocumentMap(array("Q", external_ids))
+
+    # файлы индекса перезаписываются, если output совпадает с filepath
+    del word_to_docs
+    inverted_index.close()
+    optimized.dump(output, storage_policy=storage_policy)
+
+    doc_store_path = filepath + DOCS_SUFFIX
+    if os.path.abspath(output) != os.path.abspath(filepath) and os.path.exists(doc_store_path):
+        shutil.copyfile(doc_store_path, output + DOCS_SUFFIX)
+
+
+def _read_stop_words(filepath: Optional[str]) -> List[str]:
+    """Стоп-слова из файла в кодировке utf8, разделенные пробельными символами"""
+    if filepath is None:
+        return []
+    with open(filepath, encoding="utf8") as f:
+        return f.read().split()
+
+
+def _index_size(path: str) -> int:
+    """Размер индекса в байтах вместе с файлами рядом (или всех файлов директории)"""
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(path) for name in names)
+    paths = [path] + [path + suffix for suffix in (METADATA_SUFFIX, POSITIONS_SUFFIX,
+                                                   RANK_SUFFIX, RANK_SUFFIX + NORMS_SUFFIX,
+                                                   BLOOM_SUFFIX, FUZZY_SUFFIX, DOC_MAP_SUFFIX,
+                                                   DOCS_SUFFIX)]
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
 def build_callback(arguments):
-    documents = load_documents(arguments.dataset)
-    inverted_index = build_inverted_index(documents)
-    inverted_index.dump(arguments.output,
-                        storage_policy=StructStoragePolicy(encoding="utf8"))
+    stats = Stats(enabled=arguments.stats is not None)
+    storage_policy = STORAGE_POLICIES[arguments.storage_policy]()
+    analyzer = Analyzer(lowercase=arguments.lowercase,
+                        stop_words=_read_stop_words(arguments.stop_words))
+
+    memory_budget = None
+    if arguments.memory_budget is not None:
+        memory_budget = arguments.memory_budget * 2 ** 20
+    # 0 - фильтр Блума не строится
+    bloom_error_rate = arguments.bloom_error_rate or None
+
+    # шарды без бюджета памяти строятся в памяти, каждый в своем процессе
+    streaming = memory_budget is not None or (arguments.workers > 1 and arguments.shards is None)
+    if streaming:
+        if not hasattr(storage_policy, "writer"):
+            raise ValueError(f"storage policy {arguments.storage_policy} "
+                             f"does not support streaming build")
+
+    # количество проходов по набору данных
+    side_passes = int(arguments.positions) + int(arguments.ranked)
+    if arguments.shards is not None:
+        with stats.stage("build"):
+            build_sharded_index(arguments.dataset,
+                                arguments.output,
+                                storage_policy=storage_policy,
+                                shards=arguments.shards,
+                                partition=arguments.partition,
+                                workers=arguments.workers,
+                                memory_budget=memory_budget,
+                                positions=arguments.positions,
+                                ranked=arguments.ranked,
+                                analyzer=analyzer,
+                                bloom_error_rate=bloom_error_rate,
+                                fuzzy=arguments.fuzzy)
+        passes = arguments.shards * (1 + (side_passes if streaming else 0))
+        passes += int(arguments.partition == "range")
+    elif streaming:
+        with stats.stage("build"):
+            if arguments.workers > 1:
+                build_inverted_index_parallel(arguments.dataset,
+                                              arguments.output,
+                                              storage_policy=storage_policy,
+                                              workers=arguments.workers,
+                                              memory_budget=memory_budget,
+                                              analyzer=analyzer)
+            else:
+                build_inverted_index_on_disk(iter_documents(arguments.dataset),
+                                             arguments.output,
+                                             storage_policy=storage_policy,
+                                             memory_budget=memory_budget,
+                                             analyzer=analyzer)
+
+        with stats.stage("side_indexes"):
+            _build_side_indexes(lambda: iter_documents(arguments.dataset),
+                                arguments.output,
+                                storage_policy=storage_policy,
+                                positions=arguments.positions,
+                                ranked=arguments.ranked,
+                                analyzer=analyzer,
+                                bloom_error_rate=bloom_error_rate,
+                                fuzzy=arguments.fuzzy,
+                                memory_budget=memory_budget)
+        passes = 1 + side_passes
+    else:
+        with stats.stage("load_documents"):
+            documents = load_documents(arguments.dataset)
+        with stats.stage("build"):
+            inverted_index = build_inverted_index(documents,
+                                                  positions=arguments.positions,
+                                                  ranked=arguments.ranked,
+                                                  analyzer=analyzer,
+                                                  bloom_error_rate=bloom_error_rate,
+                                                  fuzzy=arguments.fuzzy)
+        with stats.stage("dump"):
+            inverted_index.dump(arguments.output, storage_policy=storage_policy)
+        passes = 1
+
+        if stats.enabled:
+            stats.add("documents", len(documents))
+            stats.add("terms", len(inverted_index.word_in_docs_map))
+            stats.add("postings", sum(len(docs) for docs in
+                                      inverted_index.word_in_docs_map.values()))
+
+    # хранилище от предыдущего построения ссылалось бы на другие документы
+    doc_store_path = document_store_path(arguments.output)
+    if arguments.doc_store:
+        with stats.stage("document_store"):
+            build_document_store(arguments.dataset, doc_store_path)
+        passes += 1
+    elif os.path.exists(doc_store_path):
+        os.remove(doc_store_path)
+
+    if stats.enabled:
+        stats.add("bytes_read", passes * os.path.getsize(arguments.dataset))
+        stats.add("bytes_written", _index_size(arguments.output))
+    stats.report(arguments.stats)
+
+
+def update_callback(arguments):
+    storage_policy = STORAGE_POLICIES[arguments.storage_policy]()
+
+    memory_budget = None
+    if arguments.memory_budget is not None:
+        memory_budget = arguments.memory_budget * 2 ** 20
+
+    # у существующего индекса по умолчанию берется анализатор из манифеста
+    analyzer = None
+    if arguments.lowercase or arguments.stop_words is not None:
+        analyzer = Analyzer(lowercase=arguments.lowercase,
+                            stop_words=_read_stop_words(arguments.stop_words))
+
+    with SegmentedInvertedIndex(arguments.index,
+                                storage_policy=storage_policy,
+                                max_segments=arguments.max_segments,
+                                analyzer=analyzer) as inverted_index:
+        if arguments.delete:
+            inverted_index.delete_documents(arguments.delete)
+
+        if arguments.dataset is not None:
+            documents = ((doc.id, _document_words(doc, inverted_index.analyzer))
+                         for doc in iter_documents(arguments.dataset))
+            inverted_index.add_documents(documents, memory_budget=memory_budget)
+
+        if arguments.merge:
+            inverted_index.merge()
+
+        logger.info("index has %d documents in %d segments",
+                    len(inverted_index), len(inverted_index.segments))
+
+
+def detect_storage_policy(path: str) -> str:
+    """
+    Название политики хранения (ключ STORAGE_POLICIES) по заголовку файла индекса
+
+    Для индекса из шардов смотрится первый шард, для индекса из сегментов -
+    первый сегмент (пустой индекс из сегментов - mmap).
+    Файл без известного заголовка считается сохраненным StructStoragePolicy
+
+    Args:
+        path: путь до индекса (файл или директория)
+
+    Returns: название политики хранения
+    """
+    if is_sharded_index(path):
+        _, paths = read_manifest(path)
+        path = paths[0]
+    elif os.path.isdir(path):
+        segments = sorted(name for name in os.listdir(path) if name.endswith(".idx"))
+        if not segments:
+            return "mmap"
+        path = os.path.join(path, segments[0])
+
+    with open(path, "rb") as f:
+        magic = f.read(4)
+    return _POLICY_BY_MAGIC.get(magic, "struct")
+
+
+def _query_storage_policy(arguments):
+    """Политика хранения из --storage-policy или, если она не задана, по заголовку индекса"""
+    name = arguments.storage_policy
+    if name is None:
+        name = detect_storage_policy(arguments.index)
+        logger.debug("detected storage policy %s", name)
+    return STORAGE_POLICIES[name]()
+
+
+def _load_index(arguments, storage_policy, cache: Optional[QueryCache]):
+    """
+    Загрузка индекса: директория с манифестом шардов - индекс из шардов
+    (см. build --shards), другая директория - индекс из сегментов (см. update),
+    файл - обычный InvertedIndex
+    """
+    if is_sharded_index(arguments.index):
+        return ShardedInvertedIndex(arguments.index,
+                                    partial(InvertedIndex.load, storage_policy=storage_policy),
+                                    workers=arguments.workers,
+                                    cache=cache)
+    if os.path.isdir(arguments.index):
+        return SegmentedInvertedIndex(arguments.index,
+                                      storage_policy=storage_policy,
+                                      cache=cache)
+    return InvertedIndex.load(arguments.index,
+                              storage_policy=storage_policy,
+                              cache=cache)
+
+
+def _iter_queries(lines: Iterable[str]) -> Iterator[List[str]]:
+    """Запросы по одному на строку, строки читаются по мере надобности"""
+    for line in lines:
+        yield line.strip().split()
 
 
 def _extract_query(raw_queries: list) -> List[List]:
@@ -232,37 +1379,218 @@ def _extract_query(raw_queries: list) -> List[List]:
 
     Returns: массив с запросами
     """
-    # TODO покрыть тестами
-    logger.debug(raw_queries)
+    return list(_iter_queries(raw_queries))
+
+
+def _query_batch(inverted_index: InvertedIndex, queries: Iterable[List[str]],
+                 arguments, storage_policy) -> int:
+    """
+    Выполнение запросов пакетами по arguments.batch_size штук
+
+    Запросы читаются, выполняются и печатаются конвейером (см. модуль pipeline),
+    ответы печатаются в порядке запросов,
+    в конце в лог пишется пропускная способность (запросов в секунду)
+
+    Returns: количество запросов
+    """
+    started = time.perf_counter()
+    workers = arguments.workers or 1
+    # процессы загружают индекс один раз на весь запуск, а не на каждый пакет
+    executor = None
+    if workers > 1:
+        executor = worker_pool(workers, arguments.index, storage_policy)
+
+    def process(batch: List[List[str]]) -> str:
+        results = inverted_index.query_batch(batch, workers=workers, executor=executor)
+        return "".join(",".join(map(str, document_ids)) + "\n" for document_ids in results)
+
+    try:
+        count = run_pipeline(queries, process, sys.stdout, chunk_size=arguments.batch_size)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    elapsed = time.perf_counter() - started
+    throughput = count / elapsed if elapsed > 0 else float("inf")
+    logger.info("%d queries in %.3f s, %.1f queries/s", count, elapsed, throughput)
+    return count
+
+
+def _format_result(document_ids: list, query: list, show: str,
+                   document_store: Optional[DocumentStore], analyzer: Analyzer) -> str:
+    """
+    Текст ответа на запрос
+
+    ids - номера документов через запятую
+    names - названия документов через запятую
+    snippets - по строке на документ: номер, название и фрагмент текста
+               с первым словом запроса через табуляцию, после ответа пустая строка
+    """
+    if show == "ids":
+        return ",".join(str(doc_id) for doc_id in document_ids) + "\n"
 
-    queries = []
-    for query in raw_queries:
-        queries.append(query.strip().split())
+    def name(doc_id):
+        return document_store.name(doc_id) if doc_id in document_store else str(doc_id)
 
-    return queries
+    if show == "names":
+        return ",".join(name(doc_id) for doc_id in document_ids) + "\n"
+
+    terms = analyzer.analyze_words(query)
+    lines = []
+    for doc_id in document_ids:
+        snippet = ""
+        if doc_id in document_store:
+            snippet = document_store.snippet(doc_id, terms, normalize=analyzer.normalize)
+        lines.append(f"{doc_id}\t{name(doc_id)}\t{snippet}\n")
+    lines.append("\n")
+    return "".join(lines)
 
 
 def query_callback(arguments):
     logger.debug(arguments)
 
+    # файл с запросами читается потоково, по строке на запрос
     if arguments.query_from_stdin:
-        raw_queries = arguments.query_from_stdin
-        queries = _extract_query(raw_queries)
+        queries = _iter_queries(arguments.query_from_stdin)
     else:
-        raw_queries = arguments.query_from_file.readlines()
-        queries = _extract_query(raw_queries)
+        queries = _iter_queries(arguments.query_from_file)
+
+    cache = None
+    if arguments.cache_size is not None or arguments.cache_memory is not None:
+        max_bytes = None
+        if arguments.cache_memory is not None:
+            max_bytes = arguments.cache_memory * 2 ** 20
+        cache = QueryCache(max_entries=arguments.cache_size, max_bytes=max_bytes)
+
+    stats = Stats(enabled=arguments.stats is not None)
+    storage_policy = _query_storage_policy(arguments)
+    with stats.stage("load"):
+        inverted_index = _load_index(arguments, storage_policy, cache)
+    if stats.enabled:
+        stats.add("index_bytes", _index_size(arguments.index))
+
+    document_store = None
+    if arguments.show != "ids":
+        doc_store_path = document_store_path(arguments.index)
+        if not os.path.exists(doc_store_path):
+            raise ValueError(f"index {arguments.index} has no document store, "
+                             f"build it with --doc-store")
+        document_store = DocumentStore(doc_store_path, dataset=arguments.dataset)
+    analyzer = getattr(inverted_index, "analyzer", None) or Analyzer()
+    if arguments.fuzzy is not None and not hasattr(inverted_index, "fuzzy_query"):
+        raise ValueError("fuzzy queries are not supported for segmented index")
+    if arguments.top_k is not None and not hasattr(inverted_index, "top_k"):
+        raise ValueError("top-k queries are not supported for segmented index")
+
+    batch = arguments.batch
+    if batch and (arguments.boolean or arguments.limit is not None
+                  or arguments.top_k is not None or arguments.fuzzy is not None
+                  or document_store is not None):
+        logger.warning("batch mode does not support --boolean, --limit, --top-k, --fuzzy "
+                       "and --show, running queries one by one")
+        batch = False
+    elif batch and isinstance(inverted_index, SegmentedInvertedIndex):
+        logger.warning("batch mode is not supported for segmented index, "
+                       "running queries one by one")
+        batch = False
+    elif batch and isinstance(inverted_index, ShardedInvertedIndex):
+        logger.warning("batch mode is not supported for sharded index, "
+                       "running queries one by one")
+        batch = False
+
+    def run_query(query: List[str]) -> str:
+        with stats.stage("query", memory=False, timings=True):
+            if arguments.top_k is not None:
+                try:
+                    document_ids = [doc_id for doc_id, _ in
+                                    inverted_index.top_k(query, arguments.top_k)]
+                except ValueError as e:
+                    logger.error("can't rank query %r: %s", " ".join(query), e)
+                    document_ids = []
+            elif arguments.boolean:
+                try:
+                    document_ids = inverted_index.search(" ".join(query),
+                                                         limit=arguments.limit)
+                except ValueError as e:
+                    logger.error("bad query %r: %s", " ".join(query), e)
+                    document_ids = []
+            elif arguments.fuzzy is not None:
+                try:
+                    document_ids = inverted_index.fuzzy_query(query, arguments.fuzzy,
+                                                              limit=arguments.limit)
+                except ValueError as e:
+                    logger.error("can't run fuzzy query %r: %s", " ".join(query), e)
+                    document_ids = []
+            else:
+                document_ids = inverted_index.query(query, limit=arguments.limit)
+        stats.add("results", len(document_ids))
+
+        return _format_result(document_ids, query, arguments.show, document_store, analyzer)
 
-    inverted_index = InvertedIndex.load(arguments.index,
-                                        storage_policy=StructStoragePolicy(encoding="utf8"))
+    try:
+        if batch:
+            with stats.stage("batch"):
+                count = _query_batch(inverted_index, queries, arguments, storage_policy)
+        else:
+            count = run_pipeline(queries,
+                                 lambda chunk: "".join(run_query(query) for query in chunk),
+                                 sys.stdout)
+    finally:
+        if isinstance(inverted_index, ShardedInvertedIndex):
+            inverted_index.close()
+        if document_store is not None:
+            document_store.close()
+    stats.add("queries", count)
+
+    if cache is not None:
+        logger.info("query cache stats: %s", cache.stats())
+        for name in ("hits", "partial_hits", "misses"):
+            stats.add(f"cache_{name}", getattr(cache, name))
 
-    for query in queries:
-        logger.debug(query)
+    stats.report(arguments.stats)
 
-        document_ids = inverted_index.query(query)
 
-        document_ids_str = [str(i) for i in document_ids]
-        result = ",".join(document_ids_str)
-        print(result)
+def serve_callback(arguments):
+    logger.debug(arguments)
+
+    cache = None
+    if arguments.cache_size is not None:
+        cache = QueryCache(max_entries=arguments.cache_size)
+
+    storage_policy = _query_storage_policy(arguments)
+    inverted_index = _load_index(arguments, storage_policy, cache)
+
+    try:
+        asyncio.run(serve(inverted_index,
+                          host=arguments.host,
+                          port=arguments.port,
+                          unix_socket=arguments.unix_socket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if isinstance(inverted_index, ShardedInvertedIndex):
+            inverted_index.close()
+
+
+def optimize_callback(arguments):
+    logger.debug(arguments)
+
+    stats = Stats(enabled=arguments.stats is not None)
+    storage_policy = STORAGE_POLICIES[arguments.storage_policy]()
+    output = arguments.output if arguments.output is not None else arguments.index
+
+    size = _index_size(arguments.index)
+    with stats.stage("optimize"):
+        optimize_index(arguments.index, output,
+                       storage_policy=storage_policy,
+                       method=arguments.method,
+                       iterations=arguments.iterations)
+    optimized_size = _index_size(output)
+    logger.info("index size %d -> %d bytes", size, optimized_size)
+
+    stats.add("bytes_read", size)
+    stats.add("bytes_written", optimized_size)
+    stats.report(arguments.stats)
 
 
 def parse_arguments():
@@ -285,24 +1613,290 @@ def parse_arguments():
                        type=str)
     build.add_argument("--output",
                        dest="output",
-                       help="path to file with saved inverted index",
+                       help="path to file with saved inverted index "
+                            "(directory with --shards)",
                        required=True,
                        type=str)
+    build.add_argument("--storage-policy",
+                       dest="storage_policy",
+                       help="format of saved inverted index",
+                       choices=STORAGE_POLICIES,
+                       default="mmap")
+    build.add_argument("--memory-budget",
+                       dest="memory_budget",
+                       help="build index in streaming mode, keeping "
+                            "at most this many megabytes of postings in memory",
+                       default=None,
+                       type=int)
+    build.add_argument("--workers",
+                       dest="workers",
+                       help="number of processes used to build index",
+                       default=1,
+                       type=int)
+    build.add_argument("--shards",
+                       dest="shards",
+                       help="split documents into this many shards, output "
+                            "is directory with shards queried in parallel",
+                       default=None,
+                       type=int)
+    build.add_argument("--partition",
+                       dest="partition",
+                       help="how documents are split into shards: by hash of "
+                            "document id or by ranges of ids",
+                       choices=PARTITIONS,
+                       default="hash")
+    build.add_argument("--doc-store",
+                       dest="doc_store",
+                       help="also store offsets and names of documents in dataset "
+                            "(saved next to index with .docs suffix) "
+                            "for query --show names or snippets",
+                       action="store_true")
+    build.add_argument("--stats",
+                       dest="stats",
+                       help="report wall time, CPU time and peak memory of every stage "
+                            "and counters to stderr, or to JSON file if path is given",
+                       nargs="?",
+                       const="-",
+                       default=None,
+                       type=str)
+    build.add_argument("--positions",
+                       dest="positions",
+                       help="also build positional index for phrase queries "
+                            "(saved next to index with .pos suffix)",
+                       action="store_true")
+    build.add_argument("--ranked",
+                       dest="ranked",
+                       help="also store term frequencies, document lengths and "
+                            "block maximum scores for BM25 top-k queries "
+                            "(saved next to index with .rank suffix)",
+                       action="store_true")
+    build.add_argument("--bloom-error-rate",
+                       dest="bloom_error_rate",
+                       help="false positive rate of Bloom filter over index terms "
+                            "(saved next to index with .bloom suffix), queries with "
+                            "terms missing from the filter return nothing without "
+                            "reading the index, 0 - do not build the filter",
+                       default=ERROR_RATE,
+                       type=float)
+    build.add_argument("--fuzzy",
+                       dest="fuzzy",
+                       help="also build character n-gram index over index terms "
+                            "for query --fuzzy (saved next to index with .fuzzy suffix)",
+                       action="store_true")
+    build.add_argument("--lowercase",
+                       dest="lowercase",
+                       help="index and search words in lower case",
+                       action="store_true")
+    build.add_argument("--stop-words",
+                       dest="stop_words",
+                       help="path to utf8 file with whitespace separated words "
+                            "that are neither indexed nor searched",
+                       default=None,
+                       type=str)
+
+    # UPDATE
+    update_description = """
+                         add and delete documents of index stored as directory
+                         of immutable segments, optionally merge segments
+                         """
+    update = subparsers.add_parser(name="update",
+                                   description=update_description)
+    update.set_defaults(callback=update_callback)
+    update.add_argument("--index",
+                        dest="index",
+                        help="path to directory with segmented inverted index "
+                             "(created if missing)",
+                        required=True,
+                        type=str)
+    update.add_argument("--dataset",
+                        dest="dataset",
+                        help="path to file with documents to add, documents "
+                             "with existing ids replace old ones",
+                        default=None,
+                        type=str)
+    update.add_argument("--delete",
+                        dest="delete",
+                        help="ids of documents to delete",
+                        default=[],
+                        nargs="+",
+                        type=int)
+    update.add_argument("--merge",
+                        dest="merge",
+                        help="merge all segments into one",
+                        action="store_true")
+    update.add_argument("--max-segments",
+                        dest="max_segments",
+                        help="merge smallest segments when there are more of them",
+                        default=8,
+                        type=int)
+    update.add_argument("--storage-policy",
+                        dest="storage_policy",
+                        help="format of segments",
+                        choices=["mmap", "roaring", "trie",
+                                 "block-zlib", "block-lzma", "block-bz2"],
+                        default="mmap")
+    update.add_argument("--memory-budget",
+                        dest="memory_budget",
+                        help="keep at most this many megabytes of postings "
+                             "in memory while building new segment",
+                        default=None,
+                        type=int)
+    update.add_argument("--lowercase",
+                        dest="lowercase",
+                        help="index and search words in lower case "
+                             "(only for new index, existing one keeps its settings)",
+                        action="store_true")
+    update.add_argument("--stop-words",
+                        dest="stop_words",
+                        help="path to utf8 file with whitespace separated words "
+                             "that are neither indexed nor searched "
+                             "(only for new index)",
+                        default=None,
+                        type=str)
+
+    # OPTIMIZE
+    optimize_description = """
+                           Reassign document ids of saved index so that documents
+                           sharing words get close ids: postings compress better
+                           and intersect faster, queries still return dataset ids
+                           """
+    optimize = subparsers.add_parser(name="optimize",
+                                     description=optimize_description)
+    optimize.set_defaults(callback=optimize_callback)
+    optimize.add_argument("--index",
+                          dest="index",
+                          help="path to file with saved inverted index "
+                               "or directory with sharded index",
+                          required=True,
+                          type=str)
+    optimize.add_argument("--output",
+                          dest="output",
+                          help="where to save optimized index (default - rewrite index)",
+                          default=None,
+                          type=str)
+    optimize.add_argument("--storage-policy",
+                          dest="storage_policy",
+                          help="format of saved inverted index",
+                          choices=STORAGE_POLICIES,
+                          default="mmap")
+    optimize.add_argument("--method",
+                          dest="method",
+                          help="bisection - recursive graph bisection (smaller index), "
+                               "minhash - sort by MinHash of document words (faster)",
+                          choices=METHODS,
+                          default=BISECTION)
+    optimize.add_argument("--iterations",
+                          dest="iterations",
+                          help="document swap iterations on every bisection level",
+                          default=ITERATIONS,
+                          type=int)
+    optimize.add_argument("--stats",
+                          dest="stats",
+                          help="report wall time, CPU time and peak memory "
+                               "to stderr, or to JSON file if path is given",
+                          nargs="?",
+                          const="-",
+                          default=None,
+                          type=str)
 
     # QUERY
     query_description = """
                         Show which document contains query
                         If query is more than one worlds algo will file
                         documents union.
+                        Words with * and ? (data*, d?ta) match all words
+                        of index, fast with trie storage policy.
                         """
     query = subparsers.add_parser(name="query",
                                   description=query_description)
     query.set_defaults(callback=query_callback)
     query.add_argument("--index",
                        dest="index",
-                       help="path to file with saved inverted index",
+                       help="path to file with saved inverted index "
+                            "or directory with segmented or sharded index",
                        required=True,
                        type=str)
+    query.add_argument("--storage-policy",
+                       dest="storage_policy",
+                       help="format of saved inverted index "
+                            "(default - detected from index file header)",
+                       choices=STORAGE_POLICIES,
+                       default=None)
+    query.add_argument("--cache-size",
+                       dest="cache_size",
+                       help="cache results of at most this many queries",
+                       default=None,
+                       type=int)
+    query.add_argument("--cache-memory",
+                       dest="cache_memory",
+                       help="cache query results up to this many megabytes",
+                       default=None,
+                       type=int)
+    query.add_argument("--batch",
+                       dest="batch",
+                       help="plan and run queries in batches sharing common "
+                            "intersections, report throughput",
+                       action="store_true")
+    query.add_argument("--batch-size",
+                       dest="batch_size",
+                       help="number of queries planned together in batch mode",
+                       default=10000,
+                       type=int)
+    query.add_argument("--workers",
+                       dest="workers",
+                       help="number of processes used in batch mode (default 1) "
+                            "or holding shards of sharded index "
+                            "(default one per shard, 0 - query shards in this process)",
+                       default=None,
+                       type=int)
+
+    query.add_argument("--show",
+                       dest="show",
+                       help="print document ids, names or names with text snippets "
+                            "(names and snippets need index built with --doc-store)",
+                       choices=["ids", "names", "snippets"],
+                       default="ids")
+    query.add_argument("--dataset",
+                       dest="dataset",
+                       help="path to dataset for --show snippets, "
+                            "if it was moved after build",
+                       default=None,
+                       type=str)
+    query.add_argument("--stats",
+                       dest="stats",
+                       help="report wall time, CPU time and peak memory of every stage "
+                            "and counters to stderr, or to JSON file if path is given",
+                       nargs="?",
+                       const="-",
+                       default=None,
+                       type=str)
+    query.add_argument("--boolean",
+                       dest="boolean",
+                       help="treat queries as boolean expressions with AND, OR, NOT, "
+                            "parentheses and quoted phrases (\"a b\" or \"a b\"~N)",
+                       action="store_true")
+    query.add_argument("--limit",
+                       dest="limit",
+                       help="print at most this many first documents per query",
+                       default=None,
+                       type=int)
+    query.add_argument("--top-k",
+                       dest="top_k",
+                       help="print this many best documents by BM25 in rank order, "
+                            "documents need at least one query word "
+                            "(index must be built with --ranked)",
+                       default=None,
+                       type=int)
+    query.add_argument("--fuzzy",
+                       dest="fuzzy",
+                       help="typo tolerant query: every word matches index words "
+                            f"within this Levenshtein distance (default {MAX_DISTANCE}), "
+                            "documents need a match for every word "
+                            "(index must be built with --fuzzy)",
+                       nargs="?",
+                       const=MAX_DISTANCE,
+                       default=None,
+                       type=int)
 
     query_group = query.add_mutually_exclusive_group()
     query_group.add_argument("--query",
@@ -314,23 +1908,70 @@ def parse_arguments():
     query_group.add_argument("--query-file-utf8",
                              dest="query_from_file",
                              help="file with query in utf8 coding",
-                             type=EncodedFileType('r', encoding="utf8"),
+                             type=EncodedFileType('r', bufsize=QUERY_FILE_BUFFER, encoding="utf8"),
                              default=TextIOWrapper(sys.stdin.buffer)
                              )
     query_group.add_argument("--query-file-cp1251",
                              dest="query_from_file",
                              help="file with query in cp1251 coding",
-                             type=EncodedFileType('r', encoding="cp1251"),
+                             type=EncodedFileType('r', bufsize=QUERY_FILE_BUFFER, encoding="cp1251"),
                              default=TextIOWrapper(sys.stdin.buffer)
                              )
 
+    # SERVE
+    serve_description = """
+                        Load inverted index once and answer line-delimited
+                        queries over TCP or unix socket (see query_client.py)
+                        """
+    serve_parser = subparsers.add_parser(name="serve",
+                                         description=serve_description)
+    serve_parser.set_defaults(callback=serve_callback)
+    serve_parser.add_argument("--index",
+                              dest="index",
+                              help="path to file with saved inverted index "
+                                   "or directory with segmented or sharded index",
+                              required=True,
+                              type=str)
+    serve_parser.add_argument("--storage-policy",
+                              dest="storage_policy",
+                              help="format of saved inverted index "
+                                   "(default - detected from index file header)",
+                              choices=STORAGE_POLICIES,
+                              default=None)
+    serve_parser.add_argument("--cache-size",
+                              dest="cache_size",
+                              help="cache results of at most this many queries",
+                              default=None,
+                              type=int)
+    serve_parser.add_argument("--workers",
+                              dest="workers",
+                              help="number of processes holding shards of sharded index "
+                                   "(default one per shard, 0 - query shards in this process)",
+                              default=None,
+                              type=int)
+
+    address_group = serve_parser.add_mutually_exclusive_group(required=True)
+    address_group.add_argument("--port",
+                               dest="port",
+                               help="TCP port to listen on",
+                               type=int)
+    address_group.add_argument("--unix-socket",
+                               dest="unix_socket",
+                               help="path to unix socket to listen on",
+                               type=str)
+    serve_parser.add_argument("--host",
+                              dest="host",
+                              help="address to listen on",
+                              default="127.0.0.1",
+                              type=str)
+
     args = args_parser.parse_args()
 
     return args
 
 
 def setup_logger():
-    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
 
     return None
 
@@ -0,0 +1,256 @@
+"""
+Модуль, в котором реализован инвертированный индекс на массивах NumPy
+
+Все списки документов лежат подряд в одном массиве uint32 (или uint64,
+если идентификаторы не помещаются в 32 бита), границы списков задаются
+таблицей смещений. Файл открывается через np.memmap, поэтому загрузка
+не раскодирует ни одного элемента, а в памяти оказываются только
+прочитанные страницы
+
+Формат файла общий с ColumnarStoragePolicy, но со своим magic,
+чтобы формат индекса можно было определить по заголовку.
+Пересечение и объединение выполняются векторно на отсортированных
+массивах (np.searchsorted, np.union1d)
+
+Требует установленного numpy
+"""
+from typing import List
+
+import numpy as np
+
+from storage_policy import ColumnarStoragePolicy
+from storage_policy import SortedTermDictionary
+
+
+class NumpyPostings:
+    """
+    Отсортированный список документов - представление (view)
+    на часть общего массива без копирования
+
+    * array - одномерный отсортированный массив идентификаторов
+    """
+    __slots__ = ("array",)
+
+    def __init__(self, array):
+        self.array = array
+
+    @classmethod
+    def from_sorted(cls, doc_ids):
+        return cls(np.fromiter(doc_ids, dtype=np.uint64))
+
+    @classmethod
+    def from_iterable(cls, doc_ids):
+        return cls(np.unique(np.fromiter(doc_ids, dtype=np.uint64)))
+
+    @property
+    def nbytes(self) -> int:
+        return self.array.nbytes
+
+    def _contains_mask(self, doc_ids):
+        if len(self.array) == 0:
+            return np.zeros(len(doc_ids), dtype=bool)
+        positions = np.searchsorted(self.array, doc_ids)
+        positions[positions == len(self.array)] = 0
+        return self.array[positions] == doc_ids
+
+    def __and__(self, other):
+        """
+        Пересечение: элементы более короткого массива ищутся
+        бинарным поиском в более длинном
+
+        Returns: NumpyPostings
+        """
+        if not isinstance(other, NumpyPostings):
+            return NotImplemented
+        small, big = sorted((self, other), key=len)
+        small_array = small.array.astype(big.array.dtype, copy=False)
+        return NumpyPostings(small_array[big._contains_mask(small_array)])
+
+    def __or__(self, other):
+        """
+        Объединение
+
+        Returns: NumpyPostings
+        """
+        if not isinstance(other, NumpyPostings):
+            return NotImplemented
+        return NumpyPostings(np.union1d(self.array, other.array))
+
+    def filter_sorted(self, doc_ids: List[int]) -> List[int]:
+        """
+        Оставляет из doc_ids только документы, которые есть в списке
+
+        Args:
+            doc_ids: отсортированный список документов
+                     (или NumpyPostings, или массив numpy)
+
+        Returns: отсортированный список документов
+        """
+        if not len(doc_ids):
+            return []
+        if isinstance(doc_ids, NumpyPostings):
+            doc_ids = doc_ids.array
+        candidates = np.asarray(doc_ids, dtype=self.array.dtype)
+        return candidates[self._contains_mask(candidates)].tolist()
+
+    def __len__(self):
+        return len(self.array)
+
+    def __iter__(self):
+        return iter(self.array.tolist())
+
+    def __contains__(self, doc_id):
+        return bool(self.filter_sorted([doc_id]))
+
+    def __eq__(self, other):
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({list(self)})"
+
+
+class NumpyTermDictionary(SortedTermDictionary):
+    """
+    Инвертированный индекс в формате NumpyStoragePolicy
+
+    Ведет себя как словарь слово -> NumpyPostings,
+    слово ищется бинарным поиском по отсортированному словарю термов
+    """
+    def __init__(self, filepath: str, encoding: str, use_mmap: bool = True):
+        self.encoding = encoding
+
+        if use_mmap:
+            buffer = np.memmap(filepath, dtype=np.uint8, mode="r")
+        else:
+            buffer = np.fromfile(filepath, dtype=np.uint8)
+
+        header = ColumnarStoragePolicy.header
+        (magic, version, itemsize, term_count,
+         terms_offset, term_offsets_offset,
+         postings_offsets_offset, postings_offset) = header.unpack(bytes(buffer[:header.size]))
+        if (magic not in (ColumnarStoragePolicy.magic, ColumnarStoragePolicy.numpy_magic)
+                or version != ColumnarStoragePolicy.version):
+            raise ValueError(f"{filepath} is not a numpy inverted index")
+
+        dtype = np.uint32 if itemsize == 4 else np.uint64
+        index_size = 8 * (term_count + 1)
+
+        self._term_count = term_count
+        self._terms = buffer[terms_offset:term_offsets_offset]
+        self._term_offsets = buffer[term_offsets_offset:
+                                    term_offsets_offset + index_size].view("<u8")
+        self._postings_offsets = buffer[postings_offsets_offset:
+                                        postings_offsets_offset + index_size].view("<u8")
+        self._postings = buffer[postings_offset:].view(np.dtype(dtype).newbyteorder("<"))
+
+    def _term(self, i: int) -> bytes:
+        return self._terms[self._term_offsets[i]:self._term_offsets[i + 1]].tobytes()
+
+    def doc_count(self, word: str) -> int:
+        """Количество документов со словом"""
+        i = self._find(word)
+        if i < 0:
+            return 0
+        return int(self._postings_offsets[i + 1] - self._postings_offsets[i])
+
+    def __getitem__(self, word: str) -> NumpyPostings:
+        i = self._find(word)
+        if i < 0:
+            raise KeyError(word)
+        start = self._postings_offsets[i]
+        end = self._postings_offsets[i + 1]
+        return NumpyPostings(self._postings[start:end])
+
+    def close(self) -> None:
+        """Файл закрывается, когда удалены все представления на него"""
+        self._terms = self._term_offsets = self._postings_offsets = self._postings = None
+
+
+class NumpyStoragePolicy(ColumnarStoragePolicy):
+    """
+    Сохранение инвертированного индекса на диск в виде массивов NumPy
+
+    Формат файла такой же, как у ColumnarStoragePolicy (magic свой),
+    но загрузка возвращает NumpyTermDictionary - массивы без копирования
+    """
+    magic = ColumnarStoragePolicy.numpy_magic
+    compressed_postings = True
+
+    def __init__(self, encoding, use_mmap: bool = True):
+        """
+        Args:
+            encoding: кодировка в которой сохраняются слова
+            use_mmap: открывать файл через np.memmap (иначе читать целиком)
+        """
+        self.encoding = encoding
+        self.use_mmap = use_mmap
+
+    def dump(self, word_to_docs_mapping, filepath: str) -> None:
+        """
+        Сохранение инвертированного индекса на жесткий диск
+
+        Списки склеиваются векторно, списки не из NumpyPostings
+        предварительно сортируются и очищаются от дубликатов
+
+        Args:
+            word_to_docs_mapping: инвертированный индекс
+            filepath: путь до файла куда сохранять
+
+        Returns: None
+        """
+        keys = sorted((word.encode(self.encoding), word) for word in word_to_docs_mapping)
+        term_count = len(keys)
+
+        term_offsets = np.zeros(term_count + 1, dtype="<u8")
+        postings_offsets = np.zeros(term_count + 1, dtype="<u8")
+        postings_lists = []
+        for i, (key, word) in enumerate(keys):
+            docs = word_to_docs_mapping[word]
+            if isinstance(docs, NumpyPostings):
+                docs = docs.array
+            else:
+                docs = np.unique(np.fromiter(docs, dtype=np.uint64))
+            postings_lists.append(docs)
+            term_offsets[i + 1] = term_offsets[i] + len(key)
+            postings_offsets[i + 1] = postings_offsets[i] + len(docs)
+
+        postings = np.concatenate(postings_lists) if postings_lists else np.zeros(0)
+        if len(postings) == 0 or int(postings.max()) < 2 ** 32:
+            postings = postings.astype("<u4")
+        else:
+            postings = postings.astype("<u8")
+        terms = b"".join(key for key, _ in keys)
+
+        terms_offset = self.header.size
+        term_offsets_offset = terms_offset + len(terms) + (-len(terms) % 8)
+        postings_offsets_offset = term_offsets_offset + term_offsets.nbytes
+        postings_offset = postings_offsets_offset + postings_offsets.nbytes
+
+        with open(filepath, "wb") as f:
+            f.write(self.header.pack(self.magic, self.version,
+                                     postings.itemsize, term_count,
+                                     terms_offset, term_offsets_offset,
+                                     postings_offsets_offset, postings_offset))
+            f.write(terms)
+            f.write(b"\0" * (term_offsets_offset - terms_offset - len(terms)))
+            f.write(term_offsets.tobytes())
+            f.write(postings_offsets.tobytes())
+            f.write(postings.tobytes())
+
+        return None
+
+    def load(self, filepath: str) -> NumpyTermDictionary:
+        """
+        Открытие инвертированного индекса с жесткого диска
+
+        Args:
+            filepath: путь до сохраненного инвертированного индекса
+
+        Returns: словарь слово -> NumpyPostings без копирования данных
+        """
+        return NumpyTermDictionary(filepath, self.encoding, use_mmap=self.use_mmap)
@@ -0,0 +1,143 @@
+"""
+Модуль, в котором реализован конвейер для потоковой обработки запросов
+
+Чтение и декодирование входа, вычисление и запись ответов идут
+одновременно в трех потоках, связанных очередями ограниченного размера:
+
+    поток чтения -> очередь порций -> вычисление -> очередь текста -> поток записи
+
+* поток чтения берет элементы из source порциями по chunk_size
+  (для файла это чтение и декодирование строк)
+* вычисление идет в вызывающем потоке, process получает порцию
+  и возвращает текст ответов на всю порцию
+* поток записи копит текст и пишет его в output кусками
+  не меньше buffer_size символов
+
+Очереди хранят не больше queue_size порций, поэтому память
+не зависит от размера входа: если вычисление не успевает,
+чтение ждет, если не успевает запись - ждет вычисление.
+Ошибка в любом из потоков останавливает конвейер и выбрасывается
+из run_pipeline
+"""
+from itertools import islice
+from queue import Empty
+from queue import Queue
+from threading import Event
+from threading import Thread
+from typing import Callable
+from typing import Iterable
+from typing import List
+from typing import TextIO
+
+# элементов в порции
+CHUNK_SIZE = 256
+# порций в каждой очереди
+QUEUE_SIZE = 16
+# размер куска, который пишется в output за раз, в символах
+BUFFER_SIZE = 1 << 20
+
+# конец входа
+_DONE = None
+
+
+class _Failure:
+    """Ошибка потока чтения, передается через очередь"""
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def _read_chunks(source: Iterable, chunk_size: int, chunks: Queue, stop: Event) -> None:
+    try:
+        iterator = iter(source)
+        while not stop.is_set():
+            chunk = list(islice(iterator, chunk_size))
+            if not chunk:
+                break
+            chunks.put(chunk)
+    except BaseException as error:
+        chunks.put(_Failure(error))
+        return
+    chunks.put(_DONE)
+
+
+def _write_texts(output: TextIO, texts: Queue, buffer_size: int, errors: list) -> None:
+    pending = []
+    size = 0
+    while True:
+        text = texts.get()
+        if text is _DONE:
+            break
+        # после ошибки очередь только опустошается, чтобы не блокировать вычисление
+        if errors:
+            continue
+        pending.append(text)
+        size += len(text)
+        if size >= buffer_size:
+            try:
+                output.write("".join(pending))
+            except BaseException as error:
+                errors.append(error)
+            pending = []
+            size = 0
+
+    if not errors:
+        try:
+            if pending:
+                output.write("".join(pending))
+            output.flush()
+        except BaseException as error:
+            errors.append(error)
+
+
+def run_pipeline(source: Iterable,
+                 process: Callable[[List], str],
+                 output: TextIO,
+                 chunk_size: int = CHUNK_SIZE,
+                 queue_size: int = QUEUE_SIZE,
+                 buffer_size: int = BUFFER_SIZE) -> int:
+    """
+    Потоковая обработка элементов конвейером (см. документацию модуля)
+
+    Args:
+        source: элементы, например строки файла (итерируется в потоке чтения)
+        process: функция порция элементов -> текст ответов на порцию
+        output: куда писать ответы
+        chunk_size: элементов в порции
+        queue_size: порций в каждой очереди
+        buffer_size: минимальный размер куска, который пишется в output
+
+    Returns: количество обработанных элементов
+    """
+    chunks = Queue(maxsize=queue_size)
+    texts = Queue(maxsize=queue_size)
+    stop = Event()
+    errors = []
+    reader = Thread(target=_read_chunks, args=(source, chunk_size, chunks, stop), daemon=True)
+    writer = Thread(target=_write_texts, args=(output, texts, buffer_size, errors), daemon=True)
+    reader.start()
+    writer.start()
+
+    count = 0
+    try:
+        while not errors:
+            chunk = chunks.get()
+            if chunk is _DONE:
+                break
+            if isinstance(chunk, _Failure):
+                raise chunk.error
+            texts.put(process(chunk))
+            count += len(chunk)
+    finally:
+        stop.set()
+        # поток чтения может ждать места в очереди
+        while reader.is_alive():
+            try:
+                chunks.get(timeout=0.1)
+            except Empty:
+                pass
+        texts.put(_DONE)
+        writer.join()
+
+    if errors:
+        raise errors[0]
+    return count
@@ -0,0 +1,344 @@
+"""
+Модуль, в котором реализован позиционный индекс для фразовых запросов
+
+Для каждого слова хранятся документы и номера позиций слова
+в документе (номер слова в тексте документа, начиная с 0).
+Позиционный индекс лежит в отдельном файле рядом с основным
+(путь основного индекса + POSITIONS_SUFFIX), поэтому обычные запросы
+его не читают и ничего за него не платят
+
+Формат файла такой же, как у MmapStoragePolicy, списки документов
+записаны PositionalPostings.to_bytes:
+    varint(количество документов), затем для каждого документа
+    varint(разность с предыдущим документом),
+    varint(длина позиций в байтах),
+    позиции - разности с предыдущей позицией в формате varint
+
+Фраза "a b c"~N находит документы, где слова идут в указанном порядке
+и между соседними словами фразы не больше N других слов
+(N = 0 - точная фраза). Кандидаты берутся пересечением основного индекса,
+затем позиции слов в каждом кандидате сливаются (positional merge join)
+"""
+import sys
+from bisect import bisect_left
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+from postings import decode_varint
+from postings import encode_varint
+from spimi import POSTING_OVERHEAD
+from spimi import TERM_OVERHEAD
+from spimi import SpimiRuns
+from storage_policy import MmapStoragePolicy
+
+POSITIONS_SUFFIX = ".pos"
+
+
+def _decode_positions(buf) -> List[int]:
+    positions = []
+    position = 0
+    pos = 0
+    size = len(buf)
+    while pos < size:
+        delta, pos = decode_varint(buf, pos)
+        position += delta
+        positions.append(position)
+    return positions
+
+
+class PositionalPostings:
+    """
+    Отсортированный список документов с позициями слова в каждом документе
+
+    При восстановлении из байт раскодируются только заголовки документов,
+    позиции раскодируются при обращении к конкретному документу
+
+    * _data - байты с позициями документов
+    * _doc_ids - идентификаторы документов по возрастанию
+    * _bounds - пары (начало, конец) позиций каждого документа в _data
+    """
+    __slots__ = ("_data", "_doc_ids", "_bounds")
+
+    def __init__(self, data, doc_ids: List[int], bounds: List[tuple]):
+        self._data = data
+        self._doc_ids = doc_ids
+        self._bounds = bounds
+
+    @classmethod
+    def from_dict(cls, doc_positions: Dict[int, List[int]]):
+        """
+        Построение из словаря документ -> позиции
+
+        Args:
+            doc_positions: документ -> позиции слова по возрастанию
+
+        Returns: PositionalPostings
+        """
+        data = bytearray()
+        doc_ids = []
+        bounds = []
+        for doc_id in sorted(doc_positions):
+            start = len(data)
+            previous = 0
+            for position in doc_positions[doc_id]:
+                encode_varint(position - previous, data)
+                previous = position
+            doc_ids.append(doc_id)
+            bounds.append((start, len(data)))
+        return cls(bytes(data), doc_ids, bounds)
+
+    def to_bytes(self) -> bytes:
+        """
+        Сериализация (формат описан в документации модуля)
+
+        Returns: байты
+        """
+        out = bytearray()
+        encode_varint(len(self._doc_ids), out)
+        previous = 0
+        for doc_id, (start, end) in zip(self._doc_ids, self._bounds):
+            encode_varint(doc_id - previous, out)
+            encode_varint(end - start, out)
+            out += self._data[start:end]
+            previous = doc_id
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, buf):
+        """
+        Восстановление из байт, полученных методом to_bytes
+
+        Args:
+            buf: bytes, bytearray или memoryview
+
+        Returns: PositionalPostings, ссылающийся на buf без копирования позиций
+        """
+        count, pos = decode_varint(buf, 0)
+        doc_ids = []
+        bounds = []
+        doc_id = 0
+        for _ in range(count):
+            delta, pos = decode_varint(buf, pos)
+            size, pos = decode_varint(buf, pos)
+            doc_id += delta
+            doc_ids.append(doc_id)
+            bounds.append((pos, pos + size))
+            pos += size
+
+        return cls(buf, doc_ids, bounds)
+
+    def positions(self, doc_id: int) -> List[int]:
+        """
+        Позиции слова в документе
+
+        Args:
+            doc_id: идентификатор документа
+
+        Returns: позиции по возрастанию (пустой список, если документа нет)
+        """
+        i = bisect_left(self._doc_ids, doc_id)
+        if i == len(self._doc_ids) or self._doc_ids[i] != doc_id:
+            return []
+        start, end = self._bounds[i]
+        return _decode_positions(self._data[start:end])
+
+    def filter_sorted(self, doc_ids: List[int]) -> List[int]:
+        """
+        Оставляет из doc_ids только документы, которые есть в списке
+
+        Args:
+            doc_ids: отсортированный список документов
+
+        Returns: отсортированный список документов
+        """
+        result = []
+        own = self._doc_ids
+        pos = 0
+        size = len(own)
+        for doc_id in doc_ids:
+            pos = bisect_left(own, doc_id, pos)
+            if pos == size:
+                break
+            if own[pos] == doc_id:
+                result.append(doc_id)
+        return result
+
+    def __len__(self):
+        return len(self._doc_ids)
+
+    def __iter__(self):
+        return iter(self._doc_ids)
+
+    def __eq__(self, other):
+        if not isinstance(other, PositionalPostings):
+            return NotImplemented
+        return (self._doc_ids == other._doc_ids
+                and all(self.positions(doc_id) == other.positions(doc_id)
+                        for doc_id in self._doc_ids))
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self._doc_ids})"
+
+
+class PositionalStoragePolicy(MmapStoragePolicy):
+    """
+    Сохранение позиционного индекса на диск
+
+    Формат файла такой же, как у MmapStoragePolicy,
+    списки документов записаны PositionalPostings.to_bytes
+    """
+    magic = b"IIPS"
+    postings_class = PositionalPostings
+
+
+def build_positional_index(documents: Iterable[tuple]) -> Dict[str, PositionalPostings]:
+    """
+    Построение позиционного индекса
+
+    Args:
+        documents: пары (идентификатор документа, слова документа)
+
+    Returns: словарь слово -> PositionalPostings
+    """
+    word_to_positions = {}
+    for doc_id, words in documents:
+        for position, word in enumerate(words):
+            word_to_positions.setdefault(word, {}).setdefault(doc_id, []).append(position)
+
+    return {word: PositionalPostings.from_dict(doc_positions)
+            for word, doc_positions in word_to_positions.items()}
+
+
+def merge_positional(postings_lists: List[PositionalPostings]) -> PositionalPostings:
+    """
+    Объединение позиционных списков одного слова из разных частичных индексов
+
+    Позиции документа, встретившегося в нескольких списках,
+    дописываются в порядке списков
+    """
+    if len(postings_lists) == 1:
+        return postings_lists[0]
+    doc_positions = {}
+    for postings in postings_lists:
+        for doc_id in postings:
+            doc_positions.setdefault(doc_id, []).extend(postings.positions(doc_id))
+    return PositionalPostings.from_dict(doc_positions)
+
+
+def build_positional_index_on_disk(documents: Iterable[tuple],
+                                   filepath: str,
+                                   memory_budget: Optional[int],
+                                   encoding: str = "utf8") -> None:
+    """
+    Построение позиционного индекса с ограниченной памятью (SPIMI)
+
+    Частичный индекс сбрасывается в run файл при превышении бюджета,
+    затем runs сливаются и потоково пишутся в filepath
+
+    Args:
+        documents: пары (идентификатор документа, слова документа)
+        filepath: путь до файла позиционного индекса
+        memory_budget: бюджет памяти под частичный индекс в байтах
+                       (None - сброс только в конце)
+        encoding: кодировка слов
+
+    Returns: None
+    """
+    if memory_budget is not None and memory_budget <= 0:
+        raise ValueError("memory budget must be positive")
+
+    with SpimiRuns(PositionalPostings, merge_positional, encoding) as runs:
+        word_to_positions = {}
+        memory_used = 0
+        for doc_id, words in documents:
+            for position, word in enumerate(words):
+                doc_positions = word_to_positions.get(word)
+                if doc_positions is None:
+                    doc_positions = word_to_positions[word] = {}
+                    memory_used += TERM_OVERHEAD + sys.getsizeof(word)
+                positions = doc_positions.get(doc_id)
+                if positions is None:
+                    positions = doc_positions[doc_id] = []
+                    memory_used += TERM_OVERHEAD
+                positions.append(position)
+                memory_used += POSTING_OVERHEAD
+
+            if memory_budget is not None and memory_used >= memory_budget:
+                runs.write({word: PositionalPostings.from_dict(doc_positions)
+                            for word, doc_positions in word_to_positions.items()})
+                word_to_positions = {}
+                memory_used = 0
+
+        runs.write({word: PositionalPostings.from_dict(doc_positions)
+                    for word, doc_positions in word_to_positions.items()})
+        word_to_positions = None
+
+        with PositionalStoragePolicy(encoding).writer(filepath) as writer:
+            for key, postings in runs.items():
+                writer.add(key.decode(encoding), postings)
+
+
+def match_positions(positions_lists: List[List[int]], slop: int = 0) -> bool:
+    """
+    Есть ли в документе вхождение фразы
+
+    Слияние отсортированных списков позиций слов фразы:
+    для каждого следующего слова оставляются только позиции,
+    до которых можно дойти от допустимых позиций предыдущего слова
+
+    Args:
+        positions_lists: позиции каждого слова фразы по порядку
+        slop: сколько других слов допускается между соседними словами фразы
+
+    Returns: True, если фраза найдена
+    """
+    reachable = positions_lists[0]
+    for positions in positions_lists[1:]:
+        following = []
+        j = 0
+        size = len(reachable)
+        for position in positions:
+            # предыдущее слово должно стоять в [position - 1 - slop, position - 1]
+            while j < size and reachable[j] < position - 1 - slop:
+                j += 1
+            if j == size:
+                break
+            if reachable[j] < position:
+                following.append(position)
+        if not following:
+            return False
+        reachable = following
+    return True
+
+
+def filter_phrase(doc_ids: List[int], words: List[str], positional_mapping,
+                  slop: int = 0) -> List[int]:
+    """
+    Оставляет документы, в которых есть фраза
+
+    Args:
+        doc_ids: отсортированные документы, в которых есть все слова фразы
+        words: слова фразы по порядку
+        positional_mapping: словарь слово -> PositionalPostings
+        slop: сколько других слов допускается между соседними словами фразы
+
+    Returns: отсортированный список документов
+    """
+    if len(words) == 1:
+        return doc_ids
+
+    try:
+        postings = [positional_mapping[word] for word in words]
+    except KeyError:
+        return []
+
+    result = []
+    for doc_id in doc_ids:
+        positions_lists = [positional.positions(doc_id) for positional in postings]
+        if match_positions(positions_lists, slop):
+            result.append(doc_id)
+    return result
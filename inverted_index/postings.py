@@ -0,0 +1,384 @@
+"""
+Модуль, в котором реализованы сжатые списки документов (postings)
+
+Идентификаторы документов хранятся отсортированными по возрастанию
+и разбиваются на блоки по BLOCK_SIZE штук.
+Внутри блока хранятся разности (delta) между соседними идентификаторами,
+закодированные varint (variable-byte): 7 бит данных на байт,
+старший бит - признак продолжения числа.
+
+Для каждого блока хранится указатель пропуска (skip pointer):
+первый идентификатор блока и смещение блока в байтах.
+Благодаря этому при пересечении списков можно перепрыгивать
+через целые блоки, не раскодируя их.
+"""
+import operator
+from array import array
+from bisect import bisect_left
+from bisect import bisect_right
+from functools import reduce
+from itertools import accumulate
+from typing import Iterable
+from typing import List
+
+BLOCK_SIZE = 128
+
+
+def encode_varint(value: int, out: bytearray) -> None:
+    """
+    Дописывает в out число value в формате varint
+
+    Args:
+        value: неотрицательное целое число
+        out: буфер, в который дописывается результат
+
+    Returns: None
+    """
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varint(buf, pos: int) -> tuple:
+    """
+    Читает из буфера одно число в формате varint
+
+    Args:
+        buf: буфер с данными (bytes, bytearray, memoryview, mmap)
+        pos: позиция, с которой начинается число
+
+    Returns: пара (число, позиция сразу после числа)
+    """
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+class CompressedPostings:
+    """
+    Отсортированный список идентификаторов документов в сжатом виде
+
+    * _data - блоки с delta + varint закодированными идентификаторами
+    * _skip_docs - первый идентификатор каждого блока
+    * _skip_offsets - смещение каждого блока в _data
+    * _length - количество идентификаторов
+
+    Первый идентификатор блока в _data не хранится
+    (он уже есть в _skip_docs), остальные хранятся как разности
+    с предыдущим идентификатором того же блока
+    """
+    __slots__ = ("_data", "_skip_docs", "_skip_offsets", "_length")
+
+    def __init__(self, data=b"", skip_docs=None, skip_offsets=None, length=0):
+        self._data = data
+        self._skip_docs = skip_docs if skip_docs is not None else array("Q")
+        self._skip_offsets = skip_offsets if skip_offsets is not None else array("Q")
+        self._length = length
+
+    @classmethod
+    def from_sorted(cls, doc_ids: Iterable[int]):
+        """
+        Сжатие отсортированного списка уникальных идентификаторов
+
+        Args:
+            doc_ids: идентификаторы документов по возрастанию без повторов
+
+        Returns: CompressedPostings
+        """
+        data = bytearray()
+        skip_docs = array("Q")
+        skip_offsets = array("Q")
+        length = 0
+        previous = None
+
+        for doc_id in doc_ids:
+            if previous is not None and doc_id <= previous:
+                raise ValueError("doc ids must be sorted and unique")
+            if length % BLOCK_SIZE == 0:
+                skip_docs.append(doc_id)
+                skip_offsets.append(len(data))
+            elif doc_id - previous < 0x80:
+                # большинство разностей помещается в один байт
+                data.append(doc_id - previous)
+            else:
+                encode_varint(doc_id - previous, data)
+            previous = doc_id
+            length += 1
+
+        return cls(bytes(data), skip_docs, skip_offsets, length)
+
+    @classmethod
+    def from_iterable(cls, doc_ids: Iterable[int]):
+        """
+        Сжатие произвольного набора идентификаторов (с сортировкой и
+        удалением дубликатов)
+
+        Args:
+            doc_ids: идентификаторы документов в любом порядке
+
+        Returns: CompressedPostings
+        """
+        return cls.from_sorted(sorted(set(doc_ids)))
+
+    def to_bytes(self) -> bytes:
+        """
+        Сериализация в самодостаточный набор байт
+
+        Формат: varint(количество идентификаторов),
+                для каждого блока varint(разность первых идентификаторов
+                соседних блоков) и varint(длина блока в байтах),
+                затем сами блоки
+
+        Returns: байты
+        """
+        out = bytearray()
+        encode_varint(self._length, out)
+
+        previous_doc = 0
+        block_count = len(self._skip_docs)
+        for i in range(block_count):
+            end = (self._skip_offsets[i + 1] if i + 1 < block_count
+                   else len(self._data))
+            encode_varint(self._skip_docs[i] - previous_doc, out)
+            encode_varint(end - self._skip_offsets[i], out)
+            previous_doc = self._skip_docs[i]
+
+        out += self._data
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, buf):
+        """
+        Восстановление из байт, полученных методом to_bytes
+
+        Данные блоков не копируются и не раскодируются:
+        если buf это memoryview над mmap, то читаться с диска будут
+        только те блоки, к которым реально обратились
+
+        Args:
+            buf: bytes, bytearray или memoryview
+
+        Returns: CompressedPostings
+        """
+        length, pos = decode_varint(buf, 0)
+        block_count = (length + BLOCK_SIZE - 1) // BLOCK_SIZE
+
+        skip_docs = array("Q")
+        skip_offsets = array("Q")
+        doc_id = 0
+        offset = 0
+        for _ in range(block_count):
+            delta, pos = decode_varint(buf, pos)
+            size, pos = decode_varint(buf, pos)
+            doc_id += delta
+            skip_docs.append(doc_id)
+            skip_offsets.append(offset)
+            offset += size
+
+        return cls(buf[pos:pos + offset], skip_docs, skip_offsets, length)
+
+    @property
+    def nbytes(self) -> int:
+        """Примерный объем памяти, занимаемый сжатыми данными"""
+        return (len(self._data)
+                + self._skip_docs.itemsize * len(self._skip_docs)
+                + self._skip_offsets.itemsize * len(self._skip_offsets))
+
+    def decode_block(self, block: int) -> List[int]:
+        """
+        Раскодирование одного блока
+
+        Args:
+            block: номер блока
+
+        Returns: идентификаторы документов блока
+        """
+        data = self._data
+        start = self._skip_offsets[block]
+        if block + 1 < len(self._skip_offsets):
+            end = self._skip_offsets[block + 1]
+        else:
+            end = len(data)
+
+        doc_id = self._skip_docs[block]
+        raw = bytes(data[start:end])
+        # все разности однобайтовые (частый случай для длинных списков):
+        # раскодирование сводится к накопленной сумме
+        if not raw or max(raw) < 0x80:
+            return list(accumulate(raw, initial=doc_id))
+
+        result = [doc_id]
+        pos = start
+        while pos < end:
+            delta, pos = decode_varint(data, pos)
+            doc_id += delta
+            result.append(doc_id)
+
+        return result
+
+    def filter_sorted(self, doc_ids: List[int]) -> List[int]:
+        """
+        Оставляет из doc_ids только документы, которые есть в списке
+
+        Для каждого кандидата нужный блок ищется бинарным поиском
+        по указателям пропуска начиная с текущего блока, блоки без кандидатов
+        не раскодируются, внутри блока позиция ищется бинарным поиском
+        от предыдущей найденной позиции
+
+        Args:
+            doc_ids: отсортированный список документов
+
+        Returns: отсортированный список документов
+        """
+        skip_docs = self._skip_docs
+        block = -1
+        docs = []
+        pos = 0
+        result = []
+
+        for doc_id in doc_ids:
+            if not docs or docs[-1] < doc_id:
+                next_block = bisect_right(skip_docs, doc_id, max(block, 0)) - 1
+                if next_block == block or next_block < 0:
+                    # кандидат попал в промежуток между блоками
+                    continue
+                block = next_block
+                docs = self.decode_block(block)
+                pos = 0
+
+            pos = bisect_left(docs, doc_id, pos)
+            if pos < len(docs) and docs[pos] == doc_id:
+                result.append(doc_id)
+
+        return result
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for block in range(len(self._skip_docs)):
+            yield from self.decode_block(block)
+
+    def __contains__(self, doc_id):
+        return bool(self.filter_sorted([doc_id]))
+
+    def __eq__(self, other):
+        if isinstance(other, CompressedPostings):
+            return (self._length == other._length
+                    and list(self._skip_docs) == list(other._skip_docs)
+                    and bytes(self._data) == bytes(other._data))
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({list(self)})"
+
+
+def as_postings(doc_ids) -> CompressedPostings:
+    """
+    Приводит набор идентификаторов к CompressedPostings
+
+    Списки документов других форматов (например RoaringPostings)
+    возвращаются как есть
+
+    Args:
+        doc_ids: CompressedPostings или любой итерируемый объект с int
+
+    Returns: CompressedPostings
+    """
+    if isinstance(doc_ids, CompressedPostings) or hasattr(doc_ids, "filter_sorted"):
+        return doc_ids
+    return CompressedPostings.from_iterable(doc_ids)
+
+
+def convert_postings(docs, postings_class):
+    """
+    Приводит список документов к формату postings_class
+
+    Args:
+        docs: список документов в любом из форматов postings
+              (уже отсортирован) или просто набор идентификаторов
+        postings_class: класс списков (from_sorted и from_iterable)
+
+    Returns: объект postings_class
+    """
+    if isinstance(docs, postings_class):
+        return docs
+    if hasattr(docs, "filter_sorted"):
+        # CompressedPostings и RoaringPostings уже отсортированы
+        return postings_class.from_sorted(docs)
+    return postings_class.from_iterable(docs)
+
+
+def intersect(postings_lists: list) -> List[int]:
+    """
+    Пересечение отсортированных списков документов
+
+    Списки обходятся от самого короткого к самому длинному:
+    кандидаты берутся из самого короткого списка и последовательно
+    фильтруются остальными списками (см. intersect_sorted),
+    каждый фильтр раскодирует только блоки, в которые попали кандидаты
+    Множества (set) при этом не строятся
+
+    Списки одного формата, которые умеют пересекаться друг с другом
+    целиком (оператор &, например RoaringPostings),
+    сначала пересекаются между собой
+
+    Args:
+        postings_lists: списки CompressedPostings или RoaringPostings
+
+    Returns: отсортированный список общих документов
+    """
+    if not postings_lists:
+        return []
+
+    combinable = {}
+    rest = []
+    for postings in postings_lists:
+        if hasattr(postings, "__and__"):
+            combinable.setdefault(type(postings), []).append(postings)
+        else:
+            rest.append(postings)
+    if any(len(group) > 1 for group in combinable.values()):
+        postings_lists = rest + [reduce(operator.and_, sorted(group, key=len))
+                                 for group in combinable.values()]
+
+    ordered = sorted(postings_lists, key=len)
+    if len(ordered[0]) == 0:
+        return []
+    if len(ordered) == 1:
+        return list(ordered[0])
+
+    return intersect_sorted(list(ordered[0]), ordered[1:])
+
+
+def intersect_sorted(doc_ids: List[int], postings_lists: list) -> List[int]:
+    """
+    Пересечение уже посчитанного отсортированного списка документов
+    со сжатыми списками
+
+    Args:
+        doc_ids: отсортированный список документов
+        postings_lists: списки с методом filter_sorted
+                        (CompressedPostings или RoaringPostings)
+
+    Returns: отсортированный список общих документов
+    """
+    result = doc_ids
+    for postings in sorted(postings_lists, key=len):
+        if not result:
+            break
+        result = postings.filter_sorted(result)
+
+    return result
@@ -0,0 +1,151 @@
+"""
+Модуль, в котором реализован кэш результатов запросов к инвертированному индексу
+
+Ключ кэша - множество слов запроса (frozenset), поэтому запросы
+"hello world", "world hello" и "hello hello world" попадают в одну запись.
+Вытеснение - LRU по количеству записей и/или по объему памяти
+"""
+from array import array
+from collections import OrderedDict
+from typing import FrozenSet
+from typing import Optional
+from typing import Tuple
+
+# примерные накладные расходы на одну запись кэша в байтах
+ENTRY_OVERHEAD = 200
+
+
+class QueryCache:
+    """
+    LRU кэш результатов запросов
+
+    * max_entries - максимальное количество записей (None - без ограничения)
+    * max_bytes - максимальный объем результатов в байтах (None - без ограничения)
+    * hits - количество запросов, целиком найденных в кэше
+    * partial_hits - количество запросов, посчитанных от закэшированного подмножества
+    * misses - количество запросов, которых не было в кэше
+    * evictions - количество вытесненных записей
+    """
+    def __init__(self, max_entries: Optional[int] = 1024, max_bytes: Optional[int] = None):
+        if max_entries is not None and max_entries <= 0:
+            raise ValueError("max_entries must be positive")
+        if max_bytes is not None and max_bytes <= 0:
+            raise ValueError("max_bytes must be positive")
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()
+        self.nbytes = 0
+
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size(doc_ids: array) -> int:
+        return ENTRY_OVERHEAD + doc_ids.itemsize * len(doc_ids)
+
+    def get(self, words: FrozenSet[str]) -> Optional[list]:
+        """
+        Поиск результата запроса в кэше
+
+        Args:
+            words: множество слов запроса
+
+        Returns: отсортированный список документов или None
+        """
+        doc_ids = self._entries.get(words)
+        if doc_ids is None:
+            return None
+
+        self._entries.move_to_end(words)
+        return list(doc_ids)
+
+    def get_subset(self, words: FrozenSet[str]) -> Optional[Tuple[FrozenSet[str], list]]:
+        """
+        Поиск закэшированного запроса, который на одно слово короче данного
+
+        Результат такого запроса можно дополнительно пересечь
+        с оставшимся словом, не пересчитывая все остальное
+
+        Args:
+            words: множество слов запроса
+
+        Returns: пара (множество слов найденного запроса, его документы)
+                 с самым коротким списком документов или None
+        """
+        if len(words) < 3:
+            return None
+
+        best = None
+        for word in words:
+            subset = words - {word}
+            doc_ids = self._entries.get(subset)
+            if doc_ids is not None and (best is None or len(doc_ids) < len(best[1])):
+                best = (subset, doc_ids)
+
+        if best is None:
+            return None
+
+        self._entries.move_to_end(best[0])
+        return best[0], list(best[1])
+
+    def put(self, words: FrozenSet[str], doc_ids: list) -> None:
+        """
+        Сохранение результата запроса с вытеснением давно неиспользуемых записей
+
+        Args:
+            words: множество слов запроса
+            doc_ids: отсортированный список документов
+        """
+        stored = array("Q", doc_ids)
+        size = self._size(stored)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        previous = self._entries.pop(words, None)
+        if previous is not None:
+            self.nbytes -= self._size(previous)
+
+        self._entries[words] = stored
+        self.nbytes += size
+
+        while ((self.max_entries is not None and len(self._entries) > self.max_entries)
+               or (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= self._size(evicted)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        """Сброс кэша (например при перезагрузке индекса), счетчики сохраняются"""
+        self._entries.clear()
+        self.nbytes = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.partial_hits + self.misses
+        if total == 0:
+            return 0.0
+        return (self.hits + self.partial_hits) / total
+
+    def stats(self) -> dict:
+        """
+        Статистика работы кэша
+
+        Returns: словарь со счетчиками
+        """
+        return {"entries": len(self._entries),
+                "bytes": self.nbytes,
+                "hits": self.hits,
+                "partial_hits": self.partial_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hit_rate}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, words):
+        return words in self._entries
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""
+Легковесный клиент для сервера запросов (см. query_server.py)
+
+Не импортирует ничего из индекса, поэтому запускается быстро.
+Запросы отправляются в отдельном потоке, не дожидаясь ответов (pipelining),
+ответы читаются и печатаются в порядке запросов
+
+Пример:
+    python query_client.py --port 8765 --query-file-utf8 data/query_utf8.txt
+    echo "hello world" | python query_client.py --unix-socket /tmp/index.sock
+"""
+import socket
+import sys
+import threading
+from argparse import ArgumentParser
+from typing import Iterable
+from typing import Iterator
+from typing import List
+
+ENCODING = "utf8"
+# начало ответа сервера на запрос, который не удалось выполнить
+ERROR_PREFIX = b"error: "
+
+
+class QueryClient:
+    """
+    Клиент сервера запросов
+
+    Пример:
+        with QueryClient(port=8765) as client:
+            client.query(["hello", "world"])
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = None, unix_socket: str = None):
+        if unix_socket is not None:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.connect(unix_socket)
+        else:
+            self._socket = socket.create_connection((host, port))
+
+        self._reader = self._socket.makefile("rb")
+        self._writer = self._socket.makefile("wb")
+
+    @staticmethod
+    def _parse(line: bytes) -> List[int]:
+        line = line.strip()
+        if not line:
+            return []
+        if line.startswith(ERROR_PREFIX):
+            raise ValueError(line[len(ERROR_PREFIX):].decode(ENCODING))
+        return [int(i) for i in line.split(b",")]
+
+    def query(self, words: List[str]) -> List[int]:
+        """
+        Один запрос
+
+        Args:
+            words: слова запроса
+
+        Returns: список документов
+                 (ValueError, если сервер не смог выполнить запрос)
+        """
+        self._writer.write((" ".join(words) + "\n").encode(ENCODING))
+        self._writer.flush()
+        return self._parse(self._reader.readline())
+
+    def query_many(self, raw_queries: Iterable[str]) -> Iterator[bytes]:
+        """
+        Конвейерное выполнение запросов
+
+        После отправки всех запросов соединение закрывается на запись,
+        поэтому после query_many клиент больше использовать нельзя
+
+        Args:
+            raw_queries: строки запросов
+
+        Returns: генератор сырых строк ответов в порядке запросов
+        """
+        def send():
+            for raw_query in raw_queries:
+                self._writer.write((" ".join(raw_query.split()) + "\n").encode(ENCODING))
+            self._writer.flush()
+            self._socket.shutdown(socket.SHUT_WR)
+
+        sender = threading.Thread(target=send, daemon=True)
+        sender.start()
+
+        # сервер закроет соединение, ответив на все запросы
+        for line in self._reader:
+            yield line
+
+        sender.join()
+
+    def close(self) -> None:
+        self._writer.close()
+        self._reader.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def parse_arguments():
+    args_parser = ArgumentParser(description="client for inverted index query server")
+    args_parser.add_argument("--host", dest="host", default="127.0.0.1", type=str)
+    args_parser.add_argument("--port", dest="port", default=None, type=int)
+    args_parser.add_argument("--unix-socket", dest="unix_socket", default=None, type=str)
+
+    query_group = args_parser.add_mutually_exclusive_group()
+    query_group.add_argument("--query", dest="query_from_stdin", nargs="+")
+    query_group.add_argument("--query-file-utf8", dest="query_file", type=str)
+    query_group.add_argument("--query-file-cp1251", dest="query_file_cp1251", type=str)
+
+    return args_parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+
+    if args.query_from_stdin:
+        raw_queries = args.query_from_stdin
+        fin = None
+    elif args.query_file_cp1251:
+        fin = open(args.query_file_cp1251, encoding="cp1251")
+        raw_queries = fin
+    elif args.query_file:
+        fin = open(args.query_file, encoding="utf8")
+        raw_queries = fin
+    else:
+        fin = None
+        raw_queries = sys.stdin
+
+    output = sys.stdout.buffer
+    with QueryClient(host=args.host, port=args.port, unix_socket=args.unix_socket) as client:
+        for line in client.query_many(raw_queries):
+            output.write(line)
+    output.flush()
+
+    if fin is not None:
+        fin.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Модуль, в котором реализован asyncio сервер запросов к инвертированному индексу
+
+Индекс загружается один раз при старте сервера и дальше живет в памяти,
+поэтому клиенты не платят ни за запуск интерпретатора, ни за загрузку индекса
+
+Протокол построчный (utf8):
+    запрос - слова через пробел, заканчивается переводом строки
+    ответ - идентификаторы документов через запятую, тоже с переводом строки,
+    или ERROR_PREFIX и описание ошибки, если запрос выполнить не удалось
+    (соединение при этом не закрывается)
+Клиент может отправлять запросы не дожидаясь ответов (pipelining),
+ответы приходят в порядке запросов
+
+Синхронный InvertedIndex.query выполняется в отдельном потоке,
+чтобы долгий запрос не останавливал обслуживание других клиентов.
+Поток один на сервер: кэш запросов и открытые через mmap файлы
+индекса не рассчитаны на одновременное обращение из нескольких потоков
+"""
+import asyncio
+import logging
+import os
+from concurrent.futures import Executor
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+ENCODING = "utf8"
+# максимальная длина строки запроса в байтах
+LINE_LIMIT = 1 << 20
+# начало ответа на запрос, который не удалось выполнить
+ERROR_PREFIX = "error: "
+
+
+def format_result(document_ids) -> bytes:
+    """Ответ на запрос в формате протокола"""
+    return (",".join(str(i) for i in document_ids) + "\n").encode(ENCODING)
+
+
+def format_error(error: Exception) -> bytes:
+    """Ответ на запрос, который не удалось выполнить, в формате протокола"""
+    message = " ".join(f"{error.__class__.__name__}: {error}".split())
+    return (ERROR_PREFIX + message + "\n").encode(ENCODING)
+
+
+async def handle_client(reader: asyncio.StreamReader,
+                        writer: asyncio.StreamWriter,
+                        inverted_index,
+                        executor: Optional[Executor] = None) -> None:
+    """
+    Обработка одного соединения
+
+    Args:
+        reader: поток запросов клиента
+        writer: поток ответов клиенту
+        inverted_index: InvertedIndex или индекс с методом query_async
+                        (например ShardedInvertedIndex), тогда пока исполнители
+                        считают запрос, сервер обслуживает других клиентов
+        executor: где выполнять синхронный inverted_index.query
+                  (None - исполнитель цикла событий по умолчанию)
+    """
+    peer = writer.get_extra_info("peername")
+    logger.debug("client connected: %s", peer)
+    query_async = getattr(inverted_index, "query_async", None)
+    loop = asyncio.get_running_loop()
+
+    try:
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                logger.warning("query from %s is longer than %d bytes", peer, LINE_LIMIT)
+                break
+            if not line:
+                break
+
+            words = line.decode(ENCODING, errors="replace").split()
+            try:
+                if not words:
+                    document_ids = []
+                elif query_async is not None:
+                    document_ids = await query_async(words)
+                else:
+                    document_ids = await loop.run_in_executor(executor,
+                                                              inverted_index.query, words)
+            except Exception as error:
+                logger.warning("query %r from %s failed: %r", words, peer, error)
+                writer.write(format_error(error))
+            else:
+                writer.write(format_result(document_ids))
+            # drain ждет только если буфер отправки переполнен
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        logger.debug("client disconnected: %s", peer)
+        writer.close()
+
+
+async def start_server(inverted_index,
+                       host: str = None,
+                       port: int = None,
+                       unix_socket: str = None) -> asyncio.AbstractServer:
+    """
+    Запуск сервера на TCP порту или на unix сокете
+
+    Args:
+        inverted_index: загруженный InvertedIndex
+        host: адрес для TCP сервера
+        port: порт для TCP сервера (0 - любой свободный)
+        unix_socket: путь до unix сокета (вместо host и port)
+
+    Returns: asyncio сервер
+    """
+    executor = None
+    if not hasattr(inverted_index, "query_async"):
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query")
+
+    async def handler(reader, writer):
+        await handle_client(reader, writer, inverted_index, executor)
+
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        return await asyncio.start_unix_server(handler, path=unix_socket, limit=LINE_LIMIT)
+
+    if port is None:
+        raise ValueError("either port or unix_socket must be set")
+    return await asyncio.start_server(handler, host=host, port=port, limit=LINE_LIMIT)
+
+
+async def serve(inverted_index,
+                host: str = None,
+                port: int = None,
+                unix_socket: str = None) -> None:
+    """
+    Запуск сервера и обслуживание клиентов до остановки процесса
+
+    Args:
+        inverted_index: загруженный InvertedIndex
+        host: адрес для TCP сервера
+        port: порт для TCP сервера
+        unix_socket: путь до unix сокета (вместо host и port)
+    """
+    server = await start_server(inverted_index, host=host, port=port,
+                                unix_socket=unix_socket)
+    addresses = [sock.getsockname() for sock in server.sockets]
+    logger.info("serving inverted index on %s", addresses)
+
+    async with server:
+        await server.serve_forever()
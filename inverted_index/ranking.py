@@ -0,0 +1,861 @@
+"""
+Модуль, в котором реализован ранжированный поиск top-k по BM25
+
+Для каждого слова хранятся документы с частотой слова в документе (tf),
+разбитые на блоки по BLOCK_SIZE документов. Для каждого блока заранее
+посчитан максимум tf-составляющей BM25 по документам блока, поэтому
+верхняя граница вклада слова в любой документ блока равна idf * максимум.
+Длины документов хранятся отдельно (DocumentNorms)
+
+Ранжированный индекс лежит в отдельных файлах рядом с основным:
+    путь основного индекса + RANK_SUFFIX - слова (формат MmapStoragePolicy,
+        списки документов записаны ScoredPostings.to_bytes)
+    ... + NORMS_SUFFIX - длины документов и параметры BM25
+
+Запрос выполняется алгоритмом block-max WAND: курсоры слов упорядочиваются
+по текущему документу, опорный документ (pivot) выбирается по сумме
+максимальных вкладов слов, затем сумма максимумов текущих блоков
+отсекает целые блоки, которые не могут попасть в top-k.
+Полностью оцениваются только документы, способные войти в top-k,
+поэтому время запроса слабо зависит от количества подходящих документов
+
+Если индекс - часть набора (шард), idf и средняя длина документа
+берутся из CollectionStats всего набора, чтобы оценки частей были
+сравнимы. Максимумы блоков посчитаны со средней длиной части,
+при большей средней длине набора tf-составляющая может вырасти
+не больше чем в (средняя длина набора / средняя длина части) раз,
+на этот множитель увеличиваются границы
+"""
+import heapq
+import math
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from postings import BLOCK_SIZE
+from postings import decode_varint
+from postings import encode_varint
+from spimi import TERM_OVERHEAD
+from spimi import SpimiRuns
+from storage_policy import MmapStoragePolicy
+
+RANK_SUFFIX = ".rank"
+NORMS_SUFFIX = ".norms"
+
+K1 = 1.2
+B = 0.75
+
+_FLOAT = struct.Struct("<f")
+_UINT32 = "I" if array("I").itemsize == 4 else "L"
+
+
+def _round_up_float32(value: float) -> float:
+    """
+    Ближайшее сверху число float32 (для неотрицательных value),
+    чтоб граница блока оставалась верхней
+    """
+    packed = _FLOAT.pack(value)
+    rounded = _FLOAT.unpack(packed)[0]
+    if rounded < value:
+        # следующее число float32 - следующее целое в его битовом представлении
+        bits = int.from_bytes(packed, "little") + 1
+        rounded = _FLOAT.unpack(bits.to_bytes(4, "little"))[0]
+    return rounded
+
+
+def idf(doc_count: int, doc_frequency: int) -> float:
+    """
+    Обратная частота документа в варианте BM25 (всегда положительная)
+
+    Args:
+        doc_count: количество документов в индексе
+        doc_frequency: количество документов со словом
+
+    Returns: idf
+    """
+    return math.log(1 + (doc_count - doc_frequency + 0.5) / (doc_frequency + 0.5))
+
+
+class DocumentNorms:
+    """
+    Длины документов и параметры BM25
+
+    * doc_ids - идентификаторы документов по возрастанию
+    * lengths - длины документов в словах (в том же порядке)
+    * k1, b - параметры BM25
+    """
+    magic = b"IINR"
+    version = 1
+    header = struct.Struct("<4sHxxQQdd")
+
+    def __init__(self, doc_ids, lengths, k1: float = K1, b: float = B,
+                 total_length: Optional[int] = None):
+        self.doc_ids = doc_ids
+        self.lengths = lengths
+        self.k1 = k1
+        self.b = b
+        self.total_length = sum(lengths) if total_length is None else total_length
+        self.avg_length = self.total_length / len(doc_ids) if len(doc_ids) else 0.0
+        self._mmap = None
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def length(self, doc_id: int) -> int:
+        """Длина документа (0, если документа нет)"""
+        i = bisect_left(self.doc_ids, doc_id)
+        if i == len(self.doc_ids) or self.doc_ids[i] != doc_id:
+            return 0
+        return self.lengths[i]
+
+    def with_avg_length(self, avg_length: float):
+        """Те же длины документов с другой средней длиной (средней по всему набору)"""
+        norms = DocumentNorms(self.doc_ids, self.lengths, self.k1, self.b, self.total_length)
+        norms.avg_length = avg_length
+        return norms
+
+    def tf_score(self, tf: int, length: int) -> float:
+        """tf-составляющая BM25"""
+        k1 = self.k1
+        norm = k1 * (1 - self.b + self.b * length / self.avg_length)
+        return tf * (k1 + 1) / (tf + norm)
+
+    def dump(self, filepath: str) -> None:
+        """
+        Сохранение на диск
+
+        Формат: заголовок (см. header), идентификаторы документов uint64,
+                длины документов uint32
+        """
+        doc_ids = array("Q", self.doc_ids)
+        lengths = array(_UINT32, self.lengths)
+        if sys.byteorder != "little":
+            doc_ids.byteswap()
+            lengths.byteswap()
+        with open(filepath, "wb") as f:
+            f.write(self.header.pack(self.magic, self.version, len(doc_ids),
+                                     self.total_length, self.k1, self.b))
+            doc_ids.tofile(f)
+            lengths.tofile(f)
+
+    @classmethod
+    def load(cls, filepath: str):
+        """
+        Открытие через mmap, длины читаются с диска по мере обращения
+
+        Returns: DocumentNorms
+        """
+        with open(filepath, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, doc_count, total_length, k1, b = cls.header.unpack_from(buffer)
+        if magic != cls.magic or version != cls.version:
+            buffer.close()
+            raise ValueError(f"{filepath} is not a document norms file")
+
+        start = cls.header.size
+        view = memoryview(buffer)
+        doc_ids = view[start:start + 8 * doc_count]
+        lengths = view[start + 8 * doc_count:start + 12 * doc_count]
+        if sys.byteorder == "little":
+            doc_ids = doc_ids.cast("Q")
+            lengths = lengths.cast(_UINT32)
+        else:
+            doc_ids = array("Q", doc_ids)
+            doc_ids.byteswap()
+            lengths = array(_UINT32, lengths)
+            lengths.byteswap()
+
+        norms = cls(doc_ids, lengths, k1, b, total_length)
+        norms._mmap = buffer
+        return norms
+
+
+class ScoredPostings:
+    """
+    Отсортированный список документов с частотами слова,
+    разбитый на блоки с максимальной оценкой
+
+    * _data - блоки: для каждого документа varint(разность с предыдущим
+              документом блока, у первого 0) и varint(tf)
+    * _skip_docs - первый документ каждого блока
+    * _skip_last - последний документ каждого блока
+    * _skip_offsets - смещение каждого блока в _data
+    * _block_max - максимум tf-составляющей BM25 в каждом блоке
+    * _length - количество документов
+    """
+    __slots__ = ("_data", "_skip_docs", "_skip_last", "_skip_offsets",
+                 "_block_max", "_length")
+
+    def __init__(self, data, skip_docs, skip_last, skip_offsets, block_max, length):
+        self._data = data
+        self._skip_docs = skip_docs
+        self._skip_last = skip_last
+        self._skip_offsets = skip_offsets
+        self._block_max = block_max
+        self._length = length
+
+    @classmethod
+    def from_frequencies(cls, doc_tfs: Iterable[Tuple[int, int]], norms: DocumentNorms):
+        """
+        Построение из пар (документ, tf)
+
+        Args:
+            doc_tfs: пары по возрастанию документов
+            norms: длины документов для подсчета максимумов блоков
+
+        Returns: ScoredPostings
+        """
+        data = bytearray()
+        skip_docs = array("Q")
+        skip_last = array("Q")
+        skip_offsets = array("Q")
+        block_max = array("d")
+        length = 0
+        previous = None
+
+        for doc_id, tf in doc_tfs:
+            if previous is not None and doc_id <= previous:
+                raise ValueError("doc ids must be sorted and unique")
+            if length % BLOCK_SIZE == 0:
+                skip_docs.append(doc_id)
+                skip_last.append(doc_id)
+                skip_offsets.append(len(data))
+                block_max.append(0.0)
+                previous = doc_id
+            encode_varint(doc_id - previous, data)
+            encode_varint(tf, data)
+            skip_last[-1] = doc_id
+            score = _round_up_float32(norms.tf_score(tf, norms.length(doc_id)))
+            block_max[-1] = max(block_max[-1], score)
+            previous = doc_id
+            length += 1
+
+        return cls(bytes(data), skip_docs, skip_last, skip_offsets, block_max, length)
+
+    def to_bytes(self) -> bytes:
+        """
+        Сериализация
+
+        Формат: varint(количество документов), затем для каждого блока
+                varint(разность первого документа с первым документом
+                предыдущего блока), varint(разность последнего и первого
+                документа блока), varint(размер блока в байтах),
+                float32 максимум блока; затем данные блоков
+
+        Returns: байты
+        """
+        out = bytearray()
+        encode_varint(self._length, out)
+
+        previous = 0
+        offsets = list(self._skip_offsets) + [len(self._data)]
+        for i, doc_id in enumerate(self._skip_docs):
+            encode_varint(doc_id - previous, out)
+            encode_varint(self._skip_last[i] - doc_id, out)
+            encode_varint(offsets[i + 1] - offsets[i], out)
+            out += _FLOAT.pack(self._block_max[i])
+            previous = doc_id
+
+        out += self._data
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, buf):
+        """
+        Восстановление из байт, полученных методом to_bytes
+
+        Данные блоков не копируются и не раскодируются
+
+        Args:
+            buf: bytes, bytearray или memoryview
+
+        Returns: ScoredPostings
+        """
+        length, pos = decode_varint(buf, 0)
+        block_count = (length + BLOCK_SIZE - 1) // BLOCK_SIZE
+
+        skip_docs = array("Q")
+        skip_last = array("Q")
+        skip_offsets = array("Q")
+        block_max = array("d")
+        doc_id = 0
+        offset = 0
+        for _ in range(block_count):
+            delta, pos = decode_varint(buf, pos)
+            span, pos = decode_varint(buf, pos)
+            size, pos = decode_varint(buf, pos)
+            doc_id += delta
+            skip_docs.append(doc_id)
+            skip_last.append(doc_id + span)
+            skip_offsets.append(offset)
+            block_max.append(_FLOAT.unpack_from(buf, pos)[0])
+            pos += _FLOAT.size
+            offset += size
+
+        return cls(buf[pos:pos + offset], skip_docs, skip_last, skip_offsets,
+                   block_max, length)
+
+    @property
+    def max_score(self) -> float:
+        """Максимум tf-составляющей BM25 по всем документам"""
+        return max(self._block_max, default=0.0)
+
+    def decode_block(self, block: int) -> Tuple[List[int], List[int]]:
+        """
+        Раскодирование одного блока
+
+        Args:
+            block: номер блока
+
+        Returns: пара (документы блока, частоты слова в них)
+        """
+        data = self._data
+        pos = self._skip_offsets[block]
+        if block + 1 < len(self._skip_offsets):
+            end = self._skip_offsets[block + 1]
+        else:
+            end = len(data)
+
+        doc_ids = []
+        tfs = []
+        doc_id = self._skip_docs[block]
+        while pos < end:
+            delta, pos = decode_varint(data, pos)
+            tf, pos = decode_varint(data, pos)
+            doc_id += delta
+            doc_ids.append(doc_id)
+            tfs.append(tf)
+        return doc_ids, tfs
+
+    def filter_sorted(self, doc_ids: List[int]) -> List[int]:
+        """
+        Оставляет из doc_ids только документы, которые есть в списке
+
+        Args:
+            doc_ids: отсортированный список документов
+
+        Returns: отсортированный список документов
+        """
+        result = []
+        block = -1
+        docs = []
+        for doc_id in doc_ids:
+            next_block = bisect_left(self._skip_last, doc_id, max(block, 0))
+            if next_block == len(self._skip_last):
+                break
+            if next_block != block:
+                block = next_block
+                docs, _ = self.decode_block(block)
+            pos = bisect_left(docs, doc_id)
+            if pos < len(docs) and docs[pos] == doc_id:
+                result.append(doc_id)
+        return result
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for block in range(len(self._skip_docs)):
+            yield from self.decode_block(block)[0]
+
+    def items(self) -> Iterable[Tuple[int, int]]:
+        """Пары (документ, tf) по возрастанию документов"""
+        for block in range(len(self._skip_docs)):
+            yield from zip(*self.decode_block(block))
+
+    def __eq__(self, other):
+        if not isinstance(other, ScoredPostings):
+            return NotImplemented
+        return list(self.items()) == list(other.items())
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({list(self.items())})"
+
+
+class TermFrequencies:
+    """
+    Пары (документ, tf) одного слова по возрастанию документов
+
+    Списки run файлов при построении с ограниченной памятью:
+    максимумы блоков ScoredPostings зависят от средней длины документа,
+    которая известна только после прохода по всем документам
+
+    * doc_ids - документы по возрастанию
+    * tfs - частоты слова (в том же порядке)
+    """
+    __slots__ = ("doc_ids", "tfs")
+
+    def __init__(self, doc_ids, tfs):
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+
+    @classmethod
+    def from_pairs(cls, doc_tfs: Iterable[Tuple[int, int]]):
+        """
+        Построение из пар (документ, tf) в любом порядке,
+        частоты повторяющихся документов складываются
+        """
+        doc_ids = array("Q")
+        tfs = array("Q")
+        for doc_id, tf in sorted(doc_tfs):
+            if doc_ids and doc_ids[-1] == doc_id:
+                tfs[-1] += tf
+            else:
+                doc_ids.append(doc_id)
+                tfs.append(tf)
+        return cls(doc_ids, tfs)
+
+    def to_bytes(self) -> bytes:
+        """
+        Сериализация
+
+        Формат: varint(количество документов), затем для каждого документа
+                varint(разность с предыдущим документом), varint(tf)
+        """
+        out = bytearray()
+        encode_varint(len(self.doc_ids), out)
+        previous = 0
+        for doc_id, tf in zip(self.doc_ids, self.tfs):
+            encode_varint(doc_id - previous, out)
+            encode_varint(tf, out)
+            previous = doc_id
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, buf):
+        """Восстановление из байт, полученных методом to_bytes"""
+        count, pos = decode_varint(buf, 0)
+        doc_ids = array("Q")
+        tfs = array("Q")
+        doc_id = 0
+        for _ in range(count):
+            delta, pos = decode_varint(buf, pos)
+            tf, pos = decode_varint(buf, pos)
+            doc_id += delta
+            doc_ids.append(doc_id)
+            tfs.append(tf)
+        return cls(doc_ids, tfs)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def items(self) -> Iterable[Tuple[int, int]]:
+        """Пары (документ, tf) по возрастанию документов"""
+        return zip(self.doc_ids, self.tfs)
+
+
+def _merge_frequencies(frequencies: List[TermFrequencies]) -> TermFrequencies:
+    if len(frequencies) == 1:
+        return frequencies[0]
+    return TermFrequencies.from_pairs(heapq.merge(*(item.items() for item in frequencies)))
+
+
+class RankedStoragePolicy(MmapStoragePolicy):
+    """
+    Сохранение слов ранжированного индекса на диск
+
+    Формат файла такой же, как у MmapStoragePolicy,
+    списки документов записаны ScoredPostings.to_bytes
+    """
+    magic = b"IIRK"
+    postings_class = ScoredPostings
+
+
+class CollectionStats:
+    """
+    Статистика набора документов для BM25
+
+    * doc_count - количество документов
+    * total_length - суммарная длина документов в словах
+    * doc_frequencies - слово -> количество документов со словом
+
+    Пример:
+        stats = CollectionStats.merge([shard.collection_stats(words) for shard in shards])
+        shard.top_k(words, 10, stats)
+    """
+    def __init__(self, doc_count: int, total_length: int, doc_frequencies: Dict[str, int]):
+        self.doc_count = doc_count
+        self.total_length = total_length
+        self.doc_frequencies = doc_frequencies
+
+    @property
+    def avg_length(self) -> float:
+        return self.total_length / self.doc_count if self.doc_count else 0.0
+
+    @classmethod
+    def merge(cls, stats: Iterable["CollectionStats"]):
+        """Статистика объединения непересекающихся наборов"""
+        doc_count = 0
+        total_length = 0
+        doc_frequencies = {}
+        for item in stats:
+            doc_count += item.doc_count
+            total_length += item.total_length
+            for word, frequency in item.doc_frequencies.items():
+                doc_frequencies[word] = doc_frequencies.get(word, 0) + frequency
+        return cls(doc_count, total_length, doc_frequencies)
+
+
+class _Cursor:
+    """
+    Курсор по ScoredPostings для block-max WAND
+
+    * weight - idf слова
+    * bound_weight - множитель максимумов блоков (idf, увеличенный,
+                     если средняя длина набора больше средней длины индекса)
+    * max_score - максимальный вклад слова в оценку документа
+    * doc - текущий документ (None - список закончился)
+    """
+    __slots__ = ("postings", "weight", "bound_weight", "max_score", "doc",
+                 "_block", "_docs", "_tfs", "_pos")
+
+    def __init__(self, postings: ScoredPostings, weight: float, bound_scale: float = 1.0):
+        self.postings = postings
+        self.weight = weight
+        self.bound_weight = weight * bound_scale
+        self.max_score = self.bound_weight * postings.max_score
+        self._block = -1
+        self._docs = []
+        self._tfs = []
+        self._pos = 0
+        self.doc = None
+        self.next_geq(0)
+
+    @property
+    def tf(self) -> int:
+        return self._tfs[self._pos]
+
+    def next_geq(self, target: int) -> None:
+        """Перемещает курсор к первому документу >= target"""
+        docs = self._docs
+        if docs and docs[-1] >= target:
+            if self.doc < target:
+                self._pos = bisect_left(docs, target, self._pos)
+                self.doc = docs[self._pos]
+            return
+
+        skip_last = self.postings._skip_last
+        block = bisect_left(skip_last, target, self._block + 1)
+        if block == len(skip_last):
+            self.doc = None
+            return
+        self._block = block
+        docs, self._tfs = self.postings.decode_block(block)
+        self._docs = docs
+        self._pos = bisect_left(docs, target)
+        self.doc = docs[self._pos]
+
+    def block_bound(self, target: int) -> Tuple[float, int]:
+        """
+        Граница вклада слова в документ target без раскодирования блоков
+
+        Returns: пара (максимальный вклад в блоке, где может быть target,
+                       последний документ этого блока)
+        """
+        skip_last = self.postings._skip_last
+        block = bisect_left(skip_last, target, max(self._block, 0))
+        if block == len(skip_last):
+            return 0.0, sys.maxsize
+        if self.postings._skip_docs[block] > target:
+            # target попал между блоками: слова в нем точно нет
+            return 0.0, self.postings._skip_docs[block] - 1
+        return self.bound_weight * self.postings._block_max[block], skip_last[block]
+
+
+class RankedIndex:
+    """
+    Ранжированный индекс: слово -> ScoredPostings и длины документов
+
+    Пример:
+        ranked = RankedIndex.build([(1, ["hello", "world"]), (2, ["hello"])])
+        ranked.top_k(["hello", "world"], k=10)  # [(1, 0.87), (2, 0.19)]
+    """
+    def __init__(self, word_to_postings, norms: DocumentNorms):
+        self.word_to_postings = word_to_postings
+        self.norms = norms
+
+    @classmethod
+    def build(cls, documents: Iterable[Tuple[int, List[str]]],
+              k1: float = K1, b: float = B):
+        """
+        Построение ранжированного индекса
+
+        Args:
+            documents: пары (идентификатор документа, слова документа)
+            k1, b: параметры BM25
+
+        Returns: RankedIndex
+        """
+        word_to_tfs = {}
+        lengths = {}
+        for doc_id, words in documents:
+            lengths[doc_id] = lengths.get(doc_id, 0) + len(words)
+            for word, tf in Counter(words).items():
+                word_to_tfs.setdefault(word, {})
+                tfs = word_to_tfs[word]
+                tfs[doc_id] = tfs.get(doc_id, 0) + tf
+
+        doc_ids = sorted(lengths)
+        norms = DocumentNorms(doc_ids, [lengths[doc_id] for doc_id in doc_ids], k1, b)
+        word_to_postings = {word: ScoredPostings.from_frequencies(sorted(tfs.items()), norms)
+                            for word, tfs in word_to_tfs.items()}
+        return cls(word_to_postings, norms)
+
+    def dump(self, filepath: str, encoding: str = "utf8") -> None:
+        """
+        Сохранение: слова в filepath, длины документов в filepath + NORMS_SUFFIX
+        """
+        RankedStoragePolicy(encoding).dump(self.word_to_postings, filepath)
+        self.norms.dump(filepath + NORMS_SUFFIX)
+
+    @classmethod
+    def load(cls, filepath: str, encoding: str = "utf8"):
+        """
+        Открытие сохраненного индекса через mmap
+
+        Returns: RankedIndex
+        """
+        return cls(RankedStoragePolicy(encoding).load(filepath),
+                   DocumentNorms.load(filepath + NORMS_SUFFIX))
+
+    def collection_stats(self, words: Iterable[str]) -> CollectionStats:
+        """Статистика индекса: количество и суммарная длина документов, частоты слов запроса"""
+        doc_frequencies = {}
+        for word in set(words):
+            postings = self.word_to_postings.get(word)
+            if postings is not None:
+                doc_frequencies[word] = len(postings)
+        return CollectionStats(len(self.norms), self.norms.total_length, doc_frequencies)
+
+    def _idf(self, word: str, postings: ScoredPostings,
+             stats: Optional[CollectionStats]) -> float:
+        if stats is None:
+            return idf(len(self.norms), len(postings))
+        return idf(stats.doc_count, stats.doc_frequencies.get(word, len(postings)))
+
+    def _norms(self, stats: Optional[CollectionStats]) -> DocumentNorms:
+        if stats is None:
+            return self.norms
+        return self.norms.with_avg_length(stats.avg_length)
+
+    def _cursors(self, words: Iterable[str],
+                 stats: Optional[CollectionStats] = None) -> List[_Cursor]:
+        bound_scale = 1.0
+        if stats is not None and self.norms.avg_length:
+            bound_scale = max(1.0, stats.avg_length / self.norms.avg_length)
+        cursors = []
+        for word in set(words):
+            try:
+                postings = self.word_to_postings[word]
+            except KeyError:
+                continue
+            cursor = _Cursor(postings, self._idf(word, postings, stats), bound_scale)
+            if cursor.doc is not None:
+                cursors.append(cursor)
+        return cursors
+
+    @staticmethod
+    def _score(doc_id: int, cursors: List[_Cursor], norms: DocumentNorms) -> float:
+        length = norms.length(doc_id)
+        # fsum не зависит от порядка курсоров, поэтому оценка документа
+        # одинакова при любой нумерации документов
+        return math.fsum(cursor.weight * norms.tf_score(cursor.tf, length)
+                         for cursor in cursors)
+
+    def top_k(self, words: Iterable[str], k: int,
+              stats: Optional[CollectionStats] = None,
+              doc_map=None) -> List[Tuple[int, float]]:
+        """
+        Лучшие k документов по BM25 (документ подходит,
+        если в нем есть хотя бы одно слово запроса)
+
+        Args:
+            words: слова запроса
+            k: количество документов
+            stats: статистика всего набора, если индекс - его часть
+                   (None - статистика самого индекса)
+            doc_map: исходные номера документов перенумерованного индекса
+                     (DocumentMap), ими документы упорядочиваются
+                     при равной оценке и возвращаются
+
+        Returns: пары (документ, оценка) по убыванию оценки,
+                 при равной оценке - по возрастанию документа
+        """
+        if k <= 0:
+            return []
+
+        cursors = self._cursors(words, stats)
+        norms = self._norms(stats)
+        # документы перебираются по возрастанию номеров индекса; у перенумерованного
+        # индекса документ с оценкой, равной порогу, еще может вытеснить худший
+        # из лучших меньшим исходным номером, поэтому равные порогу не отсекаются
+        ties = doc_map is not None
+        # min-куча из (оценка, -документ): на вершине худший из лучших
+        top = []
+        threshold = 0.0
+
+        while cursors:
+            cursors.sort(key=lambda cursor: cursor.doc)
+
+            # опорный документ: первый, на котором сумма максимумов превышает порог
+            upper_bound = 0.0
+            pivot = None
+            for i, cursor in enumerate(cursors):
+                upper_bound += cursor.max_score
+                if upper_bound > threshold or ties and upper_bound == threshold:
+                    pivot = i
+                    break
+            if pivot is None:
+                break
+            pivot_doc = cursors[pivot].doc
+            # все курсоры на опорном документе участвуют в его оценке
+            while pivot + 1 < len(cursors) and cursors[pivot + 1].doc == pivot_doc:
+                pivot += 1
+
+            # проверка по максимумам текущих блоков
+            block_bound = 0.0
+            next_doc = sys.maxsize
+            for cursor in cursors[:pivot + 1]:
+                bound, block_last = cursor.block_bound(pivot_doc)
+                block_bound += bound
+                next_doc = min(next_doc, block_last + 1)
+
+            if block_bound < threshold or not ties and block_bound == threshold:
+                # ни один документ до конца самого короткого блока не пройдет порог
+                if pivot + 1 < len(cursors):
+                    next_doc = min(next_doc, cursors[pivot + 1].doc)
+                for cursor in cursors[:pivot + 1]:
+                    cursor.next_geq(next_doc)
+            elif cursors[0].doc == pivot_doc:
+                matched = cursors[:pivot + 1]
+                score = self._score(pivot_doc, matched, norms)
+                item = (score, -(pivot_doc if doc_map is None else doc_map[pivot_doc]))
+                if len(top) < k:
+                    heapq.heappush(top, item)
+                elif item > top[0]:
+                    heapq.heapreplace(top, item)
+                if len(top) == k:
+                    threshold = top[0][0]
+                for cursor in matched:
+                    cursor.next_geq(pivot_doc + 1)
+            else:
+                # курсоры до опорного документа догоняют его
+                for cursor in cursors[:pivot]:
+                    if cursor.doc < pivot_doc:
+                        cursor.next_geq(pivot_doc)
+
+            cursors = [cursor for cursor in cursors if cursor.doc is not None]
+
+        return [(-neg_doc, score) for score, neg_doc in sorted(top, key=lambda x: (-x[0], -x[1]))]
+
+    def score_all(self, words: Iterable[str],
+                  stats: Optional[CollectionStats] = None) -> Dict[int, float]:
+        """
+        Оценки всех документов, в которых есть хотя бы одно слово запроса
+        (полный перебор, без отсечения)
+
+        Returns: словарь документ -> оценка
+        """
+        norms = self._norms(stats)
+        scores = {}
+        for word in set(words):
+            postings = self.word_to_postings.get(word)
+            if postings is None:
+                continue
+            weight = self._idf(word, postings, stats)
+            for doc_id, tf in postings.items():
+                score = weight * norms.tf_score(tf, norms.length(doc_id))
+                scores.setdefault(doc_id, []).append(score)
+        return {doc_id: math.fsum(doc_scores) for doc_id, doc_scores in scores.items()}
+
+    def close(self) -> None:
+        if hasattr(self.word_to_postings, "close"):
+            self.word_to_postings.close()
+
+
+def _document_norms(doc_ids: array, lengths: array, k1: float, b: float) -> DocumentNorms:
+    """Длины документов по возрастанию документов, длины повторяющихся складываются"""
+    if all(doc_ids[i] < doc_ids[i + 1] for i in range(len(doc_ids) - 1)):
+        return DocumentNorms(doc_ids, lengths, k1, b)
+
+    sorted_ids = array("Q")
+    sorted_lengths = array(_UINT32)
+    for i in sorted(range(len(doc_ids)), key=doc_ids.__getitem__):
+        if sorted_ids and sorted_ids[-1] == doc_ids[i]:
+            sorted_lengths[-1] += lengths[i]
+        else:
+            sorted_ids.append(doc_ids[i])
+            sorted_lengths.append(lengths[i])
+    return DocumentNorms(sorted_ids, sorted_lengths, k1, b)
+
+
+def build_ranked_index_on_disk(documents: Iterable[Tuple[int, List[str]]],
+                               filepath: str,
+                               memory_budget: Optional[int],
+                               encoding: str = "utf8",
+                               k1: float = K1, b: float = B) -> None:
+    """
+    Построение ранжированного индекса с ограниченной памятью (SPIMI)
+
+    Частоты слов копятся в частичном индексе и сбрасываются в run файл
+    при превышении бюджета. В памяти остаются только длины документов
+    (по 12 байт на документ, столько же занимает файл длин).
+    После прохода по документам runs сливаются, и списки с максимумами
+    блоков потоково пишутся в filepath, длины - в filepath + NORMS_SUFFIX
+
+    Args:
+        documents: пары (идентификатор документа, слова документа)
+        filepath: путь до файла ранжированного индекса
+        memory_budget: бюджет памяти под частичный индекс в байтах
+                       (None - сброс только в конце)
+        encoding: кодировка слов
+        k1, b: параметры BM25
+
+    Returns: None
+    """
+    if memory_budget is not None and memory_budget <= 0:
+        raise ValueError("memory budget must be positive")
+
+    doc_ids = array("Q")
+    lengths = array(_UINT32)
+    with SpimiRuns(TermFrequencies, _merge_frequencies, encoding) as runs:
+        word_to_tfs = {}
+        memory_used = 0
+        for doc_id, words in documents:
+            doc_ids.append(doc_id)
+            lengths.append(len(words))
+            for word, tf in Counter(words).items():
+                doc_tfs = word_to_tfs.get(word)
+                if doc_tfs is None:
+                    doc_tfs = word_to_tfs[word] = []
+                    memory_used += TERM_OVERHEAD + sys.getsizeof(word)
+                doc_tfs.append((doc_id, tf))
+                memory_used += TERM_OVERHEAD
+
+            if memory_budget is not None and memory_used >= memory_budget:
+                runs.write({word: TermFrequencies.from_pairs(doc_tfs)
+                            for word, doc_tfs in word_to_tfs.items()})
+                word_to_tfs = {}
+                memory_used = 0
+
+        runs.write({word: TermFrequencies.from_pairs(doc_tfs)
+                    for word, doc_tfs in word_to_tfs.items()})
+        word_to_tfs = None
+
+        norms = _document_norms(doc_ids, lengths, k1, b)
+        with RankedStoragePolicy(encoding).writer(filepath) as writer:
+            for key, frequencies in runs.items():
+                writer.add(key.decode(encoding),
+                           ScoredPostings.from_frequencies(frequencies.items(), norms))
+        norms.dump(filepath + NORMS_SUFFIX)
@@ -0,0 +1,320 @@
+"""
+Модуль, в котором реализована перенумерация документов индекса
+
+Номера документов в индексе совпадают с номерами из набора данных,
+поэтому документы с общими словами обычно стоят далеко друг от друга:
+разности между соседними номерами в списках большие и плохо сжимаются,
+а пересечение перепрыгивает через большее количество блоков.
+Если похожие документы получат соседние номера, списки станут
+"кучнее": разности уменьшатся (больше разностей займет один байт varint),
+и документы списков соберутся в меньшем количестве блоков
+
+Порядок документов строится по словам, которые встречаются
+хотя бы в двух документах, одним из методов:
+* bisection - рекурсивное разбиение графа документы-слова пополам
+  (graph bisection): документы обмениваются между половинами,
+  пока это уменьшает оценку размера разностей
+  sum(d * log2(n / (d + 1))) по словам обеих половин,
+  где d - количество документов половины со словом, n - размер половины
+* minhash - сортировка по MinHash сигнатурам множеств слов документов:
+  документы с похожими множествами слов получают близкие сигнатуры,
+  быстрее, но сжатие хуже
+
+Документы получают номера 1..N в новом порядке, исходные номера
+хранятся в DocumentMap рядом с индексом (путь индекса + DOC_MAP_SUFFIX),
+и индекс отвечает на запросы исходными номерами документов.
+Исходные номера записываются разностями с предыдущим в varint (zigzag),
+чтобы карта номеров не съедала выигрыш от перенумерации
+"""
+import math
+import mmap
+import struct
+import sys
+from array import array
+from collections import Counter
+from itertools import chain
+from typing import Dict
+from typing import Iterable
+from typing import List
+
+from positional import PositionalPostings
+from postings import CompressedPostings
+from postings import decode_varint
+from postings import encode_varint
+from ranking import DocumentNorms
+from ranking import RankedIndex
+from ranking import ScoredPostings
+
+DOC_MAP_SUFFIX = ".docmap"
+
+BISECTION = "bisection"
+MINHASH = "minhash"
+METHODS = (BISECTION, MINHASH)
+
+# итераций обмена документами на каждом уровне разбиения
+ITERATIONS = 8
+# части меньше этого размера не разбиваются
+MIN_PARTITION = 16
+# количество хэш функций MinHash
+MINHASH_COUNT = 4
+
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+class DocumentMap:
+    """
+    Исходные номера документов перенумерованного индекса
+
+    Документ с номером i в индексе (i = 1..N) имеет в наборе данных
+    номер external_ids[i - 1]
+
+    Пример:
+        doc_map = DocumentMap([7, 3, 5])
+        doc_map[1]  # 7
+        doc_map.external([1, 2])  # [3, 7]
+    """
+    magic = b"IIDM"
+    version = 2
+    header = struct.Struct("<4sHxxQ")
+
+    def __init__(self, external_ids):
+        self.external_ids = external_ids
+        self._mmap = None
+
+    def __len__(self) -> int:
+        return len(self.external_ids)
+
+    def __getitem__(self, doc_id: int) -> int:
+        if doc_id < 1:
+            raise IndexError(doc_id)
+        return self.external_ids[doc_id - 1]
+
+    def external(self, doc_ids: Iterable[int]) -> List[int]:
+        """Исходные номера документов по возрастанию"""
+        external_ids = self.external_ids
+        return sorted(external_ids[doc_id - 1] for doc_id in doc_ids)
+
+    def dump(self, filepath: str) -> None:
+        """
+        Сохранение на диск
+
+        Формат: заголовок (см. header), для каждого документа
+                varint(zigzag(исходный номер - исходный номер предыдущего))
+        """
+        out = bytearray()
+        previous = 0
+        for external_id in self.external_ids:
+            delta = external_id - previous
+            # zigzag: 0, -1, 1, -2, ... -> 0, 1, 2, 3, ...
+            encode_varint(2 * delta if delta >= 0 else -2 * delta - 1, out)
+            previous = external_id
+        with open(filepath, "wb") as f:
+            f.write(self.header.pack(self.magic, self.version, len(self.external_ids)))
+            f.write(out)
+
+    @classmethod
+    def load(cls, filepath: str):
+        """
+        Загрузка с диска, номера раскодируются в массив uint64
+
+        Файлы версии 1 (номера uint64 без сжатия) открываются через mmap
+        """
+        with open(filepath, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = cls.header.unpack_from(buffer)
+        if magic != cls.magic or version not in (1, cls.version):
+            buffer.close()
+            raise ValueError(f"{filepath} is not a document map")
+
+        if version == 1:
+            return cls._load_uint64(buffer, count)
+
+        external_ids = array("Q")
+        external_id = 0
+        pos = cls.header.size
+        for _ in range(count):
+            value, pos = decode_varint(buffer, pos)
+            external_id += value >> 1 if not value & 1 else -((value + 1) >> 1)
+            external_ids.append(external_id)
+        buffer.close()
+        return cls(external_ids)
+
+    @classmethod
+    def _load_uint64(cls, buffer, count: int):
+        view = memoryview(buffer)[cls.header.size:cls.header.size + 8 * count]
+        if sys.byteorder == "little":
+            doc_map = cls(view.cast("Q"))
+            doc_map._mmap = buffer
+            return doc_map
+        external_ids = array("Q", view.tobytes())
+        external_ids.byteswap()
+        view.release()
+        buffer.close()
+        return cls(external_ids)
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            if isinstance(self.external_ids, memoryview):
+                self.external_ids.release()
+            self._mmap.close()
+            self._mmap = None
+
+
+def _costs(size: int) -> List[float]:
+    """Оценка размера разностей слова d * log2(size / (d + 1)) для d = 0..size + 1"""
+    return [0.0] + [degree * math.log2(size / (degree + 1)) for degree in range(1, size + 2)]
+
+
+def _move_gains(from_degrees: Counter, to_degrees: Counter,
+                from_size: int, to_size: int) -> Dict[int, float]:
+    """
+    Уменьшение оценки размера для каждого слова при переносе
+    одного документа со словом из одной половины в другую
+    """
+    from_costs = _costs(from_size)
+    to_costs = _costs(to_size)
+    gains = {}
+    for term, degree in from_degrees.items():
+        other = to_degrees[term]
+        gains[term] = (from_costs[degree] + to_costs[other]
+                       - from_costs[degree - 1] - to_costs[other + 1])
+    return gains
+
+
+def _degrees(docs: List[int], doc_terms: List[List[int]]) -> Counter:
+    """Количество документов с каждым словом"""
+    return Counter(chain.from_iterable(doc_terms[doc] for doc in docs))
+
+
+def _bisect(docs: List[int], doc_terms: List[List[int]],
+            iterations: int, min_partition: int) -> List[int]:
+    if len(docs) < min_partition:
+        return docs
+
+    half = len(docs) // 2
+    left, right = docs[:half], docs[half:]
+    for _ in range(iterations):
+        left_degrees = _degrees(left, doc_terms)
+        right_degrees = _degrees(right, doc_terms)
+        to_right = _move_gains(left_degrees, right_degrees, len(left), len(right))
+        to_left = _move_gains(right_degrees, left_degrees, len(right), len(left))
+
+        left_gains = sorted(((sum(map(to_right.__getitem__, doc_terms[doc])), doc)
+                             for doc in left), reverse=True)
+        right_gains = sorted(((sum(map(to_left.__getitem__, doc_terms[doc])), doc)
+                              for doc in right), reverse=True)
+        moved = set()
+        for (left_gain, left_doc), (right_gain, right_doc) in zip(left_gains, right_gains):
+            if left_gain + right_gain <= 0:
+                break
+            moved.add(left_doc)
+            moved.add(right_doc)
+        if not moved:
+            break
+        left, right = ([doc for doc in right if doc in moved]
+                       + [doc for doc in left if doc not in moved],
+                       [doc for doc in left if doc in moved]
+                       + [doc for doc in right if doc not in moved])
+
+    return (_bisect(left, doc_terms, iterations, min_partition)
+            + _bisect(right, doc_terms, iterations, min_partition))
+
+
+def bisection_order(doc_terms: List[List[int]],
+                    iterations: int = ITERATIONS,
+                    min_partition: int = MIN_PARTITION) -> List[int]:
+    """
+    Порядок документов рекурсивным разбиением пополам
+
+    Args:
+        doc_terms: номера слов каждого документа
+        iterations: итераций обмена на каждом уровне
+        min_partition: части меньше этого размера не разбиваются
+
+    Returns: номера документов (индексы doc_terms) в новом порядке
+    """
+    return _bisect(list(range(len(doc_terms))), doc_terms, iterations, min_partition)
+
+
+def minhash_order(doc_terms: List[List[int]], hash_count: int = MINHASH_COUNT) -> List[int]:
+    """
+    Порядок документов по MinHash сигнатурам множеств слов
+
+    Args:
+        doc_terms: номера слов каждого документа
+        hash_count: количество хэш функций
+
+    Returns: номера документов (индексы doc_terms) в новом порядке
+    """
+    coefficients = [(2 * i + 1) * 0x9E3779B97F4A7C15 % _MERSENNE_PRIME for i in range(hash_count)]
+
+    def signature(doc):
+        terms = doc_terms[doc]
+        if not terms:
+            return ()
+        return tuple(min((a * (term + 1) + i) % _MERSENNE_PRIME for term in terms)
+                     for i, a in enumerate(coefficients))
+
+    return sorted(range(len(doc_terms)), key=signature)
+
+
+def document_order(word_to_docs_mapping, doc_ids: List[int],
+                   method: str = BISECTION, iterations: int = ITERATIONS) -> List[int]:
+    """
+    Новый порядок документов индекса
+
+    Args:
+        word_to_docs_mapping: инвертированный индекс
+        doc_ids: все документы индекса по возрастанию
+        method: "bisection" или "minhash"
+        iterations: итераций обмена на каждом уровне разбиения (для bisection)
+
+    Returns: документы в новом порядке
+    """
+    if method not in METHODS:
+        raise ValueError(f"unknown reordering method {method}, expected one of {METHODS}")
+
+    position = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+    doc_terms = [[] for _ in doc_ids]
+    term = 0
+    for docs in word_to_docs_mapping.values():
+        # слово одного документа не влияет на разности
+        if len(docs) < 2:
+            continue
+        for doc_id in docs:
+            doc_terms[position[doc_id]].append(term)
+        term += 1
+
+    if method == MINHASH:
+        order = minhash_order(doc_terms)
+    else:
+        order = bisection_order(doc_terms, iterations)
+    return [doc_ids[i] for i in order]
+
+
+def remap_postings(word_to_docs_mapping, new_ids: Dict[int, int]) -> Dict[str, CompressedPostings]:
+    """Списки документов с новыми номерами"""
+    return {word: CompressedPostings.from_sorted(sorted(new_ids[doc_id] for doc_id in docs))
+            for word, docs in word_to_docs_mapping.items()}
+
+
+def remap_positions(positional_mapping, new_ids: Dict[int, int]) -> Dict[str, PositionalPostings]:
+    """Позиционный индекс с новыми номерами документов"""
+    return {word: PositionalPostings.from_dict({new_ids[doc_id]: postings.positions(doc_id)
+                                                for doc_id in postings})
+            for word, postings in positional_mapping.items()}
+
+
+def remap_ranking(ranking: RankedIndex, new_ids: Dict[int, int]) -> RankedIndex:
+    """Ранжированный индекс с новыми номерами документов"""
+    norms = ranking.norms
+    lengths = sorted((new_ids[doc_id], length)
+                     for doc_id, length in zip(norms.doc_ids, norms.lengths))
+    new_norms = DocumentNorms([doc_id for doc_id, _ in lengths],
+                              [length for _, length in lengths],
+                              norms.k1, norms.b, norms.total_length)
+    word_to_postings = {}
+    for word, postings in ranking.word_to_postings.items():
+        doc_tfs = sorted((new_ids[doc_id], tf) for doc_id, tf in postings.items())
+        word_to_postings[word] = ScoredPostings.from_frequencies(doc_tfs, new_norms)
+    return RankedIndex(word_to_postings, new_norms)
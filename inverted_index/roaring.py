@@ -0,0 +1,334 @@
+"""
+Модуль, в котором реализованы гибридные списки документов в стиле Roaring bitmap
+
+Идентификаторы документов делятся на чанки по старшим 16 битам.
+Младшие 16 бит каждого чанка хранятся в одном из контейнеров:
+* array - отсортированный массив uint16, если документов в чанке
+  не больше ARRAY_LIMIT (редкие слова)
+* bitmap - битовая карта на 65536 бит (8192 байта), если документов
+  больше (частые слова)
+
+Пересечение двух bitmap контейнеров выполняется пословно (как AND
+больших целых чисел), array контейнер проверяется по bitmap за O(1)
+на элемент, поэтому пересечение частого слова с редким стоит
+пропорционально длине редкого
+"""
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Iterable
+from typing import List
+
+from postings import decode_varint
+from postings import encode_varint
+
+ARRAY_LIMIT = 4096
+BITMAP_BYTES = 1 << 13
+
+ARRAY_CONTAINER = 0
+BITMAP_CONTAINER = 1
+
+# номера установленных битов для каждого значения байта
+_BYTE_BITS = [[bit for bit in range(8) if value >> bit & 1] for value in range(256)]
+
+
+def _bitmap_to_array(bitmap: bytes) -> array:
+    result = array("H")
+    for i, value in enumerate(bitmap):
+        if value:
+            base = i << 3
+            result.extend(base + bit for bit in _BYTE_BITS[value])
+    return result
+
+
+def _array_to_bitmap(lows) -> bytes:
+    bitmap = bytearray(BITMAP_BYTES)
+    for low in lows:
+        bitmap[low >> 3] |= 1 << (low & 7)
+    return bytes(bitmap)
+
+
+def _make_container(lows: array):
+    if len(lows) > ARRAY_LIMIT:
+        return _array_to_bitmap(lows), len(lows)
+    return lows, len(lows)
+
+
+def _and_containers(first, first_count: int, second, second_count: int):
+    first_is_bitmap = isinstance(first, bytes)
+    second_is_bitmap = isinstance(second, bytes)
+
+    if first_is_bitmap and second_is_bitmap:
+        bits = int.from_bytes(first, "little") & int.from_bytes(second, "little")
+        count = bin(bits).count("1")
+        bitmap = bits.to_bytes(BITMAP_BYTES, "little")
+        if count > ARRAY_LIMIT:
+            return bitmap, count
+        return _bitmap_to_array(bitmap), count
+
+    if first_is_bitmap:
+        first, second = second, first
+
+    if isinstance(second, bytes):
+        lows = array("H", (low for low in first
+                           if second[low >> 3] >> (low & 7) & 1))
+        return lows, len(lows)
+
+    # оба контейнера - массивы: бинарный поиск элементов меньшего в большем
+    if first_count > second_count:
+        first, second = second, first
+    lows = array("H")
+    pos = 0
+    size = len(second)
+    for low in first:
+        pos = bisect_left(second, low, pos)
+        if pos == size:
+            break
+        if second[pos] == low:
+            lows.append(low)
+    return lows, len(lows)
+
+
+class RoaringPostings:
+    """
+    Отсортированный список идентификаторов документов в виде
+    гибридных array/bitmap контейнеров
+
+    * _keys - старшие 16 бит чанков по возрастанию
+    * _containers - старшие 16 бит -> (контейнер, количество документов)
+    * _length - общее количество документов
+    """
+    __slots__ = ("_keys", "_containers", "_length")
+
+    def __init__(self, keys=None, containers=None):
+        self._keys = keys if keys is not None else []
+        self._containers = containers if containers is not None else {}
+        self._length = sum(count for _, count in self._containers.values())
+
+    @classmethod
+    def from_sorted(cls, doc_ids: Iterable[int]):
+        """
+        Построение из отсортированного списка уникальных идентификаторов
+
+        Args:
+            doc_ids: идентификаторы документов по возрастанию без повторов
+
+        Returns: RoaringPostings
+        """
+        keys = []
+        containers = {}
+        lows = None
+        previous = None
+
+        for doc_id in doc_ids:
+            if previous is not None and doc_id <= previous:
+                raise ValueError("doc ids must be sorted and unique")
+            previous = doc_id
+
+            key = doc_id >> 16
+            if not keys or keys[-1] != key:
+                if lows is not None:
+                    containers[keys[-1]] = _make_container(lows)
+                keys.append(key)
+                lows = array("H")
+            lows.append(doc_id & 0xFFFF)
+
+        if lows is not None:
+            containers[keys[-1]] = _make_container(lows)
+
+        return cls(keys, containers)
+
+    @classmethod
+    def from_iterable(cls, doc_ids: Iterable[int]):
+        """
+        Построение из произвольного набора идентификаторов
+
+        Args:
+            doc_ids: идентификаторы документов в любом порядке
+
+        Returns: RoaringPostings
+        """
+        return cls.from_sorted(sorted(set(doc_ids)))
+
+    @property
+    def nbytes(self) -> int:
+        """Примерный объем памяти, занимаемый контейнерами"""
+        return sum(len(container) if isinstance(container, bytes)
+                   else container.itemsize * len(container)
+                   for container, _ in self._containers.values())
+
+    def bitmap_count(self) -> int:
+        """Количество bitmap контейнеров"""
+        return sum(isinstance(container, bytes)
+                   for container, _ in self._containers.values())
+
+    def to_bytes(self) -> bytes:
+        """
+        Сериализация
+
+        Формат: varint(количество контейнеров), затем для каждого контейнера
+                varint(разность старших бит с предыдущим контейнером),
+                varint(количество документов), тип контейнера (1 байт)
+                и данные: uint16 little endian для array
+                или BITMAP_BYTES байт для bitmap
+
+        Returns: байты
+        """
+        out = bytearray()
+        encode_varint(len(self._keys), out)
+
+        previous_key = 0
+        for key in self._keys:
+            container, count = self._containers[key]
+            encode_varint(key - previous_key, out)
+            encode_varint(count, out)
+            previous_key = key
+
+            if isinstance(container, bytes):
+                out.append(BITMAP_CONTAINER)
+                out += container
+            else:
+                out.append(ARRAY_CONTAINER)
+                if sys.byteorder != "little":
+                    container = array("H", container)
+                    container.byteswap()
+                out += container.tobytes()
+
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, buf):
+        """
+        Восстановление из байт, полученных методом to_bytes
+
+        Args:
+            buf: bytes, bytearray или memoryview
+
+        Returns: RoaringPostings
+        """
+        container_count, pos = decode_varint(buf, 0)
+
+        keys = []
+        containers = {}
+        key = 0
+        for _ in range(container_count):
+            delta, pos = decode_varint(buf, pos)
+            count, pos = decode_varint(buf, pos)
+            container_type = buf[pos]
+            pos += 1
+            key += delta
+
+            if container_type == BITMAP_CONTAINER:
+                container = bytes(buf[pos:pos + BITMAP_BYTES])
+                pos += BITMAP_BYTES
+            else:
+                container = array("H")
+                container.frombytes(buf[pos:pos + 2 * count])
+                if sys.byteorder != "little":
+                    container.byteswap()
+                pos += 2 * count
+
+            keys.append(key)
+            containers[key] = (container, count)
+
+        return cls(keys, containers)
+
+    def __and__(self, other):
+        """
+        Пересечение двух RoaringPostings по контейнерам
+
+        Returns: RoaringPostings
+        """
+        if not isinstance(other, RoaringPostings):
+            return NotImplemented
+        if len(self._keys) > len(other._keys):
+            self, other = other, self
+
+        keys = []
+        containers = {}
+        for key in self._keys:
+            other_container = other._containers.get(key)
+            if other_container is None:
+                continue
+            container, count = _and_containers(*self._containers[key], *other_container)
+            if count:
+                keys.append(key)
+                containers[key] = (container, count)
+
+        return RoaringPostings(keys, containers)
+
+    def filter_sorted(self, doc_ids: List[int]) -> List[int]:
+        """
+        Оставляет из doc_ids только документы, которые есть в списке
+
+        Args:
+            doc_ids: отсортированный список документов
+
+        Returns: отсортированный список документов
+        """
+        return self._select_sorted(doc_ids, present=True)
+
+    def exclude_sorted(self, doc_ids: Iterable[int]) -> List[int]:
+        """
+        Оставляет из doc_ids только документы, которых нет в списке
+
+        Args:
+            doc_ids: отсортированный список документов
+
+        Returns: отсортированный список документов
+        """
+        return self._select_sorted(doc_ids, present=False)
+
+    def _select_sorted(self, doc_ids: Iterable[int], present: bool) -> List[int]:
+        containers = self._containers
+        result = []
+        current_key = None
+        container = None
+
+        for doc_id in doc_ids:
+            key = doc_id >> 16
+            if key != current_key:
+                current_key = key
+                container = containers.get(key)
+                container = container[0] if container is not None else None
+            if container is None:
+                if not present:
+                    result.append(doc_id)
+                continue
+
+            low = doc_id & 0xFFFF
+            if isinstance(container, bytes):
+                found = container[low >> 3] >> (low & 7) & 1
+            else:
+                pos = bisect_left(container, low)
+                found = pos < len(container) and container[pos] == low
+            if found == present:
+                result.append(doc_id)
+
+        return result
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for key in self._keys:
+            container, _ = self._containers[key]
+            if isinstance(container, bytes):
+                container = _bitmap_to_array(container)
+            base = key << 16
+            for low in container:
+                yield base | low
+
+    def __contains__(self, doc_id):
+        return bool(self.filter_sorted([doc_id]))
+
+    def __eq__(self, other):
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({list(self)})"
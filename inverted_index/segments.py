@@ -0,0 +1,565 @@
+"""
+Модуль, в котором реализован инвертированный индекс с инкрементальными
+обновлениями: неизменяемые сегменты + битовые карты удаленных документов
+
+Индекс - это директория
+    manifest.json - список живых сегментов и настройки анализатора
+                    (перезаписывается атомарно)
+    <сегмент>.idx - инвертированный индекс сегмента (MmapStoragePolicy)
+    <сегмент>.docs - все документы сегмента (CompressedPostings.to_bytes)
+    <сегмент>.del-<номер> - удаленные документы (RoaringPostings.to_bytes)
+
+Добавление документов пишет новый небольшой сегмент, поэтому стоимость
+обновления пропорциональна размеру добавленных данных, а не всего корпуса.
+Документ с уже существующим идентификатором заменяет старый:
+в старом сегменте он помечается удаленным.
+Удаление документов только дописывает их в битовую карту сегмента.
+
+Запрос выполняется в каждом сегменте, удаленные документы отбрасываются,
+результаты сливаются. Чтоб сегментов не становилось слишком много,
+мелкие сегменты сливаются в один (по требованию или в фоновом потоке),
+удаленные документы при слиянии вычищаются
+"""
+import heapq
+import json
+import logging
+import os
+import threading
+from itertools import islice
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from analyzer import Analyzer
+from boolean_query import and_query
+from boolean_query import boolean_query
+from postings import CompressedPostings
+from postings import intersect
+from query_cache import QueryCache
+from roaring import RoaringPostings
+from spimi import SpimiIndexBuilder
+from spimi import merge_items
+from storage_policy import MmapStoragePolicy
+from term_dictionary import is_wildcard
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def _write_bytes(filepath: str, data: bytes) -> None:
+    with open(filepath, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _remove(filepath: str) -> None:
+    try:
+        os.remove(filepath)
+    except OSError as e:
+        logger.warning("can't remove %s: %s", filepath, e)
+
+
+class Segment:
+    """
+    Неизменяемый сегмент индекса
+
+    * name - имя сегмента (префикс его файлов)
+    * word_to_docs - ленивый словарь слово -> список документов
+    * doc_ids - все документы сегмента, включая удаленные
+    * deleted - удаленные документы
+    * deletes_file - имя файла с удаленными документами (None - удалений нет)
+    """
+    def __init__(self, name: str, word_to_docs, doc_ids: CompressedPostings,
+                 deleted: RoaringPostings, deletes_file: Optional[str] = None):
+        self.name = name
+        self.word_to_docs = word_to_docs
+        self.doc_ids = doc_ids
+        self.deleted = deleted
+        self.deletes_file = deletes_file
+
+    @classmethod
+    def open(cls, directory: str, name: str, storage_policy,
+             deletes_file: Optional[str] = None):
+        """
+        Открытие сегмента с диска
+
+        Args:
+            directory: директория индекса
+            name: имя сегмента
+            storage_policy: политика хранения сегмента
+            deletes_file: имя файла с удаленными документами
+
+        Returns: Segment
+        """
+        word_to_docs = storage_policy.load(os.path.join(directory, name + ".idx"))
+
+        with open(os.path.join(directory, name + ".docs"), "rb") as f:
+            doc_ids = CompressedPostings.from_bytes(f.read())
+
+        if deletes_file is not None:
+            with open(os.path.join(directory, deletes_file), "rb") as f:
+                deleted = RoaringPostings.from_bytes(f.read())
+        else:
+            deleted = RoaringPostings()
+
+        return cls(name, word_to_docs, doc_ids, deleted, deletes_file)
+
+    @property
+    def live_count(self) -> int:
+        """Количество неудаленных документов"""
+        return len(self.doc_ids) - len(self.deleted)
+
+    def query(self, words: Iterable[str], limit: Optional[int] = None) -> List[int]:
+        """
+        Неудаленные документы сегмента, в которых есть все слова
+
+        Args:
+            words: слова запроса
+            limit: вернуть не больше limit первых документов
+
+        Returns: отсортированный список документов
+        """
+        if limit is None and not any(is_wildcard(word) for word in words):
+            postings_lists = []
+            for word in words:
+                try:
+                    postings_lists.append(self.word_to_docs[word])
+                except KeyError:
+                    return []
+            return self._live(intersect(postings_lists))
+
+        if limit is None:
+            return self._live(and_query(self.word_to_docs, words))
+
+        # удаленные документы отбрасываются после выполнения запроса,
+        # поэтому их может понадобиться на len(self.deleted) больше
+        return self._live(and_query(self.word_to_docs, words,
+                                    limit + len(self.deleted)))[:limit]
+
+    def search(self, text: str, limit: Optional[int] = None,
+               analyzer: Optional[Analyzer] = None) -> List[int]:
+        """
+        Булев запрос к неудаленным документам сегмента
+
+        Args:
+            text: текст запроса (см. модуль boolean_query)
+            limit: вернуть не больше limit первых документов
+            analyzer: анализатор слов запроса
+
+        Returns: отсортированный список документов
+        """
+        if limit is None:
+            return self._live(boolean_query(self.word_to_docs, text, analyzer=analyzer))
+        return self._live(boolean_query(self.word_to_docs, text,
+                                        limit + len(self.deleted),
+                                        analyzer=analyzer))[:limit]
+
+    def _live(self, doc_ids: List[int]) -> List[int]:
+        if doc_ids and len(self.deleted):
+            doc_ids = self.deleted.exclude_sorted(doc_ids)
+        return doc_ids
+
+    def live_items(self, deleted: RoaringPostings) -> Iterator[Tuple[bytes, list]]:
+        """
+        Слова сегмента со списками документов без удаленных
+
+        Args:
+            deleted: удаленные документы
+
+        Returns: генератор пар (слово в байтах, список документов)
+                 по возрастанию слов, слова без документов пропускаются
+        """
+        for key, postings in self.word_to_docs.raw_items():
+            if len(deleted):
+                postings = deleted.exclude_sorted(postings)
+                if not postings:
+                    continue
+            yield key, postings
+
+    def to_json(self) -> dict:
+        return {"name": self.name, "deletes": self.deletes_file}
+
+
+class SegmentedInvertedIndex:
+    """
+    Инвертированный индекс из неизменяемых сегментов
+
+    * directory - директория индекса
+    * storage_policy - политика хранения сегментов, поддерживающая
+                       потоковую запись (MmapStoragePolicy или RoaringStoragePolicy)
+    * max_segments - после добавления документов сегменты сливаются,
+                     пока их не станет не больше max_segments
+    * background_merge - сливать сегменты в фоновом потоке
+    * cache - кэш результатов запросов, сбрасывается при каждом изменении
+    * analyzer - анализатор, которым получены слова документов,
+                 им же анализируются запросы, сохраняется в манифесте
+
+    Пример:
+        index = SegmentedInvertedIndex("index_dir")
+        index.add_documents([(1, ["hello", "world"]), (2, ["hello"])])
+        index.delete_documents([2])
+        index.query(["hello"])  # [1]
+    """
+    def __init__(self, directory: str, storage_policy=None, max_segments: int = 8,
+                 background_merge: bool = False, cache: Optional[QueryCache] = None,
+                 analyzer: Optional[Analyzer] = None):
+        if storage_policy is None:
+            storage_policy = MmapStoragePolicy(encoding="utf8")
+        if not hasattr(storage_policy, "writer"):
+            raise ValueError(f"storage policy {storage_policy.__class__.__name__} "
+                             f"does not support streaming build")
+        if max_segments < 1:
+            raise ValueError("max_segments must be positive")
+
+        self.directory = directory
+        self.storage_policy = storage_policy
+        self.max_segments = max_segments
+        self.background_merge = background_merge
+        self.cache = cache
+
+        # _lock защищает список сегментов и манифест,
+        # _merge_lock не дает выполняться двум слияниям одновременно
+        self._lock = threading.RLock()
+        self._merge_lock = threading.Lock()
+        self._merge_thread = None
+
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") != MANIFEST_VERSION:
+                raise ValueError(f"{directory} has unsupported manifest version")
+            stored = Analyzer.from_dict(manifest.get("analyzer", {}))
+            if analyzer is not None and analyzer != stored:
+                raise ValueError(f"{directory} was built with {stored!r}")
+            self.analyzer = stored
+            self._next_id = manifest["next_id"]
+            self.segments = [Segment.open(directory, segment["name"], storage_policy,
+                                          segment["deletes"])
+                             for segment in manifest["segments"]]
+        else:
+            self.analyzer = analyzer if analyzer is not None else Analyzer()
+            self._next_id = 0
+            self.segments = []
+            self._write_manifest()
+
+    def _new_name(self, prefix: str) -> str:
+        """Уникальное в пределах индекса имя файла"""
+        with self._lock:
+            name = f"{prefix}-{self._next_id:06d}"
+            self._next_id += 1
+        return name
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _write_manifest(self) -> None:
+        """Атомарная замена манифеста: запись во временный файл и os.replace"""
+        manifest = {"version": MANIFEST_VERSION,
+                    "next_id": self._next_id,
+                    "analyzer": self.analyzer.to_dict(),
+                    "segments": [segment.to_json() for segment in self.segments]}
+        tmp_path = self._path(MANIFEST + ".tmp")
+        _write_bytes(tmp_path, json.dumps(manifest).encode("utf8"))
+        os.replace(tmp_path, self._path(MANIFEST))
+
+    def _changed(self) -> None:
+        if self.cache is not None:
+            self.cache.clear()
+
+    def __len__(self) -> int:
+        """Количество неудаленных документов"""
+        return sum(segment.live_count for segment in self.segments)
+
+    def query(self, words: list, limit: Optional[int] = None) -> list:
+        """
+        Возвращает список документов, в которых есть все слова запроса
+
+        Args:
+            words: список со словами
+            limit: вернуть не больше limit первых документов
+
+        Returns: отсортированный список с документами
+        """
+        key = frozenset(self.analyzer.analyze_words(words))
+        if not key:
+            return []
+        if limit is not None:
+            results = [segment.query(key, limit) for segment in self.segments]
+            return list(islice(heapq.merge(*results), limit))
+
+        if self.cache is not None:
+            doc_ids = self.cache.get(key)
+            if doc_ids is not None:
+                self.cache.hits += 1
+                return doc_ids
+            self.cache.misses += 1
+
+        # снимок списка сегментов: слияние может заменить его во время запроса
+        segments = self.segments
+        results = [segment.query(key) for segment in segments]
+        results = [doc_ids for doc_ids in results if doc_ids]
+        if len(results) == 1:
+            doc_ids = results[0]
+        else:
+            # после замены документа он жив только в одном сегменте
+            doc_ids = list(heapq.merge(*results))
+
+        if self.cache is not None and segments is self.segments:
+            self.cache.put(key, doc_ids)
+        return doc_ids
+
+    def search(self, text: str, limit: Optional[int] = None) -> list:
+        """
+        Булев запрос с операторами AND, OR, NOT и скобками
+        (см. модуль boolean_query)
+
+        Args:
+            text: текст запроса
+            limit: вернуть не больше limit первых документов
+
+        Returns: отсортированный список с документами
+        """
+        results = [segment.search(text, limit, self.analyzer) for segment in self.segments]
+        return list(islice(heapq.merge(*results), limit))
+
+    def add_documents(self, documents: Iterable[Tuple[int, Iterable[str]]],
+                      memory_budget: Optional[int] = None) -> Optional[str]:
+        """
+        Добавление документов новым сегментом
+
+        Документы с уже существующими идентификаторами заменяют старые
+
+        Args:
+            documents: пары (идентификатор документа, слова документа),
+                       слова уже обработаны анализатором индекса
+            memory_budget: бюджет памяти на построение сегмента в байтах
+                           (None - без ограничения)
+
+        Returns: имя нового сегмента или None, если документов нет
+        """
+        name = self._new_name("segment")
+        doc_ids = set()
+
+        with SpimiIndexBuilder(memory_budget, encoding=self.storage_policy.encoding,
+                               tmp_dir=self.directory) as builder:
+            for doc_id, words in documents:
+                doc_ids.add(doc_id)
+                builder.add_document(doc_id, words)
+            if not doc_ids:
+                return None
+
+            with self.storage_policy.writer(self._path(name + ".idx")) as writer:
+                builder.write(writer)
+
+        doc_ids = CompressedPostings.from_iterable(doc_ids)
+        _write_bytes(self._path(name + ".docs"), doc_ids.to_bytes())
+        segment = Segment.open(self.directory, name, self.storage_policy)
+
+        with self._lock:
+            obsolete = self._delete(list(doc_ids))
+            self.segments = self.segments + [segment]
+            self._write_manifest()
+            self._changed()
+        for filepath in obsolete:
+            _remove(filepath)
+
+        logger.debug("added segment %s with %d documents", name, len(doc_ids))
+
+        if len(self.segments) > self.max_segments:
+            if self.background_merge:
+                self.merge_in_background()
+            else:
+                self.maybe_merge()
+
+        return name
+
+    def delete_documents(self, doc_ids: Iterable[int]) -> None:
+        """
+        Удаление документов
+
+        Args:
+            doc_ids: идентификаторы документов (несуществующие игнорируются)
+        """
+        doc_ids = sorted(set(doc_ids))
+        with self._lock:
+            obsolete = self._delete(doc_ids)
+            self._write_manifest()
+            self._changed()
+        for filepath in obsolete:
+            _remove(filepath)
+
+    def _delete(self, doc_ids: List[int]) -> List[str]:
+        """
+        Добавляет документы в битовые карты удаленных тех сегментов,
+        где они есть, манифест не перезаписывает
+
+        Вызывается под _lock
+
+        Returns: пути до устаревших файлов удаленных документов,
+                 их можно удалить после записи манифеста
+        """
+        obsolete = []
+        segments = []
+        for segment in self.segments:
+            present = segment.doc_ids.filter_sorted(doc_ids)
+            new_deleted = segment.deleted.exclude_sorted(present)
+            if new_deleted:
+                if segment.deletes_file is not None:
+                    obsolete.append(self._path(segment.deletes_file))
+                segment = self._with_deleted(segment, new_deleted)
+            segments.append(segment)
+        self.segments = segments
+        return obsolete
+
+    def _with_deleted(self, segment: Segment, doc_ids: List[int]) -> Segment:
+        """
+        Новый объект сегмента с дополнительными удаленными документами,
+        битовая карта удаленных записывается в новый файл
+
+        Объекты сегментов не меняются, чтоб выполняющиеся
+        в других потоках запросы видели согласованное состояние
+        """
+        deleted = RoaringPostings.from_sorted(heapq.merge(segment.deleted, doc_ids))
+        deletes_file = self._new_name(segment.name + ".del")
+        _write_bytes(self._path(deletes_file), deleted.to_bytes())
+
+        return Segment(segment.name, segment.word_to_docs, segment.doc_ids,
+                       deleted, deletes_file)
+
+    def _merge_candidates(self) -> List[Segment]:
+        """
+        Сегменты для слияния: самые маленькие по количеству
+        неудаленных документов, столько, чтоб после слияния
+        сегментов осталось max_segments
+        """
+        excess = len(self.segments) - self.max_segments
+        if excess <= 0:
+            return []
+        return sorted(self.segments, key=lambda segment: segment.live_count)[:excess + 1]
+
+    def maybe_merge(self) -> bool:
+        """
+        Слияние, если сегментов больше max_segments
+
+        Returns: было ли выполнено слияние
+        """
+        with self._lock:
+            candidates = self._merge_candidates()
+        if not candidates:
+            return False
+        self.merge([segment.name for segment in candidates])
+        return True
+
+    def merge(self, names: Optional[List[str]] = None) -> Optional[str]:
+        """
+        Слияние сегментов в один, удаленные документы вычищаются
+
+        Запросы, добавления и удаления во время слияния не блокируются.
+        Документы, удаленные из сливаемых сегментов во время слияния,
+        помечаются удаленными в новом сегменте
+
+        Args:
+            names: имена сливаемых сегментов (None - все сегменты)
+
+        Returns: имя нового сегмента или None, если сливать нечего
+        """
+        with self._merge_lock:
+            with self._lock:
+                if names is None:
+                    sources = list(self.segments)
+                else:
+                    names = set(names)
+                    sources = [segment for segment in self.segments
+                               if segment.name in names]
+            if not sources:
+                return None
+
+            name = self._new_name("segment")
+            # снимок удаленных документов на момент начала слияния
+            snapshot = {segment.name: segment.deleted for segment in sources}
+
+            streams = [segment.live_items(segment.deleted) for segment in sources]
+            with self.storage_policy.writer(self._path(name + ".idx")) as writer:
+                for key, postings in merge_items(streams):
+                    writer.add(key.decode(self.storage_policy.encoding), postings)
+
+            doc_ids = CompressedPostings.from_sorted(heapq.merge(
+                *(segment.deleted.exclude_sorted(segment.doc_ids) for segment in sources)))
+            _write_bytes(self._path(name + ".docs"), doc_ids.to_bytes())
+            merged = Segment.open(self.directory, name, self.storage_policy)
+
+            with self._lock:
+                current = {segment.name: segment for segment in self.segments}
+                late_deleted = []
+                for source in sources:
+                    late_deleted.extend(current[source.name].deleted
+                                        .exclude_sorted(snapshot[source.name]))
+                if late_deleted:
+                    merged = self._with_deleted(merged, sorted(late_deleted))
+
+                obsolete = []
+                for source in sources:
+                    segment = current[source.name]
+                    obsolete.append(self._path(segment.name + ".idx"))
+                    obsolete.append(self._path(segment.name + ".docs"))
+                    if segment.deletes_file is not None:
+                        obsolete.append(self._path(segment.deletes_file))
+
+                self.segments = [segment for segment in self.segments
+                                 if segment.name not in snapshot] + [merged]
+                self._write_manifest()
+                self._changed()
+
+        # файлы, открытые через mmap, остаются доступны выполняющимся запросам
+        for filepath in obsolete:
+            _remove(filepath)
+
+        logger.debug("merged %d segments into %s with %d documents",
+                     len(sources), name, merged.live_count)
+        return name
+
+    def merge_in_background(self) -> threading.Thread:
+        """
+        Запуск maybe_merge в фоновом потоке
+
+        Если фоновое слияние уже идет, новое не запускается
+
+        Returns: поток слияния
+        """
+        with self._lock:
+            if self._merge_thread is None or not self._merge_thread.is_alive():
+                self._merge_thread = threading.Thread(target=self._merge_until_bounded,
+                                                      daemon=True)
+                self._merge_thread.start()
+            return self._merge_thread
+
+    def _merge_until_bounded(self) -> None:
+        while self.maybe_merge():
+            pass
+
+    def wait_for_merge(self) -> None:
+        """Ожидание окончания фонового слияния"""
+        thread = self._merge_thread
+        if thread is not None:
+            thread.join()
+
+    def close(self) -> None:
+        """Дожидается фонового слияния и закрывает файлы сегментов"""
+        self.wait_for_merge()
+        with self._lock:
+            for segment in self.segments:
+                segment.word_to_docs.close()
+            self.segments = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,372 @@
+"""
+Модуль, в котором реализован индекс из нескольких шардов
+с распределенным (scatter-gather) выполнением запросов
+
+Документы делятся на шарды по идентификатору:
+    hash  - номер шарда = doc_id % количество шардов
+    range - непрерывные диапазоны идентификаторов примерно
+            одинакового размера, границы хранятся в манифесте
+
+Индекс - это директория
+    shards.json - манифест: способ деления и список шардов
+    shard-<номер> - обычный инвертированный индекс шарда
+                    (со всеми файлами рядом, см. InvertedIndex.dump)
+
+Запрос рассылается процессам-исполнителям, каждый держит открытыми
+свои шарды (шард i у исполнителя i % workers), выполняет на них запрос
+и сливает ответы, затем ответы исполнителей сливаются еще раз.
+Количество шардов задается при построении, количество исполнителей -
+при открытии индекса, они друг от друга не зависят.
+
+Ранжированный запрос выполняется в два прохода: сначала со всех шардов
+собирается статистика (количество документов, суммарная длина,
+количество документов со словами запроса), затем шарды оценивают
+документы по статистике всего индекса. Так оценки разных шардов
+сравнимы и совпадают с оценками индекса без шардов
+"""
+import asyncio
+import heapq
+import json
+import os
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Callable
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+from query_cache import QueryCache
+from ranking import CollectionStats
+
+MANIFEST = "shards.json"
+MANIFEST_VERSION = 1
+
+HASH = "hash"
+RANGE = "range"
+PARTITIONS = (HASH, RANGE)
+
+
+def is_sharded_index(path: str) -> bool:
+    """Является ли путь директорией индекса из шардов"""
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def shard_name(shard: int) -> str:
+    """Имя шарда по номеру"""
+    return f"shard-{shard:03d}"
+
+
+class Partition:
+    """
+    Деление документов на шарды
+
+    * kind - HASH или RANGE
+    * shards - количество шардов
+    * bounds - для RANGE: первый идентификатор каждого шарда, кроме нулевого
+    """
+    def __init__(self, kind: str, shards: int, bounds: Optional[List[int]] = None):
+        if kind not in PARTITIONS:
+            raise ValueError(f"unknown partition {kind!r}")
+        if shards < 1:
+            raise ValueError("number of shards must be positive")
+        if kind == RANGE and (bounds is None or len(bounds) != shards - 1):
+            raise ValueError("range partition needs shards - 1 bounds")
+
+        self.kind = kind
+        self.shards = shards
+        self.bounds = bounds
+
+    @classmethod
+    def from_doc_ids(cls, kind: str, shards: int, doc_ids: Iterable[int]):
+        """
+        Деление по известным идентификаторам документов
+
+        Для RANGE границы выбираются так, чтоб в шардах было
+        примерно поровну документов
+
+        Args:
+            kind: HASH или RANGE
+            shards: количество шардов
+            doc_ids: идентификаторы всех документов (нужны только для RANGE)
+
+        Returns: Partition
+        """
+        if kind != RANGE:
+            return cls(kind, shards)
+        doc_ids = sorted(doc_ids)
+        bounds = [doc_ids[len(doc_ids) * shard // shards] if doc_ids else 0
+                  for shard in range(1, shards)]
+        return cls(kind, shards, bounds)
+
+    def __call__(self, doc_id: int) -> int:
+        """Номер шарда документа"""
+        if self.kind == HASH:
+            return doc_id % self.shards
+        return bisect_right(self.bounds, doc_id)
+
+    def to_json(self) -> dict:
+        return {"partition": self.kind, "shards": self.shards, "bounds": self.bounds}
+
+    @classmethod
+    def from_json(cls, data: dict):
+        return cls(data["partition"], data["shards"], data.get("bounds"))
+
+
+def write_manifest(directory: str, partition: Partition) -> None:
+    """
+    Запись манифеста индекса из шардов
+
+    Args:
+        directory: директория индекса
+        partition: деление документов на шарды
+    """
+    manifest = dict(partition.to_json(),
+                    version=MANIFEST_VERSION,
+                    names=[shard_name(shard) for shard in range(partition.shards)])
+    tmp_path = os.path.join(directory, MANIFEST + ".tmp")
+    with open(tmp_path, "w", encoding="utf8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(directory, MANIFEST))
+
+
+def read_manifest(directory: str) -> tuple:
+    """
+    Чтение манифеста индекса из шардов
+
+    Args:
+        directory: директория индекса
+
+    Returns: (Partition, пути до шардов)
+    """
+    with open(os.path.join(directory, MANIFEST), encoding="utf8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"{directory} has unsupported manifest version")
+    paths = [os.path.join(directory, name) for name in manifest["names"]]
+    return Partition.from_json(manifest), paths
+
+
+def merge_doc_ids(results: Iterable[List[int]], limit: Optional[int] = None) -> List[int]:
+    """Слияние отсортированных ответов шардов (документ живет в одном шарде)"""
+    return list(islice(heapq.merge(*results), limit))
+
+
+def merge_top_k(results: Iterable[list], k: int) -> list:
+    """Слияние ответов top-k шардов: пары (документ, оценка) по убыванию оценки"""
+    return heapq.nsmallest(k, (item for result in results for item in result),
+                           key=lambda item: (-item[1], item[0]))
+
+
+def _merge(method: str, args: tuple, results: list):
+    """Слияние ответов шардов или исполнителей на запрос method с аргументами args"""
+    if method == "collection_stats":
+        return CollectionStats.merge(results)
+    if method == "top_k":
+        return merge_top_k(results, args[1])
+    return merge_doc_ids(results, args[-1])
+
+
+# шарды, открытые в процессе-исполнителе
+_worker_shards = []
+
+
+def _init_worker(paths: List[str], open_shard: Callable) -> None:
+    global _worker_shards
+    _worker_shards = [open_shard(path) for path in paths]
+
+
+def _run_on_shards(shards: list, method: str, args: tuple):
+    """
+    Выполнение запроса на шардах и слияние ответов
+
+    Args:
+        shards: открытые шарды
+        method: "query", "search", "fuzzy_query", "collection_stats" или "top_k"
+        args: аргументы метода (у запросов документов последний - limit,
+              у top_k второй - k)
+
+    Returns: слитый ответ
+    """
+    return _merge(method, args, [getattr(shard, method)(*args) for shard in shards])
+
+
+def _run_in_worker(method: str, args: tuple):
+    return _run_on_shards(_worker_shards, method, args)
+
+
+def _worker_ready() -> None:
+    """Пустая задача, которой процесс-исполнитель запускается заранее"""
+
+
+class ShardedInvertedIndex:
+    """
+    Инвертированный индекс из шардов с выполнением запросов
+    в процессах-исполнителях
+
+    * directory - директория индекса
+    * partition - деление документов на шарды
+    * workers - количество процессов-исполнителей
+                (0 - шарды открываются и опрашиваются в текущем процессе)
+    * cache - кэш результатов запросов без limit
+
+    Пример:
+        index = ShardedInvertedIndex("index_dir",
+                                     partial(InvertedIndex.load, storage_policy=policy))
+        index.query(["hello", "world"])
+        index.close()
+    """
+    def __init__(self, directory: str, open_shard: Callable,
+                 workers: Optional[int] = None, cache: Optional[QueryCache] = None):
+        """
+        Args:
+            directory: директория индекса
+            open_shard: функция путь до шарда -> индекс с методами
+                        query, search, collection_stats и top_k
+                        (например InvertedIndex.load с заданной политикой
+                        хранения), должна сериализоваться pickle
+                        для передачи исполнителям
+            workers: количество процессов-исполнителей
+                     (None - по процессу на шард, но не больше шардов)
+            cache: кэш результатов запросов
+        """
+        self.directory = directory
+        self.partition, paths = read_manifest(directory)
+        self.cache = cache
+
+        if workers is None:
+            workers = len(paths)
+        self.workers = min(workers, len(paths))
+        if self.workers < 0:
+            raise ValueError("number of workers must not be negative")
+
+        self._shards = []
+        self._executors = []
+        if self.workers == 0:
+            self._shards = [open_shard(path) for path in paths]
+        else:
+            for worker in range(self.workers):
+                self._executors.append(
+                    ProcessPoolExecutor(max_workers=1,
+                                        initializer=_init_worker,
+                                        initargs=(paths[worker::self.workers], open_shard)))
+            # процессы запускаются при первой задаче; если это случится во время
+            # обработки соединения сервером, исполнители унаследуют сокеты
+            # клиента и сервера, и клиент не дождется закрытия соединения
+            try:
+                for future in [executor.submit(_worker_ready) for executor in self._executors]:
+                    future.result()
+            except BaseException:
+                self.close()
+                raise
+
+    def _scatter(self, method: str, args: tuple) -> list:
+        """Рассылка запроса исполнителям, возвращает futures"""
+        return [executor.submit(_run_in_worker, method, args)
+                for executor in self._executors]
+
+    def _run(self, method: str, args: tuple):
+        if not self._executors:
+            return _run_on_shards(self._shards, method, args)
+        futures = self._scatter(method, args)
+        return _merge(method, args, [future.result() for future in futures])
+
+    async def _run_async(self, method: str, args: tuple):
+        if not self._executors:
+            return _run_on_shards(self._shards, method, args)
+        futures = [asyncio.wrap_future(future) for future in self._scatter(method, args)]
+        return _merge(method, args, await asyncio.gather(*futures))
+
+    def query(self, words: list, limit: Optional[int] = None) -> list:
+        """
+        Возвращает список документов, в которых есть все слова запроса
+
+        Args:
+            words: список со словами
+            limit: вернуть не больше limit первых документов
+
+        Returns: отсортированный список с документами
+        """
+        if limit is not None or self.cache is None:
+            return self._run("query", (list(words), limit))
+
+        key = frozenset(words)
+        doc_ids = self.cache.get(key)
+        if doc_ids is not None:
+            self.cache.hits += 1
+            return doc_ids
+        self.cache.misses += 1
+        doc_ids = self._run("query", (list(words), None))
+        self.cache.put(key, doc_ids)
+        return doc_ids
+
+    async def query_async(self, words: list, limit: Optional[int] = None) -> list:
+        """
+        То же, что query, но не блокирует цикл событий asyncio
+        на время выполнения запроса исполнителями
+        """
+        if limit is not None or self.cache is None:
+            return await self._run_async("query", (list(words), limit))
+
+        key = frozenset(words)
+        doc_ids = self.cache.get(key)
+        if doc_ids is not None:
+            self.cache.hits += 1
+            return doc_ids
+        self.cache.misses += 1
+        doc_ids = await self._run_async("query", (list(words), None))
+        self.cache.put(key, doc_ids)
+        return doc_ids
+
+    def search(self, text: str, limit: Optional[int] = None) -> list:
+        """
+        Булев запрос (см. модуль boolean_query)
+
+        Args:
+            text: текст запроса
+            limit: вернуть не больше limit первых документов
+
+        Returns: отсортированный список с документами
+        """
+        return self._run("search", (text, limit))
+
+    def top_k(self, words: list, k: int) -> list:
+        """
+        Лучшие k документов по BM25 (idf и средняя длина документа
+        по статистике всех шардов)
+
+        Args:
+            words: список со словами
+            k: количество документов
+
+        Returns: пары (документ, оценка) по убыванию оценки
+        """
+        words = list(words)
+        stats = self._run("collection_stats", (words,))
+        return self._run("top_k", (words, k, stats))
+
+    def fuzzy_query(self, words: list, max_distance: int, limit: Optional[int] = None) -> list:
+        """
+        Запрос с опечатками (см. InvertedIndex.fuzzy_query), близкие слова
+        ищутся в словаре каждого шарда
+
+        Args:
+            words: список со словами
+            max_distance: максимальное расстояние Левенштейна
+            limit: вернуть не больше limit первых документов
+
+        Returns: отсортированный список с документами
+        """
+        return self._run("fuzzy_query", (list(words), max_distance, limit))
+
+    def close(self) -> None:
+        """Остановка процессов-исполнителей"""
+        for executor in self._executors:
+            executor.shutdown()
+        self._executors = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
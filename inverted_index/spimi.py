@@ -0,0 +1,327 @@
+"""
+Модуль, в котором реализовано построение инвертированного индекса
+для данных, не помещающихся в оперативную память (SPIMI)
+
+Документы обрабатываются потоком, частичный индекс копится в памяти,
+пока его примерный размер не превысит заданный бюджет.
+После этого частичный индекс сортируется и сбрасывается во временный
+файл (run). В конце все runs сливаются k-way слиянием и потоково
+записываются в итоговый индекс, поэтому пиковое потребление памяти
+ограничено бюджетом и не зависит от размера набора данных
+
+Формат run файла: подряд записи
+    varint(длина слова в байтах), слово,
+    varint(длина списка документов в байтах), CompressedPostings.to_bytes()
+слова идут в порядке возрастания байтового представления
+
+Так же через SpimiRuns строятся индексы с другими списками
+(позиционный, ранжированный): списки пишутся своим to_bytes,
+а списки одного слова из разных runs объединяются своей функцией
+"""
+import heapq
+import os
+import sys
+import tempfile
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+
+from postings import CompressedPostings
+from postings import encode_varint
+
+# примерная стоимость в байтах нового слова в частичном индексе
+# (элемент словаря + пустой список) и одного идентификатора документа
+TERM_OVERHEAD = 160
+POSTING_OVERHEAD = 8
+
+READ_BUFFER_SIZE = 1 << 20
+
+
+def write_run(filepath: str, items: Iterable[Tuple[bytes, CompressedPostings]]) -> None:
+    """
+    Запись отсортированного частичного индекса в run файл
+
+    Args:
+        filepath: путь до run файла
+        items: пары (слово в байтах, список документов) по возрастанию слов
+    """
+    header = bytearray()
+    with open(filepath, "wb") as f:
+        for key, postings in items:
+            raw_postings = postings.to_bytes()
+            header.clear()
+            encode_varint(len(key), header)
+            f.write(header)
+            f.write(key)
+            header.clear()
+            encode_varint(len(raw_postings), header)
+            f.write(header)
+            f.write(raw_postings)
+
+
+def _read_varint(f):
+    result = 0
+    shift = 0
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        result |= (byte[0] & 0x7F) << shift
+        if byte[0] < 0x80:
+            return result
+        shift += 7
+
+
+def read_run(filepath: str,
+             postings_class=CompressedPostings) -> Iterator[Tuple[bytes, CompressedPostings]]:
+    """
+    Последовательное чтение run файла
+
+    Args:
+        filepath: путь до run файла
+        postings_class: класс списков документов в файле
+
+    Returns: генератор пар (слово в байтах, список документов)
+    """
+    with open(filepath, "rb", buffering=READ_BUFFER_SIZE) as f:
+        while True:
+            key_size = _read_varint(f)
+            if key_size is None:
+                return
+            key = f.read(key_size)
+            postings_size = _read_varint(f)
+            postings = postings_class.from_bytes(f.read(postings_size))
+            yield key, postings
+
+
+def merge_items(streams: list,
+                merge: Callable[[list], object] = None) -> Iterator[Tuple[bytes, CompressedPostings]]:
+    """
+    k-way слияние отсортированных потоков частичных индексов
+
+    Одинаковые слова из разных потоков объединяются,
+    их списки документов сливаются с сохранением порядка
+
+    Args:
+        streams: итерируемые объекты с парами (слово в байтах, список документов)
+                 по возрастанию слов
+        merge: функция, объединяющая списки одного слова в порядке потоков
+               (None - слияние списков документов в CompressedPostings)
+
+    Returns: генератор пар (слово в байтах, список документов)
+             по возрастанию слов
+    """
+    def numbered(i, stream):
+        # номер потока нужен, чтобы при равных словах не сравнивать списки
+        for key, postings in stream:
+            yield key, i, postings
+
+    if merge is None:
+        merge = _merge_postings
+    streams = [numbered(i, stream) for i, stream in enumerate(streams)]
+
+    current_key = None
+    current_postings = []
+    for key, _, postings in heapq.merge(*streams):
+        if key != current_key and current_postings:
+            yield current_key, merge(current_postings)
+            current_postings = []
+        current_key = key
+        current_postings.append(postings)
+
+    if current_postings:
+        yield current_key, merge(current_postings)
+
+
+def merge_runs(run_paths: list, postings_class=CompressedPostings,
+               merge: Callable[[list], object] = None) -> Iterator[Tuple[bytes, CompressedPostings]]:
+    """
+    k-way слияние run файлов
+
+    Args:
+        run_paths: пути до run файлов
+        postings_class: класс списков документов в файлах
+        merge: функция, объединяющая списки одного слова (см. merge_items)
+
+    Returns: генератор пар (слово в байтах, список документов)
+             по возрастанию слов
+    """
+    return merge_items([read_run(path, postings_class) for path in run_paths], merge)
+
+
+def _merge_postings(postings_lists: list) -> CompressedPostings:
+    if len(postings_lists) == 1 and isinstance(postings_lists[0], CompressedPostings):
+        return postings_lists[0]
+
+    def unique(doc_ids):
+        previous = None
+        for doc_id in doc_ids:
+            if doc_id != previous:
+                yield doc_id
+                previous = doc_id
+
+    return CompressedPostings.from_sorted(unique(heapq.merge(*postings_lists)))
+
+
+class SpimiIndexBuilder:
+    """
+    Построитель инвертированного индекса с ограниченной памятью
+
+    * memory_budget - примерный объем памяти под частичный индекс в байтах
+                      (None - без ограничения, сброс только в конце)
+    * encoding - кодировка слов
+    * runs - пути до уже сброшенных на диск run файлов
+
+    Пример:
+        with SpimiIndexBuilder(memory_budget=64 * 2 ** 20) as builder:
+            for doc in documents:
+                builder.add_document(doc.id, doc.content.split())
+            with storage_policy.writer(filepath) as writer:
+                builder.write(writer)
+    """
+    def __init__(self, memory_budget: Optional[int], encoding: str = "utf8",
+                 tmp_dir: str = None):
+        if memory_budget is not None and memory_budget <= 0:
+            raise ValueError("memory budget must be positive")
+
+        self.memory_budget = memory_budget
+        self.encoding = encoding
+        self.runs = []
+
+        self._tmp_dir = tempfile.TemporaryDirectory(prefix="spimi-", dir=tmp_dir)
+        self._word_to_docs = {}
+        self._memory_used = 0
+
+    def add_document(self, doc_id: int, words: Iterable[str]) -> None:
+        """
+        Добавление слов документа в частичный индекс
+
+        Args:
+            doc_id: идентификатор документа
+            words: слова документа
+        """
+        word_to_docs = self._word_to_docs
+        for word in words:
+            docs = word_to_docs.get(word)
+            if docs is None:
+                word_to_docs[word] = [doc_id]
+                self._memory_used += TERM_OVERHEAD + sys.getsizeof(word)
+            elif docs[-1] != doc_id:
+                docs.append(doc_id)
+                self._memory_used += POSTING_OVERHEAD
+
+        if self.memory_budget is not None and self._memory_used >= self.memory_budget:
+            self.flush()
+
+    def flush(self) -> None:
+        """Сброс частичного индекса в новый run файл"""
+        if not self._word_to_docs:
+            return
+
+        items = sorted((word.encode(self.encoding), docs)
+                       for word, docs in self._word_to_docs.items())
+        self._word_to_docs = {}
+        self._memory_used = 0
+
+        run_path = os.path.join(self._tmp_dir.name, f"run-{len(self.runs)}")
+        write_run(run_path, ((key, CompressedPostings.from_iterable(docs))
+                             for key, docs in items))
+        self.runs.append(run_path)
+
+    def items(self) -> Iterator[Tuple[bytes, CompressedPostings]]:
+        """
+        Итоговый индекс: слияние всех runs
+
+        Returns: генератор пар (слово в байтах, список документов)
+                 по возрастанию слов
+        """
+        self.flush()
+        return merge_runs(self.runs)
+
+    def write(self, writer) -> None:
+        """
+        Запись итогового индекса
+
+        Args:
+            writer: потоковый писатель индекса
+                    (например MmapStoragePolicy.writer)
+        """
+        for key, postings in self.items():
+            writer.add(key.decode(self.encoding), postings)
+
+    def cleanup(self) -> None:
+        """Удаление временных файлов"""
+        self._tmp_dir.cleanup()
+        self.runs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.cleanup()
+
+
+class SpimiRuns:
+    """
+    Run файлы частичных индексов с произвольными списками документов
+
+    Частичный индекс собирает вызывающий код и сам решает, когда
+    его сбросить (например по бюджету памяти), SpimiRuns сортирует
+    слова, пишет run файл и в конце сливает все runs
+
+    * postings_class - класс списков (to_bytes и from_bytes)
+    * merge - функция, объединяющая списки одного слова из разных runs
+              в порядке их записи
+    * encoding - кодировка слов
+    * runs - пути до уже записанных run файлов
+
+    Пример:
+        with SpimiRuns(PositionalPostings, merge_positional) as runs:
+            runs.write(partial_index)
+            for key, postings in runs.items():
+                ...
+    """
+    def __init__(self, postings_class, merge: Callable[[list], object],
+                 encoding: str = "utf8", tmp_dir: str = None):
+        self.postings_class = postings_class
+        self.merge = merge
+        self.encoding = encoding
+        self.runs = []
+
+        self._tmp_dir = tempfile.TemporaryDirectory(prefix="spimi-", dir=tmp_dir)
+
+    def write(self, word_to_postings: dict) -> None:
+        """
+        Запись частичного индекса в новый run файл
+
+        Args:
+            word_to_postings: словарь слово -> список в формате postings_class
+        """
+        if not word_to_postings:
+            return
+        items = sorted((word.encode(self.encoding), postings)
+                       for word, postings in word_to_postings.items())
+        run_path = os.path.join(self._tmp_dir.name, f"run-{len(self.runs)}")
+        write_run(run_path, items)
+        self.runs.append(run_path)
+
+    def items(self) -> Iterator[Tuple[bytes, object]]:
+        """
+        Итоговый индекс: слияние всех runs
+
+        Returns: генератор пар (слово в байтах, список) по возрастанию слов
+        """
+        return merge_runs(self.runs, self.postings_class, self.merge)
+
+    def cleanup(self) -> None:
+        """Удаление временных файлов"""
+        self._tmp_dir.cleanup()
+        self.runs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.cleanup()
@@ -0,0 +1,210 @@
+"""
+Модуль, в котором реализован сбор статистики по этапам работы CLI
+
+Для каждого этапа (load_documents, build, dump, load, query, ...)
+считается количество вызовов, суммарное реальное время (wall)
+и процессорное время (cpu), для повторяющихся этапов (запросы) -
+еще и перцентили времени одного вызова. Счетчики (terms, postings,
+bytes_read, ...) накапливаются отдельно
+
+Пиковая память этапа - максимум резидентной памяти процесса (RSS):
+на linux перед этапом максимум сбрасывается (/proc/self/clear_refs),
+поэтому это пик именно этого этапа, на других системах - пик
+с начала работы процесса. В отличие от tracemalloc, замер не замедляет
+программу, поэтому статистику можно не выключать
+"""
+import json
+import math
+import sys
+import time
+from array import array
+from contextlib import contextmanager
+from contextlib import nullcontext
+from typing import Optional
+from typing import TextIO
+
+try:
+    import resource
+except ImportError:  # нет на windows
+    resource = None
+
+PERCENTILES = (50, 90, 99)
+
+_CLEAR_REFS = "/proc/self/clear_refs"
+_STATUS = "/proc/self/status"
+# сброс максимума RSS процесса (linux 4.0+)
+_RESET_PEAK_RSS = "5"
+
+
+def percentile(sorted_values, p: float) -> float:
+    """
+    Перцентиль методом ближайшего ранга
+
+    Args:
+        sorted_values: отсортированные значения
+        p: перцентиль от 0 до 100
+
+    Returns: значение, не меньше которого p процентов значений
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(len(sorted_values) * p / 100), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Пиковая резидентная память процесса (None, если неизвестна)"""
+    try:
+        with open(_STATUS) as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux возвращает килобайты, macOS - байты
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def reset_peak_rss() -> bool:
+    """Сброс пиковой памяти процесса до текущей, False - если не поддерживается"""
+    try:
+        with open(_CLEAR_REFS, "w") as f:
+            f.write(_RESET_PEAK_RSS)
+        return True
+    except OSError:
+        return False
+
+
+class StageStats:
+    """
+    Статистика одного этапа
+
+    * calls - количество вызовов
+    * wall_s - суммарное реальное время в секундах
+    * cpu_s - суммарное процессорное время в секундах
+    * peak_rss_bytes - пиковая память этапа (None, если не замерялась)
+    * timings - время каждого вызова (только для повторяющихся этапов)
+    """
+    __slots__ = ("calls", "wall_s", "cpu_s", "peak_rss_bytes", "timings")
+
+    def __init__(self):
+        self.calls = 0
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        self.peak_rss_bytes = None
+        self.timings = array("d")
+
+    def to_dict(self) -> dict:
+        result = {"calls": self.calls, "wall_s": self.wall_s, "cpu_s": self.cpu_s}
+        if self.peak_rss_bytes is not None:
+            result["peak_rss_bytes"] = self.peak_rss_bytes
+        if self.timings:
+            timings = sorted(self.timings)
+            for p in PERCENTILES:
+                result[f"p{p}_s"] = percentile(timings, p)
+            result["max_s"] = timings[-1]
+        return result
+
+
+class Stats:
+    """
+    Статистика по этапам и счетчики
+
+    * enabled - собирать ли статистику (выключенная ничего не замеряет)
+    * stages - название этапа -> StageStats (в порядке первого вызова)
+    * counters - название счетчика -> значение
+
+    Пример:
+        stats = Stats()
+        with stats.stage("build"):
+            ...
+        stats.add("terms", 100)
+        stats.report()
+    """
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.stages = {}
+        self.counters = {}
+        self._null_stage = nullcontext()
+
+    def stage(self, name: str, memory: bool = True, timings: bool = False):
+        """
+        Контекстный менеджер замера этапа
+
+        Args:
+            name: название этапа, повторные вызовы суммируются
+            memory: замерять пиковую память (для частых коротких этапов,
+                    например одного запроса, лучше выключить)
+            timings: сохранять время каждого вызова для перцентилей
+
+        Returns: контекстный менеджер
+        """
+        if not self.enabled:
+            return self._null_stage
+        return self._stage(name, memory, timings)
+
+    @contextmanager
+    def _stage(self, name: str, memory: bool, timings: bool):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = StageStats()
+
+        if memory:
+            reset_peak_rss()
+        wall_started = time.perf_counter()
+        cpu_started = time.process_time()
+        try:
+            yield stage
+        finally:
+            wall = time.perf_counter() - wall_started
+            stage.cpu_s += time.process_time() - cpu_started
+            stage.wall_s += wall
+            stage.calls += 1
+            if timings:
+                stage.timings.append(wall)
+            if memory:
+                peak = peak_rss_bytes()
+                if peak is not None:
+                    stage.peak_rss_bytes = max(peak, stage.peak_rss_bytes or 0)
+
+    def add(self, counter: str, value: int = 1) -> None:
+        """Увеличение счетчика на value"""
+        if self.enabled:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def to_dict(self) -> dict:
+        return {"stages": {name: stage.to_dict() for name, stage in self.stages.items()},
+                "counters": dict(self.counters)}
+
+    def report(self, destination: Optional[str] = None, stream: TextIO = None) -> None:
+        """
+        Вывод статистики
+
+        Args:
+            destination: путь до JSON файла, None или "-" - текстом в stream
+            stream: поток для текстового вывода (по умолчанию stderr)
+        """
+        if not self.enabled:
+            return
+
+        if destination not in (None, "-"):
+            with open(destination, "w", encoding="utf8") as f:
+                json.dump(self.to_dict(), f, indent=2)
+            return
+
+        stream = stream if stream is not None else sys.stderr
+        for name, stage in self.to_dict()["stages"].items():
+            line = (f"stage {name}: calls={stage['calls']} "
+                    f"wall={stage['wall_s']:.6f}s cpu={stage['cpu_s']:.6f}s")
+            if "peak_rss_bytes" in stage:
+                line += f" peak_rss={stage['peak_rss_bytes'] / 2 ** 20:.1f}MB"
+            for key in [f"p{p}_s" for p in PERCENTILES] + ["max_s"]:
+                if key in stage:
+                    line += f" {key[:-2]}={stage[key] * 1e6:.1f}us"
+            print(line, file=stream)
+        for name, value in self.counters.items():
+            print(f"counter {name}: {value}", file=stream)
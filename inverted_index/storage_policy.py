@@ -3,17 +3,33 @@
 сохранение словаря с инвертированным индексом на жесткий диск
 """
 import json
+import mmap
 import pickle
+import sys
 import zlib
 from abc import ABC
 from abc import abstractmethod
+from array import array
+from collections.abc import Mapping
 import struct
 
+from postings import CompressedPostings
+from postings import convert_postings
+from roaring import RoaringPostings
+
+# код типа array для беззнакового 32 битного числа
+_UINT32 = "I" if array("I").itemsize == 4 else "L"
+
 
 class StoragePolicy(ABC):
     """
     Интерфейс для сохранения и извлечение инвертированного индекса на диск
+
+    compressed_postings - умеет ли политика сохранять CompressedPostings
+    напрямую (иначе ей передаются обычные списки документов)
     """
+    compressed_postings = False
+
     @abstractmethod
     def dump(self, word_to_docs_mapping, filepath: str) -> None:
         pass
@@ -292,3 +308,453 @@ class StructStoragePolicy(StoragePolicy):
 
         info_mask = word_mask + " " + doc_id_mask
         return info_mask
+
+
+class SortedTermDictionary(Mapping):
+    """
+    Основа словарей с отсортированным по байтам словарем термов
+
+    Слово ищется бинарным поиском, наследник задает
+    _term (слово по номеру в байтах), _term_count и encoding
+    """
+    @abstractmethod
+    def _term(self, i: int) -> bytes:
+        """Слово с номером i в байтах"""
+
+    def _find(self, word: str) -> int:
+        """
+        Бинарный поиск слова в словаре термов
+
+        Returns: номер слова в словаре или -1, если слова нет
+        """
+        try:
+            key = word.encode(self.encoding)
+        except (UnicodeEncodeError, AttributeError):
+            return -1
+
+        low, high = 0, self._term_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._term(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low < self._term_count and self._term(low) == key:
+            return low
+        return -1
+
+    def __contains__(self, word) -> bool:
+        return self._find(word) >= 0
+
+    def __len__(self) -> int:
+        return self._term_count
+
+    def __iter__(self):
+        for i in range(self._term_count):
+            yield self._term(i).decode(self.encoding)
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class MmapTermDictionary(SortedTermDictionary):
+    """
+    Инвертированный индекс, открытый через mmap
+
+    Ведет себя как словарь слово -> CompressedPostings, но ничего
+    не загружает заранее: при обращении к слову бинарным поиском
+    по отсортированному словарю термов находится запись, и списки
+    документов читаются прямо из отображенного в память файла.
+    Поэтому с диска читаются только страницы запрошенных слов
+
+    Наследники с другим словарем термов (например MmapTrieTermDictionary)
+    используют отсюда открытие файла, таблицу записей и закрытие
+    """
+    def __init__(self, filepath: str, storage_policy):
+        self.encoding = storage_policy.encoding
+        self._postings_class = storage_policy.postings_class
+
+        with open(filepath, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, term_count,
+         terms_offset, entries_offset) = storage_policy.header.unpack_from(self._mmap)
+        if magic != storage_policy.magic or version != storage_policy.version:
+            self._mmap.close()
+            raise ValueError(f"{filepath} is not an inverted index "
+                             f"of {storage_policy.__class__.__name__}")
+
+        self._term_count = term_count
+        self._buffer = memoryview(self._mmap)
+        self._terms_offset = terms_offset
+        # чисел в записи таблицы у формата storage_policy
+        self._entry_size = storage_policy.entry_size
+
+        entries = self._buffer[entries_offset:entries_offset
+                               + 8 * self._entry_size * (term_count + 1)]
+        if sys.byteorder == "little":
+            self._entries = entries.cast("Q")
+        else:
+            self._entries = array("Q", entries)
+            self._entries.byteswap()
+
+    def _term(self, i: int) -> bytes:
+        entries = self._entries
+        step = self._entry_size
+        start = self._terms_offset + entries[i * step]
+        end = self._terms_offset + entries[(i + 1) * step]
+        return self._mmap[start:end]
+
+    def doc_count(self, word: str) -> int:
+        """Количество документов со словом, без чтения самих документов"""
+        i = self._find(word)
+        if i < 0:
+            return 0
+        return self._entries[i * self._entry_size + 2]
+
+    def __getitem__(self, word: str):
+        i = self._find(word)
+        if i < 0:
+            raise KeyError(word)
+
+        entries = self._entries
+        step = self._entry_size
+        start = entries[i * step + 1]
+        end = entries[(i + 1) * step + 1]
+        return self._postings_class.from_bytes(self._buffer[start:end])
+
+    def raw_items(self):
+        """
+        Все слова в байтах со списками документов в порядке хранения
+        (по возрастанию байтового представления слов)
+
+        Returns: генератор пар (слово в байтах, список документов)
+        """
+        entries = self._entries
+        step = self._entry_size
+        for i in range(self._term_count):
+            start = entries[i * step + 1]
+            end = entries[(i + 1) * step + 1]
+            yield self._term(i), self._postings_class.from_bytes(self._buffer[start:end])
+
+    def close(self) -> None:
+        """
+        Закрытие файла
+
+        Если где-то еще живут списки документов, ссылающиеся на файл,
+        то файл закроется сборщиком мусора
+        """
+        try:
+            if isinstance(self._entries, memoryview):
+                self._entries.release()
+            self._buffer.release()
+            self._mmap.close()
+        except BufferError:
+            pass
+
+
+class MmapIndexWriter:
+    """
+    Потоковая запись инвертированного индекса в формате MmapStoragePolicy
+
+    Слова должны добавляться в порядке возрастания их байтового
+    представления, тогда весь индекс в памяти держать не нужно:
+    списки документов сразу пишутся в файл, а в памяти копится
+    только словарь термов
+
+    Наследники с другим словарем термов (например TrieIndexWriter)
+    переопределяют _add_entry, _last_entry и _term_dictionary
+    """
+    def __init__(self, filepath: str, storage_policy):
+        self.encoding = storage_policy.encoding
+        self._storage_policy = storage_policy
+        self._file = open(filepath, "wb")
+        self._file.write(b"\0" * storage_policy.header.size)
+
+        self._terms = bytearray()
+        self._entries = array("Q")
+        self._offset = storage_policy.header.size
+        self._previous = None
+
+    def add(self, word: str, docs) -> None:
+        """
+        Добавление слова со списком документов
+
+        Args:
+            word: слово
+            docs: список документов в любом из форматов postings
+                  или просто набор идентификаторов
+        """
+        key = word.encode(self.encoding)
+        if self._previous is not None and key <= self._previous:
+            raise ValueError("words must be added in sorted order")
+        self._previous = key
+
+        postings = convert_postings(docs, self._storage_policy.postings_class)
+        raw_postings = postings.to_bytes()
+
+        self._add_entry(key, len(postings))
+        self._file.write(raw_postings)
+        self._offset += len(raw_postings)
+
+    def _add_entry(self, key: bytes, doc_count: int) -> None:
+        """Запись слова, список документов которого пишется с текущего смещения"""
+        self._entries.extend((len(self._terms), self._offset, doc_count))
+        self._terms += key
+
+    def _last_entry(self) -> tuple:
+        """
+        Запись-ограничитель, чтоб длины последнего слова
+        и последнего списка документов считались так же, как у остальных
+        """
+        return len(self._terms), self._offset, 0
+
+    def _term_dictionary(self) -> bytes:
+        """Словарь термов, который пишется после списков документов"""
+        return self._terms
+
+    def close(self) -> None:
+        """Дописывает словарь термов, таблицу записей и заголовок, закрывает файл"""
+        storage_policy = self._storage_policy
+        term_count = len(self._entries) // storage_policy.entry_size
+        self._entries.extend(self._last_entry())
+
+        terms_offset = self._offset
+        terms = self._term_dictionary()
+        self._file.write(terms)
+        self._offset += len(terms)
+
+        padding = -self._offset % 8
+        self._file.write(b"\0" * padding)
+        entries_offset = self._offset + padding
+
+        if sys.byteorder != "little":
+            self._entries.byteswap()
+        self._entries.tofile(self._file)
+
+        self._file.seek(0)
+        self._file.write(storage_policy.header.pack(storage_policy.magic,
+                                                    storage_policy.version,
+                                                    term_count,
+                                                    terms_offset,
+                                                    entries_offset))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+
+class MmapStoragePolicy(StoragePolicy):
+    """
+    Сохранение инвертированного индекса на диск в формате,
+    пригодном для ленивого чтения через mmap
+
+    Формат файла
+        1 заголовок (см. header)
+        2 списки документов всех слов (CompressedPostings.to_bytes)
+          в порядке возрастания слов
+        3 словарь термов - все слова подряд в указанной кодировке
+        4 таблица записей по entry_size чисел uint64 на слово:
+          смещение слова в словаре термов,
+          смещение списка документов в файле,
+          количество документов
+          + запись-ограничитель в конце
+
+    load ничего не раскодирует, а возвращает MmapTermDictionary
+    """
+    magic = b"IIMM"
+    version = 1
+    header = struct.Struct("<4sHxxQQQ")
+    entry_size = 3
+    postings_class = CompressedPostings
+
+    compressed_postings = True
+
+    def __init__(self, encoding):
+        """
+        Args:
+            encoding: кодировка в которой сохраняются слова
+        """
+        self.encoding = encoding
+
+    def dump(self, word_to_docs_mapping, filepath: str) -> None:
+        """
+        Сохранение инвертированного индекса на жесткий диск
+
+        Args:
+            word_to_docs_mapping: инвертированный индекс
+            filepath: путь до файла куда сохранять
+
+        Returns: None
+        """
+        words = sorted(word_to_docs_mapping,
+                       key=lambda word: word.encode(self.encoding))
+
+        with self.writer(filepath) as writer:
+            for word in words:
+                writer.add(word, word_to_docs_mapping[word])
+
+        return None
+
+    def writer(self, filepath: str) -> MmapIndexWriter:
+        """Потоковая запись индекса, слова подаются отсортированными"""
+        return MmapIndexWriter(filepath, self)
+
+    def load(self, filepath: str) -> MmapTermDictionary:
+        """
+        Открытие инвертированного индекса с жесткого диска
+
+        Args:
+            filepath: путь до сохраненного инвертированного индекса
+
+        Returns: ленивый словарь слово -> CompressedPostings
+        """
+        return MmapTermDictionary(filepath, self)
+
+
+class RoaringStoragePolicy(MmapStoragePolicy):
+    """
+    Сохранение инвертированного индекса на диск с гибридными
+    array/bitmap списками документов (см. модуль roaring)
+
+    Формат файла такой же, как у MmapStoragePolicy, но списки документов
+    записаны RoaringPostings.to_bytes. Частые слова хранятся битовыми
+    картами, поэтому их пересечение выполняется пословно
+    """
+    magic = b"IIRB"
+    postings_class = RoaringPostings
+
+
+class ColumnarStoragePolicy(StoragePolicy):
+    """
+    Сохранение инвертированного индекса на диск в колоночном формате
+
+    В отличие от StructStoragePolicy здесь нет отдельной маски на каждое
+    слово: весь индекс раскладывается на несколько сплошных массивов,
+    каждый из которых пишется и читается одной операцией.
+    Идентификаторы документов хранятся как uint32, а если не помещаются,
+    то как uint64 (у StructStoragePolicy ограничение 65535).
+    Порядок документов в списках сохраняется как есть
+
+    Формат файла (все числа little endian, разделы выровнены по 8 байт)
+        1 заголовок (см. header): magic, version, размер идентификатора
+          документа в байтах, количество слов, смещения разделов 2-5
+        2 словарь термов - все слова подряд в порядке возрастания байт
+        3 смещения слов в словаре термов, uint64, term_count + 1 штук
+        4 смещения списков документов в массиве документов, uint64,
+          term_count + 1 штук
+        5 массив документов uint32 или uint64
+    """
+    magic = b"IICL"
+    # тот же формат, записанный NumpyStoragePolicy (см. модуль numpy_postings)
+    numpy_magic = b"IINP"
+    version = 1
+    header = struct.Struct("<4sHH5Q")
+
+    def __init__(self, encoding):
+        """
+        Args:
+            encoding: кодировка в которой сохраняются слова
+        """
+        self.encoding = encoding
+
+    def dump(self, word_to_docs_mapping, filepath: str) -> None:
+        """
+        Сохранение инвертированного индекса на жесткий диск
+
+        Args:
+            word_to_docs_mapping: инвертированный индекс
+            filepath: путь до файла куда сохранять
+
+        Returns: None
+        """
+        keys = sorted((word.encode(self.encoding), word) for word in word_to_docs_mapping)
+
+        terms = bytearray()
+        term_offsets = array("Q", [0])
+        postings_offsets = array("Q", [0])
+        postings = array(_UINT32)
+        for key, word in keys:
+            docs = word_to_docs_mapping[word]
+            size = len(postings)
+            try:
+                postings.extend(docs)
+            except OverflowError:
+                # идентификаторы не помещаются в 32 бита
+                postings = array("Q", postings[:size])
+                postings.extend(docs)
+            terms += key
+            term_offsets.append(len(terms))
+            postings_offsets.append(len(postings))
+
+        terms_offset = self.header.size
+        term_offsets_offset = terms_offset + len(terms) + (-len(terms) % 8)
+        postings_offsets_offset = term_offsets_offset + 8 * len(term_offsets)
+        postings_offset = postings_offsets_offset + 8 * len(postings_offsets)
+
+        if sys.byteorder != "little":
+            for column in (term_offsets, postings_offsets, postings):
+                column.byteswap()
+
+        with open(filepath, "wb") as f:
+            f.write(self.header.pack(self.magic, self.version,
+                                     postings.itemsize, len(keys),
+                                     terms_offset, term_offsets_offset,
+                                     postings_offsets_offset, postings_offset))
+            f.write(terms)
+            f.write(b"\0" * (term_offsets_offset - terms_offset - len(terms)))
+            term_offsets.tofile(f)
+            postings_offsets.tofile(f)
+            postings.tofile(f)
+
+        return None
+
+    def load(self, filepath: str) -> dict:
+        """
+        Извлечение инвертированного индекса с жесткого диска
+
+        Args:
+            filepath: путь до сохраненного инвертированного индекса
+
+        Returns: инвертированный индекс
+        """
+        with open(filepath, "rb") as f:
+            data = f.read()
+
+        (magic, version, itemsize, term_count,
+         terms_offset, term_offsets_offset,
+         postings_offsets_offset, postings_offset) = self.header.unpack_from(data)
+        if magic not in (self.magic, self.numpy_magic) or version != self.version:
+            raise ValueError(f"{filepath} is not a columnar inverted index")
+
+        index_size = 8 * (term_count + 1)
+        terms = data[terms_offset:term_offsets_offset]
+        term_offsets = array("Q")
+        term_offsets.frombytes(data[term_offsets_offset:term_offsets_offset + index_size])
+        postings_offsets = array("Q")
+        postings_offsets.frombytes(data[postings_offsets_offset:
+                                        postings_offsets_offset + index_size])
+        postings = array(_UINT32 if itemsize == 4 else "Q")
+        postings.frombytes(data[postings_offset:])
+
+        if sys.byteorder != "little":
+            for column in (term_offsets, postings_offsets, postings):
+                column.byteswap()
+
+        encoding = self.encoding
+        return {terms[term_offsets[i]:term_offsets[i + 1]].decode(encoding):
+                postings[postings_offsets[i]:postings_offsets[i + 1]].tolist()
+                for i in range(term_count)}
@@ -0,0 +1,545 @@
+"""
+Модуль, в котором реализован словарь термов на сжатом префиксном дереве
+
+Слова хранятся не строками Python, а одним буфером байт - сжатым
+префиксным деревом (radix tree, TermTrie) над байтовым представлением слов.
+Общие префиксы слов хранятся один раз, цепочки узлов с одним
+потомком схлопываются в одно ребро с несколькими байтами
+
+Номер слова - его номер в порядке возрастания байтового представления,
+у всех слов одного поддерева номера идут подряд, поэтому по префиксу
+сразу известен диапазон номеров, а сами слова перечисляются обходом
+только нужного поддерева (время пропорционально размеру ответа)
+
+Узел дерева:
+    varint(количество потомков * 2 + 1, если на узле заканчивается слово)
+    первые байты ребер ко всем потомкам по возрастанию
+    для каждого потомка:
+        varint(длина ребра), байты ребра,
+        varint(количество слов в поддереве потомка),
+        varint(смещение узла потомка)
+Потомки записываются раньше родителя, корень - последним
+
+Шаблоны слов в запросах:
+    data*  - все слова с префиксом data
+    d?ta   - ? заменяет ровно один символ
+    d*t?   - * заменяет любое количество символов
+"""
+import re
+import struct
+from collections.abc import Mapping
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from postings import as_postings
+from postings import decode_varint
+from postings import encode_varint
+from storage_policy import MmapIndexWriter
+from storage_policy import MmapStoragePolicy
+from storage_policy import MmapTermDictionary
+
+_WILDCARD_RE = re.compile(r"[*?]")
+
+
+def is_wildcard(word: str) -> bool:
+    """Является ли слово запроса шаблоном (содержит * или ?)"""
+    return _WILDCARD_RE.search(word) is not None
+
+
+def wildcard_regex(pattern: str):
+    """
+    Регулярное выражение для шаблона слова
+
+    Args:
+        pattern: шаблон, * - любое количество символов, ? - один символ
+
+    Returns: скомпилированное регулярное выражение (использовать с fullmatch)
+    """
+    parts = []
+    for piece in re.split(r"([*?])", pattern):
+        if piece == "*":
+            parts.append(".*")
+        elif piece == "?":
+            parts.append(".")
+        else:
+            parts.append(re.escape(piece))
+    return re.compile("".join(parts), re.DOTALL)
+
+
+def literal_prefix(pattern: str) -> str:
+    """Часть шаблона до первого * или ?"""
+    match = _WILDCARD_RE.search(pattern)
+    return pattern if match is None else pattern[:match.start()]
+
+
+def expand_terms(word_to_docs_mapping, pattern: str) -> List[str]:
+    """
+    Слова индекса, подходящие под шаблон
+
+    Словарь на префиксном дереве перечисляет только поддерево
+    префикса шаблона, у остальных индексов просматриваются все слова
+
+    Args:
+        word_to_docs_mapping: инвертированный индекс
+        pattern: шаблон слова (см. документацию модуля)
+
+    Returns: список слов
+    """
+    if hasattr(word_to_docs_mapping, "expand"):
+        return word_to_docs_mapping.expand(pattern)
+    regex = wildcard_regex(pattern)
+    return [word for word in word_to_docs_mapping if regex.fullmatch(word)]
+
+
+def _common_prefix_length(first: bytes, last: bytes, start: int) -> int:
+    end = min(len(first), len(last))
+    while start < end and first[start] == last[start]:
+        start += 1
+    return start
+
+
+def _write_node(terminal: bool, children: list, out: bytearray) -> int:
+    """
+    Запись узла, потомки которого уже записаны
+
+    Args:
+        terminal: заканчивается ли на узле слово
+        children: [ребро, количество слов в поддереве, смещение потомка]
+        out: буфер с узлами
+
+    Returns: смещение записанного узла
+    """
+    offset = len(out)
+    encode_varint(len(children) << 1 | terminal, out)
+    out += bytes(edge[0] for edge, _, _ in children)
+    for edge, count, child in children:
+        encode_varint(len(edge), out)
+        out += edge
+        encode_varint(count, out)
+        encode_varint(child, out)
+    return offset
+
+
+def _build_nodes(keys: List[bytes], out: bytearray) -> int:
+    """
+    Запись дерева непустого списка слов keys
+
+    Дерево обходится в глубину с явным стеком: глубина дерева равна
+    количеству уровней ветвления и может быть больше предела рекурсии
+
+    Returns: смещение корня
+    """
+    def frame(low, high, depth):
+        terminal = len(keys[low]) == depth
+        # [начало следующего потомка, конец слов узла, длина общего префикса,
+        #  заканчивается ли на узле слово, потомки]
+        return [low + terminal, high, depth, terminal, []]
+
+    stack = [frame(0, len(keys), 0)]
+    while True:
+        node = stack[-1]
+        i, high, depth, terminal, children = node
+        if i < high:
+            first = keys[i][depth]
+            j = i + 1
+            while j < high and keys[j][depth] == first:
+                j += 1
+            end = _common_prefix_length(keys[i], keys[j - 1], depth + 1)
+            children.append([keys[i][depth:end], j - i, None])
+            node[0] = j
+            stack.append(frame(i, j, end))
+            continue
+
+        offset = _write_node(terminal, children, out)
+        stack.pop()
+        if not stack:
+            return offset
+        stack[-1][4][-1][2] = offset
+
+
+class TermTrie:
+    """
+    Сжатое префиксное дерево над словами в байтах (формат в документации модуля)
+
+    * _buf - буфер с деревом (bytes или mmap)
+    * _start - смещение дерева в буфере
+    * _root - смещение корня в буфере
+    * _count - количество слов
+    """
+    __slots__ = ("_buf", "_start", "_root", "_count")
+
+    # смещение корня относительно начала узлов, количество слов
+    header = struct.Struct("<QQ")
+
+    def __init__(self, buf, start: int = 0):
+        root, self._count = self.header.unpack_from(buf, start)
+        self._buf = buf
+        self._start = start + self.header.size
+        self._root = self._start + root
+
+    @classmethod
+    def from_sorted(cls, keys: List[bytes]):
+        """
+        Построение дерева
+
+        Args:
+            keys: различные слова в байтах по возрастанию
+
+        Returns: TermTrie
+        """
+        nodes = bytearray()
+        root = _build_nodes(keys, nodes) if keys else 0
+        if not keys:
+            encode_varint(0, nodes)
+        return cls(cls.header.pack(root, len(keys)) + bytes(nodes))
+
+    def to_bytes(self) -> bytes:
+        """
+        Сериализация
+
+        Returns: байты, из которых дерево восстанавливается конструктором
+        """
+        # корень записан последним, дерево заканчивается вместе с ним
+        end = self._skip_node(self._root)
+        return bytes(self._buf[self._start - self.header.size:end])
+
+    @property
+    def nbytes(self) -> int:
+        """Размер дерева в байтах"""
+        return len(self.to_bytes())
+
+    def _skip_node(self, node: int) -> int:
+        """Позиция сразу после записи узла"""
+        buf = self._buf
+        header, pos = decode_varint(buf, node)
+        pos += header >> 1
+        for _ in range(header >> 1):
+            length, pos = decode_varint(buf, pos)
+            _, pos = decode_varint(buf, pos + length)
+            _, pos = decode_varint(buf, pos)
+        return pos
+
+    def _child(self, node: int, key: bytes, pos: int):
+        """
+        Переход от узла по байту key[pos]
+
+        Returns: (ребро, количество слов до потомка среди потомков узла,
+                  количество слов в поддереве потомка, смещение потомка)
+                 или None, если такого ребра нет
+        """
+        buf = self._buf
+        header, labels = decode_varint(buf, node)
+        count = header >> 1
+        index = buf.find(key[pos:pos + 1], labels, labels + count)
+        if index < 0:
+            return None
+
+        skipped = 0
+        entry = labels + count
+        for _ in range(index - labels):
+            length, entry = decode_varint(buf, entry)
+            subtree, entry = decode_varint(buf, entry + length)
+            skipped += subtree
+            _, entry = decode_varint(buf, entry)
+
+        length, entry = decode_varint(buf, entry)
+        edge = buf[entry:entry + length]
+        subtree, entry = decode_varint(buf, entry + length)
+        child, _ = decode_varint(buf, entry)
+        return edge, skipped, subtree, self._start + child
+
+    def find(self, key: bytes) -> int:
+        """
+        Номер слова
+
+        Args:
+            key: слово в байтах
+
+        Returns: номер слова или -1, если слова нет
+        """
+        if not self._count:
+            return -1
+        node = self._root
+        base = 0
+        pos = 0
+        while True:
+            terminal = self._buf[node] & 1
+            if pos == len(key):
+                return base if terminal else -1
+            base += terminal
+
+            step = self._child(node, key, pos)
+            if step is None:
+                return -1
+            edge, skipped, _, node = step
+            if key[pos:pos + len(edge)] != edge:
+                return -1
+            base += skipped
+            pos += len(edge)
+
+    def _locate(self, prefix: bytes) -> Optional[tuple]:
+        """
+        Поддерево всех слов с префиксом
+
+        Returns: (смещение узла, путь до узла, номер первого слова поддерева,
+                  количество слов в поддереве) или None
+        """
+        if not self._count:
+            return None
+        node = self._root
+        path = b""
+        base = 0
+        count = self._count
+        while len(path) < len(prefix):
+            base += self._buf[node] & 1
+            step = self._child(node, prefix, len(path))
+            if step is None:
+                return None
+            edge, skipped, count, node = step
+            if not edge.startswith(prefix[len(path):len(path) + len(edge)]):
+                return None
+            base += skipped
+            path += edge
+        return node, path, base, count
+
+    def prefix_range(self, prefix: bytes) -> range:
+        """
+        Номера всех слов с префиксом
+
+        Args:
+            prefix: префикс в байтах
+
+        Returns: диапазон номеров (пустой, если таких слов нет)
+        """
+        located = self._locate(prefix)
+        if located is None:
+            return range(0)
+        _, _, base, count = located
+        return range(base, base + count)
+
+    def items(self, prefix: bytes = b"") -> Iterator[Tuple[bytes, int]]:
+        """
+        Все слова с префиксом по возрастанию
+
+        Обходится только поддерево префикса
+
+        Args:
+            prefix: префикс в байтах
+
+        Returns: генератор пар (слово в байтах, номер слова)
+        """
+        located = self._locate(prefix)
+        if located is None:
+            return
+        node, path, term_id, _ = located
+
+        buf = self._buf
+        stack = [(node, path)]
+        while stack:
+            node, path = stack.pop()
+            header, entry = decode_varint(buf, node)
+            if header & 1:
+                yield path, term_id
+                term_id += 1
+
+            count = header >> 1
+            entry += count
+            children = []
+            for _ in range(count):
+                length, entry = decode_varint(buf, entry)
+                edge = buf[entry:entry + length]
+                _, entry = decode_varint(buf, entry + length)
+                child, entry = decode_varint(buf, entry)
+                children.append((self._start + child, path + edge))
+            stack.extend(reversed(children))
+
+    def __len__(self):
+        return self._count
+
+
+class TrieTermDictionary(Mapping):
+    """
+    Инвертированный индекс со словарем термов на префиксном дереве
+
+    Ведет себя как словарь слово -> CompressedPostings,
+    слова перечисляются по возрастанию байтового представления
+
+    * trie - дерево слов (TermTrie)
+    * encoding - кодировка слов в дереве
+    * _postings - списки документов по номерам слов
+    """
+    def __init__(self, trie: TermTrie, postings, encoding: str = "utf8"):
+        self.trie = trie
+        self.encoding = encoding
+        self._postings = postings
+
+    @classmethod
+    def from_dict(cls, word_to_docs_mapping, encoding: str = "utf8"):
+        """
+        Построение из словаря
+
+        Args:
+            word_to_docs_mapping: словарь слово -> список документов
+            encoding: кодировка слов в дереве
+
+        Returns: TrieTermDictionary со сжатыми списками документов
+        """
+        items = sorted((word.encode(encoding), docs)
+                       for word, docs in word_to_docs_mapping.items())
+        trie = TermTrie.from_sorted([key for key, _ in items])
+        return cls(trie, [as_postings(docs) for _, docs in items], encoding)
+
+    def _find(self, word: str) -> int:
+        try:
+            key = word.encode(self.encoding)
+        except (UnicodeEncodeError, AttributeError):
+            return -1
+        return self.trie.find(key)
+
+    def _postings_at(self, term_id: int):
+        return self._postings[term_id]
+
+    def _doc_count_at(self, term_id: int) -> int:
+        return len(self._postings[term_id])
+
+    def doc_count(self, word: str) -> int:
+        """Количество документов со словом"""
+        term_id = self._find(word)
+        if term_id < 0:
+            return 0
+        return self._doc_count_at(term_id)
+
+    def expand(self, pattern: str) -> List[str]:
+        """
+        Слова, подходящие под шаблон
+
+        Перечисляется только поддерево префикса шаблона до первого * или ?
+
+        Args:
+            pattern: шаблон слова (см. документацию модуля)
+
+        Returns: список слов по возрастанию
+        """
+        try:
+            prefix = literal_prefix(pattern).encode(self.encoding)
+        except UnicodeEncodeError:
+            return []
+        words = (key.decode(self.encoding) for key, _ in self.trie.items(prefix))
+        if pattern == literal_prefix(pattern) + "*":
+            return list(words)
+        regex = wildcard_regex(pattern)
+        return [word for word in words if regex.fullmatch(word)]
+
+    def __getitem__(self, word: str):
+        term_id = self._find(word)
+        if term_id < 0:
+            raise KeyError(word)
+        return self._postings_at(term_id)
+
+    def __contains__(self, word) -> bool:
+        return self._find(word) >= 0
+
+    def __len__(self) -> int:
+        return len(self.trie)
+
+    def __iter__(self):
+        for key, _ in self.trie.items():
+            yield key.decode(self.encoding)
+
+    def raw_items(self):
+        """
+        Все слова в байтах со списками документов в порядке хранения
+        (по возрастанию байтового представления слов)
+
+        Returns: генератор пар (слово в байтах, список документов)
+        """
+        for key, term_id in self.trie.items():
+            yield key, self._postings_at(term_id)
+
+
+class MmapTrieTermDictionary(TrieTermDictionary, MmapTermDictionary):
+    """
+    Инвертированный индекс в формате TrieStoragePolicy, открытый через mmap
+
+    Дерево слов и списки документов читаются прямо из отображенного
+    в память файла, заранее ничего не раскодируется.
+    Поиск слов - от TrieTermDictionary, открытие файла, таблица записей
+    и закрытие - от MmapTermDictionary
+    """
+    def __init__(self, filepath: str, storage_policy):
+        MmapTermDictionary.__init__(self, filepath, storage_policy)
+        # словарь термов этого формата - дерево слов
+        TrieTermDictionary.__init__(self, TermTrie(self._mmap, self._terms_offset), None,
+                                    storage_policy.encoding)
+
+    def _postings_at(self, term_id: int):
+        step = self._entry_size
+        start = self._entries[term_id * step]
+        end = self._entries[(term_id + 1) * step]
+        return self._postings_class.from_bytes(self._buffer[start:end])
+
+    def _doc_count_at(self, term_id: int) -> int:
+        return self._entries[term_id * self._entry_size + 1]
+
+
+class TrieIndexWriter(MmapIndexWriter):
+    """
+    Потоковая запись инвертированного индекса в формате TrieStoragePolicy
+
+    Слова должны добавляться в порядке возрастания их байтового
+    представления, списки документов сразу пишутся в файл,
+    а дерево слов строится при закрытии
+    """
+    def __init__(self, filepath: str, storage_policy):
+        super().__init__(filepath, storage_policy)
+        self._keys = []
+
+    def _add_entry(self, key: bytes, doc_count: int) -> None:
+        self._keys.append(key)
+        self._entries.extend((self._offset, doc_count))
+
+    def _last_entry(self) -> tuple:
+        return self._offset, 0
+
+    def _term_dictionary(self) -> bytes:
+        trie = TermTrie.from_sorted(self._keys).to_bytes()
+        self._keys = []
+        return trie
+
+
+class TrieStoragePolicy(MmapStoragePolicy):
+    """
+    Сохранение инвертированного индекса со словарем термов
+    на префиксном дереве
+
+    Формат файла
+        1 заголовок (см. header): magic, версия, количество слов,
+          смещение дерева, смещение таблицы записей
+        2 списки документов всех слов (CompressedPostings.to_bytes)
+          в порядке возрастания слов
+        3 дерево слов (TermTrie.to_bytes)
+        4 таблица записей по entry_size чисел uint64 на слово:
+          смещение списка документов в файле, количество документов
+          + запись-ограничитель в конце
+
+    load ничего не раскодирует, а возвращает MmapTrieTermDictionary
+    """
+    magic = b"IITR"
+    entry_size = 2
+
+    def writer(self, filepath: str) -> TrieIndexWriter:
+        """Потоковая запись индекса, слова подаются отсортированными"""
+        return TrieIndexWriter(filepath, self)
+
+    def load(self, filepath: str) -> MmapTrieTermDictionary:
+        """
+        Открытие инвертированного индекса с жесткого диска
+
+        Args:
+            filepath: путь до сохраненного инвертированного индекса
+
+        Returns: ленивый словарь слово -> CompressedPostings
+        """
+        return MmapTrieTermDictionary(filepath, self)
@@ -0,0 +1,56 @@
+import pickle
+
+import pytest
+
+from analyzer import Analyzer
+from analyzer import Vocabulary
+from boolean_query import boolean_query
+from postings import CompressedPostings
+
+
+@pytest.fixture()
+def analyzer() -> Analyzer:
+    return Analyzer(lowercase=True, stop_words=["The", "a"])
+
+
+def test_analyze(analyzer):
+    assert ["cat", "sat", "on", "mat"] == analyzer.analyze("The cat  sat on a Mat")
+    assert ["hello"] == analyzer.analyze_words(["HELLO", "the"])
+    assert "Hello" == Analyzer().normalize("Hello")
+
+
+def test_settings_round_trip(analyzer):
+    restored = Analyzer.from_dict(analyzer.to_dict())
+
+    assert analyzer == restored
+    assert analyzer == pickle.loads(pickle.dumps(analyzer))
+    assert Analyzer() != analyzer
+    with pytest.raises(ValueError):
+        Analyzer.from_dict({"tokenizer": "unknown"})
+
+
+def test_vocabulary(analyzer):
+    vocabulary = Vocabulary(analyzer)
+
+    first = vocabulary.distinct_term_ids("Hello world hello the")
+    second = vocabulary.distinct_term_ids("WORLD peace")
+
+    assert 3 == len(vocabulary)
+    assert {vocabulary.get("hello"), vocabulary.get("world")} == first
+    assert {vocabulary.get("world"), vocabulary.get("peace")} == second
+    assert "peace" == vocabulary[vocabulary.get("peace")]
+    assert vocabulary.get("the") is None
+
+
+@pytest.mark.parametrize("text, expect", [
+    ("Hello", [1, 2]),
+    ("HELLO AND the", [1, 2]),
+    ("the OR a", []),
+    ("hello NOT the", [1, 2]),
+    ("hello NOT World", [1]),
+])
+def test_boolean_query_with_analyzer(analyzer, text, expect):
+    word_to_docs = {"hello": CompressedPostings.from_sorted([1, 2]),
+                    "world": CompressedPostings.from_sorted([2])}
+
+    assert expect == boolean_query(word_to_docs, text, analyzer=analyzer)
@@ -0,0 +1,98 @@
+import pytest
+
+from batch_query import execute_plan
+from batch_query import plan_batch
+from batch_query import run_batch
+from batch_query import worker_pool
+from postings import CompressedPostings
+from storage_policy import MmapStoragePolicy
+
+
+@pytest.fixture()
+def sample_inverted_index() -> dict:
+    inverted_index = {"word": [1, 2, 4],
+                      "hello": [1, 2, 3],
+                      "covid": [2, 3, 4],
+                      "python": [2, 5],
+                      "rare": [2]}
+    return {word: CompressedPostings.from_sorted(docs)
+            for word, docs in inverted_index.items()}
+
+
+@pytest.fixture()
+def sample_queries() -> list:
+    return [["hello", "word"],
+            ["word", "hello", "covid"],
+            ["unknown", "hello"],
+            [],
+            ["python"],
+            ["rare", "hello", "word"],
+            ["hello", "word"]]
+
+
+def _expected(inverted_index: dict, queries: list) -> list:
+    expect = []
+    for words in queries:
+        docs = None
+        for word in words:
+            word_docs = set(inverted_index.get(word, []))
+            docs = word_docs if docs is None else docs & word_docs
+        expect.append(sorted(docs or []))
+    return expect
+
+
+def test_plan_batch_shares_prefixes(sample_inverted_index, sample_queries):
+    root = plan_batch(sample_queries, lambda word: len(sample_inverted_index.get(word, [])))
+
+    # запросы с неизвестными словами и пустые в план не попадают
+    assert "unknown" not in root.children
+    # одинаковые запросы заканчиваются в одном узле
+    node = root.children["hello"].children["word"]
+    assert [0, 6] == node.queries
+
+
+def test_execute_plan(sample_inverted_index, sample_queries):
+    root = plan_batch(sample_queries, lambda word: len(sample_inverted_index.get(word, [])))
+
+    results = execute_plan(root, sample_inverted_index)
+
+    assert [1, 2] == results[0]
+    assert 2 not in results
+
+
+def test_run_batch_keeps_order(sample_inverted_index, sample_queries):
+    expect = _expected(sample_inverted_index, sample_queries)
+
+    real = run_batch(sample_inverted_index, sample_queries)
+
+    assert expect == real
+
+
+def test_run_batch_in_process_pool(tmpdir, sample_inverted_index, sample_queries):
+    expect = _expected(sample_inverted_index, sample_queries)
+
+    index_path = tmpdir.join("index").strpath
+    storage_policy = MmapStoragePolicy(encoding="utf8")
+    storage_policy.dump(sample_inverted_index, index_path)
+
+    with storage_policy.load(index_path) as inverted_index:
+        real = run_batch(inverted_index, sample_queries,
+                         workers=2,
+                         index_path=index_path,
+                         storage_policy=storage_policy)
+
+    assert expect == real
+
+
+def test_run_batches_in_shared_pool(tmpdir, sample_inverted_index, sample_queries):
+    expect = _expected(sample_inverted_index, sample_queries)
+
+    index_path = tmpdir.join("index").strpath
+    storage_policy = MmapStoragePolicy(encoding="utf8")
+    storage_policy.dump(sample_inverted_index, index_path)
+
+    with storage_policy.load(index_path) as inverted_index, \
+            worker_pool(2, index_path, storage_policy) as executor:
+        for _ in range(3):
+            real = run_batch(inverted_index, sample_queries, workers=2, executor=executor)
+            assert expect == real
@@ -0,0 +1,63 @@
+import copy
+from collections import Counter
+
+from benchmark import COMPARED_METRICS
+from benchmark import benchmark_storage_policy
+from benchmark import compare_with_baseline
+from benchmark import make_corpus
+from benchmark import make_inverted_index
+from benchmark import make_queries
+from benchmark import percentile
+from benchmark import run_benchmark
+from storage_policy import ColumnarStoragePolicy
+
+
+def test_benchmark_storage_policy(tmpdir):
+    word_to_docs_mapping = make_inverted_index(doc_count=50, vocabulary_size=20, words_per_doc=5)
+
+    result = benchmark_storage_policy(ColumnarStoragePolicy(encoding="utf8"),
+                                      word_to_docs_mapping,
+                                      tmpdir.join("index").strpath,
+                                      repeat=1)
+
+    assert result["file_bytes"] > 0
+    assert result["dump_s"] > 0
+    assert result["load_s"] > 0
+
+
+def test_zipf_corpus_and_queries():
+    documents = make_corpus(doc_count=200, vocabulary_size=100, words_per_doc=10)
+    counts = Counter(word for doc in documents for word in doc.content.split())
+
+    assert [1, 200] == [documents[0].id, documents[-1].id]
+    assert counts["word0"] > counts["word9"] > counts["word99"]
+    assert documents[5].content == make_corpus(200, 100, 10)[5].content
+    assert all(1 <= len(query) <= 2 for query in make_queries(50, 100, max_words=2))
+
+
+def test_percentile():
+    values = list(range(1, 101))
+
+    assert 50 == percentile(values, 50)
+    assert 99 == percentile(values, 99)
+    assert 100 == percentile(values, 100)
+    assert 1 == percentile([1], 90)
+
+
+def test_run_benchmark_and_compare_with_baseline():
+    report = run_benchmark([30], ["struct", "mmap"], vocabulary_size=50,
+                           words_per_doc=5, query_count=20, repeat=1)
+
+    assert [(30, "struct"), (30, "mmap")] == [(result["docs"], result["policy"])
+                                             for result in report["results"]]
+    for result in report["results"]:
+        assert result["file_bytes"] > 0
+        assert result["latency_p50_s"] <= result["latency_p99_s"] <= result["latency_max_s"]
+        assert set(COMPARED_METRICS) <= set(result)
+    assert [] == compare_with_baseline(report, report)
+
+    baseline = copy.deepcopy(report)
+    baseline["results"][1]["file_bytes"] //= 2
+    regressions = compare_with_baseline(report, baseline, tolerance=0.1)
+    assert [("mmap", "file_bytes")] == [(regression["policy"], regression["metric"])
+                                        for regression in regressions]
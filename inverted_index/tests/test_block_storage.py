@@ -0,0 +1,83 @@
+import random
+
+import pytest
+
+import inverted_index as IIS
+from block_storage import BlockStoragePolicy
+from postings import CompressedPostings
+
+
+@pytest.fixture(scope="module")
+def random_inverted_index() -> dict:
+    rnd = random.Random(5)
+    return {f"word{i}": sorted(rnd.sample(range(1, 10 ** 5), rnd.randint(1, 300)))
+            for i in range(500)}
+
+
+@pytest.mark.parametrize("codec", ["zlib", "lzma", "bz2"])
+@pytest.mark.parametrize("workers", [1, 4])
+def test_dump_and_load(tmpdir, random_inverted_index, codec, workers):
+    filepath = tmpdir.join("index.block").strpath
+    storage_policy = BlockStoragePolicy(encoding="utf8", codec=codec,
+                                        block_size=4096, workers=workers)
+    storage_policy.dump(random_inverted_index, filepath)
+
+    with storage_policy.load(filepath) as loaded:
+        assert codec == loaded.codec
+        assert random_inverted_index == loaded
+        assert 500 == len(loaded)
+        assert len(random_inverted_index["word7"]) == loaded.doc_count("word7")
+        assert "unknown" not in loaded
+        assert [key.decode("utf8") for key, _ in loaded.raw_items()] == \
+               sorted(random_inverted_index, key=lambda word: word.encode("utf8"))
+
+    preloaded = BlockStoragePolicy(encoding="utf8", workers=workers, preload=True).load(filepath)
+    assert isinstance(preloaded, dict)
+    assert random_inverted_index == preloaded
+
+
+def test_query_decompresses_only_needed_blocks(tmpdir, random_inverted_index):
+    filepath = tmpdir.join("index.block").strpath
+    storage_policy = BlockStoragePolicy(encoding="utf8", block_size=4096, workers=1)
+    storage_policy.dump(random_inverted_index, filepath)
+
+    with storage_policy.load(filepath) as loaded:
+        assert len(loaded._block_offsets) > 20
+        assert 0 == loaded.blocks_decompressed
+
+        assert len(random_inverted_index["word1"]) == loaded.doc_count("word1")
+        assert "word10" in loaded
+        assert 0 == loaded.blocks_decompressed
+
+        assert CompressedPostings.from_sorted(random_inverted_index["word42"]) == loaded["word42"]
+        assert list(random_inverted_index["word42"]) == list(loaded["word42"])
+        assert 1 == loaded.blocks_decompressed
+
+
+def test_postings_larger_than_block(tmpdir):
+    word_to_docs = {"big": list(range(0, 10 ** 5, 3)), "small": [1, 2], "tiny": [5]}
+    filepath = tmpdir.join("index.block").strpath
+    storage_policy = BlockStoragePolicy(encoding="utf8", codec="lzma", block_size=64)
+    storage_policy.dump(word_to_docs, filepath)
+
+    with storage_policy.load(filepath) as loaded:
+        assert word_to_docs == loaded
+
+
+def test_bad_codec():
+    with pytest.raises(ValueError):
+        BlockStoragePolicy(encoding="utf8", codec="zstd")
+
+
+def test_block_inverted_index_streaming_build(tmpdir):
+    dataset = tmpdir.join("dataset")
+    dataset.write("1\tarticle1 Hello world\n2\tarticle2 Hello\n3\tarticle3 world peace\n")
+    filepath = tmpdir.join("index").strpath
+    storage_policy = IIS.STORAGE_POLICIES["block-bz2"]()
+
+    IIS.build_inverted_index_on_disk(IIS.iter_documents(dataset.strpath), filepath,
+                                     storage_policy=storage_policy, memory_budget=1 << 20)
+    inverted_index = IIS.InvertedIndex.load(filepath, storage_policy=storage_policy)
+
+    assert [1] == inverted_index.query(["Hello", "world"])
+    assert [1, 3] == inverted_index.query(["wor*"])
@@ -0,0 +1,40 @@
+import pytest
+
+from bloom import BloomFilter
+
+
+def test_no_false_negatives():
+    words = [f"word{i}" for i in range(10000)]
+    bloom = BloomFilter.from_keys(words, error_rate=0.01)
+
+    assert all(word in bloom for word in words)
+
+
+@pytest.mark.parametrize("error_rate", [0.1, 0.01, 0.001])
+def test_false_positive_rate(error_rate):
+    bloom = BloomFilter.from_keys((f"word{i}" for i in range(10000)), error_rate=error_rate)
+
+    false_positives = sum(f"other{i}" in bloom for i in range(100000))
+    assert false_positives / 100000 < 2 * error_rate
+    # около 1.44 * log2(1 / error_rate) бит на слово
+    assert bloom.nbytes < 10000 * 2 * 1.44 * 10 / 8
+
+
+def test_dump_and_load(tmpdir):
+    filepath = tmpdir.join("index.bloom").strpath
+    bloom = BloomFilter.from_keys(["hello", "мир"])
+    bloom.dump(filepath)
+
+    loaded = BloomFilter.load(filepath)
+    assert (bloom.bit_count, bloom.hash_count) == (loaded.bit_count, loaded.hash_count)
+    assert "hello" in loaded and "мир" in loaded
+    loaded.add("world")
+    assert "world" in loaded
+
+
+def test_empty_and_bad_arguments(tmpdir):
+    assert "hello" not in BloomFilter.from_keys([])
+    with pytest.raises(ValueError):
+        BloomFilter.from_keys(["hello"], error_rate=0)
+    with pytest.raises(ValueError):
+        BloomFilter.from_bytes(b"\0" * 32)
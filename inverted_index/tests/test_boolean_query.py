@@ -0,0 +1,94 @@
+import random
+
+import pytest
+
+from boolean_query import And
+from boolean_query import Or
+from boolean_query import QuerySyntaxError
+from boolean_query import Term
+from boolean_query import and_query
+from boolean_query import boolean_query
+from boolean_query import parse_query
+from boolean_query import plan_query
+from postings import CompressedPostings
+from roaring import RoaringPostings
+
+
+@pytest.fixture()
+def sample_inverted_index() -> dict:
+    inverted_index = {"word": [1, 2, 4],
+                      "hello": [1, 2, 3],
+                      "covid": [2, 3, 4],
+                      "python": [2, 5],
+                      "rare": [2]}
+    return {word: CompressedPostings.from_sorted(docs)
+            for word, docs in inverted_index.items()}
+
+
+@pytest.mark.parametrize("text, expect", [
+    ("hello", [1, 2, 3]),
+    ("hello covid", [2, 3]),
+    ("hello AND covid", [2, 3]),
+    ("hello OR python", [1, 2, 3, 5]),
+    ("hello NOT covid", [1]),
+    ("(hello OR python) NOT word", [3, 5]),
+    ("covid AND (rare OR python)", [2]),
+    ("hello NOT (word OR covid)", []),
+    ("hello NOT unknown", [1, 2, 3]),
+    ("hello unknown", []),
+    ("unknown OR rare", [2]),
+    ("word AND NOT NOT rare", [2]),
+])
+def test_boolean_query(sample_inverted_index, text, expect):
+    assert expect == boolean_query(sample_inverted_index, text)
+
+
+@pytest.mark.parametrize("text", ["", "hello AND", "(hello", "hello)", "OR hello",
+                                  "NOT hello", "hello OR NOT world"])
+def test_syntax_error(sample_inverted_index, text):
+    with pytest.raises(QuerySyntaxError):
+        boolean_query(sample_inverted_index, text)
+
+
+def test_parse_precedence():
+    tree = parse_query("a b OR c NOT d")
+
+    assert isinstance(tree, Or)
+    assert isinstance(tree.children[0], And)
+    assert "c" == tree.children[1].positives[0].word
+
+
+def test_plan_orders_by_cost():
+    frequency = {"a": 100, "b": 5, "c": 50, "d": 7}.get
+
+    plan = plan_query(parse_query("a (b c) NOT d"), frequency)
+
+    assert isinstance(plan, And)
+    assert ["b", "c", "a"] == [child.word for child in plan.positives]
+    assert ["d"] == [child.word for child in plan.negatives]
+    assert 5 == plan.cost
+
+
+def test_plan_drops_empty_or_operands():
+    plan = plan_query(parse_query("a OR unknown"), {"a": 3}.get)
+
+    assert isinstance(plan, Term)
+
+
+def test_limit_matches_prefix_of_full_answer():
+    rnd = random.Random(5)
+    inverted_index = {}
+    for word in ["a", "b", "c", "d"]:
+        docs = sorted(rnd.sample(range(10000), rnd.randint(1000, 5000)))
+        inverted_index[word] = RoaringPostings.from_sorted(docs)
+
+    for text in ["a b", "a b NOT c", "(a OR b) c NOT d", "a OR d"]:
+        full = boolean_query(inverted_index, text)
+        for limit in [0, 1, 10, 1000, 100000]:
+            assert full[:limit] == boolean_query(inverted_index, text, limit)
+
+
+def test_and_query(sample_inverted_index):
+    assert [2, 3] == and_query(sample_inverted_index, ["hello", "covid"])
+    assert [2] == and_query(sample_inverted_index, ["hello", "covid"], limit=1)
+    assert [] == and_query(sample_inverted_index, [])
@@ -0,0 +1,68 @@
+import pytest
+
+import inverted_index as IIS
+from analyzer import Analyzer
+from document_store import DocumentStore
+from document_store import document_store_path
+
+
+@pytest.fixture()
+def dataset(tmpdir) -> str:
+    file = tmpdir.join("dataset")
+    file.write_binary("7\tarticle7    Hello world\r\n"
+                      "2\tстатья2 Привет мир\n"
+                      "5\tarticle5 ".encode("utf8") +
+                      " ".join(f"word{i}" for i in range(100)).encode("utf8") +
+                      b"\n10\tarticle10\n")
+    return file.strpath
+
+
+@pytest.fixture()
+def document_store(tmpdir, dataset) -> DocumentStore:
+    filepath = tmpdir.join("index.docs").strpath
+    IIS.build_document_store(dataset, filepath)
+    with DocumentStore(filepath) as store:
+        yield store
+
+
+def test_names_and_texts(document_store, dataset):
+    assert 4 == len(document_store)
+    assert dataset == document_store.dataset
+    assert ["article7", "статья2", "article5", "article10"] == \
+           [document_store.name(doc_id) for doc_id in (7, 2, 5, 10)]
+    assert "Hello world" == document_store.text(7)
+    assert "Привет мир" == document_store.text(2)
+    assert "" == document_store.text(10)
+    assert 3 not in document_store
+    with pytest.raises(KeyError):
+        document_store.name(3)
+
+
+def test_snippet(document_store):
+    analyzer = Analyzer(lowercase=True)
+
+    assert "Hello world" == document_store.snippet(7, {"world"})
+    assert "Привет мир" == document_store.snippet(2, {"мир"}, normalize=analyzer.normalize)
+
+    snippet = document_store.snippet(5, {"word50"}, width=30)
+    assert snippet.startswith("...") and snippet.endswith("...")
+    assert "word50" in snippet
+    assert len(snippet) < 50
+    assert document_store.snippet(5, {"unknown"}, width=30).startswith("word0 ")
+
+
+def test_changed_dataset_is_detected(tmpdir, dataset):
+    filepath = tmpdir.join("index.docs").strpath
+    IIS.build_document_store(dataset, filepath)
+
+    with open(dataset, "a") as f:
+        f.write("11\tarticle11 new\n")
+
+    with pytest.raises(ValueError):
+        DocumentStore(filepath)
+
+
+def test_document_store_path(tmpdir):
+    assert tmpdir.join("index").strpath + ".docs" == \
+           document_store_path(tmpdir.join("index").strpath)
+    assert tmpdir.join("documents.docs").strpath == document_store_path(tmpdir.strpath)
@@ -0,0 +1,68 @@
+import random
+import string
+
+import pytest
+
+import inverted_index as IIS
+from fuzzy import NgramIndex
+from fuzzy import levenshtein
+from fuzzy import ngrams
+
+
+def test_ngrams():
+    assert ["\x02\x02a", "\x02ab", "ab\x03", "b\x03\x03"] == ngrams("ab")
+    assert 5 + 3 - 1 == len(ngrams("hello"))
+
+
+@pytest.mark.parametrize("first, second, distance", [
+    ("", "", 0),
+    ("hello", "hello", 0),
+    ("hello", "helo", 1),
+    ("hello", "hallo", 1),
+    ("hello", "ehllo", 2),
+    ("kitten", "sitting", 3),
+    ("", "abc", 3),
+])
+def test_levenshtein(first, second, distance):
+    assert distance == levenshtein(first, second)
+    assert distance == levenshtein(second, first)
+    assert min(distance, 2) == levenshtein(first, second, limit=1)
+
+
+def test_similar_matches_brute_force(tmpdir):
+    rnd = random.Random(3)
+    terms = {"".join(rnd.choices(string.ascii_lowercase[:6], k=rnd.randint(1, 8)))
+             for _ in range(2000)}
+    fuzzy = NgramIndex.from_terms(terms)
+    filepath = tmpdir.join("index.fuzzy").strpath
+    fuzzy.dump(filepath)
+    loaded = NgramIndex.load(filepath)
+
+    for word in ["a", "abc", "fedcba", "abcdefab", "zzz"]:
+        for max_distance in (0, 1, 2):
+            expected = sorted((levenshtein(word, term), term) for term in terms
+                              if levenshtein(word, term) <= max_distance)
+            assert [term for _, term in expected] == fuzzy.similar(word, max_distance)
+            assert fuzzy.similar(word, max_distance) == loaded.similar(word, max_distance)
+
+
+def test_fuzzy_query(tmpdir):
+    docs = [IIS.Document(1, "a1", "hello world"),
+            IIS.Document(2, "a2", "hallo world"),
+            IIS.Document(3, "a3", "help wanted"),
+            IIS.Document(4, "a4", "yellow word")]
+    filepath = tmpdir.join("index").strpath
+    storage_policy = IIS.STORAGE_POLICIES["mmap"]()
+    IIS.build_inverted_index(docs, fuzzy=True).dump(filepath, storage_policy)
+    loaded = IIS.InvertedIndex.load(filepath, storage_policy=storage_policy)
+
+    assert [] == loaded.query(["helo"])
+    assert [1, 3] == loaded.fuzzy_query(["helo"])
+    assert [1, 2] == loaded.fuzzy_query(["helo", "wrld"], max_distance=2)
+    assert [1, 2, 4] == loaded.fuzzy_query(["worl"])
+    assert [1] == loaded.fuzzy_query(["worl"], limit=1)
+    assert [] == loaded.fuzzy_query(["xyzxyz"])
+
+    IIS.build_inverted_index(docs).dump(filepath, storage_policy)
+    with pytest.raises(ValueError):
+        IIS.InvertedIndex.load(filepath, storage_policy=storage_policy).fuzzy_query(["helo"])
@@ -138,4 +138,270 @@ def test_query_not_in_inverted_index():
     expect_docs = []
     docs = inverted_index.query(["ABS", "DDDDD"])
 
-    assert len(expect_docs) == len(docs)
\ No newline at end of file
+    assert len(expect_docs) == len(docs)
+
+def test_query_in_mmap_inverted_index(tmpdir, small_dataset):
+    path_to_dump = tmpdir.join("index").strpath
+
+    docs = small_dataset["list_docs"]
+    IIS.build_inverted_index(docs).dump(path_to_dump,
+                                        storage_policy=IIS.MmapStoragePolicy(encoding="utf8"))
+
+    inverted_index = IIS.InvertedIndex.load(path_to_dump,
+                                            storage_policy=IIS.MmapStoragePolicy(encoding="utf8"))
+
+    assert [1, 2] == inverted_index.query(["Hello"])
+    assert [2] == inverted_index.query(["world", "Hello"])
+    assert [] == inverted_index.query(["world", "covid"])
+
+
+def test_build_inverted_index_on_disk(tmpdir, small_dataset):
+    path_to_dump = tmpdir.join("index").strpath
+    storage_policy = IIS.MmapStoragePolicy(encoding="utf8")
+
+    documents = IIS.iter_documents(small_dataset["file_with_raw_docs"])
+    IIS.build_inverted_index_on_disk(documents, path_to_dump,
+                                     storage_policy=storage_policy,
+                                     memory_budget=256)
+
+    with storage_policy.load(path_to_dump) as real:
+        assert small_dataset["inverted_index"] == dict(real.items())
+
+
+def test_split_dataset(tmpdir, small_dataset):
+    path = small_dataset["file_with_raw_docs"]
+
+    ranges = IIS.split_dataset(path, 2)
+    documents = [doc for start, end in ranges
+                 for doc in IIS.iter_documents(path, start, end)]
+
+    assert 2 == len(ranges)
+    assert small_dataset["list_docs"] == documents
+
+
+def test_build_inverted_index_parallel(tmpdir, small_dataset):
+    storage_policy = IIS.MmapStoragePolicy(encoding="utf8")
+
+    single_path = tmpdir.join("single").strpath
+    docs = small_dataset["list_docs"]
+    IIS.build_inverted_index(docs).dump(single_path, storage_policy=storage_policy)
+
+    parallel_path = tmpdir.join("parallel").strpath
+    IIS.build_inverted_index_parallel(small_dataset["file_with_raw_docs"],
+                                      parallel_path,
+                                      storage_policy=storage_policy,
+                                      workers=3)
+
+    with open(single_path, "rb") as single, open(parallel_path, "rb") as parallel:
+        assert single.read() == parallel.read()
+
+
+def test_search_and_limit(small_dataset):
+    inverted_index = IIS.build_inverted_index(small_dataset["list_docs"])
+
+    assert [1] == inverted_index.search("Hello NOT world")
+    assert [2, 3] == inverted_index.search("world OR (how AND you)")
+    assert [1] == inverted_index.search("Hello OR how", limit=1)
+    assert [1] == inverted_index.query(["Hello"], limit=1)
+
+
+def test_dump_and_load_positions(tmpdir, small_dataset):
+    filepath = tmpdir.join("index").strpath
+    storage_policy = IIS.STORAGE_POLICIES["mmap"]()
+
+    inverted_index = IIS.build_inverted_index(small_dataset["list_docs"], positions=True)
+    inverted_index.dump(filepath, storage_policy=storage_policy)
+    loaded = IIS.InvertedIndex.load(filepath, storage_policy=storage_policy)
+
+    assert [3] == loaded.search('"are you"')
+    assert [] == loaded.search('"you are"')
+
+    # без позиций старый позиционный индекс удаляется
+    IIS.build_inverted_index(small_dataset["list_docs"]).dump(filepath, storage_policy)
+    assert not os.path.exists(filepath + ".pos")
+
+
+def test_dump_and_load_ranking(tmpdir, small_dataset):
+    filepath = tmpdir.join("index").strpath
+    storage_policy = IIS.STORAGE_POLICIES["mmap"]()
+
+    inverted_index = IIS.build_inverted_index(small_dataset["list_docs"], ranked=True)
+    inverted_index.dump(filepath, storage_policy=storage_policy)
+    loaded = IIS.InvertedIndex.load(filepath, storage_policy=storage_policy)
+
+    assert [2, 1] == [doc_id for doc_id, _ in loaded.top_k(["world", "Hello"], 5)]
+
+    IIS.build_inverted_index(small_dataset["list_docs"]).dump(filepath, storage_policy)
+    assert not os.path.exists(filepath + ".rank")
+    with pytest.raises(ValueError):
+        IIS.InvertedIndex.load(filepath, storage_policy=storage_policy).top_k(["Hello"], 1)
+
+
+def test_wildcard_query_in_trie_inverted_index(tmpdir, small_dataset):
+    filepath = tmpdir.join("index").strpath
+    storage_policy = IIS.STORAGE_POLICIES["trie"]()
+
+    IIS.build_inverted_index(small_dataset["list_docs"]).dump(filepath, storage_policy)
+    loaded = IIS.InvertedIndex.load(filepath, storage_policy=storage_policy)
+
+    assert [1, 2, 3] == loaded.query(["article*"])
+    assert [2] == loaded.query(["article?", "w*d"])
+    assert [] == loaded.query(["xyz*"])
+    assert [2, 3] == loaded.search("wor* OR y?u")
+
+
+def test_analyzer_is_saved_with_index(tmpdir, small_dataset):
+    filepath = tmpdir.join("index").strpath
+    storage_policy = IIS.STORAGE_POLICIES["mmap"]()
+    analyzer = IIS.Analyzer(lowercase=True, stop_words=["are"])
+
+    inverted_index = IIS.build_inverted_index(small_dataset["list_docs"], analyzer=analyzer)
+    inverted_index.dump(filepath, storage_policy=storage_policy)
+    loaded = IIS.InvertedIndex.load(filepath, storage_policy=storage_policy)
+
+    assert analyzer == loaded.analyzer
+    assert [1, 2] == loaded.query(["HELLO"])
+    assert [3] == loaded.query(["how", "are", "You"])
+    assert [] == loaded.query(["are"])
+    assert "are" not in loaded.word_in_docs_map
+
+    # анализатор по умолчанию в метаданных не записывается
+    IIS.build_inverted_index(small_dataset["list_docs"]).dump(filepath, storage_policy)
+    assert not os.path.exists(filepath + IIS.METADATA_SUFFIX)
+    assert IIS.Analyzer() == IIS.InvertedIndex.load(filepath, storage_policy).analyzer
+
+
+def test_build_with_unordered_and_large_doc_ids():
+    docs = [IIS.Document(2 ** 40, "b", "hello"),
+            IIS.Document(3, "a", "hello world"),
+            IIS.Document(7, "c", "world")]
+
+    inverted_index = IIS.build_inverted_index(docs)
+
+    assert [3, 2 ** 40] == inverted_index.query(["hello"])
+    assert [3, 7] == inverted_index.query(["world"])
+
+
+def test_build_with_nested_prefix_words(tmpdir):
+    docs = [IIS.Document(i, "doc", "a" * i) for i in range(1, 1500)]
+    filepath = tmpdir.join("index").strpath
+    storage_policy = IIS.STORAGE_POLICIES["trie"]()
+
+    inverted_index = IIS.build_inverted_index(docs)
+    assert [1000] == inverted_index.query(["a" * 1000])
+    assert [1497, 1498, 1499] == inverted_index.query(["a" * 1497 + "*"])
+
+    trie_index = IIS.build_inverted_index(docs, trie=True)
+    assert [1497, 1498, 1499] == trie_index.query(["a" * 1497 + "*"])
+
+    inverted_index.dump(filepath, storage_policy)
+    loaded = IIS.InvertedIndex.load(filepath, storage_policy=storage_policy)
+    assert [1000] == loaded.query(["a" * 1000])
+    assert [1497, 1498, 1499] == loaded.query(["a" * 1497 + "*"])
+
+
+@pytest.mark.parametrize("policy", sorted(IIS.STORAGE_POLICIES))
+def test_detect_storage_policy(tmpdir, small_dataset, policy):
+    filepath = tmpdir.join("index").strpath
+    IIS.build_inverted_index(small_dataset["list_docs"]).dump(filepath,
+                                                              IIS.STORAGE_POLICIES[policy]())
+
+    detected = IIS.detect_storage_policy(filepath)
+    loaded = IIS.InvertedIndex.load(filepath, storage_policy=IIS.STORAGE_POLICIES[detected]())
+
+    assert [2] == loaded.query(["Hello", "world"])
+    # кодек блоков берется из файла, любая block-политика читает любой кодек
+    assert detected == ("block-zlib" if policy.startswith("block-") else policy)
+
+
+def test_detect_storage_policy_of_directories(tmpdir, small_dataset):
+    sharded = tmpdir.join("sharded").strpath
+    IIS.build_sharded_index(small_dataset["file_with_raw_docs"], sharded,
+                            storage_policy=IIS.STORAGE_POLICIES["trie"](), shards=2)
+    segmented = tmpdir.join("segmented").strpath
+    index = IIS.SegmentedInvertedIndex(segmented, storage_policy=IIS.STORAGE_POLICIES["roaring"]())
+
+    assert "trie" == IIS.detect_storage_policy(sharded)
+    assert "mmap" == IIS.detect_storage_policy(segmented)
+    index.add_documents([(1, ["hello", "world"])])
+    assert "roaring" == IIS.detect_storage_policy(segmented)
+
+
+def test_query_cli_rejects_top_k_for_segmented_index(tmpdir, monkeypatch):
+    directory = tmpdir.join("segmented").strpath
+    IIS.SegmentedInvertedIndex(directory).add_documents([(1, ["hello", "world"])])
+    monkeypatch.setattr("sys.argv", ["inverted_index.py", "query", "--index", directory,
+                                     "--top-k", "5", "--query", "hello"])
+    arguments = IIS.parse_arguments()
+
+    with pytest.raises(ValueError, match="top-k queries are not supported"):
+        arguments.callback(arguments)
+
+
+def test_bloom_filter_is_saved_with_index(tmpdir, small_dataset):
+    filepath = tmpdir.join("index").strpath
+    storage_policy = IIS.STORAGE_POLICIES["mmap"]()
+
+    IIS.build_inverted_index(small_dataset["list_docs"]).dump(filepath, storage_policy)
+    assert os.path.exists(filepath + IIS.BLOOM_SUFFIX)
+    loaded = IIS.InvertedIndex.load(filepath, storage_policy=storage_policy)
+    assert all(word in loaded.bloom for word in small_dataset["inverted_index"])
+
+    def fail(words):
+        raise AssertionError("index must not be read")
+
+    loaded._query = fail
+    assert [] == loaded.query(["Hello", "unknown"])
+
+    IIS.build_inverted_index(small_dataset["list_docs"],
+                             bloom_error_rate=None).dump(filepath, storage_policy)
+    assert not os.path.exists(filepath + IIS.BLOOM_SUFFIX)
+    assert IIS.InvertedIndex.load(filepath, storage_policy).bloom is None
+
+
+def test_query_batch_matches_single_queries(tmpdir, small_dataset):
+    filepath = tmpdir.join("index").strpath
+    storage_policy = IIS.STORAGE_POLICIES["mmap"]()
+    IIS.build_inverted_index(small_dataset["list_docs"]).dump(filepath, storage_policy)
+    queries = [["Hello", "world"], ["Hello", "unknown"], ["Hel*"], ["you", "are"], []]
+
+    inverted_index = IIS.InvertedIndex.load(filepath, storage_policy=storage_policy)
+
+    assert [inverted_index.query(words) for words in queries] == \
+           inverted_index.query_batch(queries)
+
+
+def test_bloom_filter_on_disk_build(tmpdir, small_dataset):
+    filepath = tmpdir.join("index").strpath
+    storage_policy = IIS.STORAGE_POLICIES["mmap"]()
+
+    IIS.build_inverted_index_on_disk(IIS.iter_documents(small_dataset["file_with_raw_docs"]),
+                                     filepath, storage_policy=storage_policy,
+                                     memory_budget=1 << 20)
+    IIS._build_side_indexes(lambda: IIS.iter_documents(small_dataset["file_with_raw_docs"]),
+                            filepath, storage_policy=storage_policy)
+    loaded = IIS.InvertedIndex.load(filepath, storage_policy=storage_policy)
+
+    assert "world" in loaded.bloom
+    assert [2] == loaded.query(["Hello", "world"])
+    assert [] == loaded.query(["Hello", "unknown"])
+
+
+def test_side_indexes_on_disk_build(tmpdir, small_dataset):
+    storage_policy = IIS.STORAGE_POLICIES["mmap"]()
+    in_memory_path = tmpdir.join("in_memory").strpath
+    on_disk_path = tmpdir.join("on_disk").strpath
+
+    IIS.build_inverted_index(small_dataset["list_docs"], positions=True,
+                             ranked=True).dump(in_memory_path, storage_policy)
+    IIS.build_inverted_index_on_disk(IIS.iter_documents(small_dataset["file_with_raw_docs"]),
+                                     on_disk_path, storage_policy=storage_policy,
+                                     memory_budget=256)
+    IIS._build_side_indexes(lambda: IIS.iter_documents(small_dataset["file_with_raw_docs"]),
+                            on_disk_path, storage_policy=storage_policy,
+                            positions=True, ranked=True, memory_budget=256)
+
+    for suffix in (IIS.POSITIONS_SUFFIX, IIS.RANK_SUFFIX, IIS.RANK_SUFFIX + IIS.NORMS_SUFFIX):
+        with open(in_memory_path + suffix, "rb") as expect, \
+                open(on_disk_path + suffix, "rb") as real:
+            assert expect.read() == real.read()
@@ -0,0 +1,109 @@
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import inverted_index as IIS
+from batch_query import run_batch
+from numpy_postings import NumpyPostings
+from numpy_postings import NumpyStoragePolicy
+from postings import intersect
+from storage_policy import ColumnarStoragePolicy
+
+
+@pytest.fixture()
+def sample_inverted_index() -> dict:
+    rnd = random.Random(11)
+    return {"россия": [1, 2, 3, 4],
+            "hello": [1, 4],
+            "world": [1],
+            "common": list(range(0, 5000, 2)),
+            "rare": sorted(rnd.sample(range(5000), 40)),
+            "big": [2 ** 33, 2 ** 33 + 1]}
+
+
+def test_numpy_storage_policy(tmpdir, sample_inverted_index):
+    expect = sample_inverted_index
+    path_to_dump = tmpdir.join("dump_tmp").strpath
+
+    storage_policy = NumpyStoragePolicy(encoding="utf8")
+    storage_policy.dump(expect, path_to_dump)
+
+    with storage_policy.load(path_to_dump) as real:
+        assert len(expect) == len(real)
+        assert expect == {word: list(docs) for word, docs in real.items()}
+        assert 2500 == real.doc_count("common")
+        assert "covid" not in real
+
+
+def test_numpy_storage_policy_without_mmap(tmpdir, sample_inverted_index):
+    path_to_dump = tmpdir.join("dump_tmp").strpath
+
+    NumpyStoragePolicy(encoding="cp1251").dump(sample_inverted_index, path_to_dump)
+
+    real = NumpyStoragePolicy(encoding="cp1251", use_mmap=False).load(path_to_dump)
+
+    assert [1, 2, 3, 4] == list(real["россия"])
+
+
+def test_numpy_and_columnar_files_are_compatible(tmpdir, sample_inverted_index):
+    numpy_path = tmpdir.join("numpy").strpath
+    columnar_path = tmpdir.join("columnar").strpath
+    NumpyStoragePolicy(encoding="utf8").dump(sample_inverted_index, numpy_path)
+    ColumnarStoragePolicy(encoding="utf8").dump(sample_inverted_index, columnar_path)
+
+    # свой magic, чтобы формат определялся по заголовку
+    with open(numpy_path, "rb") as f:
+        assert NumpyStoragePolicy.magic == f.read(4) != ColumnarStoragePolicy.magic
+    assert sample_inverted_index == ColumnarStoragePolicy(encoding="utf8").load(numpy_path)
+    with NumpyStoragePolicy(encoding="utf8").load(columnar_path) as real:
+        assert sample_inverted_index == {word: list(docs) for word, docs in real.items()}
+
+
+def test_numpy_postings_and_or(sample_inverted_index):
+    common = NumpyPostings.from_sorted(sample_inverted_index["common"])
+    rare = NumpyPostings.from_sorted(sample_inverted_index["rare"])
+
+    expect_and = sorted(set(sample_inverted_index["common"]) & set(sample_inverted_index["rare"]))
+    expect_or = sorted(set(sample_inverted_index["common"]) | set(sample_inverted_index["rare"]))
+
+    assert expect_and == list(common & rare)
+    assert expect_or == list(common | rare)
+    assert expect_and == intersect([common, rare])
+
+
+def test_query_numpy_inverted_index(tmpdir, sample_inverted_index):
+    path_to_dump = tmpdir.join("dump_tmp").strpath
+    storage_policy = NumpyStoragePolicy(encoding="utf8")
+
+    inverted_index = IIS.InvertedIndex()
+    inverted_index.word_in_docs_map = sample_inverted_index
+    inverted_index.dump(path_to_dump, storage_policy=storage_policy)
+
+    inverted_index = IIS.InvertedIndex.load(path_to_dump, storage_policy=storage_policy)
+
+    assert [4] == inverted_index.query(["hello", "россия", "common"])
+    assert [] == inverted_index.query(["hello", "covid"])
+
+
+def test_run_batch_numpy_inverted_index(tmpdir, sample_inverted_index):
+    queries = [["hello", "россия", "common"],
+               ["common", "rare"],
+               ["hello", "covid"],
+               ["россия", "hello"]]
+    expect = [[4],
+              sorted(set(sample_inverted_index["common"]) & set(sample_inverted_index["rare"])),
+              [],
+              [1, 4]]
+
+    path_to_dump = tmpdir.join("dump_tmp").strpath
+    storage_policy = NumpyStoragePolicy(encoding="utf8")
+    storage_policy.dump(sample_inverted_index, path_to_dump)
+
+    with storage_policy.load(path_to_dump) as inverted_index:
+        assert expect == run_batch(inverted_index, queries)
+        assert expect == run_batch(inverted_index, queries,
+                                   workers=2,
+                                   index_path=path_to_dump,
+                                   storage_policy=storage_policy)
@@ -0,0 +1,66 @@
+import io
+import threading
+
+import pytest
+
+from pipeline import run_pipeline
+
+
+def test_results_are_written_in_order():
+    output = io.StringIO()
+    count = run_pipeline((str(i) for i in range(10000)),
+                         lambda chunk: "".join(item + "\n" for item in chunk),
+                         output, chunk_size=7, queue_size=2, buffer_size=100)
+
+    assert 10000 == count
+    assert [str(i) for i in range(10000)] == output.getvalue().split()
+
+
+def test_source_is_read_lazily():
+    read = []
+    gate = threading.Event()
+
+    def source():
+        for i in range(1000):
+            read.append(i)
+            yield i
+
+    def process(chunk):
+        gate.wait()
+        return ""
+
+    output = io.StringIO()
+    thread = threading.Thread(target=run_pipeline,
+                              args=(source(), process, output),
+                              kwargs=dict(chunk_size=10, queue_size=2))
+    thread.start()
+    thread.join(timeout=0.5)
+    # в очереди и в обработке не больше нескольких порций
+    assert len(read) <= 10 * 5
+    gate.set()
+    thread.join()
+    assert 1000 == len(read)
+
+
+def test_errors_are_raised():
+    def bad_source():
+        yield "1"
+        raise UnicodeDecodeError("utf8", b"\xff", 0, 1, "invalid start byte")
+
+    with pytest.raises(UnicodeDecodeError):
+        run_pipeline(bad_source(), "".join, io.StringIO(), chunk_size=1)
+
+    def bad_process(chunk):
+        raise ValueError("bad query")
+
+    with pytest.raises(ValueError):
+        run_pipeline(map(str, range(10000)), bad_process, io.StringIO(),
+                     chunk_size=1, queue_size=1)
+
+    class BrokenOutput(io.StringIO):
+        def write(self, text):
+            raise BrokenPipeError()
+
+    with pytest.raises(BrokenPipeError):
+        run_pipeline(map(str, range(10000)), "".join, BrokenOutput(),
+                     chunk_size=1, queue_size=1, buffer_size=1)
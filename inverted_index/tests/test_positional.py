@@ -0,0 +1,87 @@
+import pytest
+
+from boolean_query import boolean_query
+from positional import PositionalPostings
+from positional import PositionalStoragePolicy
+from positional import build_positional_index
+from positional import build_positional_index_on_disk
+from positional import match_positions
+from postings import CompressedPostings
+
+
+@pytest.fixture()
+def documents() -> list:
+    return [(1, "new york city".split()),
+            (2, "york new".split()),
+            (3, "new big york new york".split()),
+            (4, "new very big old york".split())]
+
+
+@pytest.fixture()
+def word_to_docs(documents) -> dict:
+    mapping = {}
+    for doc_id, words in documents:
+        for word in words:
+            mapping.setdefault(word, set()).add(doc_id)
+    return {word: CompressedPostings.from_iterable(docs) for word, docs in mapping.items()}
+
+
+def test_positional_postings_round_trip():
+    positional = PositionalPostings.from_dict({7: [0, 5, 300], 2: [1]})
+
+    restored = PositionalPostings.from_bytes(memoryview(positional.to_bytes()))
+
+    assert positional == restored
+    assert [2, 7] == list(restored)
+    assert [0, 5, 300] == restored.positions(7)
+    assert [] == restored.positions(3)
+    assert [7] == restored.filter_sorted([3, 7, 9])
+
+
+@pytest.mark.parametrize("positions_lists, slop, expect", [
+    ([[0], [1]], 0, True),
+    ([[1], [0]], 0, False),
+    ([[0], [2]], 0, False),
+    ([[0], [2]], 1, True),
+    ([[0, 10], [3, 12], [13]], 1, True),
+    # жадный выбор первого подходящего вхождения здесь ошибся бы
+    ([[1], [2, 5], [9]], 3, True),
+])
+def test_match_positions(positions_lists, slop, expect):
+    assert expect == match_positions(positions_lists, slop)
+
+
+@pytest.mark.parametrize("text, expect", [
+    ('"new york"', [1, 3]),
+    ('"york new"', [2, 3]),
+    ('"new york"~1', [1, 3]),
+    ('"new york"~3', [1, 3, 4]),
+    ('"new york city"', [1]),
+    ('"new york" NOT city', [3]),
+    ('"big york" OR "york city"', [1, 3]),
+    ('"new"', [1, 2, 3, 4]),
+    ('"new unknown"', []),
+])
+def test_phrase_query(tmpdir, documents, word_to_docs, text, expect):
+    filepath = tmpdir.join("positions").strpath
+    PositionalStoragePolicy("utf8").dump(build_positional_index(documents), filepath)
+
+    with PositionalStoragePolicy("utf8").load(filepath) as positions:
+        assert expect == boolean_query(word_to_docs, text, positional_mapping=positions)
+
+
+def test_phrase_query_needs_positions(word_to_docs):
+    with pytest.raises(ValueError):
+        boolean_query(word_to_docs, '"new york"')
+
+
+@pytest.mark.parametrize("memory_budget", [None, 64])
+def test_build_positional_index_on_disk(tmpdir, documents, memory_budget):
+    expect_path = tmpdir.join("expect").strpath
+    real_path = tmpdir.join("real").strpath
+    PositionalStoragePolicy("utf8").dump(build_positional_index(documents), expect_path)
+
+    build_positional_index_on_disk(reversed(documents), real_path, memory_budget=memory_budget)
+
+    with open(expect_path, "rb") as expect, open(real_path, "rb") as real:
+        assert expect.read() == real.read()
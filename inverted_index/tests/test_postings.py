@@ -0,0 +1,94 @@
+import random
+
+import pytest
+
+from postings import BLOCK_SIZE
+from postings import CompressedPostings
+from postings import decode_varint
+from postings import encode_varint
+from postings import intersect
+
+
+@pytest.fixture()
+def long_postings() -> list:
+    rnd = random.Random(42)
+    return sorted(rnd.sample(range(1, 100000), 3 * BLOCK_SIZE + 17))
+
+
+def test_varint_round_trip():
+    values = [0, 1, 127, 128, 300, 2 ** 32, 2 ** 40 + 5]
+
+    buf = bytearray()
+    for value in values:
+        encode_varint(value, buf)
+
+    real = []
+    pos = 0
+    while pos < len(buf):
+        value, pos = decode_varint(buf, pos)
+        real.append(value)
+
+    assert values == real
+
+
+def test_compressed_postings_round_trip(long_postings):
+    postings = CompressedPostings.from_sorted(long_postings)
+
+    assert len(long_postings) == len(postings)
+    assert long_postings == list(postings)
+    assert long_postings == postings
+
+
+def test_compressed_postings_to_bytes(long_postings):
+    postings = CompressedPostings.from_sorted(long_postings)
+
+    restored = CompressedPostings.from_bytes(memoryview(postings.to_bytes()))
+
+    assert postings == restored
+    assert long_postings == list(restored)
+
+
+def test_compressed_postings_smaller_than_list(long_postings):
+    postings = CompressedPostings.from_sorted(long_postings)
+
+    assert postings.nbytes < 8 * len(long_postings)
+
+
+def test_compressed_postings_from_iterable():
+    postings = CompressedPostings.from_iterable([5, 1, 3, 1, 5])
+
+    assert [1, 3, 5] == list(postings)
+
+
+def test_compressed_postings_raise_on_unsorted():
+    with pytest.raises(ValueError):
+        CompressedPostings.from_sorted([1, 3, 2])
+
+
+def test_compressed_postings_contains(long_postings):
+    postings = CompressedPostings.from_sorted(long_postings)
+    doc_ids = set(long_postings)
+
+    for doc_id in range(0, long_postings[-1] + 2, 997):
+        assert (doc_id in doc_ids) == (doc_id in postings)
+    assert long_postings[0] in postings
+    assert long_postings[-1] in postings
+
+
+def test_intersect(long_postings):
+    other = list(range(0, 100000, 3))
+    small = long_postings[::5]
+
+    expect = sorted(set(long_postings) & set(other) & set(small))
+    real = intersect([CompressedPostings.from_sorted(long_postings),
+                      CompressedPostings.from_sorted(other),
+                      CompressedPostings.from_sorted(small)])
+
+    assert expect == real
+
+
+def test_intersect_with_empty(long_postings):
+    real = intersect([CompressedPostings.from_sorted(long_postings),
+                      CompressedPostings.from_sorted([])])
+
+    assert [] == real
@@ -0,0 +1,67 @@
+import pytest
+
+import inverted_index as IIS
+from query_cache import QueryCache
+
+
+@pytest.fixture()
+def cached_inverted_index():
+    inverted_index = IIS.InvertedIndex(cache=QueryCache(max_entries=2))
+    inverted_index.word_in_docs_map = {"word": [1, 2, 4],
+                                       "hello": [1, 2, 3],
+                                       "covid": [2, 3, 4],
+                                       "python": [2, 5]}
+    return inverted_index
+
+
+def test_query_cache_hit_order_independent(cached_inverted_index):
+    cache = cached_inverted_index.cache
+
+    assert [1, 2] == cached_inverted_index.query(["hello", "word"])
+    assert [1, 2] == cached_inverted_index.query(["word", "hello", "word"])
+
+    assert 1 == cache.hits
+    assert 1 == cache.misses
+
+
+def test_query_cache_partial_hit(cached_inverted_index):
+    cache = cached_inverted_index.cache
+
+    cached_inverted_index.query(["hello", "word"])
+    assert [2] == cached_inverted_index.query(["hello", "word", "covid"])
+
+    assert 1 == cache.partial_hits
+
+
+def test_query_cache_lru_eviction(cached_inverted_index):
+    cache = cached_inverted_index.cache
+
+    cached_inverted_index.query(["hello", "word"])
+    cached_inverted_index.query(["hello", "covid"])
+    cached_inverted_index.query(["hello", "word"])
+    cached_inverted_index.query(["python", "covid"])
+
+    assert 1 == cache.evictions
+    assert frozenset(["hello", "word"]) in cache
+    assert frozenset(["hello", "covid"]) not in cache
+
+
+def test_query_cache_memory_eviction():
+    cache = QueryCache(max_entries=None, max_bytes=1000)
+
+    cache.put(frozenset(["a"]), list(range(50)))
+    cache.put(frozenset(["b"]), list(range(50)))
+
+    assert 1 == len(cache)
+    assert cache.nbytes <= 1000
+    assert 1 == cache.evictions
+
+
+def test_query_cache_cleared_on_reload(cached_inverted_index):
+    cache = cached_inverted_index.cache
+    cached_inverted_index.query(["hello", "word"])
+
+    cached_inverted_index.word_in_docs_map = {"hello": [7], "word": [7]}
+
+    assert 0 == len(cache)
+    assert [7] == cached_inverted_index.query(["hello", "word"])
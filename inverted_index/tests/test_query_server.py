@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import inverted_index as IIS
+from query_client import QueryClient
+from query_server import start_server
+
+
+@pytest.fixture()
+def sample_inverted_index():
+    inverted_index = IIS.InvertedIndex()
+    inverted_index.word_in_docs_map = {"word": [1, 4],
+                                       "hello": [1, 2],
+                                       "россия": [3, 4]}
+    return inverted_index
+
+
+def test_server_pipelined_queries(sample_inverted_index):
+    async def scenario():
+        server = await start_server(sample_inverted_index, host="127.0.0.1", port=0)
+        port = server.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write("hello word\n\nроссия\nhello covid\n".encode("utf8"))
+        await writer.drain()
+        answers = [await reader.readline() for _ in range(4)]
+
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return answers
+
+    answers = asyncio.run(scenario())
+
+    assert [b"1\n", b"\n", b"3,4\n", b"\n"] == answers
+
+
+def test_query_client_over_unix_socket(tmpdir, sample_inverted_index):
+    socket_path = tmpdir.join("index.sock").strpath
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(start_server(sample_inverted_index,
+                                                  unix_socket=socket_path))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    try:
+        with QueryClient(unix_socket=socket_path) as client:
+            assert [1, 2] == client.query(["hello"])
+
+        with QueryClient(unix_socket=socket_path) as client:
+            answers = list(client.query_many(["hello word", "word", "covid"]))
+
+        assert [b"1\n", b"1,4\n", b"\n"] == answers
+    finally:
+        server.close()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+class _FailingIndex:
+    """Индекс, который падает на слове fail и долго считает слово slow"""
+    def __init__(self):
+        self.slow_started = threading.Event()
+        self.release = threading.Event()
+
+    def query(self, words):
+        if "fail" in words:
+            raise ValueError("broken postings")
+        if "slow" in words:
+            self.slow_started.set()
+            self.release.wait(5)
+        return [len(words)]
+
+
+def test_server_reports_errors_and_keeps_serving():
+    inverted_index = _FailingIndex()
+
+    async def scenario():
+        server = await start_server(inverted_index, host="127.0.0.1", port=0)
+        port = server.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"a b\nfail\nc\n")
+        await writer.drain()
+        answers = [await reader.readline() for _ in range(3)]
+
+        # долгий запрос не останавливает цикл событий: иначе запрос
+        # отпустят только по истечении таймаута ожидания
+        started = time.monotonic()
+        writer.write(b"slow\n")
+        await writer.drain()
+        await asyncio.get_running_loop().run_in_executor(None, inverted_index.slow_started.wait, 5)
+        inverted_index.release.set()
+        answers.append(await reader.readline())
+        assert time.monotonic() - started < 4
+
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return answers
+
+    answers = asyncio.run(scenario())
+
+    assert [b"2\n", b"error: ValueError: broken postings\n", b"1\n", b"1\n"] == answers
+
+
+def test_query_client_raises_on_error_response():
+    with pytest.raises(ValueError):
+        QueryClient._parse(b"error: ValueError: broken postings\n")
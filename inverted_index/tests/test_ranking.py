@@ -0,0 +1,122 @@
+import math
+import random
+
+import pytest
+
+from ranking import NORMS_SUFFIX
+from ranking import CollectionStats
+from ranking import DocumentNorms
+from ranking import RankedIndex
+from ranking import ScoredPostings
+from ranking import build_ranked_index_on_disk
+
+
+@pytest.fixture(scope="module")
+def random_documents() -> list:
+    rnd = random.Random(11)
+    vocabulary = [f"word{i}" for i in range(300)]
+    weights = [1 / (i + 1) for i in range(len(vocabulary))]
+    return [(doc_id, rnd.choices(vocabulary, weights, k=rnd.randint(3, 40)))
+            for doc_id in range(1, 3001)]
+
+
+@pytest.fixture(scope="module")
+def ranked_index(random_documents) -> RankedIndex:
+    return RankedIndex.build(random_documents)
+
+
+def _expected_top_k(ranked: RankedIndex, words: list, k: int, stats=None) -> list:
+    scores = ranked.score_all(words, stats)
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+
+def _assert_same_ranking(expect: list, real: list):
+    assert [doc_id for doc_id, _ in expect] == [doc_id for doc_id, _ in real]
+    for (_, expect_score), (_, real_score) in zip(expect, real):
+        assert math.isclose(expect_score, real_score, rel_tol=1e-9)
+
+
+def test_scored_postings_round_trip():
+    norms = DocumentNorms(list(range(1, 301)), [10] * 300)
+    doc_tfs = [(doc_id, doc_id % 7 + 1) for doc_id in range(1, 301, 2)]
+
+    postings = ScoredPostings.from_frequencies(doc_tfs, norms)
+    restored = ScoredPostings.from_bytes(memoryview(postings.to_bytes()))
+
+    assert postings == restored
+    assert doc_tfs == list(restored.items())
+    assert [doc_id for doc_id, _ in doc_tfs] == list(restored)
+    assert [3, 5] == restored.filter_sorted([2, 3, 4, 5, 1000])
+    assert math.isclose(norms.tf_score(7, 10), restored.max_score, rel_tol=1e-6)
+    assert restored.max_score >= norms.tf_score(7, 10)
+
+
+def test_top_k_prefers_rare_and_frequent_words():
+    ranked = RankedIndex.build([(1, ["hello", "world"]),
+                                (2, ["hello"]),
+                                (3, ["world", "world", "rare"]),
+                                (4, ["filler"])])
+
+    top = ranked.top_k(["hello", "rare"], k=2)
+
+    assert [3, 2] == [doc_id for doc_id, _ in top]
+    assert [] == ranked.top_k(["unknown"], k=5)
+    assert [] == ranked.top_k(["hello"], k=0)
+
+
+@pytest.mark.parametrize("words", [["word0", "word1"],
+                                   ["word0", "word150"],
+                                   ["word3", "word10", "word299", "word0"],
+                                   ["word42"],
+                                   ["word1", "unknown"]])
+@pytest.mark.parametrize("k", [1, 10, 100])
+def test_top_k_matches_exhaustive_scoring(ranked_index, words, k):
+    expect = _expected_top_k(ranked_index, words, k)
+
+    _assert_same_ranking(expect, ranked_index.top_k(words, k))
+
+
+@pytest.mark.parametrize("words", [["word0", "word1"],
+                                   ["word3", "word10", "word299", "word0"],
+                                   ["word42"]])
+def test_parts_with_collection_stats_match_whole_index(random_documents, ranked_index, words):
+    # части с разной средней длиной документа
+    short = RankedIndex.build(doc for doc in random_documents if len(doc[1]) < 10)
+    long = RankedIndex.build(doc for doc in random_documents if len(doc[1]) >= 10)
+    stats = CollectionStats.merge([short.collection_stats(words), long.collection_stats(words)])
+
+    merged = sorted(short.top_k(words, 20, stats) + long.top_k(words, 20, stats),
+                    key=lambda item: (-item[1], item[0]))[:20]
+
+    assert len(random_documents) == stats.doc_count
+    _assert_same_ranking(ranked_index.top_k(words, 20), merged)
+    # границы блоков короткой части увеличены под большую среднюю длину
+    for part in (short, long):
+        _assert_same_ranking(_expected_top_k(part, words, 5, stats), part.top_k(words, 5, stats))
+
+
+def test_dump_and_load(tmpdir, ranked_index):
+    filepath = tmpdir.join("index.rank").strpath
+    ranked = ranked_index
+    ranked.dump(filepath)
+
+    loaded = RankedIndex.load(filepath)
+
+    assert len(ranked.norms) == len(loaded.norms)
+    assert ranked.norms.avg_length == loaded.norms.avg_length
+    words = ["word2", "word20", "word200"]
+    _assert_same_ranking(ranked.top_k(words, 10), loaded.top_k(words, 10))
+
+
+@pytest.mark.parametrize("memory_budget", [None, 4096])
+def test_build_ranked_index_on_disk(tmpdir, random_documents, ranked_index, memory_budget):
+    expect_path = tmpdir.join("expect.rank").strpath
+    real_path = tmpdir.join("real.rank").strpath
+    ranked_index.dump(expect_path)
+    documents = random_documents[1::2] + random_documents[::2]
+
+    build_ranked_index_on_disk(documents, real_path, memory_budget=memory_budget)
+
+    for suffix in ("", NORMS_SUFFIX):
+        with open(expect_path + suffix, "rb") as expect, open(real_path + suffix, "rb") as real:
+            assert expect.read() == real.read()
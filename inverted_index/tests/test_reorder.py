@@ -0,0 +1,161 @@
+import os
+import random
+import struct
+
+import pytest
+
+import inverted_index as IIS
+from reorder import DocumentMap
+from reorder import bisection_order
+from reorder import minhash_order
+
+
+@pytest.fixture()
+def clustered_dataset(tmpdir) -> str:
+    """Документы ста тем вперемешку"""
+    rnd = random.Random(7)
+    topics = [[f"topic{t}word{i}" for i in range(30)] for t in range(100)]
+    file = tmpdir.join("dataset")
+    file.write("".join(f"{doc_id}\tarticle{doc_id} " +
+                       " ".join(rnd.sample(topics[rnd.randrange(100)], 10)) + "\n"
+                       for doc_id in range(1, 3001)))
+    return file.strpath
+
+
+def test_document_map(tmpdir):
+    filepath = tmpdir.join("index.docmap").strpath
+    DocumentMap([7, 3, 5]).dump(filepath)
+
+    doc_map = DocumentMap.load(filepath)
+    assert 3 == len(doc_map)
+    assert 7 == doc_map[1] and 5 == doc_map[3]
+    assert [3, 5, 7] == doc_map.external([3, 2, 1])
+    with pytest.raises(IndexError):
+        doc_map[0]
+    doc_map.close()
+
+    external_ids = [5, 2 ** 64 - 1, 1, 2 ** 40, 3]
+    DocumentMap(external_ids).dump(filepath)
+    assert external_ids == list(DocumentMap.load(filepath).external_ids)
+
+
+def test_document_map_reads_uint64_version(tmpdir):
+    filepath = tmpdir.join("index.docmap").strpath
+    with open(filepath, "wb") as f:
+        f.write(DocumentMap.header.pack(DocumentMap.magic, 1, 3))
+        f.write(struct.pack("<3Q", 7, 3, 5))
+
+    doc_map = DocumentMap.load(filepath)
+    assert [7, 3, 5] == list(doc_map.external_ids)
+    doc_map.close()
+
+
+def _files_size(filepath: str) -> int:
+    """Размер индекса со всеми файлами рядом"""
+    directory, name = os.path.split(filepath)
+    return sum(os.path.getsize(os.path.join(directory, file))
+               for file in os.listdir(directory) if file.startswith(name))
+
+
+@pytest.mark.parametrize("order", [bisection_order, minhash_order])
+def test_order_groups_similar_documents(order):
+    # документы двух тем чередуются
+    rnd = random.Random(1)
+    doc_terms = [rnd.sample(range(6), 3) if doc % 2 else rnd.sample(range(6, 12), 3)
+                 for doc in range(64)]
+
+    ordered = order(doc_terms)
+
+    assert sorted(ordered) == list(range(64))
+    # документы одной темы идут подряд
+    changes = sum(ordered[i] % 2 != ordered[i + 1] % 2 for i in range(63))
+    assert changes == 1
+
+
+@pytest.mark.parametrize("method", ["bisection", "minhash"])
+def test_optimize_keeps_answers(tmpdir, clustered_dataset, method):
+    storage_policy = IIS.STORAGE_POLICIES["mmap"]()
+    filepath = tmpdir.join("index").strpath
+    optimized_path = tmpdir.join("optimized").strpath
+    inverted_index = IIS.build_inverted_index(IIS.load_documents(clustered_dataset),
+                                              positions=True, ranked=True, fuzzy=True)
+    inverted_index.dump(filepath, storage_policy)
+    IIS.build_document_store(clustered_dataset, filepath + IIS.DOCS_SUFFIX)
+
+    IIS.optimize_index(filepath, optimized_path, storage_policy, method=method)
+    original = IIS.InvertedIndex.load(filepath, storage_policy)
+    optimized = IIS.InvertedIndex.load(optimized_path, storage_policy)
+
+    assert optimized.doc_map is not None
+    assert os.path.getsize(optimized_path) < os.path.getsize(filepath)
+    assert os.path.exists(optimized_path + IIS.DOCS_SUFFIX)
+    assert optimized.bloom is not None and optimized.fuzzy is not None
+    for words in (["topic1word1"], ["topic2word3", "topic2word4"], ["article5"], ["unknown"]):
+        assert original.query(words) == optimized.query(words)
+        for k in (1, 5, 10 ** 6):
+            assert original.top_k(words, k) == optimized.top_k(words, k)
+    for text in ("topic3word1 OR topic4word2", "topic3word1 NOT topic3word2",
+                 '"topic3word1 topic3word2"~5'):
+        assert original.search(text) == optimized.search(text)
+    assert original.fuzzy_query(["topic5word1x"]) == optimized.fuzzy_query(["topic5word1x"])
+
+
+@pytest.mark.parametrize("method", ["bisection", "minhash"])
+def test_optimize_does_not_grow_index(tmpdir, clustered_dataset, method):
+    storage_policy = IIS.STORAGE_POLICIES["mmap"]()
+    filepath = tmpdir.join("index").strpath
+    optimized_path = tmpdir.join("optimized").strpath
+    IIS.build_inverted_index(IIS.load_documents(clustered_dataset)).dump(filepath, storage_policy)
+
+    IIS.optimize_index(filepath, optimized_path, storage_policy, method=method)
+
+    assert os.path.exists(optimized_path + IIS.DOC_MAP_SUFFIX)
+    assert _files_size(optimized_path) < _files_size(filepath)
+
+
+def test_optimize_keeps_limited_answers(tmpdir, clustered_dataset):
+    storage_policy = IIS.STORAGE_POLICIES["mmap"]()
+    filepath = tmpdir.join("index").strpath
+    optimized_path = tmpdir.join("optimized").strpath
+    IIS.build_inverted_index(IIS.load_documents(clustered_dataset),
+                             fuzzy=True).dump(filepath, storage_policy)
+
+    IIS.optimize_index(filepath, optimized_path, storage_policy, method="minhash")
+    original = IIS.InvertedIndex.load(filepath, storage_policy)
+    optimized = IIS.InvertedIndex.load(optimized_path, storage_policy)
+
+    for limit in (1, 3, 10):
+        for words in (["topic1word1"], ["topic2word3", "topic2word4"], ["topic7word*"]):
+            expect = original.query(words)[:limit]
+            assert expect == original.query(words, limit=limit)
+            assert expect == optimized.query(words, limit=limit)
+        text = "topic3word1 OR topic4word2"
+        assert original.search(text, limit) == optimized.search(text, limit)
+        assert original.fuzzy_query(["topic5word1x"], limit=limit) == \
+               optimized.fuzzy_query(["topic5word1x"], limit=limit)
+
+
+def test_optimize_in_place_twice(tmpdir, clustered_dataset):
+    storage_policy = IIS.STORAGE_POLICIES["mmap"]()
+    filepath = tmpdir.join("index").strpath
+    IIS.build_inverted_index(IIS.load_documents(clustered_dataset)).dump(filepath, storage_policy)
+    expected = IIS.InvertedIndex.load(filepath, storage_policy).query(["topic1word1"])
+
+    IIS.optimize_index(filepath, filepath, storage_policy, method="minhash")
+    IIS.optimize_index(filepath, filepath, storage_policy)
+
+    assert expected == IIS.InvertedIndex.load(filepath, storage_policy).query(["topic1word1"])
+
+
+def test_optimize_sharded_index(tmpdir, clustered_dataset):
+    storage_policy = IIS.STORAGE_POLICIES["mmap"]()
+    directory = tmpdir.join("sharded").strpath
+    optimized = tmpdir.join("optimized").strpath
+    IIS.build_sharded_index(clustered_dataset, directory, storage_policy, shards=2)
+
+    IIS.optimize_index(directory, optimized, storage_policy)
+
+    open_shard = lambda path: IIS.InvertedIndex.load(path, storage_policy)  # noqa: E731
+    with IIS.ShardedInvertedIndex(directory, open_shard, workers=0) as original, \
+            IIS.ShardedInvertedIndex(optimized, open_shard, workers=0) as reordered:
+        assert original.query(["topic1word1"]) == reordered.query(["topic1word1"])
@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+from postings import CompressedPostings
+from postings import intersect
+from roaring import ARRAY_LIMIT
+from roaring import RoaringPostings
+
+
+@pytest.fixture()
+def dense_doc_ids() -> list:
+    # два чанка: плотный (bitmap) и разреженный (array)
+    return list(range(0, 2 * ARRAY_LIMIT, 1)) + list(range(70000, 80000, 7))
+
+
+@pytest.fixture()
+def sparse_doc_ids() -> list:
+    rnd = random.Random(5)
+    return sorted(rnd.sample(range(0, 200000), 300))
+
+
+def test_roaring_round_trip(dense_doc_ids):
+    postings = RoaringPostings.from_sorted(dense_doc_ids)
+
+    assert len(dense_doc_ids) == len(postings)
+    assert dense_doc_ids == list(postings)
+    assert 1 == postings.bitmap_count()
+
+
+def test_roaring_to_bytes(dense_doc_ids):
+    postings = RoaringPostings.from_sorted(dense_doc_ids)
+
+    restored = RoaringPostings.from_bytes(memoryview(postings.to_bytes()))
+
+    assert dense_doc_ids == list(restored)
+
+
+def test_roaring_and(dense_doc_ids, sparse_doc_ids):
+    expect = sorted(set(dense_doc_ids) & set(sparse_doc_ids))
+
+    real = RoaringPostings.from_sorted(dense_doc_ids) & RoaringPostings.from_sorted(sparse_doc_ids)
+
+    assert expect == list(real)
+
+
+def test_roaring_and_bitmaps():
+    first = list(range(0, 60000, 2))
+    second = list(range(0, 60000, 3))
+    expect = sorted(set(first) & set(second))
+
+    real = RoaringPostings.from_sorted(first) & RoaringPostings.from_sorted(second)
+
+    assert expect == list(real)
+
+
+def test_roaring_filter_sorted(dense_doc_ids, sparse_doc_ids):
+    expect = sorted(set(dense_doc_ids) & set(sparse_doc_ids))
+
+    real = RoaringPostings.from_sorted(dense_doc_ids).filter_sorted(sparse_doc_ids)
+
+    assert expect == real
+    assert dense_doc_ids[5] in RoaringPostings.from_sorted(dense_doc_ids)
+
+
+def test_intersect_mixed_postings(dense_doc_ids, sparse_doc_ids):
+    odd = list(range(1, 200000, 2))
+    expect = sorted(set(dense_doc_ids) & set(sparse_doc_ids) & set(odd))
+
+    real = intersect([RoaringPostings.from_sorted(dense_doc_ids),
+                      CompressedPostings.from_sorted(sparse_doc_ids),
+                      RoaringPostings.from_sorted(odd)])
+
+    assert expect == real
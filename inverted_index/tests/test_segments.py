@@ -0,0 +1,155 @@
+import os
+import random
+
+import pytest
+
+from analyzer import Analyzer
+from query_cache import QueryCache
+from segments import SegmentedInvertedIndex
+from storage_policy import RoaringStoragePolicy
+from storage_policy import StructStoragePolicy
+
+
+def _expected_query(documents: dict, words: list) -> list:
+    return sorted(doc_id for doc_id, doc_words in documents.items()
+                  if set(words) <= set(doc_words))
+
+
+def test_add_and_query(tmpdir):
+    index = SegmentedInvertedIndex(tmpdir.strpath)
+    index.add_documents([(1, ["hello", "world"]), (2, ["hello"])])
+    index.add_documents([(3, ["hello", "world"])])
+
+    assert [1, 2, 3] == index.query(["hello"])
+    assert [1, 3] == index.query(["hello", "world"])
+    assert [] == index.query(["unknown"])
+    assert 2 == len(index.segments)
+
+
+def test_delete_documents(tmpdir):
+    index = SegmentedInvertedIndex(tmpdir.strpath)
+    index.add_documents([(1, ["hello", "world"]), (2, ["hello"])])
+    index.add_documents([(3, ["hello"])])
+
+    index.delete_documents([2, 3, 100])
+
+    assert [1] == index.query(["hello"])
+    assert 1 == len(index)
+
+
+def test_readd_replaces_document(tmpdir):
+    index = SegmentedInvertedIndex(tmpdir.strpath)
+    index.add_documents([(1, ["hello", "world"]), (2, ["hello"])])
+    index.add_documents([(1, ["goodbye"])])
+
+    assert [2] == index.query(["hello"])
+    assert [1] == index.query(["goodbye"])
+    assert [] == index.query(["world"])
+
+
+def test_reopen(tmpdir):
+    with SegmentedInvertedIndex(tmpdir.strpath) as index:
+        index.add_documents([(1, ["hello", "world"]), (2, ["hello"])])
+        index.add_documents([(3, ["hello"])])
+        index.delete_documents([1])
+
+    with SegmentedInvertedIndex(tmpdir.strpath) as index:
+        assert [2, 3] == index.query(["hello"])
+        assert 2 == len(index.segments)
+
+
+def test_merge_drops_deleted_documents(tmpdir):
+    index = SegmentedInvertedIndex(tmpdir.strpath, storage_policy=RoaringStoragePolicy("utf8"))
+    index.add_documents([(1, ["hello", "world"]), (2, ["hello"])])
+    index.add_documents([(3, ["hello", "world"]), (4, ["world"])])
+    index.delete_documents([2, 3])
+
+    index.merge()
+
+    assert 1 == len(index.segments)
+    assert 0 == len(index.segments[0].deleted)
+    assert [1] == index.query(["hello"])
+    assert [1, 4] == index.query(["world"])
+
+    # файлы слитых сегментов удалены
+    files = set(os.listdir(tmpdir.strpath))
+    expect = {"manifest.json",
+              index.segments[0].name + ".idx",
+              index.segments[0].name + ".docs"}
+    assert expect == files
+
+
+def test_segment_count_is_bounded(tmpdir):
+    rnd = random.Random(3)
+    vocabulary = [f"word{i}" for i in range(20)]
+    documents = {}
+
+    index = SegmentedInvertedIndex(tmpdir.strpath, max_segments=3)
+    for batch in range(10):
+        added = {}
+        for doc_id in rnd.sample(range(200), 15):
+            added[doc_id] = [rnd.choice(vocabulary) for _ in range(5)]
+        index.add_documents(added.items())
+        documents.update(added)
+
+        deleted = rnd.sample(sorted(documents), 3)
+        index.delete_documents(deleted)
+        for doc_id in deleted:
+            del documents[doc_id]
+
+        assert len(index.segments) <= 3
+
+    for _ in range(30):
+        words = rnd.sample(vocabulary, rnd.randint(1, 2))
+        assert _expected_query(documents, words) == index.query(words)
+
+
+def test_background_merge(tmpdir):
+    index = SegmentedInvertedIndex(tmpdir.strpath, max_segments=2, background_merge=True)
+    for doc_id in range(1, 7):
+        index.add_documents([(doc_id, ["hello"])])
+    index.wait_for_merge()
+
+    assert len(index.segments) <= 2
+    assert [1, 2, 3, 4, 5, 6] == index.query(["hello"])
+
+
+def test_cache_is_cleared_on_update(tmpdir):
+    index = SegmentedInvertedIndex(tmpdir.strpath, cache=QueryCache())
+    index.add_documents([(1, ["hello"])])
+    assert [1] == index.query(["hello"])
+
+    index.add_documents([(2, ["hello"])])
+    assert [1, 2] == index.query(["hello"])
+
+
+def test_storage_policy_without_writer(tmpdir):
+    with pytest.raises(ValueError):
+        SegmentedInvertedIndex(tmpdir.strpath, storage_policy=StructStoragePolicy("utf8"))
+
+
+def test_search_and_limit(tmpdir):
+    index = SegmentedInvertedIndex(tmpdir.strpath)
+    index.add_documents([(1, ["hello", "world"]), (2, ["hello"]), (3, ["hello", "bye"])])
+    index.add_documents([(4, ["hello", "world"]), (5, ["world"])])
+    index.delete_documents([1])
+
+    assert [2, 3, 4] == index.search("hello NOT bye OR hello")
+    assert [4, 5] == index.search("world")
+    assert [2, 4] == index.search("hello NOT bye")
+    assert [2] == index.search("hello NOT bye", limit=1)
+    assert [2, 3] == index.query(["hello"], limit=2)
+
+
+def test_analyzer_is_saved_in_manifest(tmpdir):
+    analyzer = Analyzer(lowercase=True)
+    with SegmentedInvertedIndex(tmpdir.strpath, analyzer=analyzer) as index:
+        index.add_documents([(1, analyzer.analyze("Hello World"))])
+
+    with SegmentedInvertedIndex(tmpdir.strpath) as index:
+        assert analyzer == index.analyzer
+        assert [1] == index.query(["HELLO"])
+        assert [1] == index.search("world AND Hello")
+
+    with pytest.raises(ValueError):
+        SegmentedInvertedIndex(tmpdir.strpath, analyzer=Analyzer())
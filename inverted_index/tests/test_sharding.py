@@ -0,0 +1,159 @@
+import asyncio
+import random
+import threading
+from functools import partial
+
+import pytest
+
+import inverted_index as IIS
+from query_client import QueryClient
+from query_server import start_server
+from sharding import Partition
+from sharding import ShardedInvertedIndex
+from sharding import merge_top_k
+
+
+@pytest.fixture(scope="module")
+def random_dataset(tmpdir_factory) -> str:
+    rnd = random.Random(17)
+    vocabulary = [f"word{i}" for i in range(50)]
+    weights = [1 / (i + 1) for i in range(len(vocabulary))]
+    doc_ids = rnd.sample(range(1, 10 ** 6), 300)
+
+    filepath = tmpdir_factory.mktemp("sharding").join("dataset").strpath
+    with open(filepath, "w", encoding="utf8") as f:
+        for doc_id in doc_ids:
+            words = rnd.choices(vocabulary, weights, k=rnd.randint(1, 15))
+            f.write(f"{doc_id}\tarticle{doc_id} {' '.join(words)}\n")
+    return filepath
+
+
+@pytest.fixture(scope="module")
+def single_index(random_dataset):
+    return IIS.build_inverted_index(IIS.load_documents(random_dataset), ranked=True)
+
+
+def _open_sharded(directory: str, workers) -> ShardedInvertedIndex:
+    storage_policy = IIS.STORAGE_POLICIES["mmap"]()
+    return ShardedInvertedIndex(directory,
+                                partial(IIS.InvertedIndex.load, storage_policy=storage_policy),
+                                workers=workers)
+
+
+@pytest.mark.parametrize("kind", ["hash", "range"])
+def test_partition(kind):
+    doc_ids = list(range(0, 1000, 3))
+    partition = Partition.from_doc_ids(kind, 4, doc_ids)
+    restored = Partition.from_json(partition.to_json())
+
+    shards = [restored(doc_id) for doc_id in doc_ids]
+    assert shards == [partition(doc_id) for doc_id in doc_ids]
+    assert {0, 1, 2, 3} == set(shards)
+    assert all(80 <= shards.count(shard) <= 90 for shard in range(4))
+    if kind == "range":
+        assert shards == sorted(shards)
+
+
+def test_bad_partition():
+    with pytest.raises(ValueError):
+        Partition("random", 2)
+    with pytest.raises(ValueError):
+        Partition("range", 3, [10])
+
+
+def test_merge_top_k():
+    results = [[(5, 2.0), (1, 1.0)], [(3, 2.0), (4, 0.5)], []]
+
+    assert [(3, 2.0), (5, 2.0), (1, 1.0)] == merge_top_k(results, 3)
+
+
+@pytest.mark.parametrize("kind, workers, memory_budget", [("hash", 0, None),
+                                                          ("range", 2, None),
+                                                          ("hash", 2, 1 << 10)])
+def test_sharded_index_matches_single_index(tmpdir, random_dataset, single_index,
+                                            kind, workers, memory_budget):
+    directory = tmpdir.join("sharded").strpath
+    IIS.build_sharded_index(random_dataset, directory,
+                            storage_policy=IIS.STORAGE_POLICIES["mmap"](),
+                            shards=3,
+                            partition=kind,
+                            workers=2,
+                            memory_budget=memory_budget,
+                            ranked=True)
+
+    with _open_sharded(directory, workers) as sharded:
+        for words in [["word0"], ["word1", "word3"], ["word2", "word40"], ["unknown"]]:
+            assert single_index.query(words) == sharded.query(words)
+            assert single_index.query(words, limit=5) == sharded.query(words, limit=5)
+            expected = single_index.top_k(words, 10)
+            top_k = sharded.top_k(words, 10)
+            assert [doc_id for doc_id, _ in expected] == [doc_id for doc_id, _ in top_k]
+            assert [score for _, score in expected] == pytest.approx([score for _, score in top_k])
+        assert single_index.search("word1 OR word2 NOT word0") == \
+               sharded.search("word1 OR word2 NOT word0")
+
+
+def test_server_queries_sharded_index(tmpdir, random_dataset, single_index):
+    directory = tmpdir.join("sharded").strpath
+    IIS.build_sharded_index(random_dataset, directory,
+                            storage_policy=IIS.STORAGE_POLICIES["mmap"](),
+                            shards=4)
+
+    async def scenario(sharded):
+        server = await start_server(sharded, host="127.0.0.1", port=0)
+        port = server.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"word1 word3\nword5\n")
+        await writer.drain()
+        answers = [await reader.readline() for _ in range(2)]
+
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return answers
+
+    with _open_sharded(directory, workers=2) as sharded:
+        answers = asyncio.run(scenario(sharded))
+
+    expect = [",".join(map(str, single_index.query(words))).encode() + b"\n"
+              for words in [["word1", "word3"], ["word5"]]]
+    assert expect == answers
+
+
+def test_query_client_round_trip_with_sharded_index(tmpdir, random_dataset, single_index):
+    directory = tmpdir.join("sharded").strpath
+    IIS.build_sharded_index(random_dataset, directory,
+                            storage_policy=IIS.STORAGE_POLICIES["mmap"](),
+                            shards=2)
+    socket_path = tmpdir.join("index.sock").strpath
+    queries = ["word1 word3", "word5", "unknown"]
+
+    with _open_sharded(directory, workers=2) as sharded:
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(start_server(sharded, unix_socket=socket_path))
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+
+        answers = []
+
+        def run_client():
+            with QueryClient(unix_socket=socket_path) as client:
+                answers.extend(client.query_many(queries))
+
+        try:
+            # исполнители не должны держать открытыми сокеты клиентов:
+            # иначе клиент не дождется конца ответа
+            client = threading.Thread(target=run_client, daemon=True)
+            client.start()
+            client.join(10)
+            assert not client.is_alive()
+        finally:
+            server.close()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+    expect = [",".join(map(str, single_index.query(query.split()))).encode() + b"\n"
+              for query in queries]
+    assert expect == answers
@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+from postings import CompressedPostings
+from spimi import SpimiIndexBuilder
+from spimi import merge_runs
+from spimi import read_run
+from spimi import write_run
+
+
+@pytest.fixture()
+def random_documents() -> list:
+    rnd = random.Random(7)
+    vocabulary = [f"word{i}" for i in range(50)] + ["россия", "мир"]
+    documents = []
+    for doc_id in rnd.sample(range(1, 1000), 200):
+        words = [rnd.choice(vocabulary) for _ in range(rnd.randint(1, 15))]
+        documents.append((doc_id, words))
+    return documents
+
+
+def _expected_index(documents: list) -> dict:
+    expect = {}
+    for doc_id, words in documents:
+        for word in words:
+            expect.setdefault(word, set()).add(doc_id)
+    return {word: sorted(docs) for word, docs in expect.items()}
+
+
+def test_run_round_trip(tmpdir):
+    expect = [(b"hello", [1, 2]), (b"world", [2, 5, 9])]
+
+    path = tmpdir.join("run").strpath
+    write_run(path, ((key, CompressedPostings.from_sorted(docs))
+                     for key, docs in expect))
+
+    real = [(key, list(docs)) for key, docs in read_run(path)]
+
+    assert expect == real
+
+
+def test_merge_runs(tmpdir):
+    first = tmpdir.join("run-0").strpath
+    second = tmpdir.join("run-1").strpath
+    write_run(first, [(b"a", CompressedPostings.from_sorted([1, 5])),
+                      (b"c", CompressedPostings.from_sorted([2]))])
+    write_run(second, [(b"a", CompressedPostings.from_sorted([3, 5])),
+                       (b"b", CompressedPostings.from_sorted([4]))])
+
+    real = [(key, list(docs)) for key, docs in merge_runs([first, second])]
+
+    assert [(b"a", [1, 3, 5]), (b"b", [4]), (b"c", [2])] == real
+
+
+def test_spimi_builder_flushes_runs(random_documents):
+    expect = _expected_index(random_documents)
+
+    with SpimiIndexBuilder(memory_budget=4096) as builder:
+        for doc_id, words in random_documents:
+            builder.add_document(doc_id, words)
+        real = {key.decode("utf8"): list(docs) for key, docs in builder.items()}
+
+        assert len(builder.runs) > 1
+
+    assert expect == real
+
+
+def test_spimi_builder_raise_on_bad_budget():
+    with pytest.raises(ValueError):
+        SpimiIndexBuilder(memory_budget=0)
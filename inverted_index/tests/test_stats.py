@@ -0,0 +1,68 @@
+import io
+import json
+
+from stats import Stats
+from stats import percentile
+
+
+def test_stages_and_counters():
+    stats = Stats()
+
+    with stats.stage("build"):
+        data = [0] * 10 ** 6
+    for _ in range(3):
+        with stats.stage("query", memory=False, timings=True):
+            sum(data)
+    stats.add("terms", 5)
+    stats.add("terms")
+
+    result = stats.to_dict()
+
+    assert ["build", "query"] == list(result["stages"])
+    assert 1 == result["stages"]["build"]["calls"]
+    assert result["stages"]["build"]["peak_rss_bytes"] > 8 * 10 ** 6
+    query = result["stages"]["query"]
+    assert 3 == query["calls"]
+    assert "peak_rss_bytes" not in query
+    assert 0 < query["p50_s"] <= query["p99_s"] <= query["max_s"] <= query["wall_s"]
+    assert {"terms": 6} == result["counters"]
+
+
+def test_disabled_stats_do_nothing(tmpdir):
+    stats = Stats(enabled=False)
+    filepath = tmpdir.join("stats.json")
+
+    with stats.stage("build"):
+        pass
+    stats.add("terms")
+    stats.report(filepath.strpath)
+
+    assert {"stages": {}, "counters": {}} == stats.to_dict()
+    assert not filepath.exists()
+
+
+def test_report(tmpdir):
+    stats = Stats()
+    with stats.stage("load"):
+        pass
+    stats.add("queries", 2)
+
+    stream = io.StringIO()
+    stats.report(stream=stream)
+    lines = stream.getvalue().splitlines()
+    assert lines[0].startswith("stage load: calls=1 wall=")
+    assert "counter queries: 2" == lines[1]
+
+    filepath = tmpdir.join("stats.json").strpath
+    stats.report(filepath)
+    with open(filepath) as f:
+        assert stats.to_dict() == json.load(f)
+
+
+def test_percentile():
+    values = list(range(1, 101))
+
+    assert 50 == percentile(values, 50)
+    assert 99 == percentile(values, 99)
+    assert 1 == percentile([1], 90)
+    assert 0.0 == percentile([], 50)
@@ -2,9 +2,14 @@ import zlib
 
 import pytest
 
+from roaring import RoaringPostings
+from storage_policy import ColumnarStoragePolicy
 from storage_policy import JsonStoragePolicy
+from storage_policy import MmapStoragePolicy
 from storage_policy import PklStoragePolicy
+from storage_policy import RoaringStoragePolicy
 from storage_policy import ZlibStoragePolicy
+from storage_policy import SortedTermDictionary
 from storage_policy import StructStoragePolicy
 
 
@@ -115,4 +120,113 @@ def test_struct_storage_policy_cp1251(tmpdir, sample_inverted_index):
     storage_policy = StructStoragePolicy(encoding="cp1251")
     real = storage_policy.load(path_to_dump)
 
-    assert expect == real
\ No newline at end of file
+    assert expect == real
+
+def test_mmap_storage_policy_utf8(tmpdir, sample_inverted_index):
+    """Тестирование ленивого индекса через mmap в кодировке utf8"""
+    expect = sample_inverted_index
+
+    path_to_dump = tmpdir.join("dump_tmp").strpath
+
+    storage_policy = MmapStoragePolicy(encoding="utf8")
+    storage_policy.dump(expect, path_to_dump)
+
+    storage_policy = MmapStoragePolicy(encoding="utf8")
+    with storage_policy.load(path_to_dump) as real:
+        assert len(expect) == len(real)
+        assert expect == {word: list(docs) for word, docs in real.items()}
+
+
+def test_mmap_storage_policy_cp1251(tmpdir, sample_inverted_index):
+    """Тестирование ленивого индекса через mmap в кодировке cp1251"""
+    expect = sample_inverted_index
+
+    path_to_dump = tmpdir.join("dump_tmp").strpath
+
+    storage_policy = MmapStoragePolicy(encoding="cp1251")
+    storage_policy.dump(expect, path_to_dump)
+
+    with storage_policy.load(path_to_dump) as real:
+        assert [1, 2, 3, 4] == list(real["россия"])
+        assert 2 == real.doc_count("human")
+
+
+def test_mmap_storage_policy_missing_word(tmpdir, sample_inverted_index):
+    path_to_dump = tmpdir.join("dump_tmp").strpath
+
+    storage_policy = MmapStoragePolicy(encoding="utf8")
+    storage_policy.dump(sample_inverted_index, path_to_dump)
+
+    with storage_policy.load(path_to_dump) as real:
+        assert "covid" not in real
+        assert 0 == real.doc_count("covid")
+        with pytest.raises(KeyError):
+            real["covid"]
+
+
+def test_mmap_storage_policy_raise_unsorted_writer(tmpdir):
+    path_to_dump = tmpdir.join("dump_tmp").strpath
+
+    storage_policy = MmapStoragePolicy(encoding="utf8")
+
+    with pytest.raises(ValueError):
+        with storage_policy.writer(path_to_dump) as writer:
+            writer.add("world", [1])
+            writer.add("hello", [2])
+
+
+def test_roaring_storage_policy(tmpdir, sample_inverted_index):
+    expect = sample_inverted_index
+
+    path_to_dump = tmpdir.join("dump_tmp").strpath
+
+    storage_policy = RoaringStoragePolicy(encoding="utf8")
+    storage_policy.dump(expect, path_to_dump)
+
+    with storage_policy.load(path_to_dump) as real:
+        assert isinstance(real["hello"], RoaringPostings)
+        assert expect == {word: list(docs) for word, docs in real.items()}
+
+
+def test_roaring_storage_policy_raise_on_mmap_file(tmpdir, sample_inverted_index):
+    path_to_dump = tmpdir.join("dump_tmp").strpath
+
+    MmapStoragePolicy(encoding="utf8").dump(sample_inverted_index, path_to_dump)
+
+    with pytest.raises(ValueError):
+        RoaringStoragePolicy(encoding="utf8").load(path_to_dump)
+
+
+def test_columnar_storage_policy(tmpdir, sample_inverted_index):
+    expect = sample_inverted_index
+
+    path_to_dump = tmpdir.join("dump_tmp").strpath
+
+    storage_policy = ColumnarStoragePolicy(encoding="cp1251")
+    storage_policy.dump(expect, path_to_dump)
+
+    storage_policy = ColumnarStoragePolicy(encoding="cp1251")
+    real = storage_policy.load(path_to_dump)
+
+    assert expect == real
+
+
+def test_columnar_storage_policy_large_doc_ids(tmpdir):
+    """Идентификаторы документов не помещаются ни в 16, ни в 32 бита"""
+    expect = {"hello": [1, 70000, 2 ** 40]}
+
+    path_to_dump = tmpdir.join("dump_tmp").strpath
+
+    storage_policy = ColumnarStoragePolicy(encoding="utf8")
+    storage_policy.dump(expect, path_to_dump)
+
+    assert expect == storage_policy.load(path_to_dump)
+
+
+def test_sorted_term_dictionary_is_abstract():
+    class NoTerms(SortedTermDictionary):
+        def __getitem__(self, word):
+            raise KeyError(word)
+
+    with pytest.raises(TypeError):
+        NoTerms()
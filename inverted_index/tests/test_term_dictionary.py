@@ -0,0 +1,122 @@
+import random
+import sys
+
+import pytest
+
+from boolean_query import boolean_query
+from postings import CompressedPostings
+from term_dictionary import TermTrie
+from term_dictionary import TrieStoragePolicy
+from term_dictionary import TrieTermDictionary
+from term_dictionary import expand_terms
+
+
+@pytest.fixture()
+def sample_inverted_index() -> dict:
+    return {"data": [1, 2],
+            "database": [2, 3],
+            "dates": [4],
+            "date": [5],
+            "python": [1, 5],
+            "дата": [6],
+            "датчик": [7]}
+
+
+@pytest.fixture()
+def random_words() -> list:
+    rnd = random.Random(3)
+    return sorted({"".join(rnd.choice("abcя") for _ in range(rnd.randint(1, 7)))
+                   for _ in range(2000)},
+                  key=lambda word: word.encode("utf8"))
+
+
+def test_trie_find_and_prefix(random_words):
+    keys = [word.encode("utf8") for word in random_words]
+    trie = TermTrie(TermTrie.from_sorted(keys).to_bytes())
+
+    assert len(keys) == len(trie)
+    assert all(term_id == trie.find(key) for term_id, key in enumerate(keys))
+    assert -1 == trie.find(b"unknown")
+    assert -1 == trie.find(b"")
+    for prefix in [b"", b"a", b"ab", b"abc", "я".encode("utf8"), b"z"]:
+        expect = [(key, term_id) for term_id, key in enumerate(keys)
+                  if key.startswith(prefix)]
+        assert expect == list(trie.items(prefix))
+        assert [term_id for _, term_id in expect] == list(trie.prefix_range(prefix))
+
+
+def test_deep_trie_is_built_without_recursion():
+    depth = sys.getrecursionlimit() + 200
+    keys = [b"a" * length for length in range(1, depth)]
+    trie = TermTrie(TermTrie.from_sorted(keys).to_bytes())
+
+    assert len(keys) == len(trie)
+    assert depth - 2 == trie.find(b"a" * (depth - 1))
+    assert keys[-10:] == [key for key, _ in trie.items(b"a" * (depth - 10))]
+
+
+def test_empty_trie():
+    trie = TermTrie(TermTrie.from_sorted([]).to_bytes())
+
+    assert 0 == len(trie)
+    assert -1 == trie.find(b"a")
+    assert [] == list(trie.items())
+
+
+@pytest.mark.parametrize("pattern, expect", [
+    ("dat*", ["data", "database", "date", "dates"]),
+    ("data*", ["data", "database"]),
+    ("date?", ["dates"]),
+    ("d*e*", ["database", "date", "dates"]),
+    ("да?а", ["дата"]),
+    ("дат*", ["дата", "датчик"]),
+    ("*on", ["python"]),
+    ("x*", []),
+])
+def test_expand(sample_inverted_index, pattern, expect):
+    trie_dictionary = TrieTermDictionary.from_dict(sample_inverted_index)
+
+    assert expect == trie_dictionary.expand(pattern)
+    assert sorted(expect) == sorted(expand_terms(sample_inverted_index, pattern))
+
+
+def test_trie_dictionary_behaves_like_dict(sample_inverted_index):
+    trie_dictionary = TrieTermDictionary.from_dict(sample_inverted_index)
+
+    assert sample_inverted_index == trie_dictionary
+    assert 2 == trie_dictionary.doc_count("database")
+    assert 0 == trie_dictionary.doc_count("unknown")
+    assert "unknown" not in trie_dictionary
+
+
+def test_dump_and_load(tmpdir, sample_inverted_index):
+    filepath = tmpdir.join("index.trie").strpath
+    storage_policy = TrieStoragePolicy(encoding="utf8")
+    storage_policy.dump(sample_inverted_index, filepath)
+
+    with storage_policy.load(filepath) as loaded:
+        assert sample_inverted_index == loaded
+        assert 1 == loaded.doc_count("dates")
+        assert ["data", "database"] == loaded.expand("data*")
+        assert [(b"data", CompressedPostings.from_sorted([1, 2]))] == list(loaded.raw_items())[:1]
+
+
+@pytest.mark.parametrize("text, expect", [
+    ("dat*", [1, 2, 3, 4, 5]),
+    ("dat* python", [1, 5]),
+    ("date? OR дат*", [4, 6, 7]),
+    ("data* NOT database", [1]),
+    ("x* OR python", [1, 5]),
+])
+def test_wildcard_query(sample_inverted_index, text, expect):
+    trie_dictionary = TrieTermDictionary.from_dict(sample_inverted_index)
+
+    assert expect == boolean_query(trie_dictionary, text)
+
+
+def test_trie_is_smaller_than_dict_keys(random_words):
+    trie = TermTrie.from_sorted([word.encode("utf8") for word in random_words])
+    word_to_id = {word: term_id for term_id, word in enumerate(random_words)}
+
+    keys_size = sys.getsizeof(word_to_id) + sum(sys.getsizeof(word) for word in word_to_id)
+    assert trie.nbytes < keys_size / 4